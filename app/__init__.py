@@ -1,11 +1,15 @@
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.engine import make_url
 from config import Config
 import logging
 
-db = SQLAlchemy()
+from .replicas import RoutingSession
 
-def create_app():
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+def create_app(batch=False):
+    """batch：后台任务进程（不设语句超时）；flask 命令行在执行本项目的命令时再解除超时（见 cli.py）"""
     app = Flask(__name__)
     app.config.from_object(Config)
     
@@ -20,16 +24,51 @@ def create_app():
     else:
         logger.info("使用 SQLite 数据库")
     
+    # 按后端设置连接池 / 语句超时，SQLite 连接上执行 PRAGMA
+    from .engine import engine_options, tune_engine
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config, make_url(db_uri), batch=batch)
     try:
         db.init_app(app)
+        with app.app_context():
+            tune_engine(db.engine, app.config)
         logger.info("数据库初始化成功")
     except Exception as e:
         logger.error(f"数据库初始化失败: {e}")
         raise
 
+    from .cache import dashboard_cache
+    dashboard_cache.init_app(app)
+    # 商品目录缓存（同时注册商品修改时记录目录版本的会话事件）
+    from .catalog import product_catalog
+    product_catalog.init_app(app)
+    # 汇总表随会话写入增量维护（注册 rollups 的会话事件；命令行改为按需导入后这里要显式导入）
+    from . import rollups  # noqa: F401
+    # 草图增量缓冲先注册：进程退出时浏览事件缓冲区先写完，产生的草图增量再落库
+    from .sketches import sketch_buffer
+    sketch_buffer.init_app(app)
+    from .ingest import browse_ingest
+    browse_ingest.init_app(app)
+    from .metrics import request_metrics
+    request_metrics.init_app(app)
+    from .schema import schema_guard
+    schema_guard.init_app(app)
+    from .replicas import replica_router
+    replica_router.init_app(app)
+    from .analytics import analytics
+    analytics.init_app(app)
+    from .jobs import job_runner
+    job_runner.init_app(app)
+    # 页面 ETag / 304 与响应压缩（在结构检查与副本路由之后执行）
+    from .httpcache import http_cache
+    http_cache.init_app(app)
+
     # 注册蓝图
     from .routes import main
     app.register_blueprint(main)
+
+    # 注册命令行（对应模块在执行 flask 命令时才导入）
+    from .cli import LazyAppGroup, COMMANDS
+    app.cli = LazyAppGroup(app.name, lazy_commands=COMMANDS)
     
     # 添加错误处理
     @app.errorhandler(500)
@@ -0,0 +1,380 @@
+"""
+看板的进程内列式快照（可选，需要 numpy）
+
+DASHBOARD_ANALYTICS = 'numpy' 时，每个 worker 把销售与浏览记录各保存为几列紧凑的
+NumPy 数组：商品编号、距 1970-01-01 的天数、金额（分）、数量、渠道编码；
+品类按商品编码成整数。看板的合计、月度趋势、品类分布、TOP10、每日浏览与渠道分布
+都用 bincount / argpartition 在内存里算出，不再访问数据库，任意日期区间的筛选也一样便宜。
+
+快照每 ANALYTICS_REFRESH_SECONDS 秒按上次见到的最大 id 增量追加新行；追加只写在各列已发布的长度之后，
+刷新完成后换上一个新的只读视图（各列截到同一行数），正在计算的请求继续用它拿到的旧视图。
+本进程提交的删除或商品修改会触发下一次全量重载，其它进程的删除与商品修改
+最迟在 ANALYTICS_FULL_RELOAD_SECONDS 秒后的定期全量重载中生效。
+浏览记录的归档段在全量重载时一并解压计入，与汇总表口径一致。
+"""
+import importlib.util
+import logging
+import threading
+import time
+from datetime import date
+
+from sqlalchemy import BigInteger, Date, Integer, cast, event, func, literal, select
+
+from . import db
+from .models import BrowseLog, Product, Sale
+
+logger = logging.getLogger(__name__)
+
+EPOCH = date(1970, 1, 1)
+_EPOCH_ORDINAL = EPOCH.toordinal()
+
+LOAD_CHUNK = 100000
+
+_SALE_COLUMNS = {'product': 'int32', 'day': 'int32', 'cents': 'int64', 'qty': 'int32'}
+_BROWSE_COLUMNS = {'product': 'int32', 'day': 'int32', 'platform': 'int32'}
+
+
+def _epoch_day(conn, column):
+    """列值所在日期距 1970-01-01 的天数"""
+    if conn.dialect.name == 'postgresql':
+        return cast(cast(column, Date) - literal(EPOCH), Integer)
+    return cast(func.julianday(func.date(column)) - 2440587.5, Integer)
+
+
+def to_day(value):
+    return value.toordinal() - _EPOCH_ORDINAL
+
+
+def from_day(day):
+    return date.fromordinal(int(day) + _EPOCH_ORDINAL)
+
+
+def label_key(item):
+    """品类 / 渠道分布的排序键：按名称排序，未分类（None 或空串）在最前"""
+    return item[0] or ''
+
+
+class ColumnTable:
+    """按列存放的可追加数组，容量不够时翻倍"""
+
+    def __init__(self, np, dtypes):
+        self.np = np
+        self.columns = {name: np.empty(1024, dtype) for name, dtype in dtypes.items()}
+        self.size = 0
+
+    def append(self, arrays):
+        n = len(next(iter(arrays.values())))
+        if not n:
+            return
+        capacity = len(next(iter(self.columns.values())))
+        if self.size + n > capacity:
+            capacity = max(capacity * 2, self.size + n)
+            for name, column in self.columns.items():
+                grown = self.np.empty(capacity, column.dtype)
+                grown[:self.size] = column[:self.size]
+                self.columns[name] = grown
+        for name, values in arrays.items():
+            self.columns[name][self.size:self.size + n] = values
+        self.size += n
+
+    def __getitem__(self, name):
+        return self.columns[name][:self.size]
+
+    def view(self):
+        """各列截到当前行数的切片；之后的追加只写在这些切片之外，扩容时换新数组，切片不受影响"""
+        return {name: column[:self.size] for name, column in self.columns.items()}
+
+    @property
+    def nbytes(self):
+        return sum(column.nbytes for column in self.columns.values())
+
+
+class _State:
+    """一次全量加载得到的快照；增量刷新只向其中追加，只在持有锁时修改"""
+
+    def __init__(self, np):
+        self.sales = ColumnTable(np, _SALE_COLUMNS)
+        self.browse = ColumnTable(np, _BROWSE_COLUMNS)
+        self.max_sale_id = 0
+        self.max_browse_id = 0
+        self.platforms = []        # 渠道编码 -> 渠道名（None 记作 ''）
+        self.platform_codes = {}
+        self.product_category = None  # 商品编号 -> 品类编码，-1 表示商品不存在
+        self.categories = []       # 品类编码 -> 品类名
+        self.product_names = {}
+        self.loaded_at = time.monotonic()
+        self.refreshed_at = self.loaded_at
+
+
+class _View:
+    """发布给请求的只读视图：各列行数一致，商品与渠道映射是发布时的那一份"""
+
+    def __init__(self, state):
+        self.sales = state.sales.view()
+        self.browse = state.browse.view()
+        self.product_category = state.product_category
+        self.categories = tuple(state.categories)
+        self.product_names = state.product_names
+        self.platforms = tuple(state.platforms)
+
+
+class ColumnarSnapshot:
+    """每个 worker 一份的列式快照，提供看板所需的各项聚合"""
+
+    def __init__(self):
+        self.enabled = False
+        self.refresh_interval = 5.0
+        self.full_reload_interval = 300.0
+        self.np = None
+        self._state = None
+        self._view = None
+        self._stale = False
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.enabled = app.config.get('DASHBOARD_ANALYTICS', 'sql') == 'numpy'
+        if self.enabled and importlib.util.find_spec('numpy') is None:
+            logger.warning('DASHBOARD_ANALYTICS=numpy 但未安装 numpy，看板改用汇总表')
+            self.enabled = False
+        self.refresh_interval = app.config.get('ANALYTICS_REFRESH_SECONDS', self.refresh_interval)
+        self.full_reload_interval = app.config.get('ANALYTICS_FULL_RELOAD_SECONDS',
+                                                   self.full_reload_interval)
+        app.extensions['analytics'] = self
+
+    def mark_stale(self):
+        self._stale = True
+
+    # ---------- 加载 ----------
+
+    def _load_products(self, conn, state):
+        np = self.np
+        rows = conn.execute(select(Product.id, Product.name, Product.category)).all()
+        size = max((r.id for r in rows), default=0) + 1
+        product_category = np.full(size, -1, np.int32)
+        codes = {}
+        for row in rows:
+            product_category[row.id] = codes.setdefault(row.category, len(codes))
+        state.product_category = product_category
+        state.categories = list(codes)
+        state.product_names = {r.id: r.name for r in rows}
+
+    def _platform_codes(self, state, platforms):
+        np = self.np
+        codes = state.platform_codes
+        out = np.empty(len(platforms), np.int32)
+        for i, platform in enumerate(platforms):
+            code = codes.get(platform or '')
+            if code is None:
+                code = codes[platform or ''] = len(state.platforms)
+                state.platforms.append(platform or '')
+            out[i] = code
+        return out
+
+    def _append_sales(self, conn, state):
+        """追加 id 大于已见最大 id 的销售，返回新行中最大的商品编号"""
+        np = self.np
+        top = 0
+        stmt = select(Sale.id, Sale.product_id, _epoch_day(conn, Sale.sale_date),
+                      cast(func.round(Sale.total_amount * 100), BigInteger), Sale.quantity)\
+            .where(Sale.id > state.max_sale_id).order_by(Sale.id)
+        for rows in conn.execute(stmt.execution_options(yield_per=LOAD_CHUNK)).partitions():
+            data = np.array(rows, dtype=np.int64)
+            state.sales.append({'product': data[:, 1], 'day': data[:, 2],
+                                'cents': data[:, 3], 'qty': data[:, 4]})
+            state.max_sale_id = int(data[-1, 0])
+            top = max(top, int(data[:, 1].max()))
+        return top
+
+    def _append_browse(self, conn, state):
+        np = self.np
+        top = 0
+        stmt = select(BrowseLog.id, BrowseLog.product_id, _epoch_day(conn, BrowseLog.browse_time),
+                      BrowseLog.platform)\
+            .where(BrowseLog.id > state.max_browse_id).order_by(BrowseLog.id)
+        for rows in conn.execute(stmt.execution_options(yield_per=LOAD_CHUNK)).partitions():
+            ids, products, days, platforms = zip(*rows)
+            state.browse.append({'product': np.array(products, np.int32),
+                                 'day': np.array(days, np.int32),
+                                 'platform': self._platform_codes(state, platforms)})
+            state.max_browse_id = max(state.max_browse_id, ids[-1])
+            top = max(top, max(products))
+        return top
+
+    def _append_frozen_browse(self, conn, state):
+        from .partitions import frozen_segment_rows
+        np = self.np
+        for rows in frozen_segment_rows(conn):
+            if not rows:
+                continue
+            state.browse.append({
+                'product': np.array([r['product_id'] for r in rows], np.int32),
+                'day': np.array([to_day(r['browse_time'].date()) for r in rows], np.int32),
+                'platform': self._platform_codes(state, [r['platform'] for r in rows]),
+            })
+
+    def _full_load(self, conn):
+        started = time.perf_counter()
+        state = _State(self.np)
+        self._load_products(conn, state)
+        self._append_sales(conn, state)
+        self._append_frozen_browse(conn, state)
+        self._append_browse(conn, state)
+        logger.info('看板快照已加载：销售 %d 行、浏览 %d 行，%.1f MB，用时 %.2f 秒',
+                    state.sales.size, state.browse.size,
+                    (state.sales.nbytes + state.browse.nbytes) / 1e6, time.perf_counter() - started)
+        return state
+
+    def _refresh(self, conn, state):
+        top = max(self._append_sales(conn, state), self._append_browse(conn, state))
+        # 新行里出现了快照之后新建的商品：重新读商品表
+        if top >= len(state.product_category):
+            self._load_products(conn, state)
+        state.refreshed_at = time.monotonic()
+
+    def current(self):
+        """返回可用的快照视图；过期时在当前请求里刷新（全量重载时阻塞，增量刷新只由一个线程做）"""
+        if self.np is None:
+            import numpy
+            self.np = numpy
+        state = self._state
+        now = time.monotonic()
+        if state is None or self._stale or now - state.loaded_at >= self.full_reload_interval:
+            with self._lock:
+                state = self._state
+                if state is None or self._stale or now - state.loaded_at >= self.full_reload_interval:
+                    self._stale = False
+                    state = self._full_load(db.session.connection())
+                    self._view, self._state = _View(state), state
+        elif now - state.refreshed_at >= self.refresh_interval and self._lock.acquire(blocking=False):
+            try:
+                self._refresh(db.session.connection(), state)
+                self._view = _View(state)
+            finally:
+                self._lock.release()
+        return self._view
+
+    # ---------- 聚合 ----------
+
+    def _mask(self, days, start, end):
+        mask = self.np.ones(len(days), bool)
+        if start is not None:
+            mask &= days >= to_day(start)
+        if end is not None:
+            mask &= days <= to_day(end)
+        return mask
+
+    def sales_metrics(self, period, breakdown):
+        """
+        period 内的合计与月度趋势、breakdown 内的品类分布与 TOP10；
+        区间为 (开始日期, 结束日期)，两端含，None 表示不限。
+        """
+        state = self.current()
+        np = self.np
+        sales = state.sales
+        product_category = state.product_category
+        product = sales['product']
+        # 已删除的商品（及其销售）不计入
+        known = product < len(product_category)
+        known[known] = product_category[product[known]] >= 0
+
+        in_period = known & self._mask(sales['day'], *period)
+        cents, qty = sales['cents'][in_period], sales['qty'][in_period]
+        total_amount, total_qty = int(cents.sum()) / 100, int(qty.sum())
+        days = sales['day'][in_period]
+        month_list = []
+        if len(days):
+            # 先按天累计，再把（很短的）逐日结果归并到月
+            first = int(days.min())
+            by_day = [np.bincount(days - first, weights=w) for w in (cents, qty, None)]
+            months = np.arange(first, first + len(by_day[0])).astype('datetime64[D]')\
+                .astype('datetime64[M]').astype(np.int64)
+            amounts, quantities, counts = (np.bincount(months - months[0], weights=w) for w in by_day)
+            for offset in np.flatnonzero(counts):
+                month = int(months[0] + offset)
+                month_list.append(((1970 + month // 12, month % 12 + 1),
+                                   float(amounts[offset]) / 100, int(quantities[offset])))
+
+        in_breakdown = known & self._mask(sales['day'], *breakdown)
+        product, cents, qty = product[in_breakdown], sales['cents'][in_breakdown], sales['qty'][in_breakdown]
+        codes = product_category[product]
+        by_category = np.bincount(codes, weights=cents, minlength=len(state.categories))
+        present = np.bincount(codes, minlength=len(state.categories))
+        # 与汇总表路径一致：按品类名排序，数值转为 Python 内置类型（模板与 JSON 序列化不认 numpy 标量）
+        categories = sorted(((state.categories[c], float(by_category[c]) / 100) for c in np.flatnonzero(present)),
+                            key=label_key)
+
+        by_product = np.bincount(product, weights=qty, minlength=len(product_category))
+        k = min(10, int(np.count_nonzero(by_product)))
+        top = []
+        if k:
+            ids = np.argpartition(-by_product, k - 1)[:k]
+            ids = ids[np.argsort(-by_product[ids], kind='stable')]
+            top = [(state.product_names[int(i)], int(by_product[i])) for i in ids]
+
+        return {
+            'total_amount': total_amount,
+            'total_qty': total_qty,
+            'categories': categories,
+            'months': month_list,
+            'top': top,
+        }
+
+    def browse_metrics(self, daily_window, breakdown):
+        """daily_window 内的每日浏览量（None 时取最近 14 天）与 breakdown 内的渠道分布"""
+        state = self.current()
+        np = self.np
+        browse = state.browse
+        days = browse['day']
+        if daily_window is None:
+            latest = from_day(days.max()) if len(days) else date.today()
+            daily_window = (from_day(to_day(latest) - 13), latest)
+
+        selected = days[self._mask(days, *daily_window)]
+        daily = []
+        if len(selected):
+            first = selected.min()
+            counts = np.bincount(selected - first)
+            daily = [(from_day(first + offset), int(counts[offset])) for offset in np.flatnonzero(counts)]
+
+        codes = browse['platform'][self._mask(days, *breakdown)]
+        counts = np.bincount(codes, minlength=len(state.platforms))
+        platforms = sorted(((state.platforms[c], int(counts[c])) for c in np.flatnonzero(counts)), key=label_key)
+        return {'daily': daily, 'platforms': platforms}
+
+    def stats(self):
+        state = self._state
+        if not self.enabled or state is None:
+            return {'enabled': self.enabled, 'loaded': False}
+        now = time.monotonic()
+        return {
+            'enabled': True,
+            'loaded': True,
+            'sales_rows': state.sales.size,
+            'browse_rows': state.browse.size,
+            'bytes': state.sales.nbytes + state.browse.nbytes,
+            'loaded_seconds_ago': round(now - state.loaded_at, 1),
+            'refreshed_seconds_ago': round(now - state.refreshed_at, 1),
+        }
+
+
+analytics = ColumnarSnapshot()
+
+
+@event.listens_for(db.session, 'after_flush')
+def _collect_reload(session, flush_context):
+    if not analytics.enabled:
+        return
+    if any(isinstance(o, (Product, Sale, BrowseLog)) for o in session.deleted) \
+            or any(isinstance(o, Product) for o in session.dirty):
+        session.info['analytics_reload'] = True
+
+
+@event.listens_for(db.session, 'after_commit')
+def _reload_on_commit(session):
+    if session.info.pop('analytics_reload', False):
+        analytics.mark_stale()
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_on_rollback(session):
+    session.info.pop('analytics_reload', None)
@@ -0,0 +1,530 @@
+"""
+路由级压测
+
+`flask bench run` 按指定规模（10k / 1m / 10m 行）用固定种子与截止日期生成数据，
+再用多个线程并发请求看板、商品、销售、浏览记录等代表性请求，统计每个场景的
+p50/p95/p99 延迟、吞吐量和每请求 SQL 条数，结果写成 JSON。
+同一份 JSON 可以包含多个后端与规模（SQLite / PostgreSQL 各跑一次即可合并），
+`--baseline` 或 `flask bench compare` 与基线对比，出现退化时以非零状态退出。
+`flask bench startup` 反复拉起全新的进程，测量导入应用的耗时和 gunicorn worker
+从启动到返回第一个 200 的耗时，结果写入同一份 JSON 的 startup 部分。
+`flask bench mixed` 用读线程（看板聚合、浏览记录计数、商品分页）和写线程（更新商品库存）
+同时访问数据库，分别在 SQLAlchemy 默认引擎（SQLite 为回滚日志）与 app/engine.py 调整后的
+引擎上各跑一遍，对比读写吞吐与延迟，结果写入 mixed 部分。
+
+注意：生成数据会清空当前数据库，请在专用的压测库上运行。
+"""
+import json
+import logging
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import date, datetime
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import create_engine, exc, func, select, update
+
+from . import db
+from .models import BrowseLog, Product, Sale, SalesDaily
+
+# 规模名 -> 各表行数（合计约等于规模名）
+SCALES = {
+    '10k': {'users': 1000, 'products': 500, 'browse_logs': 5500, 'sales': 3000},
+    '1m': {'users': 20000, 'products': 5000, 'browse_logs': 600000, 'sales': 375000},
+    '10m': {'users': 100000, 'products': 20000, 'browse_logs': 6000000, 'sales': 3880000},
+}
+
+# 固定种子与截止日期，保证同一规模每次生成的数据相同
+SEED = 42
+END_DATE = date(2025, 12, 31)
+DAYS = 365
+
+# 退化判定：延迟变慢或吞吐下降超过容忍比例；SQL 条数只要变多就算退化
+DEFAULT_TOLERANCE = 0.25
+LATENCY_FLOOR_MS = 2.0 # 低于该值的延迟差异视为噪声
+STARTUP_FLOOR_MS = 20.0 # 启动耗时低于该值的差异视为噪声
+
+# 在全新的解释器里导入应用并发出第一个请求
+_STARTUP_PROBE = '''
+import json, sys, time
+started = time.perf_counter()
+import run
+imported = time.perf_counter()
+status = run.app.test_client().get(sys.argv[1]).status_code
+done = time.perf_counter()
+print(json.dumps({'import_ms': (imported - started) * 1000,
+                  'first_request_ms': (done - imported) * 1000, 'status': status}))
+'''
+
+
+def _scenarios():
+    """场景名 -> (URL, 每次请求前的准备动作)；深分页游标按当前数据现算"""
+    from .cache import dashboard_cache
+    from .pagination import encode_cursor
+    sale_count = db.session.execute(select(func.count(Sale.id))).scalar() or 0
+    log_count = db.session.execute(select(func.count(BrowseLog.id))).scalar() or 0
+    product_count = db.session.execute(select(func.count(Product.id))).scalar() or 0
+    deep_sale = db.session.execute(
+        select(Sale.sale_date, Sale.id).order_by(Sale.sale_date.desc(), Sale.id.desc())
+        .offset(sale_count // 2).limit(1)).first()
+    deep_log = db.session.execute(
+        select(BrowseLog.browse_time, BrowseLog.id)
+        .order_by(BrowseLog.browse_time.desc(), BrowseLog.id.desc())
+        .offset(log_count // 2).limit(1)).first()
+    db.session.remove()
+
+    month_start = END_DATE.replace(day=1)
+    scenarios = {
+        'dashboard': ('/dashboard', None),
+        'dashboard_uncached': ('/dashboard', dashboard_cache.clear),
+        'products': ('/products', None),
+        'products_deep': (f'/products?page={max(1, product_count // 20 // 2)}', None),
+        'sales': ('/sales', None),
+        'sales_keyword': ('/sales?param_keyword=手机', None),
+        'browse_logs_month': (f'/browse_logs?start_date={month_start}&end_date={END_DATE}', None),
+        'browse_logs_user': ('/browse_logs?username=王', None),
+    }
+    if deep_sale:
+        scenarios['sales_deep'] = ('/sales?cursor=' + encode_cursor('next', *deep_sale), None)
+    if deep_log:
+        scenarios['browse_logs_deep'] = ('/browse_logs?cursor=' + encode_cursor('next', *deep_log), None)
+    return scenarios
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_scenario(app, url, requests, concurrency, before=None, warmup=3):
+    """并发请求同一个 URL，返回延迟分位数、吞吐量与每请求 SQL 条数"""
+    from .metrics import request_metrics
+    client = app.test_client()
+    for _ in range(warmup):
+        client.get(url)
+    # 预热请求复用了命令行的应用上下文，释放其连接，避免在 PostgreSQL 上持有表锁
+    db.session.remove()
+
+    latencies, errors = [], []
+    lock = threading.Lock()
+    remaining = [requests]
+
+    def worker():
+        client = app.test_client()
+        local = []
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    break
+                remaining[0] -= 1
+            if before is not None:
+                before()
+            started = time.perf_counter()
+            response = client.get(url)
+            local.append((time.perf_counter() - started) * 1000)
+            if response.status_code != 200:
+                with lock:
+                    errors.append(response.status_code)
+        with lock:
+            latencies.extend(local)
+
+    before_stats = request_metrics.snapshot()
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    after_stats = request_metrics.snapshot()
+
+    requests_seen = statements = sql_time = 0
+    for key, stats in after_stats.items():
+        prior = before_stats.get(key, {'requests': 0, 'statements': 0, 'sql_time': 0.0})
+        requests_seen += stats['requests'] - prior['requests']
+        statements += stats['statements'] - prior['statements']
+        sql_time += stats['sql_time'] - prior['sql_time']
+
+    latencies.sort()
+    return {
+        'url': url,
+        'requests': len(latencies),
+        'errors': len(errors),
+        'p50_ms': round(_percentile(latencies, 0.50), 2),
+        'p95_ms': round(_percentile(latencies, 0.95), 2),
+        'p99_ms': round(_percentile(latencies, 0.99), 2),
+        'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'queries_per_request': round(statements / requests_seen, 2) if requests_seen else 0.0,
+        'sql_ms_per_request': round(sql_time * 1000 / requests_seen, 2) if requests_seen else 0.0,
+    }
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _probe_python(cwd, path):
+    """新解释器：导入耗时、首个请求耗时与进程总耗时（含解释器启动）"""
+    started = time.perf_counter()
+    proc = subprocess.run([sys.executable, '-c', _STARTUP_PROBE, path], cwd=cwd,
+                          capture_output=True, text=True, check=True)
+    total = (time.perf_counter() - started) * 1000
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    if result['status'] != 200:
+        raise click.ClickException(f'{path} 返回 {result["status"]}')
+    return result['import_ms'], result['first_request_ms'], total
+
+
+def _probe_gunicorn(cwd, path, timeout=60.0):
+    """单 worker 的 gunicorn：从启动进程到第一个 200 响应的耗时"""
+    port = _free_port()
+    url = f'http://127.0.0.1:{port}{path}'
+    started = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, '-m', 'gunicorn', 'run:app', '--workers', '1',
+                             '--bind', f'127.0.0.1:{port}', '--log-level', 'warning'],
+                            cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - started < timeout:
+            if proc.poll() is not None:
+                raise click.ClickException('gunicorn 启动失败')
+            try:
+                with urllib.request.urlopen(url, timeout=timeout) as response:
+                    if response.status == 200:
+                        return (time.perf_counter() - started) * 1000
+            except urllib.error.HTTPError as e:
+                raise click.ClickException(f'{path} 返回 {e.code}')
+            except OSError:
+                time.sleep(0.005)
+        raise click.ClickException(f'gunicorn {timeout:.0f} 秒内没有就绪')
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def measure_startup(cwd, path, runs, use_gunicorn=True):
+    """重复 runs 次，返回各项耗时的中位数（毫秒）"""
+    samples = {'import_ms': [], 'first_request_ms': [], 'process_ms': [], 'gunicorn_ready_ms': []}
+    for _ in range(runs):
+        import_ms, first_ms, total_ms = _probe_python(cwd, path)
+        samples['import_ms'].append(import_ms)
+        samples['first_request_ms'].append(first_ms)
+        samples['process_ms'].append(total_ms)
+        if use_gunicorn:
+            samples['gunicorn_ready_ms'].append(_probe_gunicorn(cwd, path))
+    return {name: round(statistics.median(values), 1) for name, values in samples.items() if values}
+
+
+MIXED_PROFILES = ('default', 'tuned')
+
+
+def _mixed_engine(config, url, profile, threads):
+    """default：SQLAlchemy 默认参数（SQLite 切回回滚日志）；tuned：app/engine.py 的连接池与 PRAGMA"""
+    from .engine import engine_options, tune_engine
+    if profile == 'tuned':
+        return tune_engine(create_engine(url, **engine_options(config, url, threads=threads)), config)
+    engine = create_engine(url)
+    if engine.dialect.name == 'sqlite':
+        with engine.connect() as conn:
+            conn.exec_driver_sql('PRAGMA journal_mode = DELETE')
+    return engine
+
+
+def _mixed_reads(product_count):
+    """看板读取的代表性查询：每次随机挑一条执行"""
+    month_start = datetime.combine(END_DATE.replace(day=1), datetime.min.time())
+    return [
+        lambda rng: select(SalesDaily.category, func.sum(SalesDaily.amount), func.sum(SalesDaily.quantity))
+        .group_by(SalesDaily.category),
+        lambda rng: select(func.count(BrowseLog.id)).where(BrowseLog.browse_time >= month_start),
+        lambda rng: select(Product).order_by(Product.id).limit(20)
+        .offset(rng.randrange(max(1, product_count - 20))),
+    ]
+
+
+def run_mixed(engine, product_ids, seconds, readers, writers):
+    """读写线程同时运行 seconds 秒，返回两类操作的吞吐、延迟分位数与失败数"""
+    import random
+    reads = _mixed_reads(len(product_ids))
+    samples = {'read': [], 'write': []}
+    errors = {'read': 0, 'write': 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def reader(seed):
+        rng = random.Random(seed)
+        local, failed = [], 0
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                with engine.connect() as conn:
+                    conn.execute(rng.choice(reads)(rng)).all()
+            except (exc.OperationalError, exc.TimeoutError):
+                failed += 1
+                continue
+            local.append((time.perf_counter() - started) * 1000)
+        with lock:
+            samples['read'].extend(local)
+            errors['read'] += failed
+
+    def writer(seed):
+        # 每次给随机商品的库存加 1 再减 1，两个事务结束后数据不变
+        rng = random.Random(seed)
+        local, failed = [], 0
+        while time.perf_counter() < deadline:
+            product_id = rng.choice(product_ids)
+            for delta in (1, -1):
+                started = time.perf_counter()
+                try:
+                    with engine.begin() as conn:
+                        conn.execute(update(Product).where(Product.id == product_id)
+                                     .values(stock=Product.stock + delta))
+                except (exc.OperationalError, exc.TimeoutError):
+                    failed += 1
+                    continue
+                local.append((time.perf_counter() - started) * 1000)
+        with lock:
+            samples['write'].extend(local)
+            errors['write'] += failed
+
+    threads = ([threading.Thread(target=reader, args=(SEED + i,)) for i in range(readers)]
+               + [threading.Thread(target=writer, args=(SEED + 1000 + i,)) for i in range(writers)])
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    result = {}
+    for kind in ('read', 'write'):
+        latencies = sorted(samples[kind])
+        result[f'{kind}s_per_s'] = round(len(latencies) / elapsed, 1)
+        result[f'{kind}_p50_ms'] = round(_percentile(latencies, 0.50), 2)
+        result[f'{kind}_p95_ms'] = round(_percentile(latencies, 0.95), 2)
+        result[f'{kind}_errors'] = errors[kind]
+    return result
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """返回 [(目标, 场景, 指标, 基线值, 当前值)] 退化列表；只比较双方都有的目标和场景"""
+    regressions = []
+    for target, scenarios in results.get('targets', {}).items():
+        base_scenarios = baseline.get('targets', {}).get(target)
+        if not base_scenarios:
+            continue
+        for name, current in scenarios.items():
+            base = base_scenarios.get(name)
+            if not base:
+                continue
+            for metric in ('p50_ms', 'p95_ms', 'p99_ms'):
+                if (current[metric] > base[metric] * (1 + tolerance)
+                        and current[metric] - base[metric] > LATENCY_FLOOR_MS):
+                    regressions.append((target, name, metric, base[metric], current[metric]))
+            if current['throughput_rps'] < base['throughput_rps'] * (1 - tolerance):
+                regressions.append((target, name, 'throughput_rps',
+                                    base['throughput_rps'], current['throughput_rps']))
+            if current['queries_per_request'] > base['queries_per_request'] + 0.01:
+                regressions.append((target, name, 'queries_per_request',
+                                    base['queries_per_request'], current['queries_per_request']))
+            if current['errors'] > base['errors']:
+                regressions.append((target, name, 'errors', base['errors'], current['errors']))
+    for backend, current in results.get('startup', {}).items():
+        base = baseline.get('startup', {}).get(backend)
+        if not base or current.get('path') != base.get('path'):
+            continue
+        for metric, value in current.items():
+            if metric == 'path' or metric not in base:
+                continue
+            if value > base[metric] * (1 + tolerance) and value - base[metric] > STARTUP_FLOOR_MS:
+                regressions.append((f'{backend}/startup', current['path'], metric, base[metric], value))
+    return regressions
+
+
+def _load(path):
+    if path and os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    return {}
+
+
+def _report_regressions(results, baseline, tolerance):
+    shared = (set(results.get('targets', {})) & set(baseline.get('targets', {}))
+              | set(results.get('startup', {})) & set(baseline.get('startup', {})))
+    if not shared:
+        click.echo('基线中没有相同的后端/规模，无法对比')
+        sys.exit(1)
+    regressions = compare(results, baseline, tolerance)
+    for target, name, metric, base, current in regressions:
+        click.echo(f'✗ {target} {name} {metric}: {base} → {current}')
+    if regressions:
+        click.echo(f'{len(regressions)} 项指标退化')
+        sys.exit(1)
+    click.echo('与基线相比没有退化')
+
+
+bench_cli = AppGroup('bench', help='路由级压测')
+
+
+@bench_cli.command('run')
+@click.option('--scale', 'scales', multiple=True, type=click.Choice(list(SCALES)),
+              help='数据规模，可重复指定；不指定时直接使用库中现有数据')
+@click.option('--requests', default=200, show_default=True, help='每个场景的请求数')
+@click.option('--concurrency', default=8, show_default=True, help='并发线程数')
+@click.option('--workers', default=4, show_default=True, help='生成数据的进程数')
+@click.option('--scenario', 'only', multiple=True, help='只跑指定场景，可重复指定')
+@click.option('--output', default='bench_results.json', show_default=True,
+              help='结果文件；已存在时合并（同一目标的结果被覆盖）')
+@click.option('--baseline', default=None, help='基线结果文件，出现退化时以非零状态退出')
+@click.option('--tolerance', default=DEFAULT_TOLERANCE, show_default=True, help='延迟/吞吐允许的退化比例')
+@click.option('--yes', is_flag=True, help='生成数据前不再确认（会清空当前数据库）')
+def run_command(scales, requests, concurrency, workers, only, output, baseline, tolerance, yes):
+    """生成各规模数据并压测代表性路由"""
+    from .seed import generate
+    app = current_app._get_current_object()
+    backend = db.engine.dialect.name
+    if scales and not yes:
+        click.confirm(f'将清空 {db.engine.url.render_as_string(hide_password=True)} 并生成压测数据，继续？',
+                      abort=True)
+
+    results = _load(output)
+    results['meta'] = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'requests': requests,
+        'concurrency': concurrency,
+    }
+    targets = results.setdefault('targets', {})
+
+    for scale in scales or (None,):
+        if scale:
+            click.echo(f'== {backend} / {scale}: 生成数据')
+            generate(**SCALES[scale], seed=SEED, workers=workers, days=DAYS, end_date=END_DATE,
+                     echo=click.echo)
+        target = f'{backend}/{scale or "current"}'
+        scenarios = _scenarios()
+        target_results = targets.setdefault(target, {})
+        click.echo(f'== {target}')
+        click.echo(f'{"场景":<22}{"p50":>9}{"p95":>9}{"p99":>9}{"req/s":>9}{"SQL/req":>9}')
+        for name, (url, before) in scenarios.items():
+            if only and name not in only:
+                continue
+            result = run_scenario(app, url, requests, concurrency, before)
+            target_results[name] = result
+            click.echo(f'{name:<24}{result["p50_ms"]:>9.1f}{result["p95_ms"]:>9.1f}'
+                       f'{result["p99_ms"]:>9.1f}{result["throughput_rps"]:>9.1f}'
+                       f'{result["queries_per_request"]:>9.2f}'
+                       + (f'  失败 {result["errors"]}' if result['errors'] else ''))
+
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    click.echo(f'结果已写入 {output}')
+
+    if baseline:
+        _report_regressions(results, _load(baseline), tolerance)
+
+
+@bench_cli.command('startup')
+@click.option('--runs', default=5, show_default=True, help='重复次数，取中位数')
+@click.option('--path', default='/products', show_default=True, help='第一个请求的路径')
+@click.option('--no-gunicorn', is_flag=True, help='只测导入与首个请求，不启动 gunicorn')
+@click.option('--output', default='bench_results.json', show_default=True,
+              help='结果文件；已存在时合并（同一后端的结果被覆盖）')
+@click.option('--baseline', default=None, help='基线结果文件，出现退化时以非零状态退出')
+@click.option('--tolerance', default=DEFAULT_TOLERANCE, show_default=True, help='启动耗时允许的退化比例')
+def startup_command(runs, path, no_gunicorn, output, baseline, tolerance):
+    """测量新进程导入应用和返回第一个请求的耗时"""
+    import importlib.util
+    use_gunicorn = not no_gunicorn
+    if use_gunicorn and importlib.util.find_spec('gunicorn') is None:
+        click.echo('未安装 gunicorn，只测导入与首个请求')
+        use_gunicorn = False
+    backend = db.engine.dialect.name
+    cwd = os.path.dirname(current_app.root_path)
+    db.session.remove()
+
+    result = measure_startup(cwd, path, runs, use_gunicorn)
+    for name, value in result.items():
+        click.echo(f'{name:<20}{value:>9.1f} ms')
+    result['path'] = path
+
+    results = _load(output)
+    results.setdefault('startup', {})[backend] = result
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    click.echo(f'结果已写入 {output}')
+
+    if baseline:
+        _report_regressions(results, _load(baseline), tolerance)
+
+
+@bench_cli.command('mixed')
+@click.option('--seconds', default=10.0, show_default=True, help='每种引擎配置的运行秒数')
+@click.option('--readers', default=8, show_default=True, help='读线程数')
+@click.option('--writers', default=2, show_default=True, help='写线程数')
+@click.option('--output', default='bench_results.json', show_default=True,
+              help='结果文件；已存在时合并（同一后端的结果被覆盖）')
+def mixed_command(seconds, readers, writers, output):
+    """并发读写：对比默认引擎与调整后的引擎"""
+    config = current_app.config
+    url = db.engine.url
+    backend = db.engine.dialect.name
+    product_ids = db.session.execute(select(Product.id)).scalars().all()
+    if not product_ids:
+        raise click.ClickException('库中没有商品，先运行 flask seed 或 flask bench run --scale 10k')
+    # 释放应用自己的连接：SQLite 切换日志模式需要独占数据库
+    db.session.remove()
+    db.engine.dispose()
+
+    # 压测查询本身很重，期间不写慢查询日志
+    slow_log = logging.getLogger('app.metrics')
+    level = slow_log.level
+    slow_log.setLevel(logging.ERROR)
+
+    result = {'readers': readers, 'writers': writers, 'seconds': seconds}
+    click.echo(f'== {backend}: {readers} 读 / {writers} 写，每种配置 {seconds:.0f} 秒')
+    click.echo(f'{"配置":<10}{"读/s":>9}{"读p95":>9}{"写/s":>9}{"写p95":>9}{"失败":>7}')
+    try:
+        for profile in MIXED_PROFILES:
+            engine = _mixed_engine(config, url, profile, readers + writers)
+            try:
+                stats = run_mixed(engine, product_ids, seconds, readers, writers)
+            finally:
+                engine.dispose()
+            result[profile] = stats
+            click.echo(f'{profile:<12}{stats["reads_per_s"]:>9.1f}{stats["read_p95_ms"]:>9.1f}'
+                       f'{stats["writes_per_s"]:>9.1f}{stats["write_p95_ms"]:>9.1f}'
+                       f'{stats["read_errors"] + stats["write_errors"]:>7}')
+    finally:
+        slow_log.setLevel(level)
+    for kind in ('reads', 'writes'):
+        before, after = result['default'][f'{kind}_per_s'], result['tuned'][f'{kind}_per_s']
+        if before:
+            click.echo(f'{kind} 吞吐：{after / before:.2f}x')
+
+    results = _load(output)
+    results.setdefault('mixed', {})[backend] = result
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    click.echo(f'结果已写入 {output}')
+
+
+@bench_cli.command('compare')
+@click.argument('results')
+@click.argument('baseline')
+@click.option('--tolerance', default=DEFAULT_TOLERANCE, show_default=True, help='延迟/吞吐允许的退化比例')
+def compare_command(results, baseline, tolerance):
+    """对比两份结果文件，出现退化时以非零状态退出"""
+    _report_regressions(_load(results), _load(baseline), tolerance)
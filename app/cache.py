@@ -0,0 +1,214 @@
+"""
+看板结果缓存
+
+默认使用进程内 LRU；配置 DASHBOARD_CACHE_BACKEND = 'sqlite' 时改用本机共享的
+SQLite 文件，所有 gunicorn worker 看到同一份缓存。
+条目带 TTL，商品/用户/销售/浏览记录的写入在事务提交后自动失效对应的 key。
+后台任务（另一个进程）整体改写数据后调用 clear_everywhere：库里的缓存代数加一，
+各 worker 在 HTTP 缓存读数据版本戳时顺带读出代数（不多一条 SQL），变化了就清空本进程的缓存。
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event, func, select
+
+from . import db
+from .models import CacheGeneration, Product, User, Sale, BrowseLog
+
+# 看板缓存 key
+SALES_KEY = 'dashboard:sales'
+BROWSE_KEY = 'dashboard:browse'
+CATALOG_KEY = 'dashboard:catalog'
+# 浏览记录已归档（未解冻）的月份列表
+ARCHIVE_KEY = 'browse:archive'
+
+
+def generation_query(name):
+    """读 cache_generations 中 name 的代数的标量子查询（没有记录时为 0）"""
+    return select(func.coalesce(func.max(CacheGeneration.generation), 0)) \
+        .where(CacheGeneration.name == name).scalar_subquery()
+
+
+def bump_generation(conn, name):
+    """在 conn 的事务里把 name 的代数加一（没有记录时记为 1）"""
+    from .rollups import _insert
+    stmt = _insert(conn, CacheGeneration.__table__).values(name=name, generation=1)
+    conn.execute(stmt.on_conflict_do_update(
+        index_elements=['name'], set_={'generation': CacheGeneration.__table__.c.generation + 1}))
+
+
+class LRUCache:
+    """进程内 LRU，条目为 (value, expires_at)"""
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                self._data.move_to_end(key)
+            return entry
+
+    def set(self, key, value, expires_at):
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class SqliteCache:
+    """本机共享缓存：多个 worker 进程读写同一个 SQLite 文件，值以 JSON 存储"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._conn() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS cache '
+                         '(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)')
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute(
+            'SELECT value, expires_at FROM cache WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def set(self, key, value, expires_at):
+        self._conn().execute(
+            'INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)',
+            (key, json.dumps(value), expires_at))
+
+    def delete(self, keys):
+        self._conn().executemany('DELETE FROM cache WHERE key = ?', [(k,) for k in keys])
+
+    def clear(self):
+        self._conn().execute('DELETE FROM cache')
+
+
+class ResultCache:
+    """带 TTL 与命中统计的结果缓存，后端可替换"""
+
+    def __init__(self, backend=None, ttl=60):
+        self.backend = backend or LRUCache()
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'stale': 0, 'invalidations': 0, 'generations': 0}
+        self.name = 'dashboard'
+        self._generation = None
+
+    def init_app(self, app):
+        backend = app.config.get('DASHBOARD_CACHE_BACKEND', 'memory')
+        if backend == 'sqlite':
+            self.backend = SqliteCache(app.config['DASHBOARD_CACHE_PATH'])
+        else:
+            self.backend = LRUCache(app.config.get('DASHBOARD_CACHE_SIZE', 128))
+        self.ttl = app.config.get('DASHBOARD_CACHE_TTL', 60)
+        app.extensions['dashboard_cache'] = self
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._stats[name] += n
+
+    def get_or_compute(self, key, compute):
+        entry = self.backend.get(key)
+        if entry is not None:
+            value, expires_at = entry
+            if expires_at > time.time():
+                self._count('hits')
+                return value
+            self._count('stale')
+        else:
+            self._count('misses')
+        value = compute()
+        self.backend.set(key, value, time.time() + self.ttl)
+        return value
+
+    def invalidate(self, *keys):
+        if keys:
+            self.backend.delete(keys)
+            self._count('invalidations', len(keys))
+
+    def clear(self):
+        self.backend.clear()
+
+    def generation_query(self):
+        """读库中缓存代数的标量子查询（没有记录时为 0）"""
+        return generation_query(self.name)
+
+    def sync_generation(self, generation):
+        """库中的缓存代数与本进程上次看到的不同（其它进程调用过 clear_everywhere）时清空本进程缓存"""
+        if generation != self._generation:
+            if self._generation is not None:
+                self.clear()
+                self._count('generations')
+            self._generation = generation
+
+    def clear_everywhere(self, conn):
+        """在 conn 的事务里把缓存代数加一并清空本进程缓存；其它进程读到新代数时清空各自的缓存"""
+        bump_generation(conn, self.name)
+        self.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats['hits'] + stats['misses'] + stats['stale']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        stats['ttl'] = self.ttl
+        stats['backend'] = type(self.backend).__name__
+        return stats
+
+
+dashboard_cache = ResultCache()
+
+# 写入类型 -> 受影响的看板 key
+_AFFECTED_KEYS = {
+    Product: (SALES_KEY, BROWSE_KEY, CATALOG_KEY),
+    User: (CATALOG_KEY,),
+    Sale: (SALES_KEY,),
+    BrowseLog: (BROWSE_KEY,),
+}
+
+
+@event.listens_for(db.session, 'after_flush')
+def _collect_dirty_keys(session, flush_context):
+    keys = session.info.setdefault('dashboard_cache_keys', set())
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        keys.update(_AFFECTED_KEYS.get(type(obj), ()))
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_on_commit(session):
+    keys = session.info.pop('dashboard_cache_keys', None)
+    if keys:
+        dashboard_cache.invalidate(*keys)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_on_rollback(session):
+    session.info.pop('dashboard_cache_keys', None)
@@ -0,0 +1,519 @@
+"""
+商品目录缓存
+
+/products、/sales、/browse_logs 渲染和商品保存 / 删除时用到的商品字段（名称、品类、型号、
+单位、单价、库存、登记日期）由每个 worker 的进程内目录缓存提供：按商品编号批量读取，
+缓存里没有的编号用一条 IN 查询补齐后留在缓存里（读穿透）。
+
+存储按列放在标准库 array 里：有序的商品编号数组（二分查找）对应槽位号，各列按槽位存放——
+单价按分存 int64，库存 int32，登记日期存日期序数；品类和单位取值很少，编码成 uint16 下标；
+名称和型号的 UTF-8 字节依次追加到一个 bytearray，槽位里只记偏移和长度。每个商品固定约
+50 字节再加名称、型号的字节数，百万 SKU 在 100MB 以内，不会为每个商品常驻 Python 对象；
+只有一页结果才临时生成带 __slots__ 的 CatalogProduct。
+
+跨 worker 一致性靠数据库里的版本号：商品的每次修改或删除（ORM 会话、批量导入、批量删除、
+下单扣库存）在同一事务内取一个新版本号，并在 catalog_changes 里按版本记下变化的商品编号。
+版本号不再是一行计数器（它的行锁会一直持有到提交，把所有下单事务串行起来）：PostgreSQL 上
+取自序列 catalog_version_seq，不加锁；SQLite 的写事务本就串行，取 catalog_changes 的最大版本号加一。
+因此版本号可能乱序提交，或因回滚留下空号。每个 worker 最多每 CATALOG_SYNC_INTERVAL 秒读一次
+最新版本号，只失效新出现的版本里变化的商品；比已见最大版本号小、还没见到的版本号记为空缺，
+之后每次同步补查，超过 CATALOG_GAP_SECONDS 秒仍未出现的视为已回滚。
+落后太多（变更记录可能已被清理）、出现整体失效标记（批量导入、重新生成数据、迁移）或
+版本号回退时清空整个缓存。本进程提交的修改会让下一次读取立即同步。
+"""
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from datetime import date
+from decimal import Decimal
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import delete, event, func, insert, or_, select, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import make_transient_to_detached
+
+from . import db
+from .models import CatalogChange, Product, catalog_version_seq
+
+FIELDS = ('id', 'name', 'category', 'model', 'unit', 'price', 'stock', 'reg_date')
+
+ALL_PRODUCTS = 0 # catalog_changes 中表示“全部商品”的编号
+MAX_CHANGED_IDS = 1000 # 一次修改超过该数量的商品时只记一条整体失效
+KEEP_VERSIONS = 10000 # catalog_changes 保留的版本数，落后更多的 worker 整体重载
+PRUNE_EVERY = 100 # 每隔多少个版本清理一次旧的变更记录
+
+_NO_STOCK = -2 ** 31 # 库存为 NULL
+_NO_TEXT = 0xFFFFFFFF # 型号为 NULL
+_MAX_CODES = 0xFFFF # 品类 + 单位的不同取值上限（uint16）
+_FETCH_CHUNK = 5000 # 补齐未命中商品时每条 IN 查询的编号个数
+
+
+class CatalogProduct:
+    """目录缓存里的一个商品，属性与 Product 同名，模板与表单处理可以直接使用"""
+    __slots__ = FIELDS
+
+    def __init__(self, id, name, category, model, unit, price, stock, reg_date):
+        self.id = id
+        self.name = name
+        self.category = category
+        self.model = model
+        self.unit = unit
+        self.price = price
+        self.stock = stock
+        self.reg_date = reg_date
+
+    def __repr__(self):
+        return f'<CatalogProduct {self.id} {self.name!r}>'
+
+
+def _to_cents(price):
+    return int((price if isinstance(price, Decimal) else Decimal(str(price))).scaleb(2))
+
+
+def _from_row(row):
+    return CatalogProduct(*(getattr(row, f) for f in FIELDS))
+
+
+class ProductCatalog:
+    """每个 worker 一份的商品目录缓存"""
+
+    def __init__(self):
+        self.enabled = True
+        self.sync_interval = 1.0
+        self.gap_seconds = 600.0
+        self._lock = threading.Lock()
+        self._version = None         # 不大于它的版本都已处理（或确认已回滚）
+        self._latest = 0             # 见过的最大版本号
+        self._gaps = {}              # 比 _latest 小、还没见到的版本号 -> 首次发现的时间
+        self._next_sync = 0.0
+        self._generation = 0
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'resets': 0, 'syncs': 0}
+        self._reset()
+
+    def init_app(self, app):
+        self.enabled = app.config.get('CATALOG_CACHE', True)
+        self.sync_interval = app.config.get('CATALOG_SYNC_INTERVAL', self.sync_interval)
+        self.gap_seconds = app.config.get('CATALOG_GAP_SECONDS', self.gap_seconds)
+        app.extensions['product_catalog'] = self
+
+    def expire(self):
+        """下一次读取时立即同步版本号"""
+        self._next_sync = 0.0
+
+    @property
+    def version(self):
+        """本进程已同步到的目录状态（已处理到的版本、最大版本、空缺数），尚未同步时为 None"""
+        if self._version is None:
+            return None
+        return f'{self._version}.{self._latest}.{len(self._gaps)}'
+
+    # ---------- 存储（调用方持有 _lock） ----------
+
+    def _reset(self):
+        self._ids = array('q')       # 有序的商品编号
+        self._slots = array('I')     # 与 _ids 对应的槽位号
+        self._free = array('I')      # 被失效腾出的槽位
+        self._price = array('q')     # 单价（分）
+        self._stock = array('i')
+        self._reg_date = array('i')  # 日期序数，0 表示 NULL
+        self._category = array('H')  # 下标指向 _words
+        self._unit = array('H')
+        self._name_at = array('I')   # 名称在 _text 中的偏移与长度
+        self._name_len = array('I')
+        self._model_at = array('I')
+        self._model_len = array('I')
+        self._text = bytearray()
+        self._garbage = 0            # _text 中已不再引用的字节数
+        self._words = [None]         # 品类 / 单位编码表，0 表示 NULL
+        self._codes = {None: 0}
+
+    def _columns(self):
+        return (self._price, self._stock, self._reg_date, self._category, self._unit,
+                self._name_at, self._name_len, self._model_at, self._model_len)
+
+    def _find(self, product_id):
+        i = bisect_left(self._ids, product_id)
+        if i < len(self._ids) and self._ids[i] == product_id:
+            return i
+        return None
+
+    def _code(self, word):
+        code = self._codes.get(word)
+        if code is None:
+            code = self._codes[word] = len(self._words)
+            self._words.append(word)
+        return code
+
+    def _put_text(self, value):
+        if value is None:
+            return 0, _NO_TEXT
+        data = value.encode('utf-8')
+        at = len(self._text)
+        self._text += data
+        return at, len(data)
+
+    def _get_text(self, at, length):
+        if length == _NO_TEXT:
+            return None
+        return self._text[at:at + length].decode('utf-8')
+
+    def _release(self, slot):
+        self._garbage += self._name_len[slot]
+        if self._model_len[slot] != _NO_TEXT:
+            self._garbage += self._model_len[slot]
+
+    def _store(self, row):
+        if len(self._words) + 2 > _MAX_CODES or len(self._text) > 0xFFFFFFFF - 4096:
+            self._reset()
+            self._stats['resets'] += 1
+        i = bisect_left(self._ids, row.id)
+        if i < len(self._ids) and self._ids[i] == row.id:
+            slot = self._slots[i]
+            self._release(slot)
+        else:
+            if self._free:
+                slot = self._free.pop()
+            else:
+                slot = len(self._price)
+                for column in self._columns():
+                    column.append(0)
+            self._ids.insert(i, row.id)
+            self._slots.insert(i, slot)
+        self._price[slot] = _to_cents(row.price)
+        self._stock[slot] = _NO_STOCK if row.stock is None else row.stock
+        self._reg_date[slot] = row.reg_date.toordinal() if row.reg_date else 0
+        self._category[slot] = self._code(row.category)
+        self._unit[slot] = self._code(row.unit)
+        self._name_at[slot], self._name_len[slot] = self._put_text(row.name)
+        self._model_at[slot], self._model_len[slot] = self._put_text(row.model)
+
+    def _evict(self, product_id):
+        i = self._find(product_id)
+        if i is None:
+            return False
+        slot = self._slots[i]
+        self._release(slot)
+        del self._ids[i]
+        del self._slots[i]
+        self._free.append(slot)
+        return True
+
+    def _maybe_compact(self):
+        # 被替换或失效的名称 / 型号超过一半（且超过 1MB）时重排 _text
+        if self._garbage > 1 << 20 and self._garbage * 2 > len(self._text):
+            self._compact()
+
+    def _compact(self):
+        text = bytearray()
+        for slot in self._slots:
+            for offsets, lengths in ((self._name_at, self._name_len),
+                                     (self._model_at, self._model_len)):
+                length = lengths[slot]
+                if length == _NO_TEXT:
+                    continue
+                at = offsets[slot]
+                offsets[slot] = len(text)
+                text += self._text[at:at + length]
+        self._text = text
+        self._garbage = 0
+
+    def _record(self, slot, product_id):
+        stock = self._stock[slot]
+        reg_date = self._reg_date[slot]
+        return CatalogProduct(
+            product_id,
+            self._get_text(self._name_at[slot], self._name_len[slot]),
+            self._words[self._category[slot]],
+            self._get_text(self._model_at[slot], self._model_len[slot]),
+            self._words[self._unit[slot]],
+            Decimal(self._price[slot]).scaleb(-2),
+            None if stock == _NO_STOCK else stock,
+            date.fromordinal(reg_date) if reg_date else None,
+        )
+
+    # ---------- 同步 ----------
+
+    def _connection(self):
+        # 版本号与商品行都从主库读：副本的复制延迟会让缓存记下比版本号更旧的数据
+        return db.session.connection(bind_arguments={'bind': db.engine})
+
+    def sync(self, force=False):
+        """到了同步间隔（或 force）时读数据库版本号，失效其它进程修改过的商品"""
+        now = time.monotonic()
+        if not force and now < self._next_sync:
+            return
+        self._next_sync = now + self.sync_interval
+        conn = self._connection()
+        latest = conn.execute(select(func.max(CatalogChange.version))).scalar() or 0
+        versions, changed = set(), None  # changed 为 None 表示整体失效
+        if self._version is not None and self._latest <= latest <= self._version + KEEP_VERSIONS:
+            if latest == self._latest and not self._gaps:
+                return
+            # 新出现的版本，以及之前的空缺（可能是当时尚未提交的事务）
+            condition = CatalogChange.version > self._latest
+            if self._gaps:
+                condition = or_(condition, CatalogChange.version.in_(sorted(self._gaps)))
+            rows = conn.execute(
+                select(CatalogChange.version, CatalogChange.product_id)
+                .where(condition, CatalogChange.version <= latest)).all()
+            versions = {r.version for r in rows}
+            if all(r.product_id != ALL_PRODUCTS for r in rows):
+                changed = {r.product_id for r in rows}
+        now = time.monotonic()
+        with self._lock:
+            self._stats['syncs'] += 1
+            if changed is None:
+                if self._ids:
+                    self._stats['resets'] += 1
+                self._reset()
+                self._gaps.clear()
+                self._latest = latest
+            else:
+                self._stats['evictions'] += sum(self._evict(pid) for pid in changed)
+                self._maybe_compact()
+                for version in range(self._latest + 1, latest + 1):
+                    if version not in versions:
+                        self._gaps[version] = now
+                for version in versions:
+                    self._gaps.pop(version, None)
+                for version, since in list(self._gaps.items()):
+                    if now - since >= self.gap_seconds:
+                        del self._gaps[version]
+                self._latest = latest
+            self._version = min(self._gaps) - 1 if self._gaps else self._latest
+            if changed is None or versions:
+                self._generation += 1
+
+    # ---------- 读取 ----------
+
+    def _fetch(self, ids):
+        conn = self._connection()
+        ids = sorted(ids)
+        rows = []
+        for i in range(0, len(ids), _FETCH_CHUNK):
+            rows.extend(conn.execute(
+                select(*(getattr(Product, f) for f in FIELDS))
+                .where(Product.id.in_(ids[i:i + _FETCH_CHUNK]))).all())
+        return rows
+
+    def lookup(self, ids):
+        """按商品编号批量取商品，返回 {编号: CatalogProduct}；不存在的编号不在结果里"""
+        ids = set(ids)
+        if not ids:
+            return {}
+        if not self.enabled:
+            return {row.id: _from_row(row) for row in self._fetch(ids)}
+        self.sync()
+        found, missing = {}, []
+        with self._lock:
+            for product_id in ids:
+                i = self._find(product_id)
+                if i is None:
+                    missing.append(product_id)
+                else:
+                    found[product_id] = self._record(self._slots[i], product_id)
+            generation = self._generation
+            self._stats['hits'] += len(found)
+            self._stats['misses'] += len(missing)
+        if missing:
+            rows = self._fetch(missing)
+            with self._lock:
+                # 查询期间同步过版本号时，读到的行可能早于刚失效的修改，这次不放进缓存
+                if generation == self._generation:
+                    for row in rows:
+                        self._store(row)
+                    self._maybe_compact()
+            found.update((row.id, _from_row(row)) for row in rows)
+        return found
+
+    def get(self, product_id):
+        """按编号取单个商品，不存在时返回 None"""
+        try:
+            product_id = int(product_id)
+        except (TypeError, ValueError):
+            return None
+        return self.lookup([product_id]).get(product_id)
+
+    def attach(self, session, product):
+        """
+        把目录里的商品作为已持久化的 Product 放进会话，不再 SELECT；
+        之后修改属性照常由 flush 写成 UPDATE（只写与目录中取值不同的列），删除写成 DELETE
+        """
+        instance = Product(**{f: getattr(product, f) for f in FIELDS})
+        make_transient_to_detached(instance)
+        return session.merge(instance, load=False)
+
+    def nbytes(self):
+        with self._lock:
+            arrays = (self._ids, self._slots, self._free, *self._columns())
+            return sum(a.itemsize * len(a) for a in arrays) + len(self._text)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['products'] = len(self._ids)
+            stats['version'] = self._version
+            stats['latest'] = self._latest
+            stats['gaps'] = len(self._gaps)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        stats['nbytes'] = self.nbytes()
+        stats['enabled'] = self.enabled
+        return stats
+
+
+product_catalog = ProductCatalog()
+
+
+def _next_version(conn):
+    if conn.dialect.name == 'postgresql':
+        # 序列不参与事务，也不加锁：并发的下单事务互不等待
+        return conn.execute(select(catalog_version_seq.next_value())).scalar()
+    # SQLite 同一时刻只有一个写事务（调用时本事务已写过商品或销售，持有写锁）
+    return (conn.execute(select(func.max(CatalogChange.version))).scalar() or 0) + 1
+
+
+def ensure_version_sequence(conn):
+    """PostgreSQL：让版本号序列不小于已记下的最大版本号（升级自计数器表、迁移后调用）"""
+    if conn.dialect.name != 'postgresql':
+        return
+    conn.exec_driver_sql(
+        "SELECT setval('catalog_version_seq', GREATEST("
+        "(SELECT last_value + is_called::int FROM catalog_version_seq), "
+        "(SELECT COALESCE(MAX(version), 0) FROM catalog_changes) + 1), false)")
+
+
+def bump_version(conn, product_ids=None):
+    """
+    在当前事务内取一个新的目录版本号，并记下变化的商品编号，返回新版本号（product_ids 为空时不记）。
+    product_ids 为 None 或超过 MAX_CHANGED_IDS 个时记为全部商品失效。
+    """
+    ids = sorted(set(product_ids)) if product_ids is not None else [ALL_PRODUCTS]
+    if not ids:
+        return None
+    if len(ids) > MAX_CHANGED_IDS:
+        ids = [ALL_PRODUCTS]
+    version = _next_version(conn)
+    conn.execute(insert(CatalogChange), [{'version': version, 'product_id': pid} for pid in ids])
+    if version % PRUNE_EVERY == 0:
+        conn.execute(delete(CatalogChange).where(CatalogChange.version <= version - KEEP_VERSIONS))
+    conn.info['catalog_bumped'] = True
+    return version
+
+
+@event.listens_for(Engine, 'commit')
+def _expire_on_commit(conn):
+    # 本进程提交了商品修改：下一次读取不等同步间隔
+    if conn.info.pop('catalog_bumped', None):
+        product_catalog.expire()
+
+
+@event.listens_for(Engine, 'rollback')
+def _discard_on_rollback(conn):
+    # 连接断开后已失效，读不到 info（随连接一起丢弃）
+    if not conn.invalidated:
+        conn.info.pop('catalog_bumped', None)
+
+
+@event.listens_for(db.session, 'after_flush')
+def _record_product_changes(session, flush_context):
+    # 新增的商品不在任何缓存里，只记修改与删除；只改了关系集合（如新增销售记录）的不算
+    changed = [o.id for o in session.deleted if isinstance(o, Product)]
+    changed += [o.id for o in session.dirty if isinstance(o, Product)
+                and session.is_modified(o, include_collections=False)]
+    if changed:
+        bump_version(session.connection(), changed)
+
+
+catalog_cli = AppGroup('catalog', help='商品目录缓存')
+
+
+@catalog_cli.command('check')
+@click.option('--limit', default=100000, show_default=True, help='最多核对的商品数')
+@click.option('--batch', default=1000, show_default=True, help='每次批量读取的商品数')
+def check_command(limit, batch):
+    """经缓存读取商品并与数据库逐字段核对，再模拟另一进程修改商品验证失效，不一致时以非零状态退出"""
+    catalog = product_catalog
+    catalog.enabled = True
+    catalog.sync(force=True)
+    ids = db.session.execute(select(Product.id).order_by(Product.id).limit(limit)).scalars().all()
+    if not ids:
+        raise click.ClickException('商品表为空')
+
+    started = time.perf_counter()
+    for i in range(0, len(ids), batch):
+        catalog.lookup(ids[i:i + batch])
+    load_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    cached = {}
+    for i in range(0, len(ids), batch):
+        cached.update(catalog.lookup(ids[i:i + batch]))
+    hit_seconds = time.perf_counter() - started
+
+    mismatches = 0
+    rows = db.session.execute(select(*(getattr(Product, f) for f in FIELDS))
+                              .where(Product.id.in_(ids[:_FETCH_CHUNK]))).all()
+    for row in rows:
+        product = cached.get(row.id)
+        for f in FIELDS:
+            if product is None or getattr(product, f) != getattr(row, f):
+                mismatches += 1
+                click.echo(f'商品 {row.id} 的 {f} 不一致: 缓存 '
+                           f'{getattr(product, f, None)!r}，数据库 {getattr(row, f)!r}')
+                break
+    stats = catalog.stats()
+    click.echo(f'核对 {len(rows)} 个商品，不一致 {mismatches} 个；缓存 {stats["products"]} 个商品，'
+               f'{stats["nbytes"] / 1024 / 1024:.1f} MB（每个 {stats["nbytes"] / stats["products"]:.0f} 字节）')
+    click.echo(f'读穿透 {len(ids) / load_seconds:,.0f} 个/秒，命中 {len(ids) / hit_seconds:,.0f} 个/秒')
+
+    # 模拟另一个 worker：用独立连接改名并记版本，本进程同步后应读到新名称
+    db.session.rollback()
+    probe = ids[0]
+    original = db.session.execute(select(Product.name).where(Product.id == probe)).scalar()
+    db.session.rollback()
+    renamed = original + ' *'
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(update(Product).where(Product.id == probe).values(name=renamed))
+            bump_version(conn, [probe])
+        catalog.sync(force=True)
+        coherent = catalog.get(probe).name == renamed
+        db.session.rollback()
+    finally:
+        with db.engine.begin() as conn:
+            conn.execute(update(Product).where(Product.id == probe).values(name=original))
+            bump_version(conn, [probe])
+    click.echo(f'跨进程失效: {"通过" if coherent else "失败"}')
+
+    # PostgreSQL：先取版本号的事务后提交，同步时不能漏掉它（SQLite 的写事务串行，不会乱序）
+    in_order = True
+    if db.engine.dialect.name == 'postgresql' and len(ids) > 1:
+        late, early = ids[0], ids[1]
+        names = dict(db.session.execute(select(Product.id, Product.name).where(Product.id.in_([late, early]))).all())
+        db.session.rollback()
+        catalog.lookup([late, early])
+        try:
+            with db.engine.connect() as slow:
+                with slow.begin():
+                    slow.execute(update(Product).where(Product.id == late).values(name=names[late] + ' *'))
+                    bump_version(slow, [late])
+                    with db.engine.begin() as conn:
+                        conn.execute(update(Product).where(Product.id == early).values(name=names[early] + ' *'))
+                        bump_version(conn, [early])
+                    catalog.sync(force=True)
+                    catalog.lookup([late, early])
+                    db.session.rollback()
+                catalog.sync(force=True)
+                in_order = catalog.get(late).name == names[late] + ' *'
+                db.session.rollback()
+        finally:
+            with db.engine.begin() as conn:
+                for product_id, name in names.items():
+                    conn.execute(update(Product).where(Product.id == product_id).values(name=name))
+                bump_version(conn, list(names))
+        click.echo(f'乱序提交: {"通过" if in_order else "失败"}')
+    if mismatches or not coherent or not in_order:
+        sys.exit(1)
@@ -0,0 +1,48 @@
+"""
+命令行注册
+
+各子命令所在的模块只在执行 flask 命令时才导入，Web 进程启动时不加载它们。
+"""
+import importlib
+
+from flask.cli import AppGroup
+
+# 命令名 -> 模块:对象
+COMMANDS = {
+    'schema': '.schema:schema_cli',
+    'seed': '.seed:seed_command',
+    'rollups': '.rollups:rollups_cli',
+    'indexes': '.indexes:indexes_cli',
+    'queries': '.querycount:queries_cli',
+    'orders': '.orders:orders_cli',
+    'partitions': '.partitions:partitions_cli',
+    'bench': '.bench:bench_cli',
+    'jobs': '.jobs:jobs_cli',
+    'products': '.product_import:products_cli',
+    'sketches': '.sketches:sketches_cli',
+    'conversion': '.conversion:conversion_cli',
+    'catalog': '.catalog:catalog_cli',
+    'http': '.httpcache:http_cli',
+}
+
+
+class LazyAppGroup(AppGroup):
+    """按需导入子命令的 AppGroup，用来替换 app.cli"""
+
+    def __init__(self, *args, lazy_commands=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lazy_commands = dict(lazy_commands or {})
+
+    def list_commands(self, ctx):
+        return sorted(set(super().list_commands(ctx)) | set(self.lazy_commands))
+
+    def get_command(self, ctx, name):
+        target = self.lazy_commands.pop(name, None)
+        if target is not None:
+            module, attr = target.split(':')
+            self.add_command(getattr(importlib.import_module(module, __package__), attr), name)
+            # 本项目的命令（seed、归档、重建汇总等长事务）不受 Web 进程的语句超时限制
+            from flask import current_app
+            from .engine import enable_batch
+            enable_batch(current_app)
+        return super().get_command(ctx, name)
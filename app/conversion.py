@@ -0,0 +1,410 @@
+"""
+浏览 → 购买转化报表
+
+按商品、品类、浏览方式统计一个日期窗口内的浏览量、浏览人数、购买人数、转化率，
+以及从首次浏览到购买的天数中位数。
+(用户, 商品) 在窗口内有浏览、且在首次浏览当天或之后有购买即算一次转化；
+浏览方式按首次浏览的方式归因（浏览量仍按每条记录的方式计）。
+
+不做两张明细表的自连接（同一用户对同一商品的多次浏览与多次购买会两两相乘），
+而是用服务端游标按 (user_id, product_id, 时间) 顺序分别流式读取窗口内的浏览记录
+和销售记录，像归并排序一样同步推进两个有序流：
+- 每对 (用户, 商品) 只需要首次浏览时间和它之后的第一笔购买；
+- 流按用户排序，品类、浏览方式的去重人数在处理完一个用户时就能确定，不需要全局集合；
+- 天数中位数用“天数 → 次数”的直方图计算，大小只与窗口天数有关。
+内存只与商品数、窗口天数有关，与明细行数无关；窗口覆盖已归档月份时，
+这些月份的记录从归档段只读地解码、排好序后并入浏览记录流（这部分按归档行数占用内存）。
+
+结果按窗口（起止日期）缓存在 conversion_reports 表中，所有 worker 与后台任务共用：
+窗口包含计算当天时缓存 CONVERSION_CACHE_TTL 秒，已经结束的窗口缓存 CONVERSION_CLOSED_TTL 秒；
+删除商品/用户、重建汇总表时清空。修改商品品类后，已缓存的品类统计要到缓存过期才会更新。
+Web 请求不在请求里计算：GET 只读缓存（cached_or_pending），缓存过期时返回旧报表，并带上该窗口
+正在排队或执行的任务；计算只由 POST（request_report，提交 conversion_report 后台任务，同一窗口同时只有一个）、
+命令行或后台任务发起，爬虫和自动刷新的页面不会触发计算。
+大窗口可以用 `flask conversion report` 或后台任务 conversion_report 预先算好。
+"""
+import heapq
+import json
+import sys
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta
+from itertools import chain, groupby
+from operator import itemgetter
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import delete, select
+
+from . import db
+from .models import BrowseLog, ConversionReport, Product, Sale
+
+YIELD_PER = 5000 # 服务端游标每批取回的行数
+PROGRESS_EVERY = 100000 # 每处理这么多条浏览记录上报一次进度
+
+_pair = itemgetter(0, 1)
+_view_order = itemgetter(0, 1, 2)
+
+
+def _median(histogram):
+    """天数直方图的中位数（偶数个时取中间两个的平均）"""
+    n = sum(histogram.values())
+    if not n:
+        return None
+    lower, upper = (n - 1) // 2, n // 2
+    seen, low = 0, None
+    for days, count in sorted(histogram.items()):
+        if low is None and seen + count > lower:
+            low = days
+        if seen + count > upper:
+            return (low + days) / 2
+        seen += count
+    return None
+
+
+class _Group:
+    """一个统计维度（某商品/品类/浏览方式或合计）的累加器"""
+    __slots__ = ('views', 'viewers', 'buyers', 'delays')
+
+    def __init__(self):
+        self.views = 0
+        self.viewers = 0
+        self.buyers = 0
+        self.delays = Counter()
+
+    def result(self):
+        return {
+            'views': self.views,
+            'viewers': self.viewers,
+            'buyers': self.buyers,
+            'conversion': round(self.buyers / self.viewers, 4) if self.viewers else 0.0,
+            'median_days': _median(self.delays),
+        }
+
+
+def _first_purchase(sales, since):
+    """有序的购买日期里第一个不早于 since 的，没有时返回 None"""
+    for _, _, sale_date in sales:
+        if sale_date >= since:
+            return sale_date
+    return None
+
+
+def _stream(conn, stmt):
+    """服务端游标分批取回，逐行产出（按批取比逐行 fetchone 少很多开销）"""
+    result = conn.execute(stmt.execution_options(stream_results=True, yield_per=YIELD_PER))
+    return chain.from_iterable(result.partitions())
+
+
+def _archived_views(conn, start_dt, end_dt):
+    """窗口内已归档月份的浏览记录，按 (user_id, product_id, browse_time) 排好序"""
+    from .partitions import archived_logs
+    return sorted(((r['user_id'], r['product_id'], r['browse_time'], r['platform'])
+                   for r in archived_logs(conn, start_dt, end_dt)), key=_view_order)
+
+
+def compute_report(conn, start, end, progress=None):
+    """
+    单次归并计算 [start, end] 两端都含的日期窗口的转化报表。
+    progress 可选，以 message 关键字参数上报已处理的行数（后台任务与命令行）。
+    """
+    catalog = {pid: (name, category or '')
+               for pid, name, category in conn.execute(select(Product.id, Product.name, Product.category))}
+    start_dt = datetime.combine(start, datetime.min.time())
+    end_dt = datetime.combine(end + timedelta(days=1), datetime.min.time())
+    logs = _stream(conn, select(BrowseLog.user_id, BrowseLog.product_id, BrowseLog.browse_time,
+                                BrowseLog.platform)
+                   .where(BrowseLog.browse_time >= start_dt, BrowseLog.browse_time < end_dt)
+                   .order_by(BrowseLog.user_id, BrowseLog.product_id, BrowseLog.browse_time))
+    archived = _archived_views(conn, start_dt, end_dt)
+    if archived:
+        logs = heapq.merge(logs, archived, key=_view_order)
+    sales = _stream(conn, select(Sale.user_id, Sale.product_id, Sale.sale_date)
+                    .where(Sale.sale_date >= start, Sale.sale_date <= end)
+                    .order_by(Sale.user_id, Sale.product_id, Sale.sale_date))
+
+    total = _Group()
+    products = defaultdict(_Group)
+    categories = defaultdict(_Group)
+    platforms = defaultdict(_Group)
+    platform_views = defaultdict(int)
+    log_rows, next_report = 0, PROGRESS_EVERY
+
+    sale_pairs = groupby(sales, key=_pair)
+    sale_key, sale_group = next(sale_pairs, (None, None))
+    for user_id, user_logs in groupby(logs, key=itemgetter(0)):
+        # 一个用户的全部 (用户, 商品) 对：去重人数在用户结束时累加
+        viewed_categories, bought_categories = set(), set()
+        viewed_platforms, bought_platforms = set(), set()
+        converted = False
+        for key, views in groupby(user_logs, key=_pair):
+            first = next(views)
+            known = key[1] in catalog
+            first_platform = first[3] or ''
+            n = 1
+            if known:
+                platform_views[first_platform] += 1
+                viewed_platforms.add(first_platform)
+                for row in views:
+                    platform = row[3] or ''
+                    platform_views[platform] += 1
+                    viewed_platforms.add(platform)
+                    n += 1
+            else:
+                n += sum(1 for _ in views)
+            log_rows += n
+
+            while sale_key is not None and sale_key < key:
+                sale_key, sale_group = next(sale_pairs, (None, None))
+            purchase = None
+            first_day = first[2].date()
+            if sale_key == key:
+                purchase = _first_purchase(sale_group, first_day)
+                sale_key, sale_group = next(sale_pairs, (None, None))
+            if not known:
+                continue
+
+            category = catalog[key[1]][1]
+            product, cat = products[key[1]], categories[category]
+            total.views += n
+            product.views += n
+            product.viewers += 1
+            cat.views += n
+            viewed_categories.add(category)
+            if purchase is not None:
+                delay = (purchase - first_day).days
+                converted = True
+                product.buyers += 1
+                bought_categories.add(category)
+                bought_platforms.add(first_platform)
+                for group in (total, product, cat, platforms[first_platform]):
+                    group.delays[delay] += 1
+
+        if viewed_categories:
+            total.viewers += 1
+            total.buyers += converted
+        for category in viewed_categories:
+            categories[category].viewers += 1
+        for category in bought_categories:
+            categories[category].buyers += 1
+        for platform in viewed_platforms:
+            platforms[platform].viewers += 1
+        for platform in bought_platforms:
+            platforms[platform].buyers += 1
+        if progress is not None and log_rows >= next_report:
+            progress(message=f'已处理 {log_rows} 条浏览记录')
+            next_report = log_rows + PROGRESS_EVERY
+    for platform, views in platform_views.items():
+        platforms[platform].views = views
+
+    def rows(groups, name):
+        return sorted(({name: key, **group.result()} for key, group in groups.items()),
+                      key=lambda r: (-r['views'], str(r[name])))
+
+    product_rows = rows(products, 'product_id')
+    for row in product_rows:
+        row['name'], row['category'] = catalog[row['product_id']]
+    return {
+        'start_date': start.isoformat(),
+        'end_date': end.isoformat(),
+        'browse_rows': log_rows,
+        'totals': total.result(),
+        'categories': rows(categories, 'category'),
+        'platforms': rows(platforms, 'platform'),
+        'products': product_rows,
+    }
+
+
+# ---------- 按窗口缓存 ----------
+
+def _is_fresh(computed_at, end, now, config):
+    closed = computed_at.date() > end
+    ttl = config.get('CONVERSION_CLOSED_TTL', 86400) if closed else config.get('CONVERSION_CACHE_TTL', 300)
+    return (now - computed_at).total_seconds() < ttl
+
+
+def cached_report(conn, start, end, config, allow_stale=False):
+    """
+    未过期的缓存报表，没有时返回 None；allow_stale 为真时过期的报表也返回，
+    报表的 stale 字段标明是否已过期
+    """
+    row = conn.execute(select(ConversionReport.computed_at, ConversionReport.payload)
+                       .where(ConversionReport.start_date == start,
+                              ConversionReport.end_date == end)).first()
+    if row is None:
+        return None
+    stale = not _is_fresh(row.computed_at, end, datetime.now(), config)
+    if stale and not allow_stale:
+        return None
+    report = json.loads(row.payload)
+    report['computed_at'] = row.computed_at.isoformat(timespec='seconds')
+    report['stale'] = stale
+    return report
+
+
+def store_report(conn, report):
+    from .rollups import _insert
+    computed_at = datetime.now()
+    stmt = _insert(conn, ConversionReport.__table__).values(
+        start_date=date.fromisoformat(report['start_date']),
+        end_date=date.fromisoformat(report['end_date']),
+        computed_at=computed_at, payload=json.dumps(report, ensure_ascii=False))
+    conn.execute(stmt.on_conflict_do_update(
+        index_elements=['start_date', 'end_date'],
+        set_={'computed_at': stmt.excluded.computed_at, 'payload': stmt.excluded.payload}))
+    report['computed_at'] = computed_at.isoformat(timespec='seconds')
+    report['stale'] = False
+    return report
+
+
+def clear_reports(conn):
+    conn.execute(delete(ConversionReport))
+
+
+def conversion_report(start, end, refresh=False, progress=None):
+    """取缓存或重新计算并写入缓存"""
+    config = current_app.config
+    if not refresh:
+        with db.engine.connect() as conn:
+            report = cached_report(conn, start, end, config)
+        if report is not None:
+            return report
+    with db.engine.connect() as conn:
+        report = compute_report(conn, start, end, progress)
+    with db.engine.begin() as conn:
+        return store_report(conn, report)
+
+
+def _job_params(start, end):
+    return {'start_date': start.isoformat(), 'end_date': end.isoformat()}
+
+
+def _cached(start, end):
+    with db.engine.connect() as conn:
+        return cached_report(conn, start, end, current_app.config, allow_stale=True)
+
+
+def cached_or_pending(start, end):
+    """
+    GET 请求用，只读：返回 (报表, 任务编号)。过期时返回旧报表（stale 为真），没有缓存时报表为 None；
+    缓存未过期时任务编号为 None，否则为该窗口正在排队或执行的计算任务（没有时也为 None）
+    """
+    from .jobs import job_runner
+    report = _cached(start, end)
+    if report is not None and not report['stale']:
+        return report, None
+    return report, job_runner.pending('conversion_report', _job_params(start, end))
+
+
+def request_report(start, end):
+    """
+    POST 请求用，不在请求里计算：返回 (报表, 任务编号)。缓存未过期时任务编号为 None；
+    过期或没有缓存时提交（或复用）该窗口的计算任务
+    """
+    from .jobs import job_runner
+    report = _cached(start, end)
+    if report is not None and not report['stale']:
+        return report, None
+    return report, job_runner.submit_once('conversion_report', _job_params(start, end))
+
+
+def report_window(start=None, end=None):
+    """补齐缺省的日期：结束日期默认今天，开始日期默认结束日期前 CONVERSION_DEFAULT_DAYS 天"""
+    end = end or date.today()
+    start = start or end - timedelta(days=current_app.config.get('CONVERSION_DEFAULT_DAYS', 30) - 1)
+    if start > end:
+        raise ValueError('开始日期不能晚于结束日期')
+    return start, end
+
+
+# ---------- 命令行 ----------
+
+def _reference_report(conn, start, end):
+    """校验用：把窗口内的明细整体载入内存，按 (用户, 商品) 直接求首次浏览与之后的首笔购买"""
+    start_dt = datetime.combine(start, datetime.min.time())
+    end_dt = datetime.combine(end + timedelta(days=1), datetime.min.time())
+    first_view, views = {}, Counter()
+    for user_id, product_id, browse_time, _ in chain(conn.execute(
+            select(BrowseLog.user_id, BrowseLog.product_id, BrowseLog.browse_time, BrowseLog.platform)
+            .where(BrowseLog.browse_time >= start_dt, BrowseLog.browse_time < end_dt)),
+            _archived_views(conn, start_dt, end_dt)):
+        key = (user_id, product_id)
+        views[product_id] += 1
+        if key not in first_view or browse_time < first_view[key]:
+            first_view[key] = browse_time
+    purchases = defaultdict(list)
+    for user_id, product_id, sale_date in conn.execute(
+            select(Sale.user_id, Sale.product_id, Sale.sale_date)
+            .where(Sale.sale_date >= start, Sale.sale_date <= end)):
+        purchases[(user_id, product_id)].append(sale_date)
+    products = defaultdict(lambda: {'viewers': 0, 'buyers': 0, 'delays': Counter()})
+    for (user_id, product_id), seen in first_view.items():
+        product = products[product_id]
+        product['viewers'] += 1
+        after = [d for d in purchases.get((user_id, product_id), ()) if d >= seen.date()]
+        if after:
+            product['buyers'] += 1
+            product['delays'][(min(after) - seen.date()).days] += 1
+    return {pid: {'views': views[pid], 'viewers': p['viewers'], 'buyers': p['buyers'],
+                  'median_days': _median(p['delays'])} for pid, p in products.items()}
+
+
+def _parse_day(value):
+    return date.fromisoformat(value) if value else None
+
+
+conversion_cli = AppGroup('conversion', help='浏览 → 购买转化报表')
+
+
+@conversion_cli.command('report')
+@click.option('--start', default=None, help='开始日期 YYYY-MM-DD，默认结束日期前 30 天')
+@click.option('--end', default=None, help='结束日期 YYYY-MM-DD（含），默认今天')
+@click.option('--by', type=click.Choice(['category', 'platform', 'product']), default='category',
+              show_default=True)
+@click.option('--limit', default=20, show_default=True, help='最多显示的行数')
+@click.option('--refresh', is_flag=True, help='忽略缓存重新计算')
+def report_command(start, end, by, limit, refresh):
+    """计算（或读取缓存的）转化报表并写入缓存"""
+    try:
+        start, end = report_window(_parse_day(start), _parse_day(end))
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    report = conversion_report(start, end, refresh=refresh, progress=lambda **kw: click.echo(kw['message']))
+    totals = report['totals']
+    click.echo(f"{report['start_date']} ~ {report['end_date']}（计算于 {report['computed_at']}）："
+               f"浏览 {totals['views']}，浏览人数 {totals['viewers']}，购买人数 {totals['buyers']}，"
+               f"转化率 {totals['conversion']:.2%}，首次浏览到购买中位数 {totals['median_days']} 天")
+    rows = report[{'category': 'categories', 'platform': 'platforms', 'product': 'products'}[by]]
+    key = 'product_id' if by == 'product' else by
+    click.echo(f'{by:<16}{"浏览":>10}{"浏览人数":>10}{"购买人数":>10}{"转化率":>9}{"中位天数":>9}')
+    for row in rows[:limit]:
+        label = f"{row['product_id']} {row['name']}" if by == 'product' else (row[key] or '未知')
+        median = '-' if row['median_days'] is None else f"{row['median_days']:g}"
+        click.echo(f"{label[:16]:<16}{row['views']:>10}{row['viewers']:>10}{row['buyers']:>10}"
+                   f"{row['conversion']:>9.2%}{median:>9}")
+
+
+@conversion_cli.command('check')
+@click.option('--start', required=True, help='开始日期 YYYY-MM-DD')
+@click.option('--end', required=True, help='结束日期 YYYY-MM-DD（含），窗口要小到明细能整体载入内存')
+def check_command(start, end):
+    """用内存里的直接计算校验归并结果（逐个商品比较），不一致时以非零状态退出"""
+    start, end = _parse_day(start), _parse_day(end)
+    with db.engine.connect() as conn:
+        report = compute_report(conn, start, end)
+        expected = _reference_report(conn, start, end)
+    actual = {row['product_id']: row for row in report['products']}
+    mismatches = 0
+    for pid in sorted(set(actual) | set(expected)):
+        got, want = actual.get(pid), expected.get(pid)
+        if got is None or want is None or any(got[k] != want[k] for k in want):
+            mismatches += 1
+            if mismatches <= 10:
+                click.echo(f'✗ 商品 {pid}: 归并 {got and {k: got[k] for k in want}}，直接计算 {want}')
+    totals = report['totals']
+    click.echo(f"{len(actual)} 个商品，{report['browse_rows']} 条浏览记录，"
+               f"购买人数 {totals['buyers']}，转化率 {totals['conversion']:.2%}")
+    if mismatches:
+        click.echo(f'{mismatches} 个商品不一致')
+        sys.exit(1)
+    click.echo('归并结果与直接计算一致')
@@ -0,0 +1,86 @@
+"""
+按后端调整数据库引擎
+
+PostgreSQL：连接池按每个 worker 的线程数估算大小（线程数 + 后台线程余量），开启 pre-ping
+与定期回收，并为 Web 进程设置语句超时，避免慢查询长期占住连接；flask 命令行与后台任务进程
+（seed / 归档 / 重建汇总等长事务）不设语句超时：任务进程以 create_app(batch=True) 建引擎，
+flask 命令行加载的是与 Web 相同的应用，执行本项目的命令前由 enable_batch 解除超时
+（flask run 等内置命令不受影响）。
+SQLite：每个新连接上执行 PRAGMA——WAL 让读者与写者互不阻塞，synchronous=NORMAL 在 WAL 下
+只在检查点时刷盘，mmap 与页缓存减少读取的系统调用，busy_timeout 让写者排队而不是立即报
+database is locked，并开启外键（ON DELETE CASCADE 依赖它）。
+"""
+from sqlalchemy import event
+
+
+def _is_memory_sqlite(url):
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+
+def engine_options(config, url, batch=False, threads=None):
+    """返回 create_engine 的关键字参数；threads 为每个进程同时处理请求的线程数"""
+    threads = threads or config.get('WEB_THREADS', 1)
+    overflow = config.get('DB_MAX_OVERFLOW')
+    options = {}
+    if not _is_memory_sqlite(url):
+        # 内存库用 SingletonThreadPool，不接受连接池大小参数
+        options.update(
+            pool_size=config.get('DB_POOL_SIZE') or threads + 2,
+            max_overflow=threads if overflow is None else overflow,
+            pool_timeout=config.get('DB_POOL_TIMEOUT', 10),
+        )
+    if url.get_backend_name() == 'postgresql':
+        # 网络连接可能被服务端或中间代理断开：借出前探活，超过回收时间的连接重建
+        options.update(pool_pre_ping=config.get('DB_POOL_PRE_PING', True),
+                       pool_recycle=config.get('DB_POOL_RECYCLE', 1800))
+        timeout = 0 if batch else config.get('DB_STATEMENT_TIMEOUT_MS', 0)
+        if timeout:
+            options['connect_args'] = {'options': f'-c statement_timeout={int(timeout)}'}
+    return options
+
+
+def _no_statement_timeout(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute('SET statement_timeout = 0')
+    cursor.close()
+    # SET 在事务回滚时会被撤销，立即提交
+    dbapi_connection.commit()
+
+
+def enable_batch(app):
+    """主库与只读副本引擎此后新建的 PostgreSQL 连接不设语句超时，并丢弃已建立的连接"""
+    from . import db
+    router = app.extensions.get('replica_router')
+    engines = [db.engine] + [replica.engine for replica in (router.replicas if router else ())]
+    for engine in engines:
+        if engine.dialect.name == 'postgresql' and not event.contains(engine, 'connect', _no_statement_timeout):
+            event.listen(engine, 'connect', _no_statement_timeout)
+            engine.dispose()
+
+
+def sqlite_pragmas(config):
+    """每个 SQLite 连接上依次执行的 PRAGMA（busy_timeout 在切换日志模式之前，切换时可能要等锁）"""
+    return [
+        f"PRAGMA busy_timeout = {int(config.get('SQLITE_BUSY_TIMEOUT_MS', 15000))}",
+        f"PRAGMA journal_mode = {config.get('SQLITE_JOURNAL_MODE', 'WAL')}",
+        f"PRAGMA synchronous = {config.get('SQLITE_SYNCHRONOUS', 'NORMAL')}",
+        f"PRAGMA mmap_size = {int(config.get('SQLITE_MMAP_SIZE', 268435456))}",
+        f"PRAGMA cache_size = -{int(config.get('SQLITE_CACHE_SIZE_KB', 32768))}",
+        'PRAGMA foreign_keys = ON',
+    ]
+
+
+def tune_engine(engine, config):
+    """SQLite 引擎注册连接事件，在每个新连接上执行 sqlite_pragmas；其他后端不需要额外处理"""
+    if engine.dialect.name != 'sqlite':
+        return engine
+    pragmas = sqlite_pragmas(config)
+    if _is_memory_sqlite(engine.url):
+        pragmas = [p for p in pragmas if 'journal_mode' not in p and 'mmap_size' not in p]
+
+    @event.listens_for(engine, 'connect')
+    def _apply_pragmas(dbapi_connection, connection_record):
+        for pragma in pragmas:
+            dbapi_connection.execute(pragma)
+
+    return engine
@@ -0,0 +1,116 @@
+"""
+销售 / 浏览记录流式导出
+
+查询按 id 顺序用 yield_per 分批取行（PostgreSQL 上走服务端游标），边取边编码成
+CSV 或 NDJSON，攒够一块就发给客户端；可选 gzip 时用增量压缩。整个导出过程的
+内存占用只与分批大小有关，与导出的总行数无关。
+"""
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+from itertools import chain
+
+from flask import Response, stream_with_context
+
+# (导出字段名, 结果行中的属性名)
+SALES_EXPORT_COLUMNS = [
+    ('id', 'id'),
+    ('sale_date', 'sale_date'),
+    ('product_name', 'product_name'),
+    ('username', 'username'),
+    ('unit_price', 'unit_price'),
+    ('quantity', 'quantity'),
+    ('total_amount', 'total_amount'),
+    ('payment_method', 'payment_method'),
+]
+
+BROWSE_EXPORT_COLUMNS = [
+    ('id', 'id'),
+    ('browse_time', 'browse_time'),
+    ('username', 'username'),
+    ('product_name', 'product_name'),
+    ('platform', 'platform'),
+]
+
+FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'ndjson': ('application/x-ndjson; charset=utf-8', 'ndjson'),
+}
+
+YIELD_PER = 2000
+CHUNK_BYTES = 64 * 1024
+
+
+def _json_value(value):
+    if value is None or isinstance(value, (int, float, str)):
+        return value
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    # Decimal 等按字符串输出，不丢精度
+    return str(value)
+
+
+def encode_rows(rows, columns, fmt):
+    """逐块产出编码后的字节"""
+    names = [name for name, _ in columns]
+    attrs = [attr for _, attr in columns]
+    buf = io.StringIO()
+    if fmt == 'csv':
+        writer = csv.writer(buf)
+        # 带 BOM，Excel 直接打开不会乱码
+        buf.write('﻿')
+        writer.writerow(names)
+        for row in rows:
+            writer.writerow(['' if v is None else v for v in (getattr(row, a) for a in attrs)])
+            if buf.tell() >= CHUNK_BYTES:
+                yield buf.getvalue().encode('utf-8')
+                buf.seek(0)
+                buf.truncate()
+    else:
+        for row in rows:
+            buf.write(json.dumps({n: _json_value(getattr(row, a)) for n, a in zip(names, attrs)},
+                                 ensure_ascii=False))
+            buf.write('\n')
+            if buf.tell() >= CHUNK_BYTES:
+                yield buf.getvalue().encode('utf-8')
+                buf.seek(0)
+                buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode('utf-8')
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_chunks(rows, columns, fmt='csv', compress=False):
+    """把行编码（并可选压缩）成字节块"""
+    chunks = encode_rows(rows, columns, fmt)
+    return gzip_chunks(chunks) if compress else chunks
+
+
+def export_filename(basename, fmt, compress=False):
+    filename = f"{basename}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{FORMATS[fmt][1]}"
+    return filename + '.gz' if compress else filename
+
+
+def export_response(query, columns, basename, fmt='csv', compress=False, before=()):
+    """把查询结果以流式响应导出，query 需已按 id 排序；before 是先于查询结果导出的行（如归档段中的记录）"""
+    if fmt not in FORMATS:
+        return Response(f'不支持的导出格式: {fmt}', status=400, mimetype='text/plain')
+    mimetype = 'application/gzip' if compress else FORMATS[fmt][0]
+    filename = export_filename(basename, fmt, compress)
+
+    def generate():
+        yield from export_chunks(chain(before, query.yield_per(YIELD_PER)), columns, fmt, compress)
+
+    headers = {'X-Accel-Buffering': 'no'}
+    headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return Response(stream_with_context(generate()), mimetype=mimetype, headers=headers)
@@ -0,0 +1,363 @@
+"""
+HTTP 缓存：条件请求、响应压缩与静态文件缓存头
+
+看板、商品、销售、浏览记录四个页面按它们依赖的数据算一个数据版本戳：销售、浏览记录、商品、
+用户表的最大编号，删除计数（删除明细、用户或商品的事务里加一，删除不一定改变最大编号），
+浏览记录归档段的数量与解冻数、看板缓存的代数、商品目录变更记录的最大版本与条数（一条语句读出），
+以及当天日期；看板另加 DASHBOARD_CACHE_TTL 秒一档的时间段，因为看板结果缓存
+和列式快照本身会落后于数据库。各分量都取自数据库里已提交的数据，同一份数据在不同 worker 上算出同一个 ETag；
+目录分量变化时本进程的商品目录缓存立即同步，页面上的商品字段不会比版本戳旧。版本戳、路径与查询参数、代码版本一起哈希成弱 ETag；
+请求带 If-None-Match 且一致时在 before_request 里直接返回 304，不执行页面的查询也不渲染模板。
+版本戳在每个 worker 内缓存 HTTP_STAMP_TTL 秒，本进程提交写入后立即重算，列表路由的 SQL
+条数不变；其它进程的写入最迟在这之后反映到 ETag 上。读到的缓存代数同时交给看板缓存，
+后台任务清空缓存后各 worker 随之清空（关闭 ETag 时也照常读版本戳）。有待显示的提示消息时不走 304。
+
+文本类响应（HTML、JSON、CSS、JS）超过 COMPRESS_MIN_SIZE 字节时按 Accept-Encoding 压缩：
+安装了 brotli 时优先 br，否则 gzip；流式响应（导出）不处理。
+静态文件的 URL 由 url_for 自动带上文件修改时间 v=...，带版本的请求返回一年有效的
+immutable 缓存头；静态文件压缩后的内容按 (文件, ETag, 编码) 缓存在进程内。
+"""
+import gzip
+import hashlib
+import importlib
+import importlib.util
+import os
+import sys
+import threading
+import time
+from datetime import date
+
+import click
+from flask import Response, current_app, g, request, session
+from flask.cli import AppGroup
+from sqlalchemy import event, func, select
+from sqlalchemy.engine import Engine
+
+from . import db
+from .models import BrowseArchive, BrowseLog, CatalogChange, Product, Sale, User
+
+# 端点 -> 依赖的版本戳分量
+ROUTE_STAMPS = {
+    'main.dashboard': ('sales', 'browse', 'archive', 'products', 'catalog', 'users', 'deletes', 'cache'),
+    'main.products_manage': ('products', 'catalog'),
+    'main.sales_query': ('sales', 'catalog', 'users', 'deletes'),
+    'main.browse_logs': ('browse', 'archive', 'catalog', 'users', 'deletes', 'cache'),
+}
+
+# cache_generations 中的删除计数
+DELETES = 'deletes'
+
+# 看板按该配置项的秒数分档
+_TIME_BUCKETS = {'main.dashboard': 'DASHBOARD_CACHE_TTL'}
+
+COMPRESS_MIMETYPES = {'text/html', 'text/css', 'text/plain', 'application/json',
+                      'application/javascript', 'text/javascript'}
+
+
+class HttpCache:
+    """页面 ETag / 304、响应压缩与静态文件缓存头"""
+
+    def __init__(self):
+        self.enabled = True
+        self.stamp_ttl = 1.0
+        self.min_size = 1024
+        self.gzip_level = 6
+        self.brotli_quality = 5
+        self.static_max_age = 31536000
+        self.brotli = None
+        self.salt = ''
+        self._stamp = None
+        self._stamp_expires = 0.0
+        self._static_versions = {}
+        self._static_bodies = {}
+        self._lock = threading.Lock()
+        self._stats = {'not_modified': 0, 'rendered': 0, 'compressed': 0,
+                       'bytes_in': 0, 'bytes_out': 0}
+
+    def init_app(self, app):
+        self.enabled = app.config.get('HTTP_ETAGS', True)
+        self.stamp_ttl = app.config.get('HTTP_STAMP_TTL', self.stamp_ttl)
+        self.min_size = app.config.get('COMPRESS_MIN_SIZE', self.min_size)
+        self.gzip_level = app.config.get('COMPRESS_GZIP_LEVEL', self.gzip_level)
+        self.brotli_quality = app.config.get('COMPRESS_BROTLI_QUALITY', self.brotli_quality)
+        self.static_max_age = app.config.get('STATIC_MAX_AGE', self.static_max_age)
+        if importlib.util.find_spec('brotli') is not None:
+            self.brotli = importlib.import_module('brotli')
+        self.salt = self._code_version(app)
+        app.before_request(self._check_not_modified)
+        app.after_request(self._finish_response)
+        app.url_defaults(self._static_version)
+        app.extensions['http_cache'] = self
+
+    def expire(self):
+        """下一次请求重新读取数据版本戳"""
+        self._stamp_expires = 0.0
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._stats[name] += n
+
+    # ---------- ETag ----------
+
+    @staticmethod
+    def _code_version(app):
+        """代码与模板的最后修改时间：部署新版本后旧 ETag 全部失效"""
+        latest = 0.0
+        for root, _, files in os.walk(app.root_path):
+            for name in files:
+                if name.endswith(('.py', '.html')):
+                    latest = max(latest, os.path.getmtime(os.path.join(root, name)))
+        return str(int(latest))
+
+    def data_stamp(self):
+        """各表的版本戳分量（每个 worker 缓存 stamp_ttl 秒）"""
+        from .cache import dashboard_cache, generation_query
+        from .catalog import product_catalog
+        now = time.monotonic()
+        stamp = self._stamp
+        if stamp is None or now >= self._stamp_expires:
+            row = db.session.execute(select(
+                select(func.max(Sale.id)).scalar_subquery(),
+                select(func.max(BrowseLog.id)).scalar_subquery(),
+                select(func.max(Product.id)).scalar_subquery(),
+                select(func.max(User.id)).scalar_subquery(),
+                select(func.count(BrowseArchive.id)).scalar_subquery(),
+                select(func.count(BrowseArchive.thawed_at)).scalar_subquery(),
+                dashboard_cache.generation_query(),
+                generation_query(DELETES),
+                # 目录版本号可能乱序提交：只看最大版本会漏掉后提交的较小版本，连同条数一起比较
+                select(func.max(CatalogChange.version)).scalar_subquery(),
+                select(func.count()).select_from(CatalogChange).scalar_subquery(),
+            )).one()
+            stamp = {'sales': row[0], 'browse': row[1], 'products': row[2], 'users': row[3],
+                     'archive': (row[4], row[5]), 'cache': row[6], 'deletes': row[7],
+                     'catalog': (row[8], row[9])}
+            dashboard_cache.sync_generation(row[6])
+            if self._stamp is None or self._stamp['catalog'] != stamp['catalog']:
+                # 商品有变化：本进程的目录缓存先同步到这些版本，再按新的版本戳渲染
+                product_catalog.expire()
+            self._stamp, self._stamp_expires = stamp, now + self.stamp_ttl
+        product_catalog.sync()
+        return stamp
+
+    def etag_for(self, endpoint):
+        stamp = self.data_stamp()
+        parts = [self.salt, request.full_path, date.today().isoformat()]
+        parts += [f'{name}={stamp[name]}' for name in ROUTE_STAMPS[endpoint]]
+        bucket = _TIME_BUCKETS.get(endpoint)
+        if bucket:
+            parts.append(str(int(time.time() // max(current_app.config.get(bucket, 60), 1))))
+        return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()[:24]
+
+    def _check_not_modified(self):
+        if request.method not in ('GET', 'HEAD') or request.endpoint not in ROUTE_STAMPS:
+            return None
+        if not self.enabled or session.get('_flashes'):
+            # 不走 304 也读版本戳（每 stamp_ttl 秒一次），看板缓存据此发现其它进程的清空
+            self.data_stamp()
+            return None
+        etag = self.etag_for(request.endpoint)
+        g.http_etag = etag
+        if request.if_none_match.contains_weak(etag):
+            self._count('not_modified')
+            response = Response(status=304)
+            self._set_validators(response, etag)
+            return response
+        self._count('rendered')
+        return None
+
+    @staticmethod
+    def _set_validators(response, etag):
+        response.set_etag(etag, weak=True)
+        # 浏览器可以保存，但每次使用前都要带 If-None-Match 重新验证
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+
+    # ---------- 压缩 ----------
+
+    def _encoding(self):
+        accept = request.accept_encodings
+        if self.brotli is not None and accept['br']:
+            return 'br'
+        if accept['gzip']:
+            return 'gzip'
+        return None
+
+    def _compress(self, data, encoding):
+        if encoding == 'br':
+            return self.brotli.compress(data, quality=self.brotli_quality)
+        return gzip.compress(data, compresslevel=self.gzip_level, mtime=0)
+
+    @staticmethod
+    def _compressible(response, is_static):
+        return (response.status_code == 200
+                and response.mimetype in COMPRESS_MIMETYPES
+                # 静态文件是文件流，单独读出压缩；其它流式响应（导出）不处理
+                and (is_static or not (response.is_streamed or response.direct_passthrough))
+                and 'Content-Encoding' not in response.headers
+                and not response.cache_control.no_transform)
+
+    def _static_body(self, response, encoding):
+        """静态文件压缩后的内容，按文件、ETag 与编码缓存"""
+        etag, _ = response.get_etag()
+        key = (request.view_args.get('filename'), etag, encoding)
+        source = response.response
+        try:
+            body = self._static_bodies.get(key)
+            if body is None:
+                body = self._static_bodies[key] = self._compress(b''.join(source), encoding)
+        finally:
+            if hasattr(source, 'close'):
+                source.close()
+        response.direct_passthrough = False
+        return body
+
+    def _finish_response(self, response):
+        etag = g.pop('http_etag', None)
+        if etag is not None and response.status_code == 200:
+            self._set_validators(response, etag)
+
+        is_static = request.endpoint == 'static'
+        if is_static and response.status_code in (200, 304):
+            if 'v' in request.args:
+                response.cache_control.no_cache = None
+                response.cache_control.public = True
+                response.cache_control.max_age = self.static_max_age
+                response.cache_control.immutable = True
+            else:
+                response.cache_control.max_age = None
+                response.cache_control.no_cache = True
+        if not self._compressible(response, is_static):
+            return response
+        response.vary.add('Accept-Encoding')
+        length = response.content_length if is_static else response.calculate_content_length()
+        encoding = self._encoding()
+        if encoding is None or length is None or length < self.min_size:
+            return response
+
+        if is_static:
+            body = self._static_body(response, encoding)
+            # 压缩后的表示与原文件不再逐字节相同，改为弱 ETag（If-None-Match 用弱比较，304 照常生效）
+            etag, _ = response.get_etag()
+            if etag:
+                response.set_etag(etag, weak=True)
+        else:
+            body = self._compress(response.get_data(), encoding)
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        self._count('compressed')
+        self._count('bytes_in', length)
+        self._count('bytes_out', len(body))
+        return response
+
+    # ---------- 静态文件 ----------
+
+    def _static_version(self, endpoint, values):
+        if endpoint != 'static' or 'v' in values or 'filename' not in values:
+            return
+        filename = values['filename']
+        version = self._static_versions.get(filename)
+        if version is None:
+            path = os.path.join(current_app.static_folder, filename)
+            try:
+                version = self._static_versions[filename] = str(int(os.path.getmtime(path)))
+            except OSError:
+                return
+        values['v'] = version
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['compression_ratio'] = round(stats['bytes_out'] / stats['bytes_in'], 4) \
+            if stats['bytes_in'] else 0.0
+        stats['brotli'] = self.brotli is not None
+        return stats
+
+
+http_cache = HttpCache()
+
+
+@event.listens_for(db.session, 'after_flush')
+def _count_deletes(session, flush_context):
+    # 级联删除某个用户的明细、删除较早的行都不改变最大编号：在同一事务里把删除计数加一
+    if any(isinstance(o, (Sale, BrowseLog, User, Product)) for o in session.deleted):
+        from .cache import bump_generation
+        bump_generation(session.connection(), DELETES)
+
+
+@event.listens_for(Engine, 'commit')
+def _expire_on_commit(conn):
+    # 本进程的写入提交后，下一个页面请求重新读版本戳
+    http_cache.expire()
+
+
+http_cli = AppGroup('http', help='HTTP 缓存与压缩')
+
+
+@http_cli.command('check')
+def check_command():
+    """检查各页面的 ETag / 304、写入后 ETag 变化、压缩与静态文件缓存头，不符合时以非零状态退出"""
+    from .catalog import bump_version
+    from .querycount import count_queries
+    app = current_app._get_current_object()
+    client = app.test_client()
+    failures = []
+
+    def fail(message):
+        failures.append(message)
+        click.echo(f'✗ {message}')
+
+    for endpoint, url in (('main.dashboard', '/dashboard'), ('main.products_manage', '/products'),
+                          ('main.sales_query', '/sales'), ('main.browse_logs', '/browse_logs')):
+        first = client.get(url)
+        etag = first.headers.get('ETag')
+        if first.status_code != 200 or not etag:
+            fail(f'{url}: {first.status_code}，ETag {etag!r}')
+            continue
+        with count_queries(db.engine) as statements:
+            again = client.get(url, headers={'If-None-Match': etag})
+        if again.status_code != 304:
+            fail(f'{url}: 带 If-None-Match 返回 {again.status_code}')
+        else:
+            click.echo(f'✓ {url}: 304，{len(again.data)} 字节，{len(statements)} 条 SQL')
+
+    # 商品修改：记目录版本后，旧 ETag 不再命中
+    first = client.get('/products')
+    product_id = db.session.execute(select(func.max(Product.id))).scalar()
+    db.session.rollback()
+    if product_id is not None:
+        with db.engine.begin() as conn:
+            bump_version(conn, [product_id])
+        after = client.get('/products', headers={'If-None-Match': first.headers['ETag']})
+        if after.status_code != 200:
+            fail(f'/products: 商品修改后仍返回 {after.status_code}')
+        else:
+            click.echo('✓ /products: 商品修改后重新渲染')
+
+    plain = client.get('/sales')
+    packed = client.get('/sales', headers={'Accept-Encoding': 'gzip'})
+    if packed.headers.get('Content-Encoding') != 'gzip' \
+            or gzip.decompress(packed.data) != plain.data:
+        fail('/sales: gzip 压缩结果不正确')
+    else:
+        click.echo(f'✓ /sales: gzip {len(plain.data)} → {len(packed.data)} 字节')
+
+    with app.test_request_context():
+        from flask import url_for
+        css_url = url_for('static', filename='css/style.css')
+    css = client.get(css_url, headers={'Accept-Encoding': 'gzip'})
+    cache_control = css.headers.get('Cache-Control', '')
+    if css.status_code != 200 or 'immutable' not in cache_control \
+            or css.headers.get('Content-Encoding') != 'gzip':
+        fail(f'{css_url}: {css.status_code}，Cache-Control {cache_control!r}，'
+             f'Content-Encoding {css.headers.get("Content-Encoding")!r}')
+    else:
+        revalidated = client.get(css_url, headers={'Accept-Encoding': 'gzip',
+                                                   'If-None-Match': css.headers['ETag']})
+        if revalidated.status_code != 304:
+            fail(f'{css_url}: 带 If-None-Match 返回 {revalidated.status_code}')
+        else:
+            click.echo(f'✓ {css_url}: {cache_control}，gzip {len(css.data)} 字节，再次请求 304')
+
+    if failures:
+        sys.exit(1)
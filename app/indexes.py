@@ -0,0 +1,163 @@
+"""
+索引管理与执行计划检查
+
+索引统一声明在 models.py 的 __table_args__ 中，create_all 会在新库上建好；
+已有数据库用 `flask indexes create` 补建（IF NOT EXISTS，SQLite/PostgreSQL 通用），
+同时建立 search.py 中的名称搜索索引。
+`flask indexes check` 逐个请求代表性路由，对其发出的每条 SELECT 做 EXPLAIN，
+大表上出现全表扫描即失败。
+"""
+import json
+import re
+import sys
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import event, select
+
+from . import db
+from .models import Sale, BrowseLog
+from .partitions import parent_table
+from .search import ensure_search_indexes
+
+# 只检查随业务无限增长的明细表；汇总表按天聚合，扫描它们是设计预期
+CHECKED_TABLES = ('sales', 'browse_logs')
+
+# 各路由的代表性请求
+ROUTE_SAMPLES = [
+    '/dashboard',
+    '/products',
+    '/products?page=3',
+    '/sales',
+    '/sales?param_keyword=手机',
+    '/browse_logs',
+    '/browse_logs?start_date=2025-01-01&end_date=2025-01-31',
+    '/browse_logs?username=王',
+]
+
+# 已被复合索引取代（复合索引的前缀能完成同样的查找），升级时删除
+REPLACED_INDEXES = ('ix_browse_logs_user_id', 'ix_sales_user_id')
+
+_SQLITE_FULL_SCAN = re.compile(r'^SCAN (\w+)(?: AS \w+)?$')
+
+
+def ensure_indexes(engine):
+    """补建 models 中声明但库里还没有的索引、删除被取代的旧索引并刷新统计信息，返回所有已确认的索引名"""
+    created = []
+    with engine.begin() as conn:
+        for name in REPLACED_INDEXES:
+            conn.exec_driver_sql(f'DROP INDEX IF EXISTS {name}')
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+                created.append(index.name)
+        ensure_search_indexes(conn)
+        # 更新统计信息，让规划器用上新索引
+        conn.exec_driver_sql('ANALYZE')
+    return created
+
+
+def _sqlite_full_scans(conn, statement, parameters):
+    rows = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).all()
+    scans = []
+    for row in rows:
+        match = _SQLITE_FULL_SCAN.match(row[-1])
+        if match and match.group(1) in CHECKED_TABLES:
+            scans.append(row[-1])
+    return scans
+
+
+def _walk_plan(node):
+    yield node
+    for child in node.get('Plans', ()):
+        yield from _walk_plan(child)
+
+
+def _postgresql_full_scans(conn, statement, parameters):
+    plan = conn.exec_driver_sql('EXPLAIN (FORMAT JSON) ' + statement, parameters).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    # 分区表的扫描节点上是分区名，归到所属的表
+    return [f"Seq Scan on {node['Relation Name']}"
+            for node in _walk_plan(plan[0]['Plan'])
+            if node['Node Type'] == 'Seq Scan'
+            and parent_table(node.get('Relation Name', '')) in CHECKED_TABLES]
+
+
+def _sample_cursor_urls(conn):
+    """取一个深页游标，确保 keyset 分页的 WHERE 条件也被检查到"""
+    from .pagination import encode_cursor
+    urls = []
+    sale = conn.execute(select(Sale.sale_date, Sale.id).order_by(Sale.id).limit(1)).first()
+    if sale:
+        urls.append('/sales?cursor=' + encode_cursor('next', *sale))
+    log = conn.execute(select(BrowseLog.browse_time, BrowseLog.id).order_by(BrowseLog.id).limit(1)).first()
+    if log:
+        urls.append('/browse_logs?cursor=' + encode_cursor('next', *log))
+    return urls
+
+
+def check_query_plans(app, urls=None):
+    """请求每个路由并 EXPLAIN 其 SELECT 语句，返回 [(url, sql, [全表扫描描述])]"""
+    with app.app_context():
+        engine = db.engine
+        with engine.connect() as conn:
+            urls = list(urls or ROUTE_SAMPLES) + _sample_cursor_urls(conn)
+
+        captured = []
+
+        def _record(conn, cursor, statement, parameters, context, executemany):
+            if not executemany and statement.lstrip().upper().startswith('SELECT'):
+                captured.append((statement, parameters))
+
+        client = app.test_client()
+        event.listen(engine, 'before_cursor_execute', _record)
+        try:
+            per_url = []
+            for url in urls:
+                captured.clear()
+                response = client.get(url)
+                if response.status_code != 200:
+                    raise RuntimeError(f'{url} 返回 {response.status_code}')
+                per_url.append((url, list(captured)))
+        finally:
+            event.remove(engine, 'before_cursor_execute', _record)
+
+        is_postgresql = engine.dialect.name == 'postgresql'
+        explain = _postgresql_full_scans if is_postgresql else _sqlite_full_scans
+        violations = []
+        with engine.connect() as conn:
+            if is_postgresql:
+                # 关掉顺序扫描后仍选 Seq Scan，说明没有索引可用（小表时规划器本就可能偏好顺序扫描）
+                conn.exec_driver_sql('SET LOCAL enable_seqscan = off')
+            for url, statements in per_url:
+                for statement, parameters in statements:
+                    scans = explain(conn, statement, parameters)
+                    if scans:
+                        violations.append((url, statement, scans))
+        return violations
+
+
+indexes_cli = AppGroup('indexes', help='索引管理与执行计划检查')
+
+
+@indexes_cli.command('create')
+def create_command():
+    """补建缺失的索引"""
+    names = ensure_indexes(db.engine)
+    click.echo(f'已确认 {len(names)} 个索引')
+
+
+@indexes_cli.command('check')
+@click.argument('urls', nargs=-1)
+def check_command(urls):
+    """EXPLAIN 各路由的查询，大表出现全表扫描时以非零状态退出"""
+    from flask import current_app
+    violations = check_query_plans(current_app._get_current_object(), urls or None)
+    for url, statement, scans in violations:
+        click.echo(f'✗ {url}: {", ".join(scans)}')
+        click.echo('    ' + ' '.join(statement.split()))
+    if violations:
+        click.echo(f'{len(violations)} 条查询出现全表扫描')
+        sys.exit(1)
+    click.echo('所有查询均可走索引')
@@ -0,0 +1,180 @@
+"""
+浏览事件批量写入
+
+请求线程只把事件放进进程内缓冲区就返回，后台线程按条数或时间阈值成批写库：
+小批量用多行 INSERT，大批量在 PostgreSQL 上改用 COPY，汇总表在同一事务内更新。
+缓冲区满时拒绝新事件（接口返回 503），进程退出前会把剩余事件写完。
+"""
+import atexit
+import csv
+import io
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from sqlalchemy.exc import IntegrityError
+
+from . import db
+from .models import BrowseLog
+
+logger = logging.getLogger(__name__)
+
+_COLUMNS = ['user_id', 'product_id', 'browse_time', 'platform']
+
+
+class BrowseEventBuffer:
+    """进程内浏览事件缓冲区 + 后台刷写线程"""
+
+    def __init__(self):
+        self.app = None
+        self.batch_size = 500
+        self.flush_interval = 1.0
+        self.max_pending = 50000
+        self.max_batch = 10000
+        self.copy_threshold = 1000
+        self._events = deque()
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stopping = False
+        self._started = time.time()
+        self._stats = {
+            'accepted': 0, 'rejected': 0, 'flushed': 0, 'failed': 0,
+            'batches': 0, 'flush_ms_total': 0.0, 'flush_ms_max': 0.0,
+        }
+
+    def init_app(self, app):
+        self.app = app
+        self.batch_size = app.config.get('INGEST_BATCH_SIZE', self.batch_size)
+        self.flush_interval = app.config.get('INGEST_FLUSH_INTERVAL', self.flush_interval)
+        self.max_pending = app.config.get('INGEST_MAX_PENDING', self.max_pending)
+        self.max_batch = app.config.get('INGEST_MAX_BATCH', self.max_batch)
+        self.copy_threshold = app.config.get('INGEST_COPY_THRESHOLD', self.copy_threshold)
+        app.extensions['browse_ingest'] = self
+        atexit.register(self.shutdown)
+
+    def submit(self, events):
+        """放入一批事件；缓冲区放不下时整批拒绝并返回 False"""
+        with self._cond:
+            if len(self._events) + len(events) > self.max_pending:
+                self._stats['rejected'] += len(events)
+                return False
+            self._events.extend(events)
+            self._stats['accepted'] += len(events)
+            if len(self._events) >= self.batch_size:
+                self._cond.notify()
+        self._ensure_thread()
+        return True
+
+    def _ensure_thread(self):
+        # gunicorn fork 之后线程不会被继承，按进程号懒启动
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._cond:
+            if self._pid != os.getpid() or self._thread is None or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._stopping = False
+                self._thread = threading.Thread(target=self._run, name='browse-ingest', daemon=True)
+                self._thread.start()
+
+    def _take(self):
+        n = min(len(self._events), self.max_batch)
+        return [self._events.popleft() for _ in range(n)]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self.flush_interval
+                while (len(self._events) < self.batch_size and not self._stopping
+                       and time.monotonic() < deadline):
+                    self._cond.wait(deadline - time.monotonic())
+                batch = self._take()
+                stopping = self._stopping
+            if batch:
+                self._write(batch)
+            if stopping and not self._events:
+                return
+
+    def flush(self):
+        """同步写完当前缓冲区中的全部事件"""
+        while True:
+            with self._cond:
+                batch = self._take()
+            if not batch:
+                return
+            self._write(batch)
+
+    def shutdown(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout=30)
+        self.flush()
+
+    def _write(self, batch):
+        from .cache import dashboard_cache, BROWSE_KEY
+        from .rollups import apply_browse
+        from .sketches import record_browse, transaction
+        started = time.perf_counter()
+        with self._flush_lock, self.app.app_context():
+            try:
+                with transaction(db.engine) as conn:
+                    self._insert(conn, batch)
+                    apply_browse(conn, batch)
+                    record_browse(conn, batch)
+                written = len(batch)
+            except IntegrityError:
+                # 批内有无效的用户/商品编号：逐条重试，跳过坏数据
+                written = 0
+                for event in batch:
+                    try:
+                        with transaction(db.engine) as conn:
+                            conn.execute(BrowseLog.__table__.insert(), [event])
+                            apply_browse(conn, [event])
+                            record_browse(conn, [event])
+                        written += 1
+                    except IntegrityError:
+                        pass
+            except Exception:
+                logger.exception('浏览事件写入失败，丢弃 %d 条', len(batch))
+                written = 0
+            if written:
+                dashboard_cache.invalidate(BROWSE_KEY)
+        elapsed = (time.perf_counter() - started) * 1000
+        with self._cond:
+            self._stats['flushed'] += written
+            self._stats['failed'] += len(batch) - written
+            self._stats['batches'] += 1
+            self._stats['flush_ms_total'] += elapsed
+            self._stats['flush_ms_max'] = max(self._stats['flush_ms_max'], elapsed)
+
+    def _insert(self, conn, batch):
+        if conn.dialect.name == 'postgresql' and len(batch) >= self.copy_threshold:
+            buf = io.StringIO()
+            writer = csv.writer(buf)
+            for event in batch:
+                writer.writerow([event[c] for c in _COLUMNS])
+            buf.seek(0)
+            with conn.connection.cursor() as cur:
+                cur.copy_expert(f"COPY browse_logs ({', '.join(_COLUMNS)}) "
+                                f"FROM STDIN WITH (FORMAT csv)", buf)
+        else:
+            conn.execute(BrowseLog.__table__.insert(), batch)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats['pending'] = len(self._events)
+        uptime = time.time() - self._started
+        stats['rows_per_sec'] = round(stats['flushed'] / uptime, 1) if uptime else 0.0
+        stats['flush_ms_avg'] = round(stats['flush_ms_total'] / stats['batches'], 2) if stats['batches'] else 0.0
+        stats['flush_ms_max'] = round(stats['flush_ms_max'], 2)
+        del stats['flush_ms_total']
+        return stats
+
+
+browse_ingest = BrowseEventBuffer()
@@ -0,0 +1,629 @@
+"""
+后台任务
+
+重新生成数据、大批量导出、重建汇总表、归档与解冻冷数据和 SQLite → PostgreSQL 迁移都可能
+跑上几分钟，不适合放在请求里（会占住 gunicorn worker 并触发超时）。
+任务记录在 jobs 表中，由独立的进程池执行：
+- JOB_RUNNER = 'local'：同一台机器上的 Web 进程共用一个进程池（spawn 方式，首次使用时才创建）。
+  最先拿到 JOB_LOCK_FILE 文件锁的 worker 持有进程池，由后台线程每秒把排队中的任务交给它；
+  其它 worker 提交任务时只排队。持有者退出后锁随之释放，下一个提交或查看任务的 worker 接手；
+- JOB_RUNNER = 'worker'：Web 进程只负责排队，由 `flask jobs worker` 轮询认领并执行（多台机器时用这种）。
+认领是一条带条件的 UPDATE（status 从 queued 改为 running），同一个任务只会被执行一次。
+执行过程中定期上报进度并检查取消标记，另有心跳线程定期刷新 heartbeat_at；
+超过 JOB_STALE_SECONDS 没有心跳的 running 任务视为执行进程已退出，重新排队（执行满
+JOB_MAX_ATTEMPTS 次后记为失败）。提交、查看任务列表时（每 JOB_REAP_INTERVAL 秒最多一次）做这项整理。
+"""
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import and_, create_engine, exc, insert, select, update
+from sqlalchemy.pool import NullPool
+
+from . import db
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+_jobs = Job.__table__
+
+
+class JobCancelled(Exception):
+    """任务在执行中被取消"""
+
+
+# ---------- 任务类型 ----------
+
+# 类型名 -> (执行函数, 是否会清空或改写已有数据)
+JOB_KINDS = {}
+
+
+def job_kind(name, destructive=False):
+    def register(fn):
+        JOB_KINDS[name] = (fn, destructive)
+        return fn
+    return register
+
+
+@job_kind('seed', destructive=True)
+def _seed_job(params, progress):
+    """清空并重新生成测试数据，参数同 `flask seed`"""
+    from datetime import date
+    from .seed import generate
+    options = {k: params[k] for k in ('users', 'products', 'browse_logs', 'sales', 'seed',
+                                      'workers', 'chunk_size', 'days', 'zipf') if k in params}
+    if params.get('end_date'):
+        options['end_date'] = date.fromisoformat(params['end_date'])
+    counts = generate(**options, echo=lambda message: progress(message=message), progress=progress)
+    return {'rows': counts}
+
+
+@job_kind('rebuild_rollups')
+def _rebuild_rollups_job(params, progress):
+    """从明细表重建看板汇总表"""
+    from .cache import dashboard_cache
+    from .rollups import rebuild_rollups
+    progress(0, 1, '重建汇总表')
+    with db.engine.begin() as conn:
+        rebuild_rollups(conn)
+        # 任务在子进程里执行，清空要经库里的缓存代数传到各 Web worker
+        dashboard_cache.clear_everywhere(conn)
+    return {}
+
+
+@job_kind('archive', destructive=True)
+def _archive_job(params, progress):
+    """把保留期之前的浏览记录压缩归档，参数 retention 为保留月数"""
+    from .partitions import archive_before, archive_cutoff
+    cutoff = archive_cutoff(retention=params.get('retention'))
+    archived = archive_before(db.engine, cutoff, echo=lambda message: progress(message=message))
+    return {'cutoff': cutoff.isoformat(),
+            'archived': [{'month': f'{month:%Y-%m}', 'rows': rows} for month, rows in archived]}
+
+
+@job_kind('thaw')
+def _thaw_job(params, progress):
+    """把已归档的月份解冻回明细表，参数 start / end 为月份 YYYY-MM（end 默认与 start 相同）"""
+    from .partitions import parse_month, thaw_between
+    start = parse_month(params['start'])
+    end = parse_month(params['end']) if params.get('end') else start
+    thawed = thaw_between(db.engine, start, end, echo=lambda message: progress(message=message))
+    return {'thawed': [{'month': f'{month:%Y-%m}', 'rows': rows} for month, rows in thawed]}
+
+
+@job_kind('migrate', destructive=True)
+def _migrate_job(params, progress):
+    """SQLite → PostgreSQL 数据迁移（upload_to_railway.py），连接信息取自配置"""
+    from upload_to_railway import migrate
+    total = migrate(fresh=bool(params.get('fresh')), chunk_size=int(params.get('chunk_size', 50000)),
+                    workers=int(params.get('workers', 2)),
+                    echo=lambda message: progress(message=message), progress=progress)
+    return {'rows': total}
+
+
+@job_kind('conversion_report')
+def _conversion_report_job(params, progress):
+    """计算浏览 → 购买转化报表并写入窗口缓存，参数 start_date / end_date / refresh"""
+    from datetime import date
+    from .conversion import conversion_report, report_window
+    start, end = report_window(*(date.fromisoformat(params[k]) if params.get(k) else None
+                                 for k in ('start_date', 'end_date')))
+    report = conversion_report(start, end, refresh=bool(params.get('refresh')), progress=progress)
+    return {'start_date': report['start_date'], 'end_date': report['end_date'],
+            'computed_at': report['computed_at'], 'totals': report['totals']}
+
+
+def _export_job(params, progress, basename, columns, build_query):
+    """build_query(params) 返回 (查询, 先于查询结果导出的行)"""
+    from itertools import chain
+    from sqlalchemy import func
+    from .export import FORMATS, YIELD_PER, export_chunks, export_filename
+    fmt = params.get('format', 'csv')
+    if fmt not in FORMATS:
+        raise ValueError(f'不支持的导出格式: {fmt}')
+    compress = bool(params.get('gzip'))
+    query, before = build_query(params)
+    # 进度按查询的行数估计，before 中的行（归档段）不预先计数
+    total = db.session.execute(
+        select(func.count()).select_from(query.order_by(None).subquery())).scalar()
+    exported = 0
+
+    def rows():
+        nonlocal exported
+        for exported, row in enumerate(chain(before, query.yield_per(YIELD_PER)), 1):
+            if exported % YIELD_PER == 0:
+                progress(min(exported, total), total)
+            yield row
+
+    filename = export_filename(basename, fmt, compress)
+    directory = current_app.config['JOB_EXPORT_DIR']
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'job_{progress.job_id}_{filename}')
+    with open(path, 'wb') as f:
+        for chunk in export_chunks(rows(), columns, fmt, compress):
+            f.write(chunk)
+    return {'rows': exported, 'file': path, 'filename': filename, 'bytes': os.path.getsize(path)}
+
+
+@job_kind('export_sales')
+def _export_sales_job(params, progress):
+    """导出销售记录到文件，参数 keyword / format / gzip，与 /sales/export 相同"""
+    from .export import SALES_EXPORT_COLUMNS
+    from .routes import _sales_query
+    return _export_job(params, progress, 'sales', SALES_EXPORT_COLUMNS,
+                       lambda p: (_sales_query(p.get('keyword', '')), ()))
+
+
+@job_kind('export_browse_logs')
+def _export_browse_logs_job(params, progress):
+    """导出浏览记录到文件，参数 username / start_date / end_date / format / gzip"""
+    from .export import BROWSE_EXPORT_COLUMNS
+    from .partitions import resolve_window
+    from .routes import _archived_browse_logs, _browse_logs_query, _parse_date_range
+
+    def build(p):
+        username = p.get('username', '')
+        start_dt, end_dt = _parse_date_range(p.get('start_date', ''), p.get('end_date', ''))
+        start_dt, _, archived = resolve_window(start_dt, end_dt)
+        before = _archived_browse_logs(archived, start_dt, end_dt, username) if archived else ()
+        return _browse_logs_query(username, start_dt, end_dt), before
+    return _export_job(params, progress, 'browse_logs', BROWSE_EXPORT_COLUMNS, build)
+
+
+# ---------- 执行 ----------
+
+_status_engines = {}
+
+
+def _status_engine():
+    """
+    写任务状态用的引擎。SQLite 只有一个写者，任务自己持有长写事务（如 seed 逐表写入）时
+    状态更新拿不到锁；这时用一个不等锁的独立连接，写不进去就跳过这次上报。
+    """
+    engine = db.engine
+    if engine.dialect.name != 'sqlite':
+        return engine
+    key = str(engine.url)
+    if key not in _status_engines:
+        _status_engines[key] = create_engine(engine.url, connect_args={'timeout': 0},
+                                             poolclass=NullPool)
+    return _status_engines[key]
+
+
+class Progress:
+    """进度回调：限频写入 jobs 表、刷新心跳，并在发现取消标记时抛出 JobCancelled"""
+
+    def __init__(self, job_id, interval=0.5):
+        self.job_id = job_id
+        self.interval = interval
+        self._reported_at = 0.0
+        self._values = {}
+        # 任务可能从多个线程上报（如迁移并行复制各表）
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def __call__(self, done=None, total=None, message=None):
+        with self._lock:
+            if done is not None and total:
+                self._values['progress'] = min(1.0, done / total)
+            if message:
+                self._values['message'] = str(message)[:200]
+            now = time.monotonic()
+            if now - self._reported_at < self.interval:
+                return
+            self._reported_at = now
+            try:
+                with _status_engine().begin() as conn:
+                    cancelled = conn.execute(
+                        update(_jobs).where(_jobs.c.id == self.job_id)
+                        .values(heartbeat_at=datetime.now(), **self._values)
+                        .returning(_jobs.c.cancel_requested)).scalar()
+            except exc.OperationalError:
+                # 数据库被本任务的写事务锁住：进度留到下次再写，取消标记等事务提交后再检查
+                return
+            self._values = {}
+        if cancelled:
+            raise JobCancelled()
+
+    def start_heartbeat(self, interval):
+        """后台线程每 interval 秒刷新一次心跳，任务长时间不上报进度也不会被当成中断"""
+        def beat():
+            while not self._stopped.wait(interval):
+                try:
+                    with _status_engine().begin() as conn:
+                        conn.execute(update(_jobs).where(_jobs.c.id == self.job_id)
+                                     .values(heartbeat_at=datetime.now()))
+                except exc.OperationalError:
+                    pass
+        threading.Thread(target=beat, name=f'job-{self.job_id}-heartbeat', daemon=True).start()
+
+    def stop_heartbeat(self):
+        self._stopped.set()
+
+
+def _finish(job_id, status, **values):
+    with db.engine.begin() as conn:
+        conn.execute(update(_jobs).where(_jobs.c.id == job_id)
+                     .values(status=status, finished_at=datetime.now(), heartbeat_at=datetime.now(),
+                             **values))
+
+
+def run_job(job_id):
+    """认领并执行一个排队中的任务；已被别的进程认领或已取消时直接返回 False"""
+    with db.engine.begin() as conn:
+        claimed = conn.execute(
+            update(_jobs).where(_jobs.c.id == job_id, _jobs.c.status == QUEUED)
+            .values(status=RUNNING, started_at=datetime.now(), heartbeat_at=datetime.now(),
+                    pid=os.getpid(), attempts=_jobs.c.attempts + 1)
+            .returning(_jobs.c.kind, _jobs.c.params)).first()
+    if claimed is None:
+        return False
+    kind, params = claimed
+    progress = Progress(job_id)
+    progress.start_heartbeat(job_runner.stale_seconds / 3)
+    try:
+        fn, _ = JOB_KINDS[kind]
+        result = fn(json.loads(params or '{}'), progress)
+    except JobCancelled:
+        logger.info('任务 %s（%s）已取消', job_id, kind)
+        _finish(job_id, CANCELLED, message='已取消')
+    except Exception as e:
+        logger.exception('任务 %s（%s）失败', job_id, kind)
+        _finish(job_id, FAILED, error=''.join(traceback.format_exception(e))[-4000:],
+                message=str(e)[:200])
+    else:
+        _finish(job_id, SUCCEEDED, progress=1.0, message='完成',
+                result=json.dumps(result or {}, ensure_ascii=False, default=str))
+    finally:
+        progress.stop_heartbeat()
+        db.session.remove()
+    return True
+
+
+# 进程池子进程里的应用（spawn 方式启动，每个子进程创建一次）
+_process_app = None
+
+
+def _init_process():
+    global _process_app
+    from . import create_app
+    _process_app = create_app(batch=True)
+
+
+def _run_in_process(job_id):
+    with _process_app.app_context():
+        return run_job(job_id)
+
+
+class JobRunner:
+    """提交、取消任务并管理执行任务的进程池"""
+
+    def __init__(self):
+        self.app = None
+        self.mode = 'local'
+        self.processes = 2
+        self.stale_seconds = 300
+        self.max_attempts = 3
+        self.reap_interval = 30
+        self.poll_interval = 1.0
+        self.lock_path = None
+        self._executor = None
+        self._lock = threading.Lock()
+        self._submit_lock = threading.Lock()
+        self._dispatched = set()
+        self._maintained_at = 0.0
+        self._lock_file = None
+        self._runner_pid = None
+
+    def init_app(self, app):
+        self.app = app
+        self.mode = app.config.get('JOB_RUNNER', self.mode)
+        self.processes = app.config.get('JOB_PROCESSES', self.processes)
+        self.stale_seconds = app.config.get('JOB_STALE_SECONDS', self.stale_seconds)
+        self.max_attempts = app.config.get('JOB_MAX_ATTEMPTS', self.max_attempts)
+        self.reap_interval = app.config.get('JOB_REAP_INTERVAL', self.reap_interval)
+        self.lock_path = app.config.get('JOB_LOCK_FILE', os.path.join(app.instance_path, 'jobs.lock'))
+        app.extensions['job_runner'] = self
+        atexit.register(self.shutdown)
+
+    def _acquire_lock(self):
+        try:
+            import fcntl
+        except ImportError:
+            # 没有 fcntl（Windows 开发环境）：每个进程都执行任务，认领仍保证只执行一次
+            return True
+        os.makedirs(os.path.dirname(self.lock_path) or '.', exist_ok=True)
+        f = open(self.lock_path, 'a')
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        self._lock_file = f
+        return True
+
+    def is_runner(self):
+        """local 模式下本进程是否负责执行任务；拿到任务锁时启动把排队任务交给进程池的后台线程"""
+        if self._runner_pid == os.getpid():
+            return True
+        with self._lock:
+            if self._runner_pid == os.getpid():
+                return True
+            if not self._acquire_lock():
+                return False
+            self._runner_pid = os.getpid()
+        logger.info('进程 %s 负责执行后台任务', os.getpid())
+        threading.Thread(target=self._poll, name='job-poller', daemon=True).start()
+        return True
+
+    def _poll(self):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                with self.app.app_context():
+                    self.maintain(adopt=False)
+                    free = self.processes - len(self._dispatched)
+                    if free <= 0:
+                        continue
+                    with _status_engine().connect() as conn:
+                        queued = conn.execute(
+                            select(_jobs.c.id).where(_jobs.c.status == QUEUED,
+                                                     _jobs.c.id.notin_(list(self._dispatched) or [0]))
+                            .order_by(_jobs.c.id).limit(free)).scalars().all()
+                for job_id in queued:
+                    self._dispatch(job_id)
+            except Exception:
+                logger.exception('读取排队中的任务失败')
+
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+                # spawn：不继承父进程的线程、连接池与锁
+                self._executor = ProcessPoolExecutor(
+                    self.processes, mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_process)
+            return self._executor
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+            if self._lock_file is not None and self._runner_pid == os.getpid():
+                self._lock_file.close()
+                self._lock_file, self._runner_pid = None, None
+
+    def submit(self, kind, params=None, dispatch=None):
+        """
+        新建一个排队中的任务，返回任务编号；dispatch 为真（local 模式默认）且本进程负责执行时
+        直接交给进程池，否则留给执行任务的进程认领
+        """
+        if kind not in JOB_KINDS:
+            raise ValueError(f'未知的任务类型: {kind}')
+        with db.engine.begin() as conn:
+            job_id = conn.execute(insert(_jobs).values(
+                kind=kind, params=json.dumps(params or {}, ensure_ascii=False), status=QUEUED,
+                progress=0.0, cancel_requested=False, created_at=datetime.now())
+                .returning(_jobs.c.id)).scalar()
+        if dispatch if dispatch is not None else self.mode == 'local':
+            if self.is_runner():
+                self._dispatch(job_id)
+            self.maintain()
+        return job_id
+
+    def submit_once(self, kind, params=None):
+        """
+        同类型、同参数的任务正在排队或执行时返回它的编号，否则提交新任务（单飞）。
+        不同进程同时提交仍可能各建一个，任务本身应能容忍重复执行（如先查缓存）。
+        """
+        params = params or {}
+        with self._submit_lock:
+            job_id = self.pending(kind, params)
+            return job_id if job_id is not None else self.submit(kind, params)
+
+    def pending(self, kind, params=None):
+        """同类型、同参数的任务正在排队或执行时返回它的编号，否则返回 None（只查询，不提交）"""
+        params = params or {}
+        with db.engine.connect() as conn:
+            pending = conn.execute(
+                select(_jobs.c.id, _jobs.c.params)
+                .where(_jobs.c.status.in_((QUEUED, RUNNING)), _jobs.c.kind == kind)
+                .order_by(_jobs.c.id)).all()
+        for job_id, existing in pending:
+            if json.loads(existing or '{}') == params:
+                return job_id
+        return None
+
+    def _dispatch(self, job_id):
+        """交给本进程的进程池；认领是带条件的 UPDATE，同一任务被多个进程派发也只执行一次"""
+        with self._lock:
+            self._dispatched.add(job_id)
+        future = self.executor().submit(_run_in_process, job_id)
+        future.add_done_callback(lambda _: self._dispatched.discard(job_id))
+
+    def cancel(self, job_id):
+        """排队中的任务直接取消；执行中的任务打上取消标记，由它在下次上报进度时退出"""
+        with db.engine.begin() as conn:
+            if conn.execute(update(_jobs).where(_jobs.c.id == job_id, _jobs.c.status == QUEUED)
+                            .values(status=CANCELLED, finished_at=datetime.now(),
+                                    message='已取消')).rowcount:
+                return True
+            return bool(conn.execute(
+                update(_jobs).where(_jobs.c.id == job_id, _jobs.c.status == RUNNING)
+                .values(cancel_requested=True)).rowcount)
+
+    def reap_stale(self, engine=None):
+        """
+        处理长时间没有心跳的 running 任务（执行进程已退出）：已请求取消的记为取消，
+        执行次数不到 max_attempts 的重新排队，其余记为失败；返回 (重新排队数, 失败数)
+        """
+        now = datetime.now()
+        stale = and_(_jobs.c.status == RUNNING,
+                     _jobs.c.heartbeat_at < now - timedelta(seconds=self.stale_seconds))
+        with (engine or db.engine).begin() as conn:
+            conn.execute(update(_jobs).where(stale, _jobs.c.cancel_requested)
+                         .values(status=CANCELLED, finished_at=now, message='已取消'))
+            requeued = conn.execute(
+                update(_jobs).where(stale, _jobs.c.attempts < self.max_attempts)
+                .values(status=QUEUED, pid=None, started_at=None, heartbeat_at=None, progress=0.0,
+                        message='执行进程中断，已重新排队')).rowcount
+            failed = conn.execute(
+                update(_jobs).where(stale)
+                .values(status=FAILED, finished_at=now, message='执行进程中断')).rowcount
+        return requeued, failed
+
+    def maintain(self, adopt=None):
+        """
+        每 reap_interval 秒最多执行一次：中断的任务重新排队；adopt 为真（local 模式默认）时
+        尝试接手任务锁（原来的持有者已退出时由本进程执行任务）。SQLite 被任务的写事务锁住时跳过，下次再做。
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now - self._maintained_at < self.reap_interval:
+                return
+            self._maintained_at = now
+        try:
+            requeued, failed = self.reap_stale(_status_engine())
+            if requeued or failed:
+                logger.warning('中断的任务：%d 个重新排队，%d 个记为失败', requeued, failed)
+            if adopt if adopt is not None else self.mode == 'local':
+                self.is_runner()
+        except exc.OperationalError as e:
+            logger.warning('整理后台任务失败: %s', e)
+
+
+job_runner = JobRunner()
+
+
+def job_dict(job):
+    """任务行 -> 接口返回的字典"""
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'progress': round(job.progress or 0.0, 4),
+        'message': job.message,
+        'params': json.loads(job.params or '{}'),
+        'result': json.loads(job.result) if job.result else None,
+        'error': job.error,
+        'cancel_requested': job.cancel_requested,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+# ---------- 命令行 ----------
+
+jobs_cli = AppGroup('jobs', help='后台任务')
+
+
+def _parse_params(pairs):
+    params = {}
+    for pair in pairs:
+        key, sep, value = pair.partition('=')
+        if not sep:
+            raise click.BadParameter(f'应为 key=value: {pair}')
+        try:
+            params[key] = json.loads(value)
+        except ValueError:
+            params[key] = value
+    return params
+
+
+@jobs_cli.command('submit')
+@click.argument('kind', type=click.Choice(sorted(JOB_KINDS)))
+@click.option('--param', 'pairs', multiple=True, help='任务参数 key=value，可重复指定')
+@click.option('--wait', is_flag=True, help='在当前进程里立即执行并等待完成')
+def submit_command(kind, pairs, wait):
+    """提交任务（默认只排队，由 `flask jobs worker` 执行）"""
+    job_id = job_runner.submit(kind, _parse_params(pairs), dispatch=False)
+    if not wait:
+        click.echo(f'任务 {job_id} 已排队')
+        return
+    run_job(job_id)
+    job = db.session.get(Job, job_id)
+    click.echo(json.dumps(job_dict(job), ensure_ascii=False, indent=2))
+    if job.status != SUCCEEDED:
+        raise SystemExit(1)
+
+
+@jobs_cli.command('list')
+@click.option('--limit', default=20, show_default=True)
+def list_command(limit):
+    """最近的任务"""
+    job_runner.maintain(adopt=False)
+    for job in db.session.execute(select(Job).order_by(Job.id.desc()).limit(limit)).scalars():
+        click.echo(f'{job.id:>6}  {job.kind:<20}{job.status:<11}{(job.progress or 0) * 100:>5.0f}%  '
+                   f'{job.message or ""}')
+
+
+@jobs_cli.command('status')
+@click.argument('job_id', type=int)
+def status_command(job_id):
+    """任务详情"""
+    job = db.session.get(Job, job_id)
+    if job is None:
+        raise click.ClickException(f'任务 {job_id} 不存在')
+    click.echo(json.dumps(job_dict(job), ensure_ascii=False, indent=2))
+
+
+@jobs_cli.command('cancel')
+@click.argument('job_id', type=int)
+def cancel_command(job_id):
+    """取消任务"""
+    try:
+        cancelled = job_runner.cancel(job_id)
+    except exc.OperationalError:
+        raise click.ClickException('数据库正忙（SQLite 任务正持有写锁），请稍后重试')
+    click.echo('已取消' if cancelled else '任务不存在或已结束')
+
+
+@jobs_cli.command('worker')
+@click.option('--processes', type=int, default=None, help='并行执行的任务数，默认 JOB_PROCESSES')
+@click.option('--poll', default=1.0, show_default=True, help='轮询间隔（秒）')
+def worker_command(processes, poll):
+    """轮询排队中的任务并交给进程池执行"""
+    if processes:
+        job_runner.processes = processes
+    requeued, failed = job_runner.reap_stale()
+    if requeued or failed:
+        click.echo(f'中断的任务：{requeued} 个重新排队，{failed} 个记为失败')
+    executor = job_runner.executor()
+    running = {}
+    click.echo(f'等待任务（{job_runner.processes} 个进程）...')
+    try:
+        while True:
+            job_runner.maintain(adopt=False)
+            for job_id in [i for i, f in running.items() if f.done()]:
+                running.pop(job_id).result()
+            free = job_runner.processes - len(running)
+            if free > 0:
+                queued = db.session.execute(
+                    select(Job.id).where(Job.status == QUEUED, Job.id.notin_(list(running) or [0]))
+                    .order_by(Job.id).limit(free)).scalars().all()
+                db.session.remove()
+                for job_id in queued:
+                    click.echo(f'执行任务 {job_id}')
+                    running[job_id] = executor.submit(_run_in_process, job_id)
+            time.sleep(poll)
+    except KeyboardInterrupt:
+        click.echo('停止，等待执行中的任务结束...')
+        executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,178 @@
+"""
+请求级 SQL 统计与 Prometheus 指标
+
+SQLAlchemy 的 before/after_cursor_execute 事件给每条语句计时，Flask 请求钩子把
+它们归到当前请求：记录路由、耗时、SQL 条数、SQL 总耗时和最慢的一条语句。
+超过 SLOW_QUERY_MS 的语句写入慢查询日志（请求之外的后台写入也会记录）。
+各路由的分布以直方图汇总，由 /metrics 以 Prometheus 文本格式输出；
+指标按进程统计，多 worker 部署时由 Prometheus 分别抓取后聚合。
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+_STATEMENT_PREVIEW = 300
+
+
+def _preview(statement):
+    text = ' '.join(statement.split())
+    return text if len(text) <= _STATEMENT_PREVIEW else text[:_STATEMENT_PREVIEW] + '...'
+
+
+class Histogram:
+    """累积分桶直方图（Prometheus 语义：le 桶为累计值）"""
+
+    __slots__ = ('buckets', 'counts', 'total', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, n in zip((*self.buckets, '+Inf'), self.counts):
+            cumulative += n
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f'{name}_sum{{{labels}}} {self.total:.6f}'
+        yield f'{name}_count{{{labels}}} {self.count}'
+
+
+class RequestMetrics:
+    """每个请求的 SQL 统计 + 按路由汇总的直方图"""
+
+    def __init__(self):
+        self.slow_query_ms = 200.0
+        self._lock = threading.Lock()
+        self._requests = {}   # (method, route, status) -> 次数
+        self._latency = {}    # (method, route) -> Histogram
+        self._statements = {}
+        self._sql_time = {}
+        self._slowest = {}    # (method, route) -> 最慢语句耗时（秒）
+        self._slow_queries = 0
+
+    def init_app(self, app):
+        self.slow_query_ms = app.config.get('SLOW_QUERY_MS', self.slow_query_ms)
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        app.extensions['request_metrics'] = self
+
+    def _start_request(self):
+        g.sql_metrics = {'started': time.perf_counter(), 'statements': 0, 'sql_time': 0.0,
+                         'slowest': 0.0, 'slowest_sql': None}
+
+    def record_statement(self, statement, elapsed):
+        route = None
+        if has_request_context():
+            stats = g.get('sql_metrics')
+            if stats is not None:
+                stats['statements'] += 1
+                stats['sql_time'] += elapsed
+                if elapsed > stats['slowest']:
+                    stats['slowest'], stats['slowest_sql'] = elapsed, statement
+            route = request.url_rule.rule if request.url_rule else request.path
+        if elapsed * 1000 >= self.slow_query_ms:
+            with self._lock:
+                self._slow_queries += 1
+            logger.warning('慢查询 %.1fms [%s] %s', elapsed * 1000, route or '后台', _preview(statement))
+
+    def _finish_request(self, response):
+        stats = g.pop('sql_metrics', None)
+        if stats is None:
+            return response
+        latency = time.perf_counter() - stats['started']
+        route = request.url_rule.rule if request.url_rule else '<unmatched>'
+        key = (request.method, route)
+        with self._lock:
+            status_key = (*key, response.status_code)
+            self._requests[status_key] = self._requests.get(status_key, 0) + 1
+            self._histogram(self._latency, key, LATENCY_BUCKETS).observe(latency)
+            self._histogram(self._statements, key, STATEMENT_BUCKETS).observe(stats['statements'])
+            self._histogram(self._sql_time, key, LATENCY_BUCKETS).observe(stats['sql_time'])
+            self._slowest[key] = max(self._slowest.get(key, 0.0), stats['slowest'])
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('%s %s %d %.1fms SQL %d 条 %.1fms，最慢 %.1fms %s',
+                         request.method, route, response.status_code, latency * 1000,
+                         stats['statements'], stats['sql_time'] * 1000, stats['slowest'] * 1000,
+                         _preview(stats['slowest_sql']) if stats['slowest_sql'] else '')
+        return response
+
+    def snapshot(self):
+        """{(method, route): {'requests', 'statements', 'sql_time'}}，供压测前后做差"""
+        with self._lock:
+            return {key: {'requests': histogram.count,
+                          'statements': self._statements[key].total,
+                          'sql_time': self._sql_time[key].total}
+                    for key, histogram in self._latency.items()}
+
+    @staticmethod
+    def _histogram(table, key, buckets):
+        histogram = table.get(key)
+        if histogram is None:
+            histogram = table[key] = Histogram(buckets)
+        return histogram
+
+    def render(self):
+        """Prometheus 文本格式"""
+        def labels(method, route):
+            route = route.replace('\\', '\\\\').replace('"', '\\"')
+            return f'method="{method}",route="{route}"'
+
+        with self._lock:
+            lines = ['# HELP cpims_http_requests_total 请求数',
+                     '# TYPE cpims_http_requests_total counter']
+            for (method, route, status), n in sorted(self._requests.items()):
+                lines.append(f'cpims_http_requests_total{{{labels(method, route)},status="{status}"}} {n}')
+            for name, table, help_text in (
+                    ('cpims_http_request_duration_seconds', self._latency, '请求耗时'),
+                    ('cpims_request_sql_statements', self._statements, '每个请求的 SQL 条数'),
+                    ('cpims_request_sql_duration_seconds', self._sql_time, '每个请求的 SQL 总耗时')):
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+                for key, histogram in sorted(table.items()):
+                    lines.extend(histogram.lines(name, labels(*key)))
+            lines += ['# HELP cpims_request_slowest_statement_seconds 各路由出现过的最慢单条 SQL',
+                      '# TYPE cpims_request_slowest_statement_seconds gauge']
+            for key, value in sorted(self._slowest.items()):
+                lines.append(f'cpims_request_slowest_statement_seconds{{{labels(*key)}}} {value:.6f}')
+            lines += ['# HELP cpims_slow_queries_total 超过慢查询阈值的 SQL 条数',
+                      '# TYPE cpims_slow_queries_total counter',
+                      f'cpims_slow_queries_total {self._slow_queries}']
+        return '\n'.join(lines) + '\n'
+
+
+request_metrics = RequestMetrics()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('query_started')
+    if started:
+        request_metrics.record_statement(statement, time.perf_counter() - started.pop())
+
+
+@event.listens_for(Engine, 'handle_error')
+def _discard_failed(context):
+    # 出错的语句不会触发 after_cursor_execute，丢掉它的开始时间
+    if context.connection is not None and context.connection.info.get('query_started'):
+        context.connection.info['query_started'].pop()
@@ -1,10 +1,18 @@
-from . import db
 from datetime import datetime
 
+from . import db
+
+# SQLite 默认不检查外键，下面声明的 ON DELETE CASCADE 依赖 app/engine.py 在每个连接上开启 foreign_keys
+
+
 # 1. 商品信息表 (Products)
 # 需求：编号、名称、登记日期、品类、型号、单位、单价、剩余数量
 class Product(db.Model):
     __tablename__ = 'products'
+    __table_args__ = (
+        db.Index('ix_products_category', 'category'),
+        db.Index('ix_products_stock', 'stock'), # 库存预警
+    )
     id = db.Column(db.Integer, primary_key=True) # 商品编号
     name = db.Column(db.String(100), nullable=False) # 商品名称
     reg_date = db.Column(db.Date, default=datetime.now) # 登记日期
@@ -14,9 +22,9 @@ class Product(db.Model):
     price = db.Column(db.Numeric(10, 2), nullable=False) # 单价
     stock = db.Column(db.Integer, default=0) # 剩余数量
     
-    # 关联
-    logs = db.relationship('BrowseLog', backref='product', cascade="all, delete-orphan")
-    sales = db.relationship('Sale', backref='product', cascade="all, delete-orphan")
+    # 关联：明细由外键的 ON DELETE CASCADE 在数据库里级联删除，删除商品时不再逐条载入
+    logs = db.relationship('BrowseLog', backref='product', cascade="all, delete-orphan", passive_deletes=True)
+    sales = db.relationship('Sale', backref='product', cascade="all, delete-orphan", passive_deletes=True)
 
 # 2. 用户信息表 (Users)
 # 需求：编号、用户名、收件地址、联系电话
@@ -27,14 +35,20 @@ class User(db.Model):
     address = db.Column(db.String(200)) # 收件地址
     phone = db.Column(db.String(20)) # 联系电话
     
-    # 关联 - 添加cascade删除配置
-    logs = db.relationship('BrowseLog', backref='user', cascade="all, delete-orphan")
-    sales = db.relationship('Sale', backref='user', cascade="all, delete-orphan")
+    # 关联 - 同商品，由数据库级联删除
+    logs = db.relationship('BrowseLog', backref='user', cascade="all, delete-orphan", passive_deletes=True)
+    sales = db.relationship('Sale', backref='user', cascade="all, delete-orphan", passive_deletes=True)
 
 # 3. 用户浏览信息表 (BrowseLogs)
 # 需求：用户编号、商品编号、浏览时间、浏览方式
 class BrowseLog(db.Model):
     __tablename__ = 'browse_logs'
+    __table_args__ = (
+        db.Index('ix_browse_logs_browse_time_id', 'browse_time', 'id'), # 按时间倒序分页
+        db.Index('ix_browse_logs_browse_time_platform', 'browse_time', 'platform'),
+        db.Index('ix_browse_logs_user_product_time', 'user_id', 'product_id', 'browse_time'), # 按用户查询、转化报表的有序扫描
+        db.Index('ix_browse_logs_product_id', 'product_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False) # 外键
     product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'), nullable=False) # 外键
@@ -45,6 +59,12 @@ class BrowseLog(db.Model):
 # 需求：商品编号、用户编号、销售日期、单价、数量、总金额、支付方式
 class Sale(db.Model):
     __tablename__ = 'sales'
+    __table_args__ = (
+        db.Index('ix_sales_sale_date_id', 'sale_date', 'id'), # 按日期倒序分页
+        db.Index('ix_sales_sale_date_product_id', 'sale_date', 'product_id'),
+        db.Index('ix_sales_product_id', 'product_id'),
+        db.Index('ix_sales_user_product_date', 'user_id', 'product_id', 'sale_date'), # 同上
+    )
     id = db.Column(db.Integer, primary_key=True)
     product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'), nullable=False) # 外键
     user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False) # 外键
@@ -52,4 +72,134 @@ class Sale(db.Model):
     unit_price = db.Column(db.Numeric(10, 2), nullable=False) # 单价
     quantity = db.Column(db.Integer, nullable=False) # 数量
     total_amount = db.Column(db.Numeric(10, 2), nullable=False) # 总金额
-    payment_method = db.Column(db.String(20)) # 支付方式
\ No newline at end of file
+    payment_method = db.Column(db.String(20)) # 支付方式
+
+# 5. 销售日汇总表 (SalesDaily)
+# 按 日期/商品/支付方式 汇总，随销售写入在同一事务内增量维护，供看板读取
+class SalesDaily(db.Model):
+    __tablename__ = 'sales_daily'
+    __table_args__ = (
+        db.Index('ix_sales_daily_product_id', 'product_id'),
+    )
+    day = db.Column(db.Date, primary_key=True) # 销售日期
+    product_id = db.Column(db.Integer, primary_key=True) # 商品编号
+    payment_method = db.Column(db.String(20), primary_key=True, default='') # 支付方式（空值记为 ''）
+    category = db.Column(db.String(50)) # 品类（冗余自商品表）
+    amount = db.Column(db.Numeric(14, 2), nullable=False, default=0) # 销售额
+    quantity = db.Column(db.Integer, nullable=False, default=0) # 销售数量
+    orders = db.Column(db.Integer, nullable=False, default=0) # 订单数
+
+# 6. 浏览日汇总表 (BrowseDaily)
+# 按 日期/商品/浏览方式 汇总浏览次数
+class BrowseDaily(db.Model):
+    __tablename__ = 'browse_daily'
+    __table_args__ = (
+        db.Index('ix_browse_daily_product_id', 'product_id'),
+    )
+    day = db.Column(db.Date, primary_key=True) # 浏览日期
+    product_id = db.Column(db.Integer, primary_key=True) # 商品编号
+    platform = db.Column(db.String(20), primary_key=True, default='') # 浏览方式（空值记为 ''）
+    views = db.Column(db.Integer, nullable=False, default=0) # 浏览次数
+
+# 7. 浏览记录归档段 (BrowseArchive / BrowseArchiveCount)
+# 保留期之外的月份从明细表移出，按 (浏览时间, 编号) 顺序压缩成若干段存放；查询窗口需要时再解冻回明细表。
+# 每段另记 (用户, 商品) 的浏览次数，按用户筛选时据此跳过没有匹配行的段、直接求出整段落在窗口内的行数
+class BrowseArchive(db.Model):
+    __tablename__ = 'browse_archive'
+    __table_args__ = (
+        db.Index('ix_browse_archive_month', 'month'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    month = db.Column(db.Date, nullable=False) # 所属月份（当月 1 日）
+    rows = db.Column(db.Integer, nullable=False) # 行数
+    min_id = db.Column(db.Integer) # 段内最小浏览记录编号
+    max_id = db.Column(db.Integer) # 段内最大浏览记录编号
+    raw_bytes = db.Column(db.Integer) # 压缩前字节数
+    payload = db.Column(db.LargeBinary, nullable=False) # zlib 压缩的 CSV
+    created_at = db.Column(db.DateTime, default=datetime.now) # 归档时间
+    thawed_at = db.Column(db.DateTime) # 解冻时间，非空表示数据已回到明细表
+    min_time = db.Column(db.DateTime) # 段内最早浏览时间
+    max_time = db.Column(db.DateTime) # 段内最晚浏览时间
+
+class BrowseArchiveCount(db.Model):
+    __tablename__ = 'browse_archive_counts'
+    __table_args__ = (
+        db.Index('ix_browse_archive_counts_user', 'user_id', 'segment_id'), # 按用户找段
+    )
+    segment_id = db.Column(db.Integer, db.ForeignKey('browse_archive.id', ondelete='CASCADE'),
+                           primary_key=True) # 归档段编号
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False) # 用户编号（用户删除后不级联，查询时过滤）
+    product_id = db.Column(db.Integer, primary_key=True, autoincrement=False) # 商品编号（同上）
+    views = db.Column(db.Integer, nullable=False) # 段内浏览次数
+
+# 8. 数据库结构版本 (SchemaVersion)
+# 由 `flask schema upgrade` 写入，Web 进程只读取它判断数据库结构是否就绪
+class SchemaVersion(db.Model):
+    __tablename__ = 'schema_version'
+    version = db.Column(db.Integer, primary_key=True) # 结构版本号
+    applied_at = db.Column(db.DateTime, default=datetime.now) # 升级时间
+
+# 9. 后台任务 (Job)
+# 由 jobs.py 的进程池执行，参数与结果以 JSON 文本存储
+class Job(db.Model):
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        db.Index('ix_jobs_status_id', 'status', 'id'), # 按状态取排队中的任务
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(40), nullable=False) # 任务类型
+    params = db.Column(db.Text) # 参数（JSON）
+    status = db.Column(db.String(20), nullable=False, default='queued') # queued/running/succeeded/failed/cancelled
+    progress = db.Column(db.Float, nullable=False, default=0.0) # 0 ~ 1
+    message = db.Column(db.String(200)) # 最近一条进度说明
+    result = db.Column(db.Text) # 结果（JSON）
+    error = db.Column(db.Text) # 失败原因
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+    pid = db.Column(db.Integer) # 执行进程
+    attempts = db.Column(db.Integer, nullable=False, default=0, server_default='0') # 已认领执行的次数，执行进程中断后重新排队时累加
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    started_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime) # 最近一次上报进度的时间
+    finished_at = db.Column(db.DateTime)
+
+# 10. 基数草图 (Sketch)
+# 独立访客/独立买家的 HyperLogLog 与热门商品的 Count-Min 草图，按日、按月各一份，由 sketches.py 维护
+class Sketch(db.Model):
+    __tablename__ = 'sketches'
+    __table_args__ = (
+        db.Index('ix_sketches_kind_key', 'kind', 'key', 'grain', 'period'), # 单个商品的区间查询
+    )
+    kind = db.Column(db.String(20), primary_key=True) # 草图种类，见 sketches.py
+    grain = db.Column(db.String(1), primary_key=True) # D 按日 / M 按月
+    period = db.Column(db.Date, primary_key=True) # 日期，按月时为当月 1 日
+    key = db.Column(db.String(50), primary_key=True, default='') # 商品编号/浏览方式/品类，Count-Min 为空
+    data = db.Column(db.LargeBinary, nullable=False) # 序列化后的草图
+
+# 11. 转化报表缓存 (ConversionReport)
+# 按日期窗口缓存 conversion.py 算出的浏览 → 购买转化报表，所有 worker 与后台任务共用
+class ConversionReport(db.Model):
+    __tablename__ = 'conversion_reports'
+    start_date = db.Column(db.Date, primary_key=True) # 窗口开始日期
+    end_date = db.Column(db.Date, primary_key=True) # 窗口结束日期（含）
+    computed_at = db.Column(db.DateTime, nullable=False) # 计算时间
+    payload = db.Column(db.Text, nullable=False) # 报表（JSON）
+
+# 12. 商品目录版本 (catalog_version_seq / CatalogChange)
+# 商品的每次修改或删除取一个新版本号，并按版本记下变化的商品编号；
+# 各 worker 的商品目录缓存（catalog.py）据此只失效变化的商品。
+# PostgreSQL 上版本号取自序列（SQLite 不支持序列，取最大版本号加一）
+catalog_version_seq = db.Sequence('catalog_version_seq', metadata=db.metadata)
+
+class CatalogChange(db.Model):
+    __tablename__ = 'catalog_changes'
+    version = db.Column(db.BigInteger, primary_key=True) # 写入时的版本号
+    product_id = db.Column(db.Integer, primary_key=True, autoincrement=False) # 变化的商品编号，0 表示全部商品
+
+# 13. 缓存代数 (CacheGeneration)
+# 后台任务等其它进程整体改写数据（重建汇总表、归档、重新生成数据）后加一，
+# 各 worker 读数据版本戳时发现代数变化就清空本进程的看板缓存；
+# 另有一行 deletes 在删除明细、用户或商品的事务里加一，作为 HTTP 版本戳的删除计数
+class CacheGeneration(db.Model):
+    __tablename__ = 'cache_generations'
+    name = db.Column(db.String(40), primary_key=True) # 缓存名（或 deletes）
+    generation = db.Column(db.Integer, nullable=False) # 当前代数
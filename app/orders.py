@@ -0,0 +1,188 @@
+"""
+下单与扣库存
+
+每个订单行用一条带条件的语句扣库存：UPDATE products SET stock = stock - q
+WHERE id = ? AND stock >= q，库存不足时影响 0 行，不会出现并发 worker 之间的丢失更新。
+PostgreSQL 上扣库存与写销售记录合并为一条 CTE 语句；SQLite 写事务本身串行，
+两条语句在同一事务内完成。一批订单共用一个事务，各订单行分别返回成功或缺货。
+"""
+import threading
+import time
+from datetime import date
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import func, insert, literal, select, update
+
+from . import db
+from .models import Product, Sale, User
+
+STATUS_OK = 'ok'
+STATUS_OUT_OF_STOCK = 'out_of_stock'
+STATUS_NOT_FOUND = 'not_found'
+STATUS_INVALID_USER = 'invalid_user'
+
+_products = Product.__table__
+_sales = Sale.__table__
+
+
+def _sell_postgresql(conn, product_id, quantity, user_id, payment_method, sale_date):
+    taken = update(_products)\
+        .where(_products.c.id == product_id, _products.c.stock >= quantity)\
+        .values(stock=_products.c.stock - quantity)\
+        .returning(_products.c.id, _products.c.price).cte('taken')
+    stmt = insert(_sales).from_select(
+        ['product_id', 'user_id', 'sale_date', 'unit_price', 'quantity', 'total_amount', 'payment_method'],
+        select(taken.c.id, literal(user_id), literal(sale_date), taken.c.price, literal(quantity),
+               taken.c.price * quantity, literal(payment_method))
+    ).returning(_sales.c.id, _sales.c.unit_price, _sales.c.total_amount)
+    return conn.execute(stmt).first()
+
+
+def _sell_sqlite(conn, product_id, quantity, user_id, payment_method, sale_date):
+    taken = conn.execute(
+        update(_products)
+        .where(_products.c.id == product_id, _products.c.stock >= quantity)
+        .values(stock=_products.c.stock - quantity)
+        .returning(_products.c.price)
+    ).first()
+    if taken is None:
+        return None
+    total = taken.price * quantity
+    sale_id = conn.execute(insert(_sales).values(
+        product_id=product_id, user_id=user_id, sale_date=sale_date, unit_price=taken.price,
+        quantity=quantity, total_amount=total, payment_method=payment_method
+    )).inserted_primary_key[0]
+    return sale_id, taken.price, total
+
+
+def place_orders(conn, orders):
+    """
+    在当前事务内处理一批订单。
+    orders: [{'user_id', 'payment_method', 'lines': [{'product_id', 'quantity'}]}]
+    返回与 orders 结构对应的逐行结果列表。
+    """
+    from .catalog import bump_version
+    from .rollups import apply_sales
+    from .sketches import record_sales
+    sell = _sell_postgresql if conn.dialect.name == 'postgresql' else _sell_sqlite
+    sale_date = date.today()
+
+    user_ids = {o['user_id'] for o in orders}
+    known_users = set(conn.execute(select(User.id).where(User.id.in_(user_ids))).scalars())
+
+    results = [[None] * len(o['lines']) for o in orders]
+    # 按商品编号顺序加行锁，并发的多行订单不会互相死锁
+    work = sorted((line['product_id'], oi, li)
+                  for oi, o in enumerate(orders) for li, line in enumerate(o['lines']))
+    sold = []
+    for product_id, oi, li in work:
+        order = orders[oi]
+        quantity = order['lines'][li]['quantity']
+        result = {'product_id': product_id, 'quantity': quantity}
+        results[oi][li] = result
+        if order['user_id'] not in known_users:
+            result['status'] = STATUS_INVALID_USER
+            continue
+        row = sell(conn, product_id, quantity, order['user_id'], order.get('payment_method'), sale_date)
+        if row is None:
+            exists = conn.execute(select(Product.id).where(Product.id == product_id)).first()
+            result['status'] = STATUS_OUT_OF_STOCK if exists else STATUS_NOT_FOUND
+            continue
+        sale_id, unit_price, total = row
+        result.update(status=STATUS_OK, sale_id=sale_id, total_amount=float(total))
+        sold.append({'sale_date': sale_date, 'product_id': product_id, 'user_id': order['user_id'],
+                     'payment_method': order.get('payment_method'),
+                     'total_amount': total, 'quantity': quantity})
+    apply_sales(conn, sold)
+    record_sales(conn, sold)
+    bump_version(conn, {s['product_id'] for s in sold})
+    return results
+
+
+def submit_orders(orders):
+    """单独开一个事务处理一批订单，提交后失效看板缓存，客户端随后的读取走主库"""
+    from .cache import dashboard_cache, SALES_KEY, CATALOG_KEY
+    from .replicas import replica_router
+    from .sketches import transaction
+    with transaction(db.engine) as conn:
+        results = place_orders(conn, orders)
+    if any(line['status'] == STATUS_OK for order in results for line in order):
+        dashboard_cache.invalidate(SALES_KEY, CATALOG_KEY)
+        replica_router.mark_write()
+    return results
+
+
+orders_cli = AppGroup('orders', help='下单')
+
+
+@orders_cli.command('bench')
+@click.option('--threads', default=8, show_default=True, help='并发线程数')
+@click.option('--orders', 'total_orders', default=2000, show_default=True, help='总订单数')
+@click.option('--batch', default=10, show_default=True, help='每个事务处理的订单数')
+@click.option('--hot-products', default=5, show_default=True, help='争抢的热门商品数')
+def bench_command(threads, total_orders, batch, hot_products):
+    """多线程抢购少量热门商品，校验库存不超卖、不丢失更新（会真实写入销售记录）"""
+    product_ids = list(db.session.execute(
+        select(Product.id).order_by(Product.id).limit(hot_products)).scalars())
+    user_id = db.session.execute(select(func.min(User.id))).scalar()
+    if not product_ids or user_id is None:
+        raise click.ClickException('请先生成测试数据')
+    stock_before = dict(db.session.execute(
+        select(Product.id, Product.stock).where(Product.id.in_(product_ids))).all())
+    db.session.remove()
+
+    lock = threading.Lock()
+    sold = {pid: 0 for pid in product_ids}
+    counts = {'ok': 0, 'rejected': 0, 'errors': 0}
+    per_thread = total_orders // threads
+
+    app = current_app._get_current_object()
+
+    def worker(n):
+        with app.app_context():
+            _worker(n)
+
+    def _worker(n):
+        for start in range(0, per_thread, batch):
+            orders = [{'user_id': user_id, 'payment_method': '支付宝',
+                       'lines': [{'product_id': product_ids[(n + i) % len(product_ids)], 'quantity': 1},
+                                 {'product_id': product_ids[(n + i + 1) % len(product_ids)], 'quantity': 2}]}
+                      for i in range(start, min(start + batch, per_thread))]
+            try:
+                results = submit_orders(orders)
+            except Exception as e:
+                with lock:
+                    counts['errors'] += 1
+                    counts.setdefault('first_error', repr(e))
+                continue
+            with lock:
+                for order in results:
+                    for line in order:
+                        if line['status'] == STATUS_OK:
+                            sold[line['product_id']] += line['quantity']
+                            counts['ok'] += 1
+                        else:
+                            counts['rejected'] += 1
+
+    started = time.perf_counter()
+    pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    stock_after = dict(db.session.execute(
+        select(Product.id, Product.stock).where(Product.id.in_(product_ids))).all())
+    consistent = all(stock_before[pid] - stock_after[pid] == sold[pid] and stock_after[pid] >= 0
+                     for pid in product_ids)
+    orders_done = threads * per_thread
+    click.echo(f'{orders_done} 单 / {elapsed:.2f} 秒 = {orders_done / elapsed:,.0f} 单/秒，'
+               f'成功行 {counts["ok"]}，缺货行 {counts["rejected"]}，失败事务 {counts["errors"]}')
+    if counts['errors']:
+        click.echo(f'首个失败原因: {counts["first_error"]}')
+    click.echo('库存一致' if consistent else f'库存不一致: 之前 {stock_before} 之后 {stock_after} 售出 {sold}')
+    if not consistent:
+        raise SystemExit(1)
@@ -0,0 +1,109 @@
+"""
+游标（keyset）分页
+
+按 (排序列, id) 倒序翻页，用上一页最后一行的位置做 WHERE 条件代替 OFFSET，
+第 5000 页与第 1 页代价相同；总数由调用方给出（汇总表精确值或估算值），不做 COUNT(*)。
+"""
+import base64
+import json
+from datetime import date, datetime
+from operator import attrgetter
+
+from sqlalchemy import func, literal, select, tuple_
+
+from . import db
+
+
+def encode_cursor(direction, value, row_id):
+    if isinstance(value, (date, datetime)):
+        value = value.isoformat()
+    raw = json.dumps([direction, value, row_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token, sort_col):
+    """解析游标，返回 (direction, (value, id))；格式不对时抛 ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        direction, value, row_id = json.loads(raw)
+    except Exception as e:
+        raise ValueError(f'invalid cursor: {token}') from e
+    if direction not in ('next', 'prev') or not isinstance(row_id, int):
+        raise ValueError(f'invalid cursor: {token}')
+    python_type = sort_col.type.python_type
+    if python_type is datetime:
+        value = datetime.fromisoformat(value)
+    elif python_type is date:
+        value = date.fromisoformat(value)
+    return direction, (value, row_id)
+
+
+class KeysetPagination:
+    """按 (sort_col, id_col) 倒序的游标分页，接口尽量与 Flask-SQLAlchemy 的 Pagination 对齐"""
+    is_keyset = True
+
+    def __init__(self, query, sort_col, id_col, per_page, cursor=None,
+                 total=None, total_is_estimate=False, extra=None):
+        self.per_page = per_page
+        self.total = total
+        self.total_is_estimate = total_is_estimate
+
+        direction, key = 'next', None
+        if cursor:
+            try:
+                direction, key = decode_cursor(cursor, sort_col)
+            except ValueError:
+                pass
+
+        position = tuple_(sort_col, id_col)
+        if direction == 'next':
+            if key is not None:
+                query = query.filter(position < tuple_(*key))
+            query = query.order_by(sort_col.desc(), id_col.desc())
+        else:
+            query = query.filter(position > tuple_(*key))
+            query = query.order_by(sort_col.asc(), id_col.asc())
+
+        # 多取一行判断是否还有下一页
+        rows = query.limit(per_page + 1).all()
+        if extra is not None:
+            # 查询之外的行（如归档段中的记录）：extra(direction, key, n) 给出同一位置之后的前 n 行
+            rows = sorted(rows + extra(direction, key, per_page + 1),
+                          key=attrgetter(sort_col.key, id_col.key), reverse=direction == 'next')
+        more = len(rows) > per_page
+        rows = rows[:per_page]
+        if direction == 'prev':
+            rows.reverse()
+        self.items = rows
+
+        if direction == 'next':
+            self.has_next, self.has_prev = more, key is not None
+        else:
+            self.has_next, self.has_prev = True, more
+
+        sort_key, id_key = sort_col.key, id_col.key
+        self.next_cursor = self.prev_cursor = None
+        if rows and self.has_next:
+            last = rows[-1]
+            self.next_cursor = encode_cursor('next', getattr(last, sort_key), getattr(last, id_key))
+        if rows and self.has_prev:
+            first = rows[0]
+            self.prev_cursor = encode_cursor('prev', getattr(first, sort_key), getattr(first, id_key))
+
+
+def bounded_count(query, limit):
+    """最多数到 limit + 1 行，用于判断结果集是否“小”"""
+    sub = query.with_entities(literal(1)).order_by(None).limit(limit + 1).subquery()
+    return db.session.execute(select(func.count()).select_from(sub)).scalar()
+
+
+def estimate_count(query):
+    """PostgreSQL 上用执行计划的行数估算；其它数据库返回 None"""
+    conn = db.session.connection()
+    if conn.dialect.name != 'postgresql':
+        return None
+    compiled = query.order_by(None).statement.compile(dialect=conn.dialect)
+    plan = conn.exec_driver_sql('EXPLAIN (FORMAT JSON) ' + str(compiled), compiled.params).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
@@ -0,0 +1,582 @@
+"""
+浏览记录按月分区与冷数据归档
+
+PostgreSQL：browse_logs 是按 browse_time 的 RANGE 分区表，每月一个分区
+（browse_logs_pYYYYMM）外加一个 DEFAULT 分区兜底；带时间条件的查询由规划器自动裁剪分区。
+已有的普通表由 ensure_partitions 一次性转换。
+SQLite：明细表保持单表（外键、ORM 与批量写入都依赖它），时间范围查询走
+browse_time 索引，冷数据同样归档移出。
+
+保留期（BROWSE_RETENTION_MONTHS）之前的月份由 `flask partitions archive` 压缩成
+browse_archive 中的归档段并从明细表移除（PostgreSQL 上直接卸载并删除分区）。
+汇总表不受影响，看板照常包含归档数据；浏览记录页默认只看保留期内的数据。
+查询窗口覆盖到已归档月份时只读地逐段解码这些月份的归档段，取出窗口内的行与明细表的结果合并，
+读请求不写库。归档段按 (浏览时间, 编号) 顺序切分并记下各段的时间范围和 (用户, 商品) 浏览次数：
+翻页只解码游标附近的段，按用户筛选时跳过没有该用户记录的段，计数只解码跨窗口边界的段。需要长期频繁查询的月份可以用 `flask partitions thaw` 或后台任务 thaw
+解冻回明细表，下次归档时再压缩回去。
+"""
+import csv
+import heapq
+import io
+import logging
+import zlib
+from collections import Counter
+from datetime import date, datetime
+from operator import attrgetter, itemgetter
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import Date, and_, func, select
+
+from . import db
+from .models import BrowseArchive, BrowseArchiveCount, BrowseLog, Product, User
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_COLUMNS = ['id', 'user_id', 'product_id', 'browse_time', 'platform']
+
+_logs = BrowseLog.__table__
+_archive = BrowseArchive.__table__
+_counts = BrowseArchiveCount.__table__
+_position = itemgetter('browse_time', 'id')
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def parse_month(value):
+    """YYYY-MM -> 该月 1 日，格式不对时抛 ValueError"""
+    return datetime.strptime(value, '%Y-%m').date()
+
+
+def add_months(month, n):
+    index = month.year * 12 + month.month - 1 + n
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def archive_cutoff(today=None, retention=None):
+    """保留期内最早的月份；它之前的月份都应归档"""
+    if retention is None:
+        retention = current_app.config['BROWSE_RETENTION_MONTHS']
+    return add_months(month_start(today or date.today()), -retention)
+
+
+def _month_range(month):
+    return datetime.combine(month, datetime.min.time()), \
+        datetime.combine(add_months(month, 1), datetime.min.time())
+
+
+def _in_month(column, month):
+    if isinstance(column.type, Date):
+        # 日期列直接按日期比较（SQLite 上日期与时间是按字符串比较的）
+        return and_(column >= month, column < add_months(month, 1))
+    lo, hi = _month_range(month)
+    return and_(column >= lo, column < hi)
+
+
+# ---------- PostgreSQL 分区 ----------
+
+def partition_name(month):
+    return f'browse_logs_p{month:%Y%m}'
+
+
+def parent_table(name):
+    """分区名 -> 所属的表名（执行计划里出现的是分区名）"""
+    if name == 'browse_logs_default' or (name.startswith('browse_logs_p') and name[13:].isdigit()):
+        return 'browse_logs'
+    return name
+
+
+def _is_partitioned(conn):
+    return conn.exec_driver_sql(
+        "SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass('browse_logs')").scalar()
+
+
+def _exists(conn, name):
+    return conn.exec_driver_sql('SELECT to_regclass(%(name)s) IS NOT NULL', {'name': name}).scalar()
+
+
+def _ensure_month_partition(conn, month):
+    name = partition_name(month)
+    if _exists(conn, name):
+        return False
+    lo, hi = _month_range(month)
+    bounds = {'lo': lo, 'hi': hi}
+    create = (f"CREATE TABLE {name} PARTITION OF browse_logs "
+              f"FOR VALUES FROM ('{lo.isoformat()}') TO ('{hi.isoformat()}')")
+    stranded = conn.exec_driver_sql(
+        'SELECT EXISTS (SELECT 1 FROM browse_logs_default '
+        'WHERE browse_time >= %(lo)s AND browse_time < %(hi)s)', bounds).scalar()
+    if not stranded:
+        conn.exec_driver_sql(create)
+        return True
+    # 该月已有数据落在 DEFAULT 分区：卸下 DEFAULT，建分区并搬走这部分数据，再挂回去
+    conn.exec_driver_sql('ALTER TABLE browse_logs DETACH PARTITION browse_logs_default')
+    conn.exec_driver_sql(create)
+    conn.exec_driver_sql(
+        f'INSERT INTO {name} SELECT * FROM browse_logs_default '
+        f'WHERE browse_time >= %(lo)s AND browse_time < %(hi)s', bounds)
+    conn.exec_driver_sql(
+        'DELETE FROM browse_logs_default WHERE browse_time >= %(lo)s AND browse_time < %(hi)s', bounds)
+    conn.exec_driver_sql('ALTER TABLE browse_logs ATTACH PARTITION browse_logs_default DEFAULT')
+    return True
+
+
+def _data_months(conn, table):
+    return [month_start(m) for m in conn.exec_driver_sql(
+        f"SELECT DISTINCT date_trunc('month', browse_time)::date FROM {table} "
+        f"WHERE browse_time IS NOT NULL").scalars()]
+
+
+def _convert(conn):
+    """把普通表 browse_logs 转成分区表（数据、主键、外键、索引、序列一并迁移）"""
+    logger.info('把 browse_logs 转换为按月分区表')
+    conn.exec_driver_sql('ALTER TABLE browse_logs RENAME TO browse_logs_unpartitioned')
+    conn.exec_driver_sql('ALTER SEQUENCE browse_logs_id_seq OWNED BY NONE')
+    conn.exec_driver_sql('CREATE TABLE browse_logs (LIKE browse_logs_unpartitioned INCLUDING DEFAULTS) '
+                         'PARTITION BY RANGE (browse_time)')
+    conn.exec_driver_sql('CREATE TABLE browse_logs_default PARTITION OF browse_logs DEFAULT')
+    for month in _data_months(conn, 'browse_logs_unpartitioned'):
+        _ensure_month_partition(conn, month)
+    conn.exec_driver_sql('INSERT INTO browse_logs SELECT * FROM browse_logs_unpartitioned')
+    conn.exec_driver_sql('DROP TABLE browse_logs_unpartitioned')
+    # 分区表的主键必须包含分区键
+    conn.exec_driver_sql('ALTER TABLE browse_logs ADD PRIMARY KEY (id, browse_time)')
+    for fk in _logs.foreign_keys:
+        conn.exec_driver_sql(
+            f'ALTER TABLE browse_logs ADD FOREIGN KEY ({fk.parent.name}) '
+            f'REFERENCES {fk.column.table.name} ({fk.column.name}) ON DELETE {fk.ondelete or "NO ACTION"}')
+    conn.exec_driver_sql('ALTER SEQUENCE browse_logs_id_seq OWNED BY browse_logs.id')
+    for index in _logs.indexes:
+        index.create(conn)
+
+
+def ensure_partitions(conn, start=None, end=None, ahead=None):
+    """
+    PostgreSQL 上确保 browse_logs 已分区，并建好 [start, end] 覆盖的月分区、
+    当月及之后 ahead 个月的分区，同时把落在 DEFAULT 分区里的整月数据搬进各自分区。
+    返回新建的分区名；SQLite 上不做任何事。
+    """
+    if conn.dialect.name != 'postgresql':
+        return []
+    if ahead is None:
+        ahead = current_app.config['BROWSE_PARTITIONS_AHEAD']
+    if not _is_partitioned(conn):
+        _convert(conn)
+    this_month = month_start(date.today())
+    months = {add_months(this_month, n) for n in range(ahead + 1)}
+    if start is not None:
+        month, last = month_start(start), month_start(end or date.today())
+        while month <= last:
+            months.add(month)
+            month = add_months(month, 1)
+    months.update(_data_months(conn, 'browse_logs_default'))
+    created = [partition_name(m) for m in sorted(months) if _ensure_month_partition(conn, m)]
+    return created
+
+
+def list_partitions(conn):
+    """[(分区名, 行数估计)]，按名称排序"""
+    return conn.exec_driver_sql(
+        "SELECT c.relname, GREATEST(c.reltuples, 0)::bigint FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass('browse_logs') ORDER BY c.relname").all()
+
+
+# ---------- 归档段 ----------
+
+def _encode_segment(rows):
+    buf = io.StringIO()
+    csv.writer(buf).writerows(['' if v is None else v for v in row] for row in rows)
+    raw = buf.getvalue().encode('utf-8')
+    return zlib.compress(raw, 9), len(raw)
+
+
+def _decode_segment(payload):
+    for row_id, user_id, product_id, browse_time, platform in csv.reader(
+            io.StringIO(zlib.decompress(payload).decode('utf-8'))):
+        yield {'id': int(row_id), 'user_id': int(user_id), 'product_id': int(product_id),
+               'browse_time': datetime.fromisoformat(browse_time), 'platform': platform or None}
+
+
+def _drop_hot_month(conn, month):
+    """把某月的数据从明细表移除"""
+    if conn.dialect.name == 'postgresql':
+        name = partition_name(month)
+        if _exists(conn, name):
+            conn.exec_driver_sql(f'ALTER TABLE browse_logs DETACH PARTITION {name}')
+            conn.exec_driver_sql(f'DROP TABLE {name}')
+    # SQLite 的整月数据，或 PostgreSQL 上落在 DEFAULT 分区的零散数据
+    conn.execute(_logs.delete().where(_in_month(_logs.c.browse_time, month)))
+
+
+def _segment_index(rows):
+    """段的编号 / 时间范围与 (用户, 商品) 浏览次数；rows 按 (浏览时间, 编号) 排好序"""
+    ids = [r['id'] for r in rows]
+    counts = Counter((r['user_id'], r['product_id']) for r in rows)
+    return {'min_id': min(ids), 'max_id': max(ids),
+            'min_time': rows[0]['browse_time'], 'max_time': rows[-1]['browse_time']}, counts
+
+
+def _write_counts(conn, segment_id, counts):
+    items = list(counts.items())
+    for i in range(0, len(items), 5000):
+        conn.execute(_counts.insert(), [{'segment_id': segment_id, 'user_id': user_id,
+                                         'product_id': product_id, 'views': views}
+                                        for (user_id, product_id), views in items[i:i + 5000]])
+
+
+def archive_month(conn, month, segment_rows):
+    """把明细表中某月的数据按 (浏览时间, 编号) 顺序压缩成归档段并移出，返回归档行数"""
+    # 已解冻的段的数据此刻都在明细表里，连同新数据重新压缩，旧段（及其计数）作废
+    conn.execute(_archive.delete().where(_archive.c.month == month, _archive.c.thawed_at.isnot(None)))
+    result = conn.execute(
+        select(*[_logs.c[c] for c in ARCHIVE_COLUMNS])
+        .where(_in_month(_logs.c.browse_time, month)).order_by(_logs.c.browse_time, _logs.c.id)
+        .execution_options(yield_per=segment_rows))
+    archived = 0
+    for rows in result.partitions():
+        payload, raw_bytes = _encode_segment(rows)
+        bounds, counts = _segment_index([row._mapping for row in rows])
+        segment_id = conn.execute(_archive.insert().values(
+            month=month, rows=len(rows), raw_bytes=raw_bytes, payload=payload,
+            created_at=datetime.now(), **bounds).returning(_archive.c.id)).scalar()
+        _write_counts(conn, segment_id, counts)
+        archived += len(rows)
+    _drop_hot_month(conn, month)
+    return archived
+
+
+def index_segments(conn):
+    """给升级前写入、还没有时间范围的归档段补上时间范围与 (用户, 商品) 计数，返回补齐的段数"""
+    segment_ids = conn.execute(select(_archive.c.id).where(_archive.c.min_time.is_(None))
+                               .order_by(_archive.c.id)).scalars().all()
+    for segment_id in segment_ids:
+        payload = conn.execute(select(_archive.c.payload).where(_archive.c.id == segment_id)).scalar()
+        rows = sorted(_decode_segment(payload), key=_position)
+        if not rows:
+            continue
+        bounds, counts = _segment_index(rows)
+        conn.execute(_archive.update().where(_archive.c.id == segment_id).values(**bounds))
+        conn.execute(_counts.delete().where(_counts.c.segment_id == segment_id))
+        _write_counts(conn, segment_id, counts)
+    return len(segment_ids)
+
+
+def hot_months_before(conn, cutoff):
+    """明细表中早于 cutoff 的各个有数据的月份"""
+    cutoff_dt = datetime.combine(cutoff, datetime.min.time())
+    oldest = conn.execute(select(func.min(_logs.c.browse_time))
+                          .where(_logs.c.browse_time < cutoff_dt)).scalar()
+    months = []
+    month = month_start(oldest) if oldest else cutoff
+    while month < cutoff:
+        if conn.execute(select(_logs.c.id).where(_in_month(_logs.c.browse_time, month)).limit(1)).first():
+            months.append(month)
+        month = add_months(month, 1)
+    return months
+
+
+def frozen_months(conn):
+    """有未解冻归档段的月份（数据只在归档里）"""
+    return sorted(conn.execute(
+        select(_archive.c.month).where(_archive.c.thawed_at.is_(None)).distinct()).scalars())
+
+
+def _existing_ids(conn, column, ids):
+    found = set()
+    ids = list(ids)
+    for i in range(0, len(ids), 5000):
+        found.update(conn.execute(select(column).where(column.in_(ids[i:i + 5000]))).scalars())
+    return found
+
+
+def _live_rows(conn, rows):
+    """去掉归档之后被删除的用户/商品的记录"""
+    users = _existing_ids(conn, User.id, {r['user_id'] for r in rows})
+    products = _existing_ids(conn, Product.id, {r['product_id'] for r in rows})
+    return [r for r in rows if r['user_id'] in users and r['product_id'] in products]
+
+
+def _segments(conn, months, start_dt=None, end_dt=None, users=None):
+    """
+    这些月份里与 [start_dt, end_dt) 时间范围重叠、未解冻的归档段 (id, min_time, max_time)；
+    users 为用户编号的子查询时只取含有这些用户记录的段
+    """
+    stmt = select(_archive.c.id, _archive.c.min_time, _archive.c.max_time)\
+        .where(_archive.c.month.in_(months), _archive.c.thawed_at.is_(None))
+    if start_dt is not None:
+        stmt = stmt.where(_archive.c.max_time >= start_dt)
+    if end_dt is not None:
+        stmt = stmt.where(_archive.c.min_time < end_dt)
+    if users is not None:
+        stmt = stmt.where(_archive.c.id.in_(
+            select(_counts.c.segment_id).where(_counts.c.user_id.in_(users))))
+    return conn.execute(stmt.order_by(_archive.c.month, _archive.c.id)).all()
+
+
+def _segment_rows(conn, segment_id, start_dt=None, end_dt=None, user_ids=None):
+    """解码一段，取出 [start_dt, end_dt) 内（且 user_id 在 user_ids 中）仍然有效的行；段已被解冻时返回空"""
+    payload = conn.execute(select(_archive.c.payload).where(
+        _archive.c.id == segment_id, _archive.c.thawed_at.is_(None))).scalar()
+    if payload is None:
+        # 期间被解冻，数据已在明细表里
+        return []
+    rows = [r for r in _decode_segment(payload)
+            if (start_dt is None or r['browse_time'] >= start_dt)
+            and (end_dt is None or r['browse_time'] < end_dt)
+            and (user_ids is None or r['user_id'] in user_ids)]
+    return _live_rows(conn, rows) if rows else []
+
+
+def thaw_month(conn, month):
+    """把某月的归档段逐段解回明细表，返回恢复的行数（别的进程已解冻的段跳过）"""
+    segment_ids = [s.id for s in _segments(conn, [month])]
+    if segment_ids and conn.dialect.name == 'postgresql':
+        _ensure_month_partition(conn, month)
+    restored = 0
+    for segment_id in segment_ids:
+        payload = conn.execute(
+            _archive.update().where(_archive.c.id == segment_id, _archive.c.thawed_at.is_(None))
+            .values(thawed_at=datetime.now()).returning(_archive.c.payload)).scalar()
+        if payload is None:
+            continue
+        rows = _live_rows(conn, list(_decode_segment(payload)))
+        for i in range(0, len(rows), 5000):
+            conn.execute(_logs.insert(), rows[i:i + 5000])
+        restored += len(rows)
+    return restored
+
+
+def frozen_segment_rows(conn):
+    """逐段产出未解冻归档段中的行（与明细表一致，跳过已删除用户/商品的记录），供重建汇总表使用"""
+    segment_ids = conn.execute(select(_archive.c.id).where(_archive.c.thawed_at.is_(None))
+                               .order_by(_archive.c.id)).scalars().all()
+    for segment_id in segment_ids:
+        yield _segment_rows(conn, segment_id)
+
+
+def frozen_user_rows(conn, user_ids):
+    """未解冻归档段中这些用户的行（按计数表只解码含有他们记录的段），删除用户时用来扣减汇总表"""
+    months = frozen_months(conn)
+    if not months:
+        return []
+    rows = []
+    for segment in _segments(conn, months, users=list(user_ids)):
+        rows.extend(_segment_rows(conn, segment.id, user_ids=set(user_ids)))
+    return rows
+
+
+# ---------- 查询窗口 ----------
+
+def _cached_frozen_months():
+    from .cache import dashboard_cache, ARCHIVE_KEY
+    months = dashboard_cache.get_or_compute(
+        ARCHIVE_KEY, lambda: [m.isoformat() for m in frozen_months(db.session.connection())])
+    return [date.fromisoformat(m) for m in months]
+
+
+def _overlapping(months, start_dt, end_dt):
+    return [m for m in months if (start_dt is None or _month_range(m)[1] > start_dt)
+            and (end_dt is None or _month_range(m)[0] < end_dt)]
+
+
+def resolve_window(start_dt, end_dt):
+    """
+    确定浏览记录查询实际覆盖的时间窗口，返回 (start_dt, archived_before, archived_months)，不写库。
+    未指定开始日期时窗口从最近一个已归档月份之后开始（archived_before 即该日期）；
+    指定的窗口覆盖到已归档月份时，archived_months 是这些月份，由调用方用 archived_logs 读出。
+    """
+    frozen = _cached_frozen_months()
+    if not frozen:
+        return start_dt, None, []
+    if start_dt is None:
+        boundary = add_months(frozen[-1], 1)
+        return datetime.combine(boundary, datetime.min.time()), boundary, []
+    return start_dt, None, _overlapping(frozen, start_dt, end_dt)
+
+
+def _user_set(conn, users):
+    return None if users is None else set(conn.execute(users).scalars())
+
+
+def archived_logs(conn, start_dt=None, end_dt=None, users=None, months=None):
+    """
+    只读地逐段解码与窗口重叠的未解冻归档段，产出 [start_dt, end_dt) 内（且用户在 users 子查询结果中）的行，
+    字段同 ARCHIVE_COLUMNS；同一时刻只解压一段，时间范围在窗口之外或没有匹配用户的段不解码，
+    已删除的用户/商品的记录跳过。months 为 None 时从归档表查出与窗口重叠的月份。
+    """
+    months = _overlapping(frozen_months(conn) if months is None else months, start_dt, end_dt)
+    if not months:
+        return
+    segments = _segments(conn, months, start_dt, end_dt, users)
+    user_ids = _user_set(conn, users) if segments else None
+    for segment in segments:
+        yield from _segment_rows(conn, segment.id, start_dt, end_dt, user_ids)
+
+
+def archived_page(conn, months, start_dt, end_dt, users, direction, key, n):
+    """
+    归档段中位于游标 key = (浏览时间, 编号) 之后的前 n 行（direction 为 'next' 时往更早翻，按位置倒序；
+    'prev' 时往更晚翻，按位置正序）。整段位于游标另一侧或窗口之外的段不解码；
+    其余段按时间范围由近及远逐段解码，已取满 n 行且下一段整段都排在第 n 行之后时停止，
+    因此每页通常只解码一两段，与翻到第几页无关。
+    """
+    newer = direction == 'next'
+    segments = _segments(conn, months, start_dt, end_dt, users)
+    if key is not None:
+        segments = [s for s in segments if (s.min_time <= key[0] if newer else s.max_time >= key[0])]
+    segments.sort(key=attrgetter('max_time' if newer else 'min_time'), reverse=newer)
+    user_ids = _user_set(conn, users) if segments else None
+    pick = heapq.nlargest if newer else heapq.nsmallest
+    best = []
+    for segment in segments:
+        if len(best) >= n:
+            edge = best[-1]['browse_time']
+            if (segment.max_time < edge) if newer else (segment.min_time > edge):
+                break
+        rows = _segment_rows(conn, segment.id, start_dt, end_dt, user_ids)
+        if key is not None:
+            rows = [r for r in rows if (_position(r) < key if newer else _position(r) > key)]
+        best = pick(n, best + rows, key=_position)
+    return best
+
+
+def archived_count(conn, months, start_dt, end_dt, users):
+    """
+    窗口内（属于 users 子查询中用户的）归档行数：整段落在窗口内的段直接对计数表求和
+    （与段内行一样排除已删除的用户/商品），只有跨窗口边界的段才解码
+    """
+    segments = _segments(conn, months, start_dt, end_dt, users)
+    inside = {s.id for s in segments if (start_dt is None or s.min_time >= start_dt)
+              and (end_dt is None or s.max_time < end_dt)}
+    counted = select(func.coalesce(func.sum(_counts.c.views), 0))\
+        .join(_archive, _archive.c.id == _counts.c.segment_id)\
+        .join(User, User.id == _counts.c.user_id).join(Product, Product.id == _counts.c.product_id)\
+        .where(_archive.c.month.in_(months), _archive.c.thawed_at.is_(None))
+    if start_dt is not None:
+        counted = counted.where(_archive.c.min_time >= start_dt)
+    if end_dt is not None:
+        counted = counted.where(_archive.c.max_time < end_dt)
+    if users is not None:
+        counted = counted.where(_counts.c.user_id.in_(users))
+    total = conn.execute(counted).scalar() if inside else 0
+    edges = [s.id for s in segments if s.id not in inside]
+    user_ids = _user_set(conn, users) if edges else None
+    for segment_id in edges:
+        total += len(_segment_rows(conn, segment_id, start_dt, end_dt, user_ids))
+    return total
+
+
+def archive_before(engine, cutoff, segment_rows=None, echo=None):
+    """归档 cutoff 之前的所有月份，每个月单独一个事务，返回 [(月份, 行数)]"""
+    from .cache import dashboard_cache
+    if segment_rows is None:
+        segment_rows = current_app.config['BROWSE_ARCHIVE_SEGMENT_ROWS']
+    with engine.connect() as conn:
+        months = hot_months_before(conn, cutoff)
+    done = []
+    for month in months:
+        with engine.begin() as conn:
+            rows = archive_month(conn, month, segment_rows)
+        done.append((month, rows))
+        if echo:
+            echo(f'✓ {month:%Y-%m}: 归档 {rows} 行')
+    if done:
+        # 可能在后台任务进程里执行：经缓存代数让各 worker 重新读取已归档的月份
+        with engine.begin() as conn:
+            if conn.dialect.name == 'postgresql':
+                # 新写入的段计数立即更新统计信息，按用户计数的查询才会走索引
+                conn.exec_driver_sql('ANALYZE browse_archive, browse_archive_counts')
+            dashboard_cache.clear_everywhere(conn)
+    return done
+
+
+def thaw_between(engine, start, end, echo=None):
+    """把 [start, end] 覆盖的已归档月份解冻回明细表，每个月单独一个事务，返回 [(月份, 行数)]"""
+    from .cache import dashboard_cache
+    with engine.connect() as conn:
+        months = [m for m in frozen_months(conn) if month_start(start) <= m <= month_start(end)]
+    done = []
+    for month in months:
+        with engine.begin() as conn:
+            rows = thaw_month(conn, month)
+        done.append((month, rows))
+        if echo:
+            echo(f'✓ {month:%Y-%m}: 解冻 {rows} 行')
+    if done:
+        # 可能在后台任务进程里执行：经缓存代数让各 worker 重新读取已归档的月份
+        with engine.begin() as conn:
+            dashboard_cache.clear_everywhere(conn)
+    return done
+
+
+partitions_cli = AppGroup('partitions', help='浏览记录分区与归档')
+
+
+@partitions_cli.command('ensure')
+def ensure_command():
+    """PostgreSQL：转换为分区表并补建月分区"""
+    with db.engine.begin() as conn:
+        if conn.dialect.name != 'postgresql':
+            click.echo('SQLite 不使用分区，无需处理')
+            return
+        created = ensure_partitions(conn)
+    click.echo(f'新建 {len(created)} 个分区' + (f'：{", ".join(created)}' if created else ''))
+
+
+@partitions_cli.command('archive')
+@click.option('--retention', type=int, default=None, help='保留的月数，默认 BROWSE_RETENTION_MONTHS')
+@click.option('--vacuum', is_flag=True, help='SQLite：归档后 VACUUM 回收空间')
+def archive_command(retention, vacuum):
+    """把保留期之前的月份压缩归档并移出明细表"""
+    cutoff = archive_cutoff(retention=retention)
+    click.echo(f'归档 {cutoff:%Y-%m} 之前的浏览记录')
+    done = archive_before(db.engine, cutoff, echo=click.echo)
+    if not done:
+        click.echo('没有需要归档的月份')
+        return
+    if vacuum and db.engine.dialect.name == 'sqlite':
+        with db.engine.connect() as conn:
+            conn.exec_driver_sql('VACUUM')
+    click.echo(f'共归档 {len(done)} 个月，{sum(rows for _, rows in done)} 行')
+
+
+@partitions_cli.command('thaw')
+@click.option('--start', required=True, help='开始月份 YYYY-MM')
+@click.option('--end', default=None, help='结束月份 YYYY-MM（含），默认与开始月份相同')
+def thaw_command(start, end):
+    """把已归档的月份解冻回明细表（下次归档时再压缩回去）"""
+    try:
+        start = parse_month(start)
+        end = parse_month(end) if end else start
+    except ValueError:
+        raise click.BadParameter('月份格式应为 YYYY-MM')
+    done = thaw_between(db.engine, start, end, echo=click.echo)
+    if not done:
+        click.echo('这段时间没有已归档的月份')
+        return
+    click.echo(f'共解冻 {len(done)} 个月，{sum(rows for _, rows in done)} 行')
+
+
+@partitions_cli.command('status')
+def status_command():
+    """列出分区与归档段"""
+    with db.engine.connect() as conn:
+        if conn.dialect.name == 'postgresql':
+            for name, rows in list_partitions(conn):
+                click.echo(f'{name}: 约 {rows} 行')
+        segments = conn.execute(
+            select(_archive.c.month, func.count(), func.sum(_archive.c.rows),
+                   func.sum(_archive.c.raw_bytes), func.sum(func.length(_archive.c.payload)),
+                   func.count(_archive.c.thawed_at))
+            .group_by(_archive.c.month).order_by(_archive.c.month)).all()
+    for month, count, rows, raw_bytes, stored, thawed in segments:
+        ratio = stored / raw_bytes if raw_bytes else 0
+        state = '已解冻' if thawed == count else '已归档'
+        click.echo(f'{month:%Y-%m} [{state}] {count} 段 {rows} 行，'
+                   f'{raw_bytes / 1024:,.0f} KB → {stored / 1024:,.0f} KB（{ratio:.0%}）')
+    if not segments:
+        click.echo('暂无归档')
@@ -0,0 +1,309 @@
+"""
+商品批量导入
+
+从 CSV 流逐行读取商品（表头为列名：id,name,reg_date,category,model,unit,price,stock，
+除 name 外都可省略），按与单个商品保存相同的规则校验，合法的行按块写入：
+- 带 id 的行按主键 upsert（INSERT ... ON CONFLICT (id) DO UPDATE），已有商品整行更新，
+  登记日期为空时保留原值；
+- 不带 id 的行作为新商品插入。
+每块单独一个事务；某块写入失败时逐行重试，只有出错的行进入错误报告。
+写入绕过 ORM，汇总表中的品类、商品目录版本、看板缓存与列式快照在这里同步处理；
+搜索索引（SQLite 触发器 / PostgreSQL GIN）随主表自动更新。
+"""
+import csv
+import io
+import math
+import time
+from datetime import date, datetime
+from functools import lru_cache
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import exc, select, text, update
+
+from . import db
+from .catalog import bump_version
+from .models import Product, SalesDaily
+
+COLUMNS = ('id', 'name', 'reg_date', 'category', 'model', 'unit', 'price', 'stock')
+# upsert 时整列覆盖的字段（登记日期单独处理）
+UPDATE_COLUMNS = ('name', 'category', 'model', 'unit', 'price', 'stock')
+
+MAX_PRICE = 10 ** 8 # Numeric(10, 2)
+MAX_STOCK = 2 ** 31 - 1
+SQLITE_MAX_PARAMS = 32000 # SQLite 3.32+ 单条语句最多 32766 个参数
+
+_STAGE_TABLE = 'product_import_stage'
+
+_products = Product.__table__
+_LENGTHS = {name: _products.c[name].type.length for name in ('name', 'category', 'model', 'unit')}
+
+
+def parse_product(values):
+    """
+    校验一个商品的原始字段（字符串），返回可写入的字典，不合法时抛 ValueError。
+    规则：名称必填；单价、库存为数字（留空为 0）；登记日期为 YYYY-MM-DD（可留空）。
+    """
+    name = (values.get('name') or '').strip()
+    if not name:
+        raise ValueError('商品名称不能为空')
+    price_str = (values.get('price') or '').strip()
+    stock_str = (values.get('stock') or '').strip()
+    try:
+        price = float(price_str) if price_str else 0
+        stock = int(stock_str) if stock_str else 0
+    except ValueError:
+        raise ValueError('价格或库存格式错误')
+    if not math.isfinite(price) or not -MAX_PRICE < price < MAX_PRICE or abs(stock) > MAX_STOCK:
+        raise ValueError('价格或库存超出范围')
+    reg_date = None
+    reg_date_str = (values.get('reg_date') or '').strip()
+    if reg_date_str:
+        try:
+            reg_date = datetime.strptime(reg_date_str, '%Y-%m-%d').date()
+        except ValueError:
+            raise ValueError('登记日期格式错误，应为 YYYY-MM-DD')
+    product = {'name': name, 'price': round(price, 2), 'stock': stock, 'reg_date': reg_date}
+    for key in ('category', 'model', 'unit'):
+        product[key] = (values.get(key) or '').strip() or None
+    for key, length in _LENGTHS.items():
+        if product[key] and len(product[key]) > length:
+            raise ValueError(f'{key} 超过 {length} 个字符')
+    return product
+
+
+def _parse_id(value):
+    value = (value or '').strip()
+    if not value:
+        return None
+    try:
+        product_id = int(value)
+    except ValueError:
+        raise ValueError('id 不是整数')
+    if not 0 < product_id <= MAX_STOCK:
+        raise ValueError('id 超出范围')
+    return product_id
+
+
+_UPSERT_SQL = (' ON CONFLICT (id) DO UPDATE SET '
+               + ', '.join(f'{c} = excluded.{c}' for c in UPDATE_COLUMNS)
+               + ', reg_date = coalesce(excluded.reg_date, products.reg_date)')
+
+
+@lru_cache(maxsize=16)
+def _sqlite_values_sql(columns, n, upsert):
+    row = '(' + ', '.join('?' * len(columns)) + ')'
+    sql = f'INSERT INTO products ({", ".join(columns)}) VALUES ' + ', '.join([row] * n)
+    return sql + _UPSERT_SQL if upsert else sql
+
+
+def _copy_rows(conn, rows, upsert):
+    """PostgreSQL：COPY 到临时表，再用一条 INSERT ... SELECT 写入商品表"""
+    col_list = ', '.join(rows[0])
+    buf = io.StringIO()
+    csv.writer(buf).writerows(row.values() for row in rows)
+    buf.seek(0)
+    conn.exec_driver_sql(f'CREATE TEMP TABLE IF NOT EXISTS {_STAGE_TABLE} ON COMMIT DELETE ROWS AS '
+                         f'SELECT {", ".join(COLUMNS)} FROM products WITH NO DATA')
+    with conn.connection.cursor() as cur:
+        cur.copy_expert(f'COPY {_STAGE_TABLE} ({col_list}) FROM STDIN WITH (FORMAT csv)', buf)
+    conn.exec_driver_sql(f'INSERT INTO products ({col_list}) SELECT {col_list} FROM {_STAGE_TABLE}'
+                         + (_UPSERT_SQL if upsert else ''))
+    conn.exec_driver_sql(f'TRUNCATE {_STAGE_TABLE}')
+
+
+def _write_rows(conn, rows, upsert):
+    """写入一批行；upsert 为真时按 id 冲突更新（登记日期为空时保留原值）"""
+    if conn.dialect.name == 'postgresql':
+        _copy_rows(conn, rows, upsert)
+        return
+    # 商品表上有 FTS5 触发器，FTS5 在每条语句结束时把待写的索引数据刷成一个新段；
+    # executemany 逐行执行会每行刷一次并不断合并段，所以改为一条语句写入多行。
+    # 多行语句由 SQLAlchemy 编译过慢，这里按行数缓存拼好的 SQL
+    columns = tuple(rows[0])
+    step = SQLITE_MAX_PARAMS // len(columns)
+    for i in range(0, len(rows), step):
+        part = rows[i:i + step]
+        params = [value.isoformat() if isinstance(value, date) else value
+                  for row in part for value in row.values()]
+        conn.exec_driver_sql(_sqlite_values_sql(columns, len(part), upsert), tuple(params))
+
+
+class ImportReport:
+    """导入结果：计数与逐行错误（最多保留 max_errors 条，error_count 为总数）"""
+
+    def __init__(self, max_errors=1000):
+        self.max_errors = max_errors
+        self.rows = 0
+        self.inserted = 0
+        self.updated = 0
+        self.error_count = 0
+        self.errors = []
+        self.seconds = 0.0
+
+    def error(self, line, message):
+        self.error_count += 1
+        if self.max_errors is None or len(self.errors) < self.max_errors:
+            self.errors.append({'line': line, 'error': message})
+
+    def to_dict(self):
+        return {
+            'rows': self.rows,
+            'inserted': self.inserted,
+            'updated': self.updated,
+            'error_count': self.error_count,
+            'errors': self.errors,
+            'seconds': round(self.seconds, 3),
+            'rows_per_second': round(self.rows / self.seconds) if self.seconds else 0,
+        }
+
+
+def _write(conn, rows):
+    """在当前事务内写入一块已校验的行，返回 (新增数, 更新数)"""
+    today = date.today()
+    new_rows, keyed = [], {}
+    for row in rows:
+        if row['id'] is None:
+            new_rows.append({k: v for k, v in row.items() if k not in ('id', 'line')})
+        else:
+            # 同一块内重复的 id 以最后一行为准（同一语句不能两次更新同一行）
+            keyed[row['id']] = {k: v for k, v in row.items() if k != 'line'}
+    for row in new_rows:
+        row['reg_date'] = row['reg_date'] or today
+
+    existing = {}
+    if keyed:
+        existing = dict(conn.execute(
+            select(_products.c.id, _products.c.category).where(_products.c.id.in_(keyed))).all())
+    if new_rows:
+        _write_rows(conn, new_rows, upsert=False)
+    if keyed:
+        for product_id, row in keyed.items():
+            if row['reg_date'] is None and product_id not in existing:
+                row['reg_date'] = today
+        # 按 id 升序写：FTS5 的待写数据按 rowid 递增累积，遇到更小的 rowid 就要先刷盘
+        _write_rows(conn, [keyed[pid] for pid in sorted(keyed)], upsert=True)
+        # 品类变化的商品同步汇总表里的品类
+        recategorized = [pid for pid, category in existing.items() if keyed[pid]['category'] != category]
+        if recategorized:
+            conn.execute(update(SalesDaily).where(SalesDaily.product_id.in_(recategorized)).values(
+                category=select(_products.c.category)
+                .where(_products.c.id == SalesDaily.product_id).scalar_subquery()))
+        # 更新过的商品在各 worker 的目录缓存中失效
+        bump_version(conn, existing)
+    return len(new_rows) + len(keyed) - len(existing), len(existing)
+
+
+def _flush(engine, rows, report):
+    try:
+        with engine.begin() as conn:
+            inserted, updated = _write(conn, rows)
+    except exc.DBAPIError:
+        # 整块失败时逐行重试，找出出错的行
+        inserted = updated = 0
+        for row in rows:
+            try:
+                with engine.begin() as conn:
+                    i, u = _write(conn, [row])
+            except exc.DBAPIError as e:
+                report.error(row['line'], f'写入失败: {str(e.orig).strip().splitlines()[0]}')
+                continue
+            inserted += i
+            updated += u
+    report.inserted += inserted
+    report.updated += updated
+
+
+def import_products(stream, chunk_size=5000, max_errors=1000, progress=None):
+    """
+    从 CSV 文本流导入商品，返回 ImportReport。
+    表头缺少 name 列或含未知列时抛 ValueError；progress(已处理行数) 在每块写入后调用。
+    """
+    from .analytics import analytics
+    from .cache import dashboard_cache, SALES_KEY, BROWSE_KEY, CATALOG_KEY
+    from .replicas import replica_router
+    started = time.perf_counter()
+    engine = db.engine
+    report = ImportReport(max_errors)
+    reader = csv.reader(stream)
+    header = [h.strip().lower() for h in next(reader, [])]
+    unknown = [h for h in header if h not in COLUMNS]
+    if unknown:
+        raise ValueError(f'未知的列: {", ".join(unknown)}（可用列: {", ".join(COLUMNS)}）')
+    if 'name' not in header:
+        raise ValueError('缺少 name 列')
+    index = list(enumerate(header))
+    explicit_ids = False
+
+    chunk = []
+    for record in reader:
+        if not any(field.strip() for field in record):
+            continue
+        report.rows += 1
+        values = {name: record[i] if i < len(record) else '' for i, name in index}
+        try:
+            row = parse_product(values)
+            row['id'] = _parse_id(values.get('id'))
+        except ValueError as e:
+            report.error(reader.line_num, str(e))
+            continue
+        row['line'] = reader.line_num
+        explicit_ids = explicit_ids or row['id'] is not None
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            _flush(engine, chunk, report)
+            chunk = []
+            if progress is not None:
+                progress(report.rows)
+    if chunk:
+        _flush(engine, chunk, report)
+
+    if report.inserted or report.updated:
+        if explicit_ids and engine.dialect.name == 'postgresql':
+            # 显式写入的 id 不经过序列，把序列推到当前最大 id 之后
+            with engine.begin() as conn:
+                conn.execute(text("SELECT setval(pg_get_serial_sequence('products', 'id'), "
+                                  "GREATEST((SELECT max(id) FROM products), 1))"))
+        dashboard_cache.invalidate(SALES_KEY, BROWSE_KEY, CATALOG_KEY)
+        replica_router.mark_write()
+        if report.updated:
+            analytics.mark_stale()
+    report.seconds = time.perf_counter() - started
+    return report
+
+
+def text_stream(binary):
+    """上传的二进制流 -> CSV 文本流（兼容带 BOM 的 UTF-8）"""
+    return io.TextIOWrapper(binary, encoding='utf-8-sig', newline='')
+
+
+products_cli = AppGroup('products', help='商品批量导入')
+
+
+@products_cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--chunk-size', default=5000, show_default=True, help='每个事务写入的行数')
+@click.option('--report', 'report_path', type=click.Path(dir_okay=False), default=None,
+              help='把出错的行写入该 CSV 文件')
+def import_command(path, chunk_size, report_path):
+    """从 CSV 文件导入或更新商品"""
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        try:
+            report = import_products(f, chunk_size=chunk_size, max_errors=None if report_path else 20,
+                                     progress=lambda n: click.echo(f'  已处理 {n} 行', err=True))
+        except ValueError as e:
+            raise click.ClickException(str(e))
+    click.echo(f'共 {report.rows} 行：新增 {report.inserted}，更新 {report.updated}，'
+               f'出错 {report.error_count}；用时 {report.seconds:.1f} 秒，'
+               f'{report.rows / report.seconds if report.seconds else 0:,.0f} 行/秒')
+    if report_path:
+        with open(report_path, 'w', encoding='utf-8-sig', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['line', 'error'])
+            writer.writerows((e['line'], e['error']) for e in report.errors)
+        click.echo(f'错误报告: {report_path}')
+    else:
+        for e in report.errors:
+            click.echo(f'  第 {e["line"]} 行: {e["error"]}')
+        if report.error_count > len(report.errors):
+            click.echo(f'  ……另有 {report.error_count - len(report.errors)} 行出错，用 --report 导出全部')
@@ -0,0 +1,52 @@
+"""
+商品批量删除
+
+浏览记录与销售记录的外键都声明了 ON DELETE CASCADE（SQLite 连接上开启了 foreign_keys），
+删除商品时由数据库级联删除明细，ORM 关系也设为 passive_deletes，不再把明细逐条载入会话。
+批量删除按 id 分块，每块只有三条集合语句：删商品（RETURNING 实际删除的 id）、
+删这些商品的销售日汇总行和浏览日汇总行，再删它们的独立访客草图，整批在一个事务内完成；
+有商品被删除时清空转化报表缓存，并记下商品目录版本。
+"""
+from sqlalchemy import delete
+
+from . import db
+from .models import Product, SalesDaily, BrowseDaily
+from .catalog import bump_version
+from .conversion import clear_reports
+from .sketches import drop_products
+
+DELETE_CHUNK = 5000 # 每条语句的 id 个数（SQLite 单条语句的参数个数有限）
+
+
+def delete_products(conn, ids):
+    """在当前事务内删除一批商品及其明细、汇总行和草图，返回实际删除的 id 列表"""
+    ids = sorted(set(ids))
+    deleted = []
+    for i in range(0, len(ids), DELETE_CHUNK):
+        chunk = ids[i:i + DELETE_CHUNK]
+        removed = conn.execute(
+            delete(Product).where(Product.id.in_(chunk)).returning(Product.id)).scalars().all()
+        if not removed:
+            continue
+        conn.execute(delete(SalesDaily).where(SalesDaily.product_id.in_(removed)))
+        conn.execute(delete(BrowseDaily).where(BrowseDaily.product_id.in_(removed)))
+        drop_products(conn, removed)
+        deleted.extend(removed)
+    if deleted:
+        clear_reports(conn)
+        bump_version(conn, deleted)
+    return deleted
+
+
+def submit_delete(ids):
+    """单独开一个事务批量删除商品，提交后失效看板缓存与列式快照"""
+    from .analytics import analytics
+    from .cache import dashboard_cache, SALES_KEY, BROWSE_KEY, CATALOG_KEY
+    from .replicas import replica_router
+    with db.engine.begin() as conn:
+        deleted = delete_products(conn, ids)
+    if deleted:
+        dashboard_cache.invalidate(SALES_KEY, BROWSE_KEY, CATALOG_KEY)
+        analytics.mark_stale()
+        replica_router.mark_write()
+    return deleted
@@ -0,0 +1,72 @@
+"""
+SQL 语句数守卫
+
+列表页按行访问关联对象时会触发 N+1 查询（50 行一页最多多出 100 条 SELECT）。
+`flask queries check` 请求各列表路由，统计每个请求发出的 SQL 条数，
+超过 QUERY_BUDGETS 中的上限即以非零状态退出。
+"""
+import sys
+from contextlib import contextmanager
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import event
+
+from . import db
+
+# 路由 -> 单次请求允许的最多 SQL 条数
+QUERY_BUDGETS = {
+    '/products': 2,
+    '/sales': 2,
+    '/sales?param_keyword=手机': 2,
+    '/browse_logs': 2,
+    '/browse_logs?start_date=2025-01-01&end_date=2025-12-31': 2,
+    '/browse_logs?username=王': 2,
+}
+
+
+@contextmanager
+def count_queries(engine):
+    """统计 with 块内在 engine 上执行的语句，产出语句列表"""
+    statements = []
+
+    def _record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', _record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', _record)
+
+
+def check_query_budgets(app, budgets=None):
+    """请求每个路由两次（第一次预热进程内缓存），返回 [(url, 实际条数, 上限)] 超标列表"""
+    budgets = budgets or QUERY_BUDGETS
+    over = []
+    with app.app_context():
+        client = app.test_client()
+        for url, budget in budgets.items():
+            client.get(url)
+            with count_queries(db.engine) as statements:
+                response = client.get(url)
+            if response.status_code != 200:
+                raise RuntimeError(f'{url} 返回 {response.status_code}')
+            if len(statements) > budget:
+                over.append((url, len(statements), budget))
+    return over
+
+
+queries_cli = AppGroup('queries', help='SQL 语句数检查')
+
+
+@queries_cli.command('check')
+def check_command():
+    """检查列表路由的 SQL 条数是否超出预算"""
+    from flask import current_app
+    over = check_query_budgets(current_app._get_current_object())
+    for url, count, budget in over:
+        click.echo(f'✗ {url}: {count} 条 SQL（上限 {budget}）')
+    if over:
+        sys.exit(1)
+    click.echo('所有列表路由均在 SQL 条数预算内')
@@ -0,0 +1,225 @@
+"""
+只读副本路由
+
+配置了 READ_REPLICA_URLS 时，看板、销售、浏览记录、商品列表等只读路由的查询
+按请求轮询分发到各个副本；同一请求内的写入（flush、UPDATE/INSERT/DELETE）始终走主库，
+之后本请求的读取也改走主库。发生过写入的客户端会拿到一个短期 cookie，
+REPLICA_READ_YOUR_WRITES 秒内它的读取都走主库，刷新页面能看到自己刚写入的数据。
+副本定期做健康检查（连接与复制延迟），不可用时暂停使用一段时间并回落到主库；
+请求中途副本连接断开或连不上时，出错的那条读取在主库上重试一次，本请求之后的读取也改走主库；
+语句超时等查询本身的错误不触发切换。
+没有配置副本时路由层不起作用，所有查询照常走主库。
+"""
+import itertools
+import logging
+import threading
+import time
+
+from flask import g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import Select, TextClause, create_engine, event, exc, text
+
+logger = logging.getLogger(__name__)
+
+# 查询可以走副本的端点
+READ_ENDPOINTS = frozenset({
+    'main.dashboard',
+    'main.products_manage',
+    'main.sales_query',
+    'main.sales_export',
+    'main.browse_logs',
+    'main.browse_logs_export',
+})
+
+PIN_COOKIE = 'db_primary_until'
+
+# 0 表示没有延迟：不是备库，或者已回放完收到的全部 WAL
+_LAG_SQL = text(
+    'SELECT CASE WHEN NOT pg_is_in_recovery() '
+    'OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+    'ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END')
+
+
+def _is_read(clause):
+    if clause is None:
+        # Session.connection()：只读路由里用来查方言、做 EXPLAIN 等；写入需显式要主库连接
+        return True
+    if isinstance(clause, Select):
+        return clause._for_update_arg is None
+    if isinstance(clause, TextClause):
+        return clause.text.lstrip()[:6].upper() == 'SELECT'
+    return False
+
+
+class Replica:
+    """一个副本的引擎与健康状态"""
+
+    __slots__ = ('url', 'engine', 'checked_at', 'down_until')
+
+    def __init__(self, url, engine):
+        self.url = url
+        self.engine = engine
+        self.checked_at = 0.0
+        self.down_until = 0.0
+
+    @property
+    def name(self):
+        return self.engine.url.render_as_string(hide_password=True)
+
+
+class ReplicaRouter:
+    """选择副本、记录写入并维护副本健康状态"""
+
+    def __init__(self):
+        self.replicas = []
+        self.read_your_writes = 5.0
+        self.health_interval = 10.0
+        self.retry_after = 30.0
+        self.max_lag = 30.0
+        self._lock = threading.Lock()
+        self._cycle = None
+
+    def init_app(self, app):
+        config = app.config
+        self.read_your_writes = config.get('REPLICA_READ_YOUR_WRITES', self.read_your_writes)
+        self.health_interval = config.get('REPLICA_HEALTH_INTERVAL', self.health_interval)
+        self.retry_after = config.get('REPLICA_RETRY_AFTER', self.retry_after)
+        self.max_lag = config.get('REPLICA_MAX_LAG', self.max_lag)
+        self.set_replicas(config.get('READ_REPLICA_URLS', []), config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+        # 钩子总是注册：没有副本时什么也不做，之后再用 set_replicas 加副本也能生效
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        app.extensions['replica_router'] = self
+
+    def set_replicas(self, urls, options=None):
+        """替换副本列表，原有副本的连接池随之释放"""
+        for replica in self.replicas:
+            replica.engine.dispose()
+        replicas = [Replica(url, create_engine(url, **(options or {}))) for url in urls]
+        for replica in replicas:
+            event.listen(replica.engine, 'handle_error', self._on_error(replica))
+        with self._lock:
+            self.replicas = replicas
+            self._cycle = itertools.cycle(replicas)
+
+    def _on_error(self, replica):
+        def handle_error(context):
+            # 只有连接断开或连不上才算副本故障；语句超时等查询本身的错误照常抛出，
+            # 否则一条慢查询会让健康的副本停用，并在主库上再执行一遍
+            if context.is_disconnect or context.connection is None:
+                self._mark_down(replica, context.original_exception)
+                # 本请求改读主库，由 RoutingSession 在主库上重试出错的查询
+                if has_request_context() and g.get('db_replica') is replica.engine:
+                    g.db_replica = None
+                    g.db_failed_over = True
+        return handle_error
+
+    def _mark_down(self, replica, reason):
+        if replica.down_until <= time.monotonic():
+            logger.warning('只读副本 %s 不可用，暂停使用 %.0f 秒: %s',
+                           replica.name, self.retry_after, reason)
+        replica.down_until = time.monotonic() + self.retry_after
+
+    def _healthy(self, replica):
+        now = time.monotonic()
+        if replica.down_until > now:
+            return False
+        if now - replica.checked_at < self.health_interval:
+            return True
+        replica.checked_at = now
+        try:
+            with replica.engine.connect() as conn:
+                lag = conn.execute(_LAG_SQL).scalar() if conn.dialect.name == 'postgresql' else 0
+        except Exception as e:
+            self._mark_down(replica, e)
+            return False
+        if lag and lag > self.max_lag:
+            self._mark_down(replica, f'复制延迟 {lag:.1f} 秒')
+            return False
+        return True
+
+    def pick(self):
+        """轮询下一个健康的副本，都不可用时返回 None"""
+        for _ in range(len(self.replicas)):
+            with self._lock:
+                replica = next(self._cycle)
+            if self._healthy(replica):
+                return replica
+        return None
+
+    def _start_request(self):
+        g.db_replica = None
+        if not self.replicas or request.endpoint not in READ_ENDPOINTS:
+            return
+        try:
+            pinned = float(request.cookies.get(PIN_COOKIE, 0)) > time.time()
+        except ValueError:
+            pinned = False
+        if not pinned:
+            replica = self.pick()
+            g.db_replica = replica.engine if replica else None
+
+    def _finish_request(self, response):
+        if g.get('db_wrote'):
+            response.set_cookie(PIN_COOKIE, str(int(time.time() + self.read_your_writes) + 1),
+                                max_age=int(self.read_your_writes) + 1, httponly=True, samesite='Lax')
+        return response
+
+    def mark_write(self):
+        """本请求之后的读取改走主库，并让客户端在读己之写窗口内继续读主库"""
+        if self.replicas and has_request_context():
+            g.db_replica = None
+            g.db_wrote = True
+
+    def bind_for(self, clause, flushing):
+        """当前请求应使用的副本引擎；应走主库时返回 None"""
+        if not self.replicas or not has_request_context():
+            return None
+        if flushing or not _is_read(clause):
+            self.mark_write()
+            return None
+        return g.get('db_replica')
+
+    def failed_over(self):
+        """刚才的错误是否来自本请求所用的副本（已改走主库，可以重试）"""
+        return has_request_context() and g.pop('db_failed_over', False)
+
+
+replica_router = ReplicaRouter()
+
+
+class RoutingSession(Session):
+    """只读路由的查询交给副本，其余按 Flask-SQLAlchemy 的默认规则选择引擎"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            replica = replica_router.bind_for(clause, self._flushing)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _retry_on_primary(self, method, *args, **kwargs):
+        try:
+            return method(*args, **kwargs)
+        except exc.DBAPIError:
+            if not replica_router.failed_over():
+                raise
+        # 副本上的事务已不可用：回滚后 get_bind 会选主库
+        self.rollback()
+        return method(*args, **kwargs)
+
+    def execute(self, *args, **kwargs):
+        return self._retry_on_primary(super().execute, *args, **kwargs)
+
+    def scalar(self, *args, **kwargs):
+        return self._retry_on_primary(super().scalar, *args, **kwargs)
+
+    def scalars(self, *args, **kwargs):
+        return self._retry_on_primary(super().scalars, *args, **kwargs)
+
+
+def primary_connection(session):
+    """在会话当前事务中取主库连接（用于写入），并按写入处理后续读取"""
+    from . import db
+    replica_router.mark_write()
+    return session.connection(bind_arguments={'bind': db.engine})
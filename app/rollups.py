@@ -0,0 +1,216 @@
+"""
+看板汇总表维护
+
+销售、浏览记录写入时在同一事务内把增量累加到 sales_daily / browse_daily，
+看板只读汇总表，耗时只与天数有关，与明细行数无关。
+独立访客/买家的基数草图（sketches.py）在同样的位置随写入更新，并随汇总表一起清空、重建。
+批量写入（绕过 ORM 的 Core 语句）请直接调用 apply_sales / apply_browse
+以及 sketches.record_sales / record_browse，历史数据用 `flask rollups rebuild` 回填。
+"""
+from collections import defaultdict
+from datetime import datetime
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import event, func, select, cast
+from sqlalchemy.dialects import postgresql, sqlite
+
+from . import db
+from .models import Product, User, Sale, BrowseLog, SalesDaily, BrowseDaily
+from .conversion import clear_reports
+from .sketches import clear_sketches, drop_products, rebuild_sketches, record_browse, record_sales
+
+
+def _as_day(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, str):
+        return datetime.strptime(value[:10], '%Y-%m-%d').date()
+    return value
+
+
+def _insert(conn, table):
+    if conn.dialect.name == 'postgresql':
+        return postgresql.insert(table)
+    return sqlite.insert(table)
+
+
+def _upsert_add(conn, table, keys, measures, rows):
+    """按主键 upsert，冲突时把 measures 列累加"""
+    if not rows:
+        return
+    stmt = _insert(conn, table)
+    set_ = {m: table.c[m] + stmt.excluded[m] for m in measures}
+    if 'category' in table.c:
+        set_['category'] = stmt.excluded.category
+    conn.execute(stmt.on_conflict_do_update(index_elements=keys, set_=set_), rows)
+
+
+def apply_sales(conn, sales, sign=1):
+    """把一批销售记录（dict 或 Sale 对象）累加到 sales_daily，sign=-1 表示扣减"""
+    acc = defaultdict(lambda: [0, 0, 0])
+    categories = {}
+    for s in sales:
+        get = s.get if isinstance(s, dict) else lambda k, s=s: getattr(s, k)
+        key = (_as_day(get('sale_date')), get('product_id'), get('payment_method') or '')
+        acc[key][0] += (get('total_amount') or 0) * sign
+        acc[key][1] += (get('quantity') or 0) * sign
+        acc[key][2] += sign
+        categories[get('product_id')] = None
+    if not acc:
+        return
+    # 品类冗余到汇总表，避免看板再去 join 商品表
+    rows = conn.execute(
+        select(Product.id, Product.category).where(Product.id.in_(categories))
+    ).all()
+    categories.update({pid: cat for pid, cat in rows})
+    _upsert_add(conn, SalesDaily.__table__, ['day', 'product_id', 'payment_method'],
+                ['amount', 'quantity', 'orders'],
+                [{'day': day, 'product_id': pid, 'payment_method': pm,
+                  'category': categories[pid],
+                  'amount': v[0], 'quantity': v[1], 'orders': v[2]}
+                 for (day, pid, pm), v in acc.items()])
+
+
+def apply_browse(conn, logs, sign=1):
+    """把一批浏览记录（dict 或 BrowseLog 对象）累加到 browse_daily"""
+    acc = defaultdict(int)
+    for log in logs:
+        get = log.get if isinstance(log, dict) else lambda k, log=log: getattr(log, k)
+        acc[(_as_day(get('browse_time')), get('product_id'), get('platform') or '')] += sign
+    _upsert_add(conn, BrowseDaily.__table__, ['day', 'product_id', 'platform'], ['views'],
+                [{'day': day, 'product_id': pid, 'platform': pf, 'views': n}
+                 for (day, pid, pf), n in acc.items()])
+
+
+def clear_rollups(conn):
+    conn.execute(SalesDaily.__table__.delete())
+    conn.execute(BrowseDaily.__table__.delete())
+    clear_sketches(conn)
+    clear_reports(conn)
+
+
+def _day_expr(conn, column):
+    if conn.dialect.name == 'postgresql':
+        return cast(column, db.Date)
+    return func.date(column)
+
+
+def rebuild_rollups(conn):
+    """清空并从明细表（以及浏览记录的归档段）重新聚合汇总表与基数草图"""
+    from .partitions import frozen_segment_rows
+    clear_rollups(conn)
+    sale_day = _day_expr(conn, Sale.sale_date)
+    conn.execute(SalesDaily.__table__.insert().from_select(
+        ['day', 'product_id', 'payment_method', 'category', 'amount', 'quantity', 'orders'],
+        select(sale_day, Sale.product_id, func.coalesce(Sale.payment_method, ''),
+               func.max(Product.category), func.sum(Sale.total_amount),
+               func.sum(Sale.quantity), func.count(Sale.id))
+        .join(Product, Product.id == Sale.product_id)
+        .group_by(sale_day, Sale.product_id, func.coalesce(Sale.payment_method, ''))
+    ))
+    browse_day = _day_expr(conn, BrowseLog.browse_time)
+    conn.execute(BrowseDaily.__table__.insert().from_select(
+        ['day', 'product_id', 'platform', 'views'],
+        select(browse_day, BrowseLog.product_id, func.coalesce(BrowseLog.platform, ''),
+               func.count(BrowseLog.id))
+        .group_by(browse_day, BrowseLog.product_id, func.coalesce(BrowseLog.platform, ''))
+    ))
+    # 已归档的行不在明细表里，逐段解压后累加
+    for rows in frozen_segment_rows(conn):
+        apply_browse(conn, rows)
+    rebuild_sketches(conn)
+
+
+def subtract_users(conn, user_ids):
+    """
+    从汇总表扣减这些用户的全部明细（在数据库级联删除明细之前调用），并清空转化报表缓存；
+    归档段里这些用户的浏览记录一并扣减，与重建汇总表时跳过已删除用户的记录一致
+    """
+    from .partitions import frozen_user_rows
+    clear_reports(conn)
+    sale_day = _day_expr(conn, Sale.sale_date)
+    sales = conn.execute(
+        select(sale_day, Sale.product_id, func.coalesce(Sale.payment_method, ''),
+               func.max(Product.category), func.sum(Sale.total_amount),
+               func.sum(Sale.quantity), func.count(Sale.id))
+        .join(Product, Product.id == Sale.product_id)
+        .where(Sale.user_id.in_(user_ids))
+        .group_by(sale_day, Sale.product_id, func.coalesce(Sale.payment_method, ''))
+    ).all()
+    _upsert_add(conn, SalesDaily.__table__, ['day', 'product_id', 'payment_method'],
+                ['amount', 'quantity', 'orders'],
+                [{'day': _as_day(day), 'product_id': pid, 'payment_method': pm, 'category': category,
+                  'amount': -amount, 'quantity': -quantity, 'orders': -orders}
+                 for day, pid, pm, category, amount, quantity, orders in sales])
+    browse_day = _day_expr(conn, BrowseLog.browse_time)
+    logs = conn.execute(
+        select(browse_day, BrowseLog.product_id, func.coalesce(BrowseLog.platform, ''),
+               func.count(BrowseLog.id))
+        .where(BrowseLog.user_id.in_(user_ids))
+        .group_by(browse_day, BrowseLog.product_id, func.coalesce(BrowseLog.platform, ''))
+    ).all()
+    _upsert_add(conn, BrowseDaily.__table__, ['day', 'product_id', 'platform'], ['views'],
+                [{'day': _as_day(day), 'product_id': pid, 'platform': pf, 'views': -views}
+                 for day, pid, pf, views in logs])
+    apply_browse(conn, frozen_user_rows(conn, user_ids), sign=-1)
+
+
+@event.listens_for(db.session, 'before_flush')
+def _subtract_deleted_users(session, flush_context, instances):
+    # 用户的明细由数据库级联删除，不经过会话，删除前按用户聚合后从汇总表扣减
+    user_ids = [o.id for o in session.deleted if isinstance(o, User)]
+    if user_ids:
+        subtract_users(session.connection(), user_ids)
+
+
+@event.listens_for(db.session, 'after_flush')
+def _maintain_rollups(session, flush_context):
+    new_sales = [o for o in session.new if isinstance(o, Sale)]
+    new_logs = [o for o in session.new if isinstance(o, BrowseLog)]
+    deleted_products = {o.id for o in session.deleted if isinstance(o, Product)}
+    deleted_users = {o.id for o in session.deleted if isinstance(o, User)}
+    # 商品被删除时直接清掉其汇总行；用户被删除时已在 flush 前整体扣减；
+    # 数据库级联删除的明细不再逐条扣减
+    deleted_sales = [o for o in session.deleted if isinstance(o, Sale)
+                     and o.product_id not in deleted_products and o.user_id not in deleted_users]
+    deleted_logs = [o for o in session.deleted if isinstance(o, BrowseLog)
+                    and o.product_id not in deleted_products and o.user_id not in deleted_users]
+    # 经目录缓存 attach 的商品，history 比较的是目录里的（可能已过时的）品类：
+    # 商品保存对提交的列调用 flag_modified，品类总算作有变化，汇总表随 UPDATE 一起改成表单上的值
+    recategorized = {}
+    for o in session.dirty:
+        if isinstance(o, Product) and db.inspect(o).attrs.category.history.has_changes():
+            recategorized[o.id] = o.category
+
+    if not (new_sales or new_logs or deleted_products or deleted_sales
+            or deleted_logs or recategorized):
+        return
+
+    conn = session.connection()
+    apply_sales(conn, new_sales)
+    apply_sales(conn, deleted_sales, sign=-1)
+    apply_browse(conn, new_logs)
+    apply_browse(conn, deleted_logs, sign=-1)
+    record_sales(conn, new_sales)
+    record_browse(conn, new_logs)
+    if deleted_products:
+        conn.execute(SalesDaily.__table__.delete()
+                     .where(SalesDaily.product_id.in_(deleted_products)))
+        conn.execute(BrowseDaily.__table__.delete()
+                     .where(BrowseDaily.product_id.in_(deleted_products)))
+        drop_products(conn, deleted_products)
+    for pid, category in recategorized.items():
+        conn.execute(SalesDaily.__table__.update()
+                     .where(SalesDaily.product_id == pid).values(category=category))
+
+
+rollups_cli = AppGroup('rollups', help='看板汇总表维护')
+
+
+@rollups_cli.command('rebuild')
+def rebuild_command():
+    """从明细表回填汇总表与基数草图"""
+    with db.engine.begin() as conn:
+        rebuild_rollups(conn)
+    click.echo('汇总表重建完成')
@@ -1,7 +1,30 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash
-from sqlalchemy import func, text
-from datetime import datetime
-from .models import db, Product, Sale, BrowseLog, User
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app, Response, send_file
+from sqlalchemy import func
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm.attributes import flag_modified
+from datetime import datetime, date, timedelta
+from collections import namedtuple
+from itertools import islice
+import json
+import os
+from .models import db, Product, Sale, BrowseLog, User, SalesDaily, BrowseDaily, Job
+from .cache import dashboard_cache, SALES_KEY, BROWSE_KEY, CATALOG_KEY
+from .catalog import product_catalog
+from .httpcache import http_cache
+from .pagination import KeysetPagination, bounded_count, estimate_count
+from .search import product_ids_matching, user_ids_matching
+from .ingest import browse_ingest
+from .orders import submit_orders
+from .export import export_response, SALES_EXPORT_COLUMNS, BROWSE_EXPORT_COLUMNS
+from .partitions import resolve_window, archived_count, archived_logs, archived_page
+from .metrics import request_metrics
+from .analytics import analytics, label_key
+from .jobs import job_runner, job_dict, JOB_KINDS, SUCCEEDED
+from .product_import import parse_product, import_products, text_stream
+from .products import submit_delete
+from .sketches import (unique_breakdown, unique_counts, daily_unique, heavy_hitters, HLL_ERROR,
+                       VIEWERS_PRODUCT, VIEWERS_PLATFORM, BUYERS_CATEGORY, TOP_VIEWS, TOP_SALES, sketch_buffer)
+from .conversion import cached_or_pending, request_report, report_window
 
 main = Blueprint('main', __name__)
 
@@ -9,155 +32,217 @@ main = Blueprint('main', __name__)
 def cover():
     return render_template('cover.html')
 
-@main.route('/dashboard')
-def dashboard():
-    current_year = datetime.now().year
-    
-    total_sales = db.session.query(func.sum(Sale.total_amount))\
-        .filter(func.extract('year', Sale.sale_date) == current_year).scalar() or 0
-    
-    total_qty = db.session.query(func.sum(Sale.quantity))\
-        .filter(func.extract('year', Sale.sale_date) == current_year).scalar() or 0
-    
-    total_products = Product.query.count()
-    total_users = User.query.count()
-    
-    # 每日浏览
-    if 'postgresql' in str(db.engine.url):
-        daily_logs = db.session.query(
-            func.cast(BrowseLog.browse_time, db.Date).label('date'),
-            func.count(BrowseLog.id).label('cnt')
-        ).group_by(text('date')).order_by(text('date')).limit(14).all()
-    else:
-        daily_logs = db.session.query(
-            func.date(BrowseLog.browse_time).label('date'),
-            func.count(BrowseLog.id).label('cnt')
-        ).group_by('date').order_by('date').limit(14).all()
-    
-    chart_dates = [str(item.date)[-5:] for item in daily_logs]
-    chart_counts = [item.cnt for item in daily_logs]
+def _day_filter(column, start, end):
+    """日期列落在 [start, end]（两端含，None 表示不限）的条件"""
+    conditions = []
+    if start is not None:
+        conditions.append(column >= start)
+    if end is not None:
+        conditions.append(column <= end)
+    return conditions
+
+def _sql_sales_metrics(period, breakdown):
+    """从销售日汇总表读取：period 内的合计与月度趋势，breakdown 内的品类分布与 TOP10"""
+    total_sales, total_qty = db.session.query(
+        func.sum(SalesDaily.amount), func.sum(SalesDaily.quantity)
+    ).filter(*_day_filter(SalesDaily.day, *period)).one()
     
     # 品类分布
     category_sales = db.session.query(
-        Product.category,
-        func.sum(Sale.total_amount).label('amount')
-    ).join(Sale).group_by(Product.category).all()
-    
-    category_labels = [item.category or '未分类' for item in category_sales]
-    category_amounts = [float(item.amount) for item in category_sales]
-    
-    # 月度趋势
-    if 'postgresql' in str(db.engine.url):
-        monthly_sales = db.session.query(
-            func.to_char(Sale.sale_date, 'YYYY-MM').label('month'),
-            func.sum(Sale.total_amount).label('amount'),
-            func.sum(Sale.quantity).label('qty')
-        ).filter(func.extract('year', Sale.sale_date) == current_year)\
-         .group_by(text('month')).order_by(text('month')).all()
-    else:
-        monthly_sales = db.session.query(
-            func.strftime('%Y-%m', Sale.sale_date).label('month'),
-            func.sum(Sale.total_amount).label('amount'),
-            func.sum(Sale.quantity).label('qty')
-        ).filter(func.extract('year', Sale.sale_date) == current_year)\
-         .group_by('month').order_by('month').all()
+        SalesDaily.category,
+        func.sum(SalesDaily.amount).label('amount')
+    ).filter(*_day_filter(SalesDaily.day, *breakdown)).group_by(SalesDaily.category).all()
     
-    month_labels = [item.month[-2:] + '月' for item in monthly_sales]
-    month_amounts = [float(item.amount) for item in monthly_sales]
-    month_quantities = [item.qty for item in monthly_sales]
+    # 月度趋势（按天汇总后在内存中归并到月，兼容 SQLite/PostgreSQL）
+    daily_sales = db.session.query(
+        SalesDaily.day,
+        func.sum(SalesDaily.amount).label('amount'),
+        func.sum(SalesDaily.quantity).label('qty')
+    ).filter(*_day_filter(SalesDaily.day, *period)).group_by(SalesDaily.day).all()
     
-    # TOP10商品
-    top_products = db.session.query(
-        Product.name,
-        func.sum(Sale.quantity).label('total_qty')
-    ).join(Sale).group_by(Product.id)\
-     .order_by(func.sum(Sale.quantity).desc()).limit(10).all()
+    monthly = {}
+    for item in daily_sales:
+        month = monthly.setdefault((item.day.year, item.day.month), [0, 0])
+        month[0] += float(item.amount)
+        month[1] += item.qty
     
-    top_product_names = [item.name[:12] for item in top_products]
-    top_product_sales = [item.total_qty for item in top_products]
+    # TOP10商品
+    top_qty = func.sum(SalesDaily.quantity)
+    top_ids = db.session.query(SalesDaily.product_id, top_qty.label('total_qty'))\
+        .filter(*_day_filter(SalesDaily.day, *breakdown))\
+        .group_by(SalesDaily.product_id).order_by(top_qty.desc()).limit(10).subquery()
+    top_products = db.session.query(Product.name, top_ids.c.total_qty)\
+        .join(top_ids, Product.id == top_ids.c.product_id)\
+        .order_by(top_ids.c.total_qty.desc()).all()
     
-    low_stock_count = Product.query.filter(Product.stock < 10).count()
+    return {
+        'total_amount': float(total_sales or 0),
+        'total_qty': total_qty or 0,
+        'categories': sorted(((item.category, float(item.amount)) for item in category_sales), key=label_key),
+        'months': [(m, *monthly[m]) for m in sorted(monthly)],
+        'top': [(item.name, item.total_qty) for item in top_products],
+    }
+
+def _sql_browse_metrics(daily_window, breakdown):
+    """从浏览日汇总表读取：daily_window 内的每日浏览（None 时取最近 14 天），breakdown 内的渠道分布"""
+    if daily_window is None:
+        latest = db.session.query(func.max(BrowseDaily.day)).scalar() or date.today()
+        daily_window = (latest - timedelta(days=13), latest)
+    daily_logs = db.session.query(
+        BrowseDaily.day.label('date'),
+        func.sum(BrowseDaily.views).label('cnt')
+    ).filter(*_day_filter(BrowseDaily.day, *daily_window))\
+     .group_by(BrowseDaily.day).order_by(BrowseDaily.day).all()
     
     platform_stats = db.session.query(
-        BrowseLog.platform,
-        func.count(BrowseLog.id).label('cnt')
-    ).group_by(BrowseLog.platform).all()
-    
-    platform_labels = [item.platform for item in platform_stats]
-    platform_counts = [item.cnt for item in platform_stats]
-
-    return render_template('dashboard.html',
-                           total_sales=f"{total_sales:,.0f}",
-                           total_qty=total_qty,
-                           total_products=total_products,
-                           total_users=total_users,
-                           chart_dates=chart_dates,
-                           chart_counts=chart_counts,
-                           category_labels=category_labels,
-                           category_amounts=category_amounts,
-                           month_labels=month_labels,
-                           month_amounts=month_amounts,
-                           month_quantities=month_quantities,
-                           top_product_names=top_product_names,
-                           top_product_sales=top_product_sales,
-                           platform_labels=platform_labels,
-                           platform_counts=platform_counts,
-                           low_stock_count=low_stock_count)
+        BrowseDaily.platform,
+        func.sum(BrowseDaily.views).label('cnt')
+    ).filter(*_day_filter(BrowseDaily.day, *breakdown)).group_by(BrowseDaily.platform).all()
+    
+    return {
+        'daily': [(item.date, item.cnt) for item in daily_logs],
+        'platforms': sorted(((item.platform, item.cnt) for item in platform_stats), key=label_key),
+    }
+
+def _dashboard_sales(start=None, end=None):
+    """销售类指标：未指定区间时合计与月度趋势取本年、品类分布与 TOP10 取全部"""
+    if start is None and end is None:
+        current_year = datetime.now().year
+        period = (date(current_year, 1, 1), date(current_year, 12, 31))
+    else:
+        period = (start, end)
+    if analytics.enabled:
+        metrics = analytics.sales_metrics(period, (start, end))
+    else:
+        metrics = _sql_sales_metrics(period, (start, end))
+    
+    months = metrics['months']
+    # 独立买家由基数草图估算（相对标准误差约 1.6%）
+    buyers = unique_counts(BUYERS_CATEGORY, start, end)
+    multi_year = len({year for (year, _), _, _ in months}) > 1
+    return {
+        'total_sales': metrics['total_amount'],
+        'total_qty': metrics['total_qty'],
+        'category_labels': [category or '未分类' for category, _ in metrics['categories']],
+        'category_amounts': [amount for _, amount in metrics['categories']],
+        'category_buyers': [buyers.get(category or '', 0) for category, _ in metrics['categories']],
+        'month_labels': [f'{y}-{m:02d}' if multi_year else f'{m:02d}月' for (y, m), _, _ in months],
+        'month_amounts': [amount for _, amount, _ in months],
+        'month_quantities': [qty for _, _, qty in months],
+        'top_product_names': [name[:12] for name, _ in metrics['top']],
+        'top_product_sales': [qty for _, qty in metrics['top']],
+    }
+
+def _dashboard_browse(start=None, end=None):
+    """浏览类指标：每日浏览（未指定区间时为最近 14 天）、渠道分布"""
+    daily_window = None if start is None and end is None else (start, end)
+    if analytics.enabled:
+        metrics = analytics.browse_metrics(daily_window, (start, end))
+    else:
+        metrics = _sql_browse_metrics(daily_window, (start, end))
+    viewers, total_viewers = unique_breakdown(VIEWERS_PLATFORM, start, end)
+    return {
+        'chart_dates': [str(day)[-5:] for day, _ in metrics['daily']],
+        'chart_counts': [count for _, count in metrics['daily']],
+        'platform_labels': [platform or None for platform, _ in metrics['platforms']],
+        'platform_counts': [count for _, count in metrics['platforms']],
+        'platform_viewers': [viewers.get(platform or '', 0) for platform, _ in metrics['platforms']],
+        'unique_viewers': total_viewers,
+    }
+
+def _dashboard_catalog():
+    """商品/用户计数与库存预警"""
+    return {
+        'total_products': Product.query.count(),
+        'total_users': User.query.count(),
+        'low_stock_count': Product.query.filter(Product.stock < 10).count(),
+    }
+
+@main.route('/dashboard')
+def dashboard():
+    start_date = request.args.get('start_date', '').strip()
+    end_date = request.args.get('end_date', '').strip()
+    start_dt, end_dt = _parse_date_range(start_date, end_date)
+    start = start_dt.date() if start_dt else None
+    end = (end_dt - timedelta(days=1)).date() if end_dt else None
+    
+    data = {}
+    if analytics.enabled:
+        # 进程内列式快照直接计算（独立访客/买家仍读草图表）
+        data.update(_dashboard_sales(start, end))
+        data.update(_dashboard_browse(start, end))
+    elif start is None and end is None:
+        # 默认视图读汇总表（sales_daily / browse_daily），结果按 key 缓存并在写入后失效
+        data.update(dashboard_cache.get_or_compute(SALES_KEY, _dashboard_sales))
+        data.update(dashboard_cache.get_or_compute(BROWSE_KEY, _dashboard_browse))
+    else:
+        data.update(_dashboard_sales(start, end))
+        data.update(_dashboard_browse(start, end))
+    data.update(dashboard_cache.get_or_compute(CATALOG_KEY, _dashboard_catalog))
+    data['total_sales'] = f"{data['total_sales']:,.0f}"
+    return render_template('dashboard.html', start_date=start_date if start else '',
+                           end_date=end_date if end else '', **data)
+
+@main.route('/dashboard/cache_stats')
+def dashboard_cache_stats():
+    stats = dashboard_cache.stats()
+    stats['analytics'] = analytics.stats()
+    stats['catalog'] = product_catalog.stats()
+    stats['http'] = http_cache.stats()
+    stats['sketches'] = sketch_buffer.stats()
+    return jsonify(stats)
+
+@main.route('/metrics')
+def metrics():
+    return Response(request_metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 @main.route('/products')
 def products_manage():
     page = request.args.get('page', 1, type=int)
     per_page = 20
-    pagination = Product.query.order_by(Product.id.desc()).paginate(page=page, per_page=per_page, error_out=False)
-    return render_template('products.html', products=pagination.items, pagination=pagination)
+    # 数据库只取这一页的商品编号，商品字段从目录缓存批量读取
+    pagination = db.session.query(Product.id).order_by(Product.id.desc())\
+        .paginate(page=page, per_page=per_page, error_out=False)
+    found = product_catalog.lookup(row.id for row in pagination.items)
+    products = [found[row.id] for row in pagination.items if row.id in found]
+    return render_template('products.html', products=products, pagination=pagination)
 
 @main.route('/products/save', methods=['POST'])
 def product_save():
     try:
         p_id = request.form.get('id')
-        name = request.form.get('name', '').strip()
-        reg_date_str = request.form.get('reg_date', '').strip()
-        category = request.form.get('category', '').strip()
-        model = request.form.get('model', '').strip()
-        unit = request.form.get('unit', '').strip()
-        price_str = request.form.get('price', '').strip()
-        stock_str = request.form.get('stock', '').strip()
-        
-        if not name:
-            flash('商品名称不能为空', 'error')
-            return redirect(url_for('main.products_manage'))
-        
         try:
-            price = float(price_str) if price_str else 0
-            stock = int(stock_str) if stock_str else 0
-        except ValueError:
-            flash('价格或库存格式错误', 'error')
+            fields = parse_product(request.form)
+        except ValueError as e:
+            flash(str(e), 'error')
             return redirect(url_for('main.products_manage'))
-        
-        reg_date = None
-        if reg_date_str:
-            try:
-                reg_date = datetime.strptime(reg_date_str, '%Y-%m-%d').date()
-            except ValueError:
-                pass
+        name, price, stock = fields['name'], fields['price'], fields['stock']
+        category, model, unit = fields['category'], fields['model'], fields['unit']
+        reg_date = fields['reg_date']
         
         if p_id:
-            p = Product.query.get(p_id)
-            if p:
+            # 从目录缓存取当前值放进会话，不再 SELECT；目录里的值可能比库里旧（如刚下单扣过库存），
+            # 所以把提交的各列都标记为已修改，UPDATE 总是写入表单上的值
+            current = product_catalog.get(p_id)
+            if current:
+                p = product_catalog.attach(db.session, current)
                 p.name = name
                 p.price = price
                 p.stock = stock
-                p.category = category or None
-                p.model = model or None
-                p.unit = unit or None
+                p.category = category
+                p.model = model
+                p.unit = unit
                 if reg_date:
                     p.reg_date = reg_date
+                for column in ('name', 'price', 'stock', 'category', 'model', 'unit', 'reg_date'):
+                    if column != 'reg_date' or reg_date:
+                        flag_modified(p, column)
                 db.session.commit()
                 flash('商品更新成功', 'success')
         else:
             p = Product(name=name, price=price, stock=stock,
-                       category=category or None, model=model or None,
-                       unit=unit or None, reg_date=reg_date)
+                       category=category, model=model,
+                       unit=unit, reg_date=reg_date)
             db.session.add(p)
             db.session.commit()
             flash('商品添加成功', 'success')
@@ -168,12 +253,43 @@ def product_save():
         flash(f'保存失败: {str(e)}', 'error')
         return redirect(url_for('main.products_manage'))
 
+def _import_source():
+    """上传的文件（multipart 的 file 字段）或请求体本身"""
+    upload = request.files.get('file')
+    return text_stream(upload.stream if upload else request.stream)
+
+@main.route('/products/import', methods=['POST'])
+def products_import():
+    """商品页上传 CSV 批量导入，结果以提示消息显示"""
+    if not request.files.get('file'):
+        flash('请选择要导入的 CSV 文件', 'error')
+        return redirect(url_for('main.products_manage'))
+    try:
+        report = import_products(_import_source(), max_errors=5)
+    except (ValueError, UnicodeDecodeError) as e:
+        flash(f'导入失败: {e}', 'error')
+        return redirect(url_for('main.products_manage'))
+    flash(f'导入完成：新增 {report.inserted}，更新 {report.updated}，出错 {report.error_count}',
+          'success')
+    for e in report.errors:
+        flash(f'第 {e["line"]} 行: {e["error"]}', 'error')
+    return redirect(url_for('main.products_manage'))
+
+@main.route('/api/products/import', methods=['POST'])
+def products_import_api():
+    """批量导入 / 更新商品：上传 CSV（file 字段或请求体），返回计数与逐行错误"""
+    try:
+        report = import_products(_import_source(), chunk_size=request.args.get('chunk_size', 5000, type=int))
+    except (ValueError, UnicodeDecodeError) as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(report.to_dict())
+
 @main.route('/products/delete/<int:id>', methods=['POST'])
 def product_delete(id):
     try:
-        p = Product.query.get(id)
-        if p:
-            db.session.delete(p)
+        current = product_catalog.get(id)
+        if current:
+            db.session.delete(product_catalog.attach(db.session, current))
             db.session.commit()
             flash('商品删除成功', 'success')
     except Exception as e:
@@ -181,69 +297,477 @@ def product_delete(id):
         flash(f'删除失败: {str(e)}', 'error')
     return redirect(url_for('main.products_manage'))
 
+@main.route('/api/products/delete', methods=['POST'])
+def products_delete_api():
+    """批量删除商品：{"ids": [...]}，明细由数据库级联删除，返回删除数与不存在的编号"""
+    payload = request.get_json(silent=True) or {}
+    ids = payload.get('ids')
+    if not isinstance(ids, list) or not ids:
+        return jsonify(error='ids 必须是非空数组'), 400
+    try:
+        ids = {int(i) for i in ids}
+    except (TypeError, ValueError):
+        return jsonify(error='ids 中含有非整数'), 400
+    deleted = submit_delete(ids)
+    return jsonify(deleted=len(deleted), not_found=sorted(ids.difference(deleted)))
+
+def _paginate(query, sort_col, id_col, per_page, total, total_is_estimate=False, extra=None):
+    """
+    结果集小时沿用页码分页；超过 PAGE_MODE_MAX_ROWS、带 cursor 参数或需要合并查询之外的行
+    （extra，见 KeysetPagination）时改用游标分页
+    """
+    cursor = request.args.get('cursor', '').strip()
+    if cursor or total is None or total_is_estimate or extra is not None \
+            or total > current_app.config['PAGE_MODE_MAX_ROWS']:
+        return KeysetPagination(query, sort_col, id_col, per_page, cursor=cursor,
+                                total=total, total_is_estimate=total_is_estimate, extra=extra)
+    page = request.args.get('page', 1, type=int)
+    pagination = query.order_by(sort_col.desc(), id_col.desc())\
+        .paginate(page=page, per_page=per_page, error_out=False, count=False)
+    pagination.total = total
+    return pagination
+
+def _with_product_names(rows):
+    """给只带 product_id 的明细行补上商品名（从目录缓存批量读取），返回字典列表供模板使用"""
+    found = product_catalog.lookup({row.product_id for row in rows})
+    items = []
+    for row in rows:
+        item = row._asdict()
+        product = found.get(row.product_id)
+        item['product_name'] = product.name if product else ''
+        items.append(item)
+    return items
+
+def _sales_query(keyword, product_name=True):
+    """
+    销售明细查询（只取模板/导出需要的列，一次查询带出商品名和用户名）；
+    product_name=False 时不联商品表，改取 product_id，由页面从目录缓存补商品名
+    """
+    product_column = Product.name.label('product_name') if product_name else Sale.product_id
+    query = db.session.query(
+        Sale.id, Sale.sale_date, Sale.unit_price, Sale.quantity,
+        Sale.total_amount, Sale.payment_method,
+        product_column, User.username
+    ).join(User, User.id == Sale.user_id)
+    if product_name:
+        query = query.join(Product, Product.id == Sale.product_id)
+    if keyword:
+        query = query.filter(Sale.product_id.in_(product_ids_matching(keyword)))
+    return query
+
 @main.route('/sales')
 def sales_query():
     keyword = request.args.get('param_keyword', '')
-    page = request.args.get('page', 1, type=int)
     per_page = 50
     
-    query = Sale.query.join(Product).join(User)
-    if keyword:
-        query = query.filter(Product.name.contains(keyword))
-    
-    pagination = query.order_by(Sale.sale_date.desc()).paginate(page=page, per_page=per_page, error_out=False)
+    query = _sales_query(keyword, product_name=False)
     
-    # 统计数据（只统计当前筛选条件下的）
-    stats_query = Sale.query.join(Product)
+    # 统计数据（只统计当前筛选条件下的），从汇总表读取，订单数同时作为分页总数
+    stats_query = db.session.query(
+        func.sum(SalesDaily.amount), func.sum(SalesDaily.quantity), func.sum(SalesDaily.orders))
     if keyword:
-        stats_query = stats_query.filter(Product.name.contains(keyword))
+        stats_query = stats_query.filter(SalesDaily.product_id.in_(product_ids_matching(keyword)))
+    total_amount, total_qty, total_count = stats_query.one()
+    total_amount = total_amount or 0
+    total_qty = total_qty or 0
+    total_count = total_count or 0
     
-    total_amount = stats_query.with_entities(func.sum(Sale.total_amount)).scalar() or 0
-    total_qty = stats_query.with_entities(func.sum(Sale.quantity)).scalar() or 0
-    total_count = stats_query.count()
+    pagination = _paginate(query, Sale.sale_date, Sale.id, per_page, total_count)
     
     return render_template('sales.html', 
-                          sales=pagination.items, 
+                          sales=_with_product_names(pagination.items), 
                           pagination=pagination,
                           keyword=keyword,
                           total_amount=total_amount,
                           total_qty=total_qty,
                           total_count=total_count)
 
-@main.route('/browse_logs')
-def browse_logs():
-    username = request.args.get('username', '').strip()
-    start_date = request.args.get('start_date', '').strip()
-    end_date = request.args.get('end_date', '').strip()
-    page = request.args.get('page', 1, type=int)
-    per_page = 50
-    
-    query = BrowseLog.query.join(User).join(Product)
-    
-    if username:
-        query = query.filter(User.username.contains(username))
-    
+@main.route('/sales/export')
+def sales_export():
+    keyword = request.args.get('param_keyword', '')
+    query = _sales_query(keyword).order_by(Sale.id)
+    return export_response(query, SALES_EXPORT_COLUMNS, 'sales',
+                           request.args.get('format', 'csv'), request.args.get('gzip', type=int) == 1)
+
+def _parse_date_range(start_date, end_date):
+    """把 YYYY-MM-DD 的起止日期转成半开区间 [start, end)，格式不对的一端视为不限"""
+    start_dt = end_dt = None
     if start_date:
         try:
             start_dt = datetime.strptime(start_date, '%Y-%m-%d')
-            query = query.filter(BrowseLog.browse_time >= start_dt)
         except ValueError:
             pass
-    
     if end_date:
         try:
-            from datetime import timedelta
             end_dt = datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)
-            query = query.filter(BrowseLog.browse_time < end_dt)
         except ValueError:
             pass
+    return start_dt, end_dt
+
+def _browse_logs_query(username, start_dt, end_dt, product_name=True):
+    """浏览明细查询（一次查询带出用户名和商品名）；product_name=False 时改取 product_id"""
+    product_column = Product.name.label('product_name') if product_name else BrowseLog.product_id
+    query = db.session.query(
+        BrowseLog.id, BrowseLog.browse_time, BrowseLog.platform,
+        User.username, product_column
+    ).join(User, User.id == BrowseLog.user_id)
+    if product_name:
+        query = query.join(Product, Product.id == BrowseLog.product_id)
+    if username:
+        # 先从搜索索引找出匹配的用户 id，再按 user_id 索引取浏览记录
+        query = query.filter(BrowseLog.user_id.in_(user_ids_matching(username)))
+    if start_dt:
+        query = query.filter(BrowseLog.browse_time >= start_dt)
+    if end_dt:
+        query = query.filter(BrowseLog.browse_time < end_dt)
+    return query
+
+ArchivedLog = namedtuple('ArchivedLog', 'id browse_time platform username product_id')
+ArchivedNamedLog = namedtuple('ArchivedNamedLog', 'id browse_time platform username product_name')
+
+def _matching_users(username):
+    """按用户名筛选时匹配用户编号的子查询，不筛选时为 None"""
+    return user_ids_matching(username) if username else None
+
+def _archived_rows(rows, product_name):
+    """归档段中的行（字典）补上用户名、商品名，字段与 _browse_logs_query 的结果行相同"""
+    user_ids = list({r['user_id'] for r in rows})
+    users = {}
+    for i in range(0, len(user_ids), 5000):
+        users.update(db.session.query(User.id, User.username).filter(User.id.in_(user_ids[i:i + 5000])))
+    products = product_catalog.lookup({r['product_id'] for r in rows}) if product_name else None
+    items = []
+    for r in rows:
+        if r['user_id'] not in users:
+            continue
+        if product_name:
+            product = products.get(r['product_id'])
+            items.append(ArchivedNamedLog(r['id'], r['browse_time'], r['platform'], users[r['user_id']],
+                                          product.name if product else ''))
+        else:
+            items.append(ArchivedLog(r['id'], r['browse_time'], r['platform'], users[r['user_id']],
+                                     r['product_id']))
+    return items
+
+def _archived_browse_logs(months, start_dt, end_dt, username, product_name=True):
+    """窗口覆盖的已归档月份中的浏览记录（只读，逐段解码），每批补一次用户名和商品名"""
+    rows = archived_logs(db.session.connection(), start_dt, end_dt, _matching_users(username), months)
+    while True:
+        batch = list(islice(rows, 5000))
+        if not batch:
+            return
+        yield from _archived_rows(batch, product_name)
+
+def _archived_browse_page(months, start_dt, end_dt, users):
+    """KeysetPagination 的 extra：归档段中位于游标之后的前 n 行，只解码游标附近的段"""
+    def extra(direction, key, n):
+        rows = archived_page(db.session.connection(), months, start_dt, end_dt, users, direction, key, n)
+        return _archived_rows(rows, product_name=False)
+    return extra
+
+@main.route('/browse_logs')
+def browse_logs():
+    username = request.args.get('username', '').strip()
+    start_date = request.args.get('start_date', '').strip()
+    end_date = request.args.get('end_date', '').strip()
+    exact = request.args.get('exact', type=int) == 1
+    per_page = 50
     
-    pagination = query.order_by(BrowseLog.browse_time.desc()).paginate(page=page, per_page=per_page, error_out=False)
+    start_dt, end_dt = _parse_date_range(start_date, end_date)
+    # 未指定开始日期时只看保留期内的数据；窗口覆盖已归档月份时从归档段读出这部分记录合并进来
+    start_dt, archived_before, archived = resolve_window(start_dt, end_dt)
+    query = _browse_logs_query(username, start_dt, end_dt, product_name=False)
+    extra = None
+    if archived:
+        extra = _archived_browse_page(archived, start_dt, end_dt, _matching_users(username))
+    
+    # 不按用户筛选时，总数直接从浏览日汇总表按日期范围求和
+    total_query = db.session.query(func.sum(BrowseDaily.views))
+    if start_dt:
+        total_query = total_query.filter(BrowseDaily.day >= start_dt.date())
+    if end_dt:
+        total_query = total_query.filter(BrowseDaily.day < end_dt.date())
+    
+    total_is_estimate = False
+    if not username:
+        total_count = total_query.scalar() or 0
+    else:
+        # 按用户筛选时只数到阈值；更大的结果集给估算值，exact=1 时才做完整 COUNT
+        max_rows = current_app.config['PAGE_MODE_MAX_ROWS']
+        # 归档段中的匹配行由各段的用户计数求出，只有跨窗口边界的段才解码
+        archived_rows = archived_count(db.session.connection(), archived, start_dt, end_dt,
+                                       _matching_users(username)) if archived else 0
+        total_count = bounded_count(query, max_rows) + archived_rows
+        if total_count > max_rows:
+            if exact:
+                total_count = query.order_by(None).count() + archived_rows
+            else:
+                total_count = estimate_count(query)
+                if total_count is not None:
+                    total_count += archived_rows
+                total_is_estimate = True
+    
+    pagination = _paginate(query, BrowseLog.browse_time, BrowseLog.id, per_page,
+                           total_count, total_is_estimate, extra)
     
     return render_template('browse_logs.html', 
-                         logs=pagination.items,
+                         logs=_with_product_names(pagination.items),
                          pagination=pagination,
                          username=username,
                          start_date=start_date,
                          end_date=end_date,
-                         total_count=pagination.total)
+                         total_count=total_count,
+                         total_is_estimate=total_is_estimate,
+                         page_mode_max_rows=current_app.config['PAGE_MODE_MAX_ROWS'],
+                         archived_before=archived_before)
+
+@main.route('/browse_logs/export')
+def browse_logs_export():
+    username = request.args.get('username', '').strip()
+    start_dt, end_dt = _parse_date_range(request.args.get('start_date', '').strip(),
+                                         request.args.get('end_date', '').strip())
+    start_dt, _, archived = resolve_window(start_dt, end_dt)
+    query = _browse_logs_query(username, start_dt, end_dt).order_by(BrowseLog.id)
+    # 已归档月份的记录更早，先于明细表的结果导出
+    before = _archived_browse_logs(archived, start_dt, end_dt, username) if archived else ()
+    return export_response(query, BROWSE_EXPORT_COLUMNS, 'browse_logs',
+                           request.args.get('format', 'csv'), request.args.get('gzip', type=int) == 1,
+                           before=before)
+
+def _parse_browse_event(item):
+    """校验单条浏览事件，格式错误时抛 ValueError"""
+    if not isinstance(item, dict):
+        raise ValueError('事件必须是 JSON 对象')
+    try:
+        user_id = int(item['user_id'])
+        product_id = int(item['product_id'])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('user_id / product_id 缺失或不是整数')
+    platform = str(item.get('platform') or '').strip()[:20] or None
+    browse_time = item.get('browse_time')
+    if browse_time:
+        try:
+            browse_time = datetime.fromisoformat(str(browse_time))
+        except ValueError:
+            raise ValueError('browse_time 格式错误')
+    else:
+        browse_time = datetime.now()
+    return {'user_id': user_id, 'product_id': product_id,
+            'browse_time': browse_time, 'platform': platform}
+
+@main.route('/api/browse_events', methods=['POST'])
+def browse_events_ingest():
+    """接收单条或一批浏览事件，放入缓冲区后立即返回 202"""
+    payload = request.get_json(silent=True)
+    items = payload if isinstance(payload, list) else [payload]
+    events = []
+    for i, item in enumerate(items):
+        try:
+            events.append(_parse_browse_event(item))
+        except ValueError as e:
+            return jsonify(error=f'第 {i + 1} 条事件: {e}'), 400
+    if not browse_ingest.submit(events):
+        return jsonify(error='缓冲区已满，请稍后重试'), 503, {'Retry-After': '1'}
+    return jsonify(accepted=len(events)), 202
+
+@main.route('/api/browse_events/stats')
+def browse_events_stats():
+    return jsonify(browse_ingest.stats())
+
+# 独立用户数的维度 -> 草图种类
+_UNIQUE_KINDS = {'product': VIEWERS_PRODUCT, 'platform': VIEWERS_PLATFORM, 'category': BUYERS_CATEGORY}
+_TOP_KINDS = {'views': TOP_VIEWS, 'sales': TOP_SALES}
+
+def _sketch_window():
+    start_dt, end_dt = _parse_date_range(request.args.get('start_date', '').strip(),
+                                         request.args.get('end_date', '').strip())
+    return (start_dt.date() if start_dt else None,
+            (end_dt - timedelta(days=1)).date() if end_dt else None)
+
+@main.route('/api/sketches/unique')
+def sketches_unique():
+    """独立访客/买家估算：dimension=product|platform|category，可选 key；daily=1 时按天返回单个 key"""
+    kind = _UNIQUE_KINDS.get(request.args.get('dimension', 'platform'))
+    if kind is None:
+        return jsonify(error='dimension 只能是 product / platform / category'), 400
+    start, end = _sketch_window()
+    key = request.args.get('key')
+    if request.args.get('daily'):
+        if key is None:
+            return jsonify(error='按天查询需要指定 key'), 400
+        days = [{'day': day.isoformat(), 'estimate': n} for day, n in daily_unique(kind, key, start, end)]
+        return jsonify(days=days, relative_error=HLL_ERROR)
+    counts, total = unique_breakdown(kind, start, end, None if key is None else [key])
+    return jsonify(counts=counts, total=total, relative_error=HLL_ERROR)
+
+@main.route('/api/sketches/top')
+def sketches_top():
+    """热门商品估算：metric=views|sales；估计值不低于真实值，至多多出 error_bound"""
+    kind = _TOP_KINDS.get(request.args.get('metric', 'views'))
+    if kind is None:
+        return jsonify(error='metric 只能是 views / sales'), 400
+    n = min(max(request.args.get('n', 10, type=int), 1), 100)
+    start, end = _sketch_window()
+    top, bound = heavy_hitters(kind, start, end, n)
+    return jsonify(top=[{'product_id': pid, 'estimate': est} for pid, est in top], error_bound=bound)
+
+def _conversion_window():
+    """转化报表的起止日期（结束日期含当天），开始晚于结束时抛 ValueError"""
+    start_dt, end_dt = _parse_date_range(request.args.get('start_date', '').strip(),
+                                         request.args.get('end_date', '').strip())
+    return report_window(start_dt.date() if start_dt else None,
+                         (end_dt - timedelta(days=1)).date() if end_dt else None)
+
+@main.route('/conversion')
+def conversion():
+    try:
+        start, end = _conversion_window()
+    except ValueError as e:
+        flash(str(e), 'error')
+        start, end = report_window()
+    # 只读缓存：过期时显示旧报表，没有时提示计算；计算由页面上的按钮（POST）发起
+    report, job_id = cached_or_pending(start, end)
+    return render_template('conversion.html', report=report, job_id=job_id,
+                           top_products=report['products'][:20] if report else [],
+                           start_date=start.isoformat(), end_date=end.isoformat()), \
+        200 if report or not job_id else 202
+
+@main.route('/conversion', methods=['POST'])
+def conversion_refresh():
+    """提交（或复用）该窗口的计算任务，回到报表页面"""
+    try:
+        start, end = _conversion_window()
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('main.conversion'))
+    request_report(start, end)
+    return redirect(url_for('main.conversion', start_date=start.isoformat(), end_date=end.isoformat()))
+
+def _conversion_response(report, job_id, start, end):
+    job = {'job_id': job_id, 'status_url': url_for('main.jobs_status', job_id=job_id)} if job_id else {}
+    if report is None:
+        if not job:
+            return jsonify(error='该窗口还没有计算过，POST /api/conversion 提交计算任务',
+                           start_date=start.isoformat(), end_date=end.isoformat()), 404
+        return jsonify(status='pending', start_date=start.isoformat(), end_date=end.isoformat(),
+                       **job), 202, {'Retry-After': '5'}
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 1000)
+    report = dict(report, **job)
+    report['product_count'] = len(report['products'])
+    report['products'] = report['products'][:limit]
+    return jsonify(report)
+
+@main.route('/api/conversion')
+def conversion_api():
+    """转化报表：合计、各品类、各浏览方式，以及浏览量最高的 limit 个商品（只读缓存，不触发计算）"""
+    try:
+        start, end = _conversion_window()
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    return _conversion_response(*cached_or_pending(start, end), start, end)
+
+@main.route('/api/conversion', methods=['POST'])
+def conversion_api_refresh():
+    """缓存过期或没有缓存时提交（或复用）计算任务：返回旧报表或 202 和任务编号"""
+    try:
+        start, end = _conversion_window()
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    return _conversion_response(*request_report(start, end), start, end)
+
+def _parse_order(item):
+    """校验单个订单，格式错误时抛 ValueError"""
+    if not isinstance(item, dict):
+        raise ValueError('订单必须是 JSON 对象')
+    try:
+        user_id = int(item['user_id'])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('user_id 缺失或不是整数')
+    lines = item.get('lines')
+    if not isinstance(lines, list) or not lines:
+        raise ValueError('lines 必须是非空数组')
+    parsed = []
+    for line in lines:
+        try:
+            product_id = int(line['product_id'])
+            quantity = int(line['quantity'])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError('订单行的 product_id / quantity 缺失或不是整数')
+        if quantity <= 0:
+            raise ValueError('数量必须大于 0')
+        parsed.append({'product_id': product_id, 'quantity': quantity})
+    payment_method = str(item.get('payment_method') or '').strip()[:20] or None
+    return {'user_id': user_id, 'payment_method': payment_method, 'lines': parsed}
+
+@main.route('/api/orders', methods=['POST'])
+def orders_place():
+    """下单：接受单个订单或订单数组，整批在一个事务内处理，逐行返回成功或缺货"""
+    payload = request.get_json(silent=True)
+    items = payload if isinstance(payload, list) else [payload]
+    orders = []
+    for i, item in enumerate(items):
+        try:
+            orders.append(_parse_order(item))
+        except ValueError as e:
+            return jsonify(error=f'第 {i + 1} 个订单: {e}'), 400
+    results = submit_orders(orders)
+    return jsonify(orders=[{'lines': lines} for lines in results])
+
+@main.route('/api/jobs', methods=['POST'])
+def jobs_submit():
+    """提交后台任务：{"kind": ..., "params": {...}}，立即返回 202 和任务编号"""
+    payload = request.get_json(silent=True) or {}
+    kind = payload.get('kind')
+    params = payload.get('params') or {}
+    if kind not in JOB_KINDS:
+        return jsonify(error=f'未知的任务类型: {kind}', kinds=sorted(JOB_KINDS)), 400
+    if not isinstance(params, dict):
+        return jsonify(error='params 必须是 JSON 对象'), 400
+    _, destructive = JOB_KINDS[kind]
+    if destructive and not current_app.config['JOBS_ALLOW_DESTRUCTIVE']:
+        return jsonify(error=f'{kind} 会改写已有数据，只能通过 flask jobs submit 提交'), 403
+    job_id = job_runner.submit(kind, params)
+    return jsonify(id=job_id, status_url=url_for('main.jobs_status', job_id=job_id)), 202
+
+@main.route('/api/jobs')
+def jobs_list():
+    # 顺带（限频）把中断的任务重新排队
+    job_runner.maintain()
+    limit = min(request.args.get('limit', 20, type=int), 200)
+    query = Job.query.order_by(Job.id.desc())
+    if request.args.get('status'):
+        query = query.filter(Job.status == request.args['status'])
+    return jsonify(jobs=[job_dict(job) for job in query.limit(limit)])
+
+@main.route('/api/jobs/<int:job_id>')
+def jobs_status(job_id):
+    job = db.session.get(Job, job_id)
+    if job is None:
+        return jsonify(error='任务不存在'), 404
+    return jsonify(job_dict(job))
+
+@main.route('/api/jobs/<int:job_id>/cancel', methods=['POST'])
+def jobs_cancel(job_id):
+    if db.session.get(Job, job_id) is None:
+        return jsonify(error='任务不存在'), 404
+    try:
+        cancelled = job_runner.cancel(job_id)
+    except OperationalError:
+        # SQLite：任务正持有写锁
+        return jsonify(error='数据库正忙，请稍后重试'), 503, {'Retry-After': '1'}
+    if not cancelled:
+        return jsonify(error='任务已结束'), 409
+    return jsonify(job_dict(db.session.get(Job, job_id, populate_existing=True)))
+
+@main.route('/api/jobs/<int:job_id>/download')
+def jobs_download(job_id):
+    """下载导出任务生成的文件"""
+    job = db.session.get(Job, job_id)
+    if job is None:
+        return jsonify(error='任务不存在'), 404
+    result = json.loads(job.result) if job.result else {}
+    if job.status != SUCCEEDED or not result.get('file'):
+        return jsonify(error='任务未完成或没有生成文件'), 409
+    if not os.path.exists(result['file']):
+        return jsonify(error='导出文件已被清理'), 410
+    return send_file(result['file'], as_attachment=True, download_name=result['filename'])
@@ -0,0 +1,150 @@
+"""
+数据库结构初始化与版本检查
+
+建表、浏览记录分区、索引和演示数据不再在 Web 进程启动时执行，统一由
+`flask schema upgrade` 完成，并在 schema_version 表中记下结构版本；库里的版本已是最新时
+该命令直接跳过（不再重建索引、ANALYZE 或重建全文索引），因此可以放在每次启动前执行。
+Web 进程只在第一个请求时读一次版本号：库里的版本落后于代码（或还没初始化）时
+返回 503 并提示先执行升级命令，版本一致后本进程不再检查。
+修改表结构时同步增大 SCHEMA_VERSION，并在 upgrade 中补上对应的变更。
+"""
+import logging
+import sys
+
+import click
+from flask import Response
+from flask.cli import AppGroup
+from sqlalchemy import exc, func, insert, inspect, select
+from sqlalchemy.schema import CreateColumn
+
+from . import db
+from .models import Product, SchemaVersion
+
+logger = logging.getLogger(__name__)
+
+# 结构版本历史：
+#   2: 新增 jobs 表
+#   3: 新增 sketches 表
+#   4: 新增 conversion_reports 表，用户维度改为复合索引
+#   5: 新增 catalog_version / catalog_changes 表
+#   6: 新增 1～2 字关键字的单字 / 双字索引
+#   7: catalog_version 计数器表改为序列
+#   8: jobs 表新增 attempts 列，新增 cache_generations 表
+#   9: browse_archive 新增 min_time / max_time 列，新增 browse_archive_counts 表
+SCHEMA_VERSION = 9
+
+# 不需要数据库的端点
+_EXEMPT_ENDPOINTS = {'static', 'main.metrics'}
+
+# 已被取代的表，升级时删除
+REPLACED_TABLES = ('catalog_version',)
+
+# 已有的表上后来新增的列 (表名, 列名)，升级时补上
+ADDED_COLUMNS = (('jobs', 'attempts'), ('browse_archive', 'min_time'), ('browse_archive', 'max_time'))
+
+
+def current_version(engine):
+    """库中已记录的结构版本；还没初始化时返回 None"""
+    with engine.connect() as conn:
+        try:
+            return conn.execute(select(func.max(SchemaVersion.version))).scalar()
+        except exc.DBAPIError:
+            # schema_version 表不存在
+            return None
+
+
+def record_version(conn, version=SCHEMA_VERSION):
+    exists = conn.execute(
+        select(SchemaVersion.version).where(SchemaVersion.version == version)).first()
+    if exists is None:
+        conn.execute(insert(SchemaVersion).values(version=version))
+
+
+def add_column(conn, column):
+    """表上还没有该列时 ALTER TABLE 补上（列定义取自模型，需有默认值或可为空）"""
+    table = column.table.name
+    if column.name in {c['name'] for c in inspect(conn).get_columns(table)}:
+        return False
+    conn.exec_driver_sql(f'ALTER TABLE {table} ADD COLUMN {CreateColumn(column).compile(dialect=conn.dialect)}')
+    return True
+
+
+def upgrade(engine):
+    """建表、建浏览记录分区、补建索引并记录版本；可重复执行"""
+    from .catalog import ensure_version_sequence
+    from .indexes import ensure_indexes
+    from .partitions import ensure_partitions, index_segments
+    with engine.begin() as conn:
+        db.metadata.create_all(conn)
+        for name in REPLACED_TABLES:
+            conn.exec_driver_sql(f'DROP TABLE IF EXISTS {name}')
+        for table, column in ADDED_COLUMNS:
+            add_column(conn, db.metadata.tables[table].c[column])
+        ensure_version_sequence(conn)
+        ensure_partitions(conn)
+        index_segments(conn)
+    ensure_indexes(engine)
+    with engine.begin() as conn:
+        record_version(conn)
+
+
+class SchemaGuard:
+    """第一个请求时检查结构版本，未就绪时返回 503"""
+
+    def __init__(self):
+        self.ready = False
+
+    def init_app(self, app):
+        app.before_request(self._check)
+        app.extensions['schema_guard'] = self
+
+    def _check(self):
+        if self.ready:
+            return None
+        from flask import request
+        if request.endpoint in _EXEMPT_ENDPOINTS:
+            return None
+        version = current_version(db.engine)
+        if version is not None and version >= SCHEMA_VERSION:
+            if version > SCHEMA_VERSION:
+                logger.warning('数据库结构版本 %s 高于代码版本 %s', version, SCHEMA_VERSION)
+            self.ready = True
+            return None
+        state = '尚未初始化' if version is None else f'版本 {version} 低于代码版本 {SCHEMA_VERSION}'
+        return Response(f'数据库结构{state}，请先执行 flask --app run schema upgrade',
+                        status=503, mimetype='text/plain')
+
+
+schema_guard = SchemaGuard()
+
+
+schema_cli = AppGroup('schema', help='数据库结构初始化与版本')
+
+
+@schema_cli.command('upgrade')
+@click.option('--seed', is_flag=True, help='商品表为空时生成一套演示数据')
+@click.option('--force', is_flag=True, help='版本已是最新时也重新执行建表 / 分区 / 索引')
+def upgrade_command(seed, force):
+    """建表 / 分区 / 索引并记录结构版本"""
+    before = current_version(db.engine)
+    if before is not None and before > SCHEMA_VERSION:
+        raise click.ClickException(f'数据库结构版本 {before} 高于代码版本 {SCHEMA_VERSION}，请先升级代码')
+    if before == SCHEMA_VERSION and not force:
+        click.echo(f'数据库结构版本 {before} 已是最新，跳过升级')
+    else:
+        upgrade(db.engine)
+        click.echo(f'数据库结构版本: {before or "无"} → {SCHEMA_VERSION}')
+    if seed and not db.session.execute(select(Product.id).limit(1)).first():
+        from .seed import seed_data
+        db.session.remove()
+        click.echo('检测到空数据库，开始填充数据...')
+        seed_data()
+
+
+@schema_cli.command('status')
+def status_command():
+    """显示结构版本，库中版本落后时以非零状态退出"""
+    version = current_version(db.engine)
+    click.echo(f'代码版本: {SCHEMA_VERSION}，数据库版本: {version or "未初始化"}')
+    if version is None or version < SCHEMA_VERSION:
+        sys.exit(1)
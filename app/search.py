@@ -0,0 +1,165 @@
+"""
+商品名称 / 用户名的子串搜索索引
+
+SQLite：FTS5 外部内容表 + trigram 分词器（products_fts / users_fts），由触发器与
+主表在同一事务内同步，商品的保存、删除以及批量写入都会自动更新索引。
+PostgreSQL：pg_trgm 的 GIN 索引，LIKE '%kw%' 直接走索引。
+1～2 个字符的关键字（如按姓氏搜用户）没有 trigram 可用，另建一份单字 + 双字（bigram）索引：
+SQLite 上是无内容的 FTS5 表（products_grams / users_grams），每行存名称中所有单字和相邻双字，
+同样由触发器维护；PostgreSQL 上是 cpims_grams(列) 表达式的 GIN 索引。
+只有字母数字组成的短关键字走这条路径，其余（含空格、标点、通配符）仍退回主表 LIKE。
+"""
+import logging
+
+from sqlalchemy import Text, bindparam, cast, func, literal_column, select, text
+from sqlalchemy.dialects.postgresql import ARRAY, array
+
+from . import db
+from .models import Product, User
+
+# 表名 -> 被索引的列
+SEARCH_FIELDS = {
+    'products': 'name',
+    'users': 'username',
+}
+
+MIN_TRIGRAM_LENGTH = 3
+# 单字 / 双字索引覆盖的最大字符位置，与 products.name 的最大长度一致
+MAX_GRAM_POSITIONS = 100
+
+logger = logging.getLogger(__name__)
+
+# 进程内缓存：各引擎上已建好的 FTS 表
+_fts_ready = {}
+
+
+def _grams_sql(ref, col):
+    """名称中全部单字与相邻双字，以空格分隔（unicode61 分词后每个即一个词）"""
+    positions = '[' + ','.join(map(str, range(1, MAX_GRAM_POSITIONS + 1))) + ']'
+    return (f"(SELECT group_concat(g, ' ') FROM ("
+            f"SELECT substr({ref}.{col}, value, 1) AS g FROM json_each('{positions}') "
+            f"WHERE value <= length({ref}.{col}) UNION "
+            f"SELECT substr({ref}.{col}, value, 2) FROM json_each('{positions}') "
+            f"WHERE value < length({ref}.{col})))")
+
+
+def _sqlite_exists(conn, name):
+    return conn.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).first() is not None
+
+
+def _sqlite_statements(conn, table, col):
+    fts, grams = f'{table}_fts', f'{table}_grams'
+    # 只在虚拟表新建时回填已有数据，重复执行不再全量重建
+    new_fts, new_grams = not _sqlite_exists(conn, fts), not _sqlite_exists(conn, grams)
+    statements = [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+        f"{col}, content='{table}', content_rowid='id', tokenize='trigram')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {fts}(rowid, {col}) VALUES (new.id, new.{col}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {col}) VALUES ('delete', old.id, old.{col}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {col} ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {col}) VALUES ('delete', old.id, old.{col}); "
+        f"INSERT INTO {fts}(rowid, {col}) VALUES (new.id, new.{col}); END",
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {grams} USING fts5("
+        f"grams, content='', tokenize='unicode61')",
+        f"CREATE TRIGGER IF NOT EXISTS {grams}_ai AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {grams}(rowid, grams) VALUES (new.id, {_grams_sql('new', col)}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {grams}_ad AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {grams}({grams}, rowid, grams) VALUES ('delete', old.id, {_grams_sql('old', col)}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {grams}_au AFTER UPDATE OF {col} ON {table} BEGIN "
+        f"INSERT INTO {grams}({grams}, rowid, grams) VALUES ('delete', old.id, {_grams_sql('old', col)}); "
+        f"INSERT INTO {grams}(rowid, grams) VALUES (new.id, {_grams_sql('new', col)}); END",
+    ]
+    if new_fts:
+        statements.append(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+    if new_grams:
+        statements.append(f"INSERT INTO {grams}(rowid, grams) SELECT id, {_grams_sql(table, col)} FROM {table}")
+    return statements
+
+
+_PG_GRAMS_FUNCTION = """
+CREATE OR REPLACE FUNCTION cpims_grams(t text) RETURNS text[]
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT coalesce(array_agg(DISTINCT g), '{}') FROM (
+        SELECT substr(t, i, 1) AS g FROM generate_series(1, length(t)) AS i
+        UNION SELECT substr(t, i, 2) FROM generate_series(1, length(t) - 1) AS i) AS grams
+$$"""
+
+
+def _postgresql_statements(conn, table, col):
+    statements = [
+        f'CREATE INDEX IF NOT EXISTS ix_{table}_{col}_grams ON {table} USING gin (cpims_grams({col}))',
+    ]
+    if _has_pg_trgm(conn):
+        statements[:0] = [
+            'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+            f'CREATE INDEX IF NOT EXISTS ix_{table}_{col}_trgm ON {table} USING gin ({col} gin_trgm_ops)',
+        ]
+    return statements
+
+
+def _has_pg_trgm(conn):
+    return conn.exec_driver_sql(
+        "SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'").scalar() is not None
+
+
+def ensure_search_indexes(conn):
+    """建立（或补建）搜索索引，可重复执行"""
+    if conn.dialect.name == 'postgresql':
+        if not _has_pg_trgm(conn):
+            logger.warning('PostgreSQL 未安装 pg_trgm 扩展，3 个字符以上的名称搜索将不走索引')
+        conn.exec_driver_sql(_PG_GRAMS_FUNCTION)
+        statements = _postgresql_statements
+    else:
+        statements = _sqlite_statements
+    for table, col in SEARCH_FIELDS.items():
+        for sql in statements(conn, table, col):
+            conn.exec_driver_sql(sql)
+    _fts_ready.pop(conn.engine.url, None)
+
+
+def _has_fts(conn, name):
+    key = conn.engine.url
+    if key not in _fts_ready:
+        names = conn.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'table' "
+            "AND (name LIKE '%\\_fts' ESCAPE '\\' OR name LIKE '%\\_grams' ESCAPE '\\')"
+        ).scalars().all()
+        _fts_ready[key] = set(names)
+    return name in _fts_ready[key]
+
+
+def _fts_match(fts, keyword):
+    # 整个关键字作为一个短语；大小写不敏感，与 LIKE 一致
+    phrase = '"' + keyword.replace('"', '""') + '"'
+    return select(literal_column('rowid')).select_from(text(fts))\
+        .where(text(f'{fts} MATCH :{fts}_q').bindparams(bindparam(f'{fts}_q', phrase)))
+
+
+def _matching_ids(model, column, keyword):
+    """返回匹配关键字的 id 子查询，供 .in_() 使用"""
+    table = model.__tablename__
+    conn = db.session.connection()
+    short = len(keyword) < MIN_TRIGRAM_LENGTH and keyword.isalnum()
+    if conn.dialect.name == 'sqlite':
+        if not short and _has_fts(conn, f'{table}_fts'):
+            # trigram 分词下短语匹配即子串匹配
+            return _fts_match(f'{table}_fts', keyword)
+        if short and _has_fts(conn, f'{table}_grams'):
+            # unicode61 会折叠变音符号等，候选集再用 LIKE 精确过滤
+            return select(model.id).where(
+                model.id.in_(_fts_match(f'{table}_grams', keyword)), column.contains(keyword))
+    elif conn.dialect.name == 'postgresql' and short:
+        return select(model.id).where(
+            func.cpims_grams(column).op('@>')(cast(array([keyword]), ARRAY(Text))))
+    return select(model.id).where(column.contains(keyword))
+
+
+def product_ids_matching(keyword):
+    return _matching_ids(Product, Product.name, keyword)
+
+
+def user_ids_matching(keyword):
+    return _matching_ids(User, User.username, keyword)
@@ -1,95 +1,315 @@
-from faker import Faker
-from datetime import datetime, timedelta
+"""
+测试数据生成
+
+按给定行数生成用户、商品、浏览记录、销售记录，可扩展到百万用户 / 数千万浏览记录：
+- 相同 seed（与 end_date）得到完全相同的数据，与进程数无关（每个分块独立播种）；
+- 多进程并行生成，按分块写入（SQLite 用 Core executemany，PostgreSQL 用 COPY），
+  同时在途的分块数有上限，内存占用与总行数无关；
+- 商品热度服从 Zipf 分布，浏览时间带日内波峰波谷，更接近真实流量。
+
+命令行：flask --app run seed --users 1000000 --browse-logs 50000000 --workers 8
+"""
+import csv
+import io
+import math
 import random
+import time
+from collections import deque
+from datetime import date, datetime, timedelta
+from itertools import accumulate
+from multiprocessing import Pool
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import create_engine, text
+
 from . import db
-from .models import Product, User, BrowseLog, Sale
+from .models import Product, User, BrowseLog, Sale, BrowseArchive
+from .partitions import ensure_partitions
+
+CATEGORIES = ['电子产品', '家居用品', '服装鞋帽', '食品饮料', '图书文具', '运动户外', '美妆个护', '母婴玩具']
+UNITS = ['件', '台', '个', '套', '盒', '瓶', '本', '双']
+NAME_SUFFIXES = ['手机', '电脑', '耳机', '沙发', '衣服', '零食', '书籍', '球鞋']
+MODEL_PREFIXES = ['A', 'B', 'C', 'X', 'Y', 'Z']
+PLATFORMS = ['PC', 'APP', '移动端', '小程序']
+PLATFORM_WEIGHTS = [25, 40, 20, 15]
+PAYMENT_METHODS = ['支付宝', '微信支付', '银行卡', '货到付款', '信用卡']
+PAYMENT_WEIGHTS = [35, 40, 10, 5, 10]
+# 0~23 点的相对浏览量：凌晨低谷，午间与晚间高峰
+HOUR_WEIGHTS = [3, 2, 1, 1, 1, 2, 4, 7, 9, 10, 11, 13, 14, 12, 11, 11, 12, 13, 15, 18, 21, 22, 17, 9]
+
+# 表的生成顺序（先父表后子表）与列顺序
+TABLES = [
+    (User.__table__, ['id', 'username', 'address', 'phone']),
+    (Product.__table__, ['id', 'name', 'reg_date', 'category', 'model', 'unit', 'price', 'stock']),
+    (BrowseLog.__table__, ['id', 'user_id', 'product_id', 'browse_time', 'platform']),
+    (Sale.__table__, ['id', 'product_id', 'user_id', 'sale_date', 'unit_price', 'quantity',
+                      'total_amount', 'payment_method']),
+]
+_COLUMNS = {table.name: columns for table, columns in TABLES}
+
+POOL_SIZE = 2000 # Faker 只用来生成这么多个候选值，之后随机组合
+
+# 每个进程内的生成状态，由 _init_worker 设置
+_state = {}
+
+
+def _init_worker(options):
+    from faker import Faker
+    fake = Faker('zh_CN')
+    fake.seed_instance(options['seed'])
+    _state.clear()
+    _state.update(options)
+    _state['names'] = [fake.name() for _ in range(POOL_SIZE)]
+    _state['addresses'] = [fake.address() for _ in range(POOL_SIZE)]
+    _state['words'] = [fake.word() for _ in range(POOL_SIZE)]
+    _state['engine'] = None
+    if options['direct_copy']:
+        _state['engine'] = create_engine(options['database_uri'])
+
+
+def _chunk_rng(table_name, start_id):
+    # 只由 seed、表名和分块起始 id 决定，与哪个进程处理无关
+    return random.Random(f"{_state['seed']}:{table_name}:{start_id}")
+
+
+def _product_price(product_id):
+    prices = _state.get('prices')
+    if prices is None:
+        # 单价是商品 id 的确定函数，销售记录生成时无需查库
+        seed = _state['seed']
+        prices = _state['prices'] = [
+            round(random.Random(f'{seed}:price:{pid}').uniform(10, 5000), 2)
+            for pid in range(_state['products'] + 1)
+        ]
+    return prices[product_id]
+
+
+def _product_picker(rng):
+    """按 Zipf 分布抽商品：热度排名经可逆置换映射到商品 id，热门商品不集中在 id 前段"""
+    n = _state['products']
+    if 'zipf_cum' not in _state:
+        s = _state['zipf']
+        _state['zipf_cum'] = list(accumulate(1.0 / (rank ** s) for rank in range(1, n + 1)))
+        stride = 2654435761 % n or 1
+        while math.gcd(stride, n) != 1:
+            stride += 1
+        _state['zipf_stride'] = stride
+    cum, stride, ranks = _state['zipf_cum'], _state['zipf_stride'], range(n)
+
+    def pick(k):
+        return [(r * stride) % n + 1 for r in rng.choices(ranks, cum_weights=cum, k=k)]
+    return pick
+
+
+def _gen_users(rng, start_id, count):
+    names, addresses = _state['names'], _state['addresses']
+    return [(uid, rng.choice(names), rng.choice(addresses),
+             '1' + ''.join(rng.choices('0123456789', k=10)))
+            for uid in range(start_id, start_id + count)]
+
+
+def _gen_products(rng, start_id, count):
+    words, end = _state['words'], _state['end_date']
+    rows = []
+    for pid in range(start_id, start_id + count):
+        rows.append((pid, rng.choice(words) + rng.choice(NAME_SUFFIXES),
+                     end - timedelta(days=rng.randrange(730)), rng.choice(CATEGORIES),
+                     f'{rng.choice(MODEL_PREFIXES)}{rng.randint(100, 999)}', rng.choice(UNITS),
+                     _product_price(pid), rng.randint(0, 500)))
+    return rows
+
+
+def _gen_browse_logs(rng, start_id, count):
+    users, days, end = _state['users'], _state['days'], _state['end_date']
+    product_ids = _product_picker(rng)(count)
+    hours = rng.choices(range(24), weights=HOUR_WEIGHTS, k=count)
+    platforms = rng.choices(PLATFORMS, weights=PLATFORM_WEIGHTS, k=count)
+    start = datetime.combine(end, datetime.min.time())
+    rows = []
+    for i in range(count):
+        browse_time = start - timedelta(days=rng.randrange(days)) \
+            + timedelta(hours=hours[i], seconds=rng.randrange(3600))
+        rows.append((start_id + i, rng.randint(1, users), product_ids[i], browse_time, platforms[i]))
+    return rows
+
+
+def _gen_sales(rng, start_id, count):
+    users, days, end = _state['users'], _state['days'], _state['end_date']
+    product_ids = _product_picker(rng)(count)
+    methods = rng.choices(PAYMENT_METHODS, weights=PAYMENT_WEIGHTS, k=count)
+    rows = []
+    for i in range(count):
+        price = _product_price(product_ids[i])
+        quantity = rng.randint(1, 10)
+        rows.append((start_id + i, product_ids[i], rng.randint(1, users),
+                     end - timedelta(days=rng.randrange(days)), price, quantity,
+                     round(price * quantity, 2), methods[i]))
+    return rows
+
+
+_GENERATORS = {
+    'users': _gen_users,
+    'products': _gen_products,
+    'browse_logs': _gen_browse_logs,
+    'sales': _gen_sales,
+}
+
+
+def _copy_rows(engine, table_name, rows):
+    buf = io.StringIO()
+    csv.writer(buf).writerows(rows)
+    buf.seek(0)
+    raw = engine.raw_connection()
+    try:
+        with raw.cursor() as cur:
+            cur.copy_expert(f"COPY {table_name} ({', '.join(_COLUMNS[table_name])}) "
+                            f"FROM STDIN WITH (FORMAT csv)", buf)
+        raw.commit()
+    finally:
+        raw.close()
+
+
+def _generate_chunk(table_name, start_id, count):
+    """生成一个分块；PostgreSQL 下由子进程直接 COPY 入库，否则把行交回主进程写入"""
+    rows = _GENERATORS[table_name](_chunk_rng(table_name, start_id), start_id, count)
+    if _state['engine'] is not None:
+        _copy_rows(_state['engine'], table_name, rows)
+        return count
+    return rows
+
+
+def _insert_rows(conn, table, rows):
+    columns = _COLUMNS[table.name]
+    conn.execute(table.insert(), [dict(zip(columns, row)) for row in rows])
+
+
+def _reset_tables(conn):
+    from .catalog import bump_version
+    from .rollups import clear_rollups
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text('TRUNCATE sales, browse_logs, products, users, browse_archive '
+                          'RESTART IDENTITY CASCADE'))
+    else:
+        for table, _ in reversed(TABLES):
+            conn.execute(table.delete())
+        conn.execute(BrowseArchive.__table__.delete())
+    clear_rollups(conn)
+    bump_version(conn)
+
+
+def _finish(conn, counts):
+    from .catalog import bump_version
+    from .rollups import rebuild_rollups
+    if conn.dialect.name == 'postgresql':
+        for table, _ in TABLES:
+            if counts[table.name]:
+                conn.execute(text(f"SELECT setval('{table.name}_id_seq', :n, true)"),
+                             {'n': counts[table.name]})
+    rebuild_rollups(conn)
+    # 生成期间各 worker 可能缓存了同编号的旧商品，写完后再整体失效一次
+    bump_version(conn)
+
+
+def generate(users=100, products=150, browse_logs=1000, sales=600, seed=None,
+             workers=1, chunk_size=50000, days=365, end_date=None, zipf=1.1, echo=print,
+             progress=None):
+    """清空并生成测试数据，返回各表行数；progress(已写入行数, 总行数) 在每个分块写入后调用"""
+    engine = db.engine
+    counts = {'users': users, 'products': products, 'browse_logs': browse_logs, 'sales': sales}
+    options = {
+        'seed': random.randrange(2 ** 32) if seed is None else seed,
+        'users': users, 'products': products, 'days': days, 'zipf': zipf,
+        'end_date': end_date or date.today(),
+        'database_uri': engine.url.render_as_string(hide_password=False),
+        'direct_copy': engine.dialect.name == 'postgresql' and workers > 1,
+    }
+
+    with engine.begin() as conn:
+        _reset_tables(conn)
+        # PostgreSQL：先建好时间跨度内的月分区，数据直接落到各自分区
+        ensure_partitions(conn, start=options['end_date'] - timedelta(days=days), end=options['end_date'])
+
+    pool = None
+    if workers > 1:
+        pool = Pool(workers, initializer=_init_worker, initargs=(options,))
+    else:
+        _init_worker(options)
+    max_in_flight = max(2, workers * 2)
+    grand_total, done = sum(counts.values()), 0
+
+    try:
+        for table, _ in TABLES:
+            total = counts[table.name]
+            started, written = time.perf_counter(), 0
+            with engine.begin() as conn:
+                def sink(result):
+                    nonlocal written
+                    if isinstance(result, int):
+                        written += result
+                    else:
+                        if conn.dialect.name == 'postgresql':
+                            _copy_rows(engine, table.name, result)
+                        else:
+                            _insert_rows(conn, table, result)
+                        written += len(result)
+                    if progress is not None:
+                        progress(done + written, grand_total)
+
+                pending = deque()
+                for start_id in range(1, total + 1, chunk_size):
+                    args = (table.name, start_id, min(chunk_size, total - start_id + 1))
+                    if pool is None:
+                        sink(_generate_chunk(*args))
+                        continue
+                    pending.append(pool.apply_async(_generate_chunk, args))
+                    if len(pending) >= max_in_flight:
+                        sink(pending.popleft().get())
+                while pending:
+                    sink(pending.popleft().get())
+            done += written
+            elapsed = time.perf_counter() - started
+            echo(f'✓ {table.name}: {written} 行，{written / elapsed if elapsed else 0:,.0f} 行/秒')
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    from .cache import dashboard_cache
+    with engine.begin() as conn:
+        _finish(conn, counts)
+        dashboard_cache.clear_everywhere(conn)
+    return counts
 
-fake = Faker('zh_CN')
 
 def seed_data():
-    """生成大量测试数据（500+条记录）"""
-    
-    # 清空现有数据
-    db.session.query(Sale).delete()
-    db.session.query(BrowseLog).delete()
-    db.session.query(Product).delete()
-    db.session.query(User).delete()
-    db.session.commit()
-    
+    """生成一套小规模演示数据（100 用户 / 150 商品 / 1000 浏览 / 600 销售）"""
     print("开始生成数据...")
-    
-    # 1. 生成100个用户
-    users = []
-    for i in range(100):
-        user = User(
-            username=fake.name(),
-            address=fake.address(),
-            phone=fake.phone_number()
-        )
-        users.append(user)
-    db.session.add_all(users)
-    db.session.commit()
-    print(f"✓ 已生成 {len(users)} 个用户")
-    
-    # 2. 生成150个商品
-    categories = ['电子产品', '家居用品', '服装鞋帽', '食品饮料', '图书文具', '运动户外', '美妆个护', '母婴玩具']
-    units = ['件', '台', '个', '套', '盒', '瓶', '本', '双']
-    
-    products = []
-    for i in range(150):
-        category = random.choice(categories)
-        product = Product(
-            name=fake.word() + random.choice(['手机', '电脑', '耳机', '沙发', '衣服', '零食', '书籍', '球鞋'][:8]),
-            reg_date=fake.date_between(start_date='-2y', end_date='today'),
-            category=category,
-            model=f"{random.choice(['A', 'B', 'C', 'X', 'Y', 'Z'])}{random.randint(100, 999)}",
-            unit=random.choice(units),
-            price=round(random.uniform(10, 5000), 2),
-            stock=random.randint(0, 500)
-        )
-        products.append(product)
-    db.session.add_all(products)
-    db.session.commit()
-    print(f"✓ 已生成 {len(products)} 个商品")
-    
-    # 3. 生成1000条浏览记录
-    browse_logs = []
-    platforms = ['PC', 'APP', '移动端', '小程序']
-    for i in range(1000):
-        log = BrowseLog(
-            user_id=random.choice(users).id,
-            product_id=random.choice(products).id,
-            browse_time=fake.date_time_between(start_date='-1y', end_date='now'),
-            platform=random.choice(platforms)
-        )
-        browse_logs.append(log)
-    db.session.add_all(browse_logs)
-    db.session.commit()
-    print(f"✓ 已生成 {len(browse_logs)} 条浏览记录")
-    
-    # 4. 生成600条销售记录
-    payment_methods = ['支付宝', '微信支付', '银行卡', '货到付款', '信用卡']
-    sales = []
-    for i in range(600):
-        product = random.choice(products)
-        quantity = random.randint(1, 10)
-        unit_price = float(product.price)
-        total = round(unit_price * quantity, 2)
-        
-        sale = Sale(
-            product_id=product.id,
-            user_id=random.choice(users).id,
-            sale_date=fake.date_between(start_date='-1y', end_date='today'),
-            unit_price=unit_price,
-            quantity=quantity,
-            total_amount=total,
-            payment_method=random.choice(payment_methods)
-        )
-        sales.append(sale)
-    db.session.add_all(sales)
-    db.session.commit()
-    print(f"✓ 已生成 {len(sales)} 条销售记录")
-    
+    counts = generate()
     print(f"\n数据生成完成！")
-    print(f"总计: {len(users)} 用户, {len(products)} 商品, {len(browse_logs)} 浏览记录, {len(sales)} 销售记录")
-    print(f"数据总量: {len(users) + len(products) + len(browse_logs) + len(sales)} 条")
+    print(f"总计: {counts['users']} 用户, {counts['products']} 商品, "
+          f"{counts['browse_logs']} 浏览记录, {counts['sales']} 销售记录")
+    print(f"数据总量: {sum(counts.values())} 条")
+
+
+@click.command('seed')
+@click.option('--users', default=100, show_default=True, help='用户数')
+@click.option('--products', default=150, show_default=True, help='商品数')
+@click.option('--browse-logs', default=1000, show_default=True, help='浏览记录数')
+@click.option('--sales', default=600, show_default=True, help='销售记录数')
+@click.option('--seed', type=int, default=None, help='随机种子，相同种子生成相同数据')
+@click.option('--workers', default=1, show_default=True, help='并行生成的进程数')
+@click.option('--chunk-size', default=50000, show_default=True, help='每批写入行数')
+@click.option('--days', default=365, show_default=True, help='浏览/销售时间跨度（天）')
+@click.option('--end-date', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help='时间跨度的截止日期，默认今天')
+@click.option('--zipf', default=1.1, show_default=True, help='商品热度 Zipf 指数')
+@with_appcontext
+def seed_command(users, products, browse_logs, sales, seed, workers, chunk_size, days,
+                 end_date, zipf):
+    """清空数据库并生成测试数据"""
+    started = time.perf_counter()
+    counts = generate(users=users, products=products, browse_logs=browse_logs, sales=sales,
+                      seed=seed, workers=workers, chunk_size=chunk_size, days=days,
+                      end_date=end_date.date() if end_date else None, zipf=zipf, echo=click.echo)
+    click.echo(f'共 {sum(counts.values())} 行，用时 {time.perf_counter() - started:.1f} 秒')
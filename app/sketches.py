@@ -0,0 +1,867 @@
+"""
+独立访客 / 独立买家的基数草图与热门商品的 Count-Min 草图
+
+看板上的“独立访客”“独立买家”本来要对明细表做 COUNT(DISTINCT user_id)，耗时随明细增长。
+这里为每个 (种类, 键, 日/月) 维护一个 HyperLogLog（P=12，相对标准误差约 1.6%）：
+
+- viewers:product  键为商品编号，浏览该商品的用户
+- viewers:platform 键为浏览方式，按渠道的浏览用户（各渠道合并即全站独立访客）
+- buyers:category  键为品类，购买该品类商品的用户
+
+另外每天、每月各有一个商品浏览量（top:views）与销量（top:sales）的 Count-Min 草图，
+附带当期估计值最高的若干候选商品，用来在任意区间里找热门商品。
+
+草图随浏览、销售记录写入计算增量（与 rollups.py 的汇总表走同样的入口），但不在写入事务里落库：
+合并草图要对当天全站共用的 Count-Min 行加行锁，放在下单事务里会把所有下单串行起来。
+增量挂在连接上，事务提交成功后交给进程内的 sketch_buffer 合并，由后台线程每 SKETCH_FLUSH_INTERVAL 秒
+在独立事务里写入一次；事务回滚或提交失败时丢弃。连接的 commit 事件在数据库提交之前触发，所以那里只把增量移到
+本线程，会话在 after_commit 里、直接用连接写入的代码经 transaction() 在提交返回后才交出。
+进程被强制结束（SIGKILL、worker 超时）时尚未写入的增量会丢失（正常退出时 atexit 会写完），
+草图因此只会略微偏小，`flask sketches rebuild` 可从明细表恢复。草图按日和按月各存一份：查询区间拆成整月加首尾零散的日，一年的区间最多合并 70 个左右的草图。
+HyperLogLog 按寄存器取最大值合并，Count-Min 按计数器相加合并，所以任意区间都能合并出结果。
+草图只增不减：删除商品时直接删掉该商品的草图，删除用户、删除单条记录不会从草图中扣除，
+修改商品品类后已有的买家也仍记在原品类下，`flask rollups rebuild`（或 `flask sketches rebuild`）会从明细表重新计算。
+`flask sketches check` 把估计值与精确的 COUNT(DISTINCT) 对比，误差超出范围时以非零状态退出。
+"""
+import atexit
+import heapq
+import logging
+import math
+import os
+import random
+import struct
+import sys
+import threading
+import time
+import zlib
+from array import array
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from operator import add, itemgetter
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import and_, delete, event, func, or_, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Engine
+
+from . import db
+from .models import BrowseLog, Product, Sale, Sketch
+from .partitions import add_months, month_start
+
+logger = logging.getLogger(__name__)
+
+VIEWERS_PRODUCT = 'viewers:product'
+VIEWERS_PLATFORM = 'viewers:platform'
+BUYERS_CATEGORY = 'buyers:category'
+TOP_VIEWS = 'top:views'
+TOP_SALES = 'top:sales'
+
+DAY = 'D'
+MONTH = 'M'
+
+P = 12 # HyperLogLog 寄存器下标位数
+M = 1 << P
+HLL_ERROR = 1.04 / math.sqrt(M) # 相对标准误差
+SPARSE_LIMIT = M // 4 # 稀疏形式超过这么多个寄存器后转为定长数组
+
+CMS_DEPTH = 4
+CMS_WIDTH = 2048
+CMS_EPSILON = math.e / CMS_WIDTH # 估计值比真实值多出的部分不超过 ε·总量……
+CMS_DELTA = math.exp(-CMS_DEPTH) # ……的概率至少为 1 - δ
+CMS_CANDIDATES = 32 # 每个草图保留的候选热门商品数
+
+_REST_BITS = 64 - P
+_REST_MASK = (1 << _REST_BITS) - 1
+_ALPHA = 0.7213 / (1 + 1.079 / M)
+_POW = tuple(2.0 ** -r for r in range(_REST_BITS + 2))
+_MASK64 = (1 << 64) - 1
+_CMS_SEEDS = (0x243F6A8885A308D3, 0x13198A2E03707344, 0xA4093822299F31D0, 0x082EFA98EC4E6C89)
+
+# 序列化格式的首字节
+_SPARSE, _DENSE, _CMS = 1, 2, 3
+
+_table = Sketch.__table__
+_KEY_COLUMNS = ('kind', 'grain', 'period', 'key')
+_LOAD_CHUNK = 5000 # 按主键批量读取时每条语句的 key 个数
+
+
+def _mix64(x):
+    """splitmix64：把整数编号打散成均匀的 64 位哈希"""
+    x = (x + 0x9E3779B97F4A7C15) & _MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return x ^ (x >> 31)
+
+
+@lru_cache(maxsize=1 << 16)
+def _hll_point(user_id):
+    """用户编号 -> (寄存器下标, 前导零个数 + 1)"""
+    h = _mix64(user_id)
+    return h >> _REST_BITS, _REST_BITS + 1 - (h & _REST_MASK).bit_length()
+
+
+@lru_cache(maxsize=1 << 16)
+def _cms_cells(item):
+    return tuple(row * CMS_WIDTH + _mix64(item ^ seed) % CMS_WIDTH
+                 for row, seed in enumerate(_CMS_SEEDS))
+
+
+def _pack(values):
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tobytes()
+
+
+def _unpack(typecode, data):
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+class HyperLogLog:
+    """寄存器少时以 {下标: 值} 稀疏存放，多了转为 M 字节的数组"""
+    __slots__ = ('sparse', 'dense')
+
+    def __init__(self):
+        self.sparse = {}
+        self.dense = None
+
+    def add(self, user_id):
+        self._set(*_hll_point(user_id))
+
+    def add_all(self, user_ids):
+        points = map(_hll_point, user_ids)
+        if self.dense is None and not self.sparse and len(user_ids) <= SPARSE_LIMIT:
+            # 空草图：按值从小到大排序后建字典，同一下标保留最大值
+            self.sparse = dict(sorted(points, key=itemgetter(1)))
+            return
+        if self.dense is None and len(self.sparse) + len(user_ids) <= SPARSE_LIMIT:
+            sparse = self.sparse
+            for index, rank in points:
+                if rank > sparse.get(index, 0):
+                    sparse[index] = rank
+            return
+        if self.dense is None:
+            self._densify()
+        dense = self.dense
+        for index, rank in points:
+            if rank > dense[index]:
+                dense[index] = rank
+
+    def _set(self, index, rank):
+        if self.dense is not None:
+            if rank > self.dense[index]:
+                self.dense[index] = rank
+        elif rank > self.sparse.get(index, 0):
+            self.sparse[index] = rank
+            if len(self.sparse) > SPARSE_LIMIT:
+                self._densify()
+
+    def _densify(self):
+        dense = bytearray(M)
+        for index, rank in self.sparse.items():
+            dense[index] = rank
+        self.dense, self.sparse = dense, {}
+
+    def update(self, other):
+        """合并另一个草图（取并集），返回自身"""
+        if other.dense is not None:
+            if self.dense is None:
+                self._densify()
+            self.dense = bytearray(map(max, self.dense, other.dense))
+        else:
+            for index, rank in other.sparse.items():
+                self._set(index, rank)
+        return self
+
+    @classmethod
+    def union(cls, sketches):
+        result = cls()
+        dense = [s.dense for s in sketches if s.dense is not None]
+        if len(dense) == 1:
+            result.dense = bytearray(dense[0])
+        elif dense:
+            result.dense = bytearray(map(max, *dense))
+        for s in sketches:
+            if s.dense is None:
+                for index, rank in s.sparse.items():
+                    result._set(index, rank)
+        return result
+
+    def count(self):
+        """基数估计；小基数时改用线性计数"""
+        if self.dense is None:
+            zeros = M - len(self.sparse)
+            total = zeros + sum(_POW[r] for r in self.sparse.values())
+        else:
+            zeros = self.dense.count(0)
+            total = sum(map(_POW.__getitem__, self.dense))
+        estimate = _ALPHA * M * M / total
+        if estimate <= 2.5 * M and zeros:
+            estimate = M * math.log(M / zeros)
+        return round(estimate)
+
+    def to_bytes(self):
+        if self.dense is not None:
+            return bytes([_DENSE]) + zlib.compress(bytes(self.dense))
+        packed = array('I', sorted(index << 6 | rank for index, rank in self.sparse.items()))
+        return bytes([_SPARSE]) + _pack(packed)
+
+    @classmethod
+    def from_bytes(cls, data):
+        sketch = cls()
+        if data[0] == _DENSE:
+            sketch.dense = bytearray(zlib.decompress(data[1:]))
+        else:
+            sketch.sparse = {v >> 6: v & 63 for v in _unpack('I', data[1:])}
+        return sketch
+
+
+class CountMin:
+    """CMS_DEPTH × CMS_WIDTH 的计数器，外加候选热门商品集合"""
+    __slots__ = ('counters', 'candidates')
+
+    def __init__(self, counters=None, candidates=()):
+        self.counters = counters if counters is not None else [0] * (CMS_DEPTH * CMS_WIDTH)
+        self.candidates = set(candidates)
+
+    def add(self, item, count=1):
+        counters = self.counters
+        for cell in _cms_cells(item):
+            counters[cell] += count
+        self.candidates.add(item)
+
+    def add_all(self, counts):
+        """counts: {item: 数量}"""
+        counters = self.counters
+        for item, count in counts.items():
+            for cell in _cms_cells(item):
+                counters[cell] += count
+        self.candidates.update(counts)
+
+    def estimate(self, item):
+        counters = self.counters
+        return min(counters[cell] for cell in _cms_cells(item))
+
+    @property
+    def total(self):
+        """计入的总量（每一行计数器之和都相同）"""
+        return sum(self.counters[:CMS_WIDTH])
+
+    def update(self, other):
+        self.counters = list(map(add, self.counters, other.counters))
+        self.candidates |= other.candidates
+        return self
+
+    @classmethod
+    def union(cls, sketches):
+        if not sketches:
+            return cls()
+        if len(sketches) == 1:
+            counters = list(sketches[0].counters)
+        else:
+            counters = list(map(sum, zip(*(s.counters for s in sketches))))
+        return cls(counters, set().union(*(s.candidates for s in sketches)))
+
+    def top(self, n):
+        """估计值最高的 n 个候选 [(item, estimate)]"""
+        best = heapq.nlargest(n, ((self.estimate(item), item) for item in self.candidates))
+        return [(item, estimate) for estimate, item in best]
+
+    def to_bytes(self):
+        keep = array('I', (item for item, _ in self.top(CMS_CANDIDATES)))
+        return bytes([_CMS]) + struct.pack('<H', len(keep)) + _pack(keep) \
+            + zlib.compress(_pack(array('Q', self.counters)))
+
+    @classmethod
+    def from_bytes(cls, data):
+        (n,) = struct.unpack_from('<H', data, 1)
+        end = 3 + 4 * n
+        return cls(_unpack('Q', zlib.decompress(data[end:])).tolist(), _unpack('I', data[3:end]))
+
+
+def decode(data):
+    if not data:
+        return None
+    if data[0] == _CMS:
+        return CountMin.from_bytes(data)
+    return HyperLogLog.from_bytes(data)
+
+
+# ---------- 写入 ----------
+
+def _insert(conn):
+    if conn.dialect.name == 'postgresql':
+        return postgresql.insert(_table)
+    return sqlite.insert(_table)
+
+
+def _load(conn, keys):
+    """按主键顺序加行锁并读出序列化的草图 {主键: bytes}"""
+    groups = defaultdict(list)
+    for kind, grain, period, key in sorted(keys):
+        groups[(kind, grain, period)].append(key)
+    found = {}
+    # 按 (种类, 粒度, 日期) 分组，每条语句用主键前缀定位，再按 key 列表取行
+    for (kind, grain, period), group in groups.items():
+        for i in range(0, len(group), _LOAD_CHUNK):
+            stmt = select(_table.c.key, _table.c.data).where(
+                _table.c.kind == kind, _table.c.grain == grain, _table.c.period == period,
+                _table.c.key.in_(group[i:i + _LOAD_CHUNK])).order_by(_table.c.key)
+            for key, data in conn.execute(stmt.with_for_update()):
+                found[(kind, grain, period, key)] = data
+    return found
+
+
+def _write(conn, deltas, merge=True):
+    """把增量草图 {主键: 草图} 合并进库；merge=False 表示库里肯定没有这些行，直接插入"""
+    if not deltas:
+        return
+    keys = sorted(deltas)
+    stored = {}
+    if merge:
+        # 先占位再按主键顺序加行锁（SQLite 上这条写入拿到库的写锁），
+        # 并发写同一个草图时读到的一定是对方提交后的内容，不会互相覆盖
+        conn.execute(_insert(conn).on_conflict_do_nothing(),
+                     [dict(zip(_KEY_COLUMNS, k), data=b'') for k in keys])
+        stored = _load(conn, keys)
+    rows = []
+    for k in keys:
+        old = stored.get(k)
+        sketch = decode(old).update(deltas[k]) if old else deltas[k]
+        data = sketch.to_bytes()
+        # 老用户再次访问时寄存器往往不变，内容相同的行不再回写
+        if data != old:
+            rows.append(dict(zip(_KEY_COLUMNS, k), data=data))
+    if not rows:
+        return
+    stmt = _insert(conn)
+    if merge:
+        stmt = stmt.on_conflict_do_update(index_elements=list(_KEY_COLUMNS),
+                                          set_={'data': stmt.excluded.data})
+    conn.execute(stmt, rows)
+
+
+def _as_day(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, str):
+        return date.fromisoformat(value[:10])
+    return value
+
+
+def _getter(row):
+    return row.get if isinstance(row, dict) else lambda k, row=row: getattr(row, k)
+
+
+class _Deltas(dict):
+    """一批记录产生的增量草图，日与当月各一份"""
+
+    def _sketch(self, key, factory):
+        sketch = self.get(key)
+        if sketch is None:
+            sketch = self[key] = factory()
+        return sketch
+
+    def add_users(self, kind, groups):
+        """groups: {(日期, key): 用户编号集合}"""
+        months = defaultdict(set)
+        for (day, key), users in groups.items():
+            self._sketch((kind, DAY, day, key), HyperLogLog).add_all(users)
+            months[(month_start(day), key)] |= users
+        for (month, key), users in months.items():
+            self._sketch((kind, MONTH, month, key), HyperLogLog).add_all(users)
+
+    def add_counts(self, kind, counts):
+        """counts: {(日期, 商品编号): 数量}"""
+        days = defaultdict(dict)
+        for (day, item), count in counts.items():
+            days[day][item] = count
+        for day, items in days.items():
+            self._sketch((kind, DAY, day, ''), CountMin).add_all(items)
+            month = self._sketch((kind, MONTH, month_start(day), ''), CountMin)
+            month.add_all(items)
+
+
+def _browse_deltas(rows):
+    """rows: (日期, 用户编号, 商品编号, 浏览方式)"""
+    viewers = defaultdict(set)
+    platforms = defaultdict(set)
+    views = Counter()
+    for day, user_id, product_id, platform in rows:
+        viewers[(day, product_id)].add(user_id)
+        platforms[(day, platform or '')].add(user_id)
+        views[(day, product_id)] += 1
+    deltas = _Deltas()
+    deltas.add_users(VIEWERS_PRODUCT, {(day, str(pid)): users for (day, pid), users in viewers.items()})
+    deltas.add_users(VIEWERS_PLATFORM, platforms)
+    deltas.add_counts(TOP_VIEWS, views)
+    return deltas
+
+
+def _sales_deltas(rows, categories):
+    """rows: (日期, 用户编号, 商品编号, 数量)"""
+    buyers = defaultdict(set)
+    quantities = Counter()
+    for day, user_id, product_id, quantity in rows:
+        buyers[(day, categories.get(product_id) or '')].add(user_id)
+        quantities[(day, product_id)] += quantity or 0
+    deltas = _Deltas()
+    deltas.add_users(BUYERS_CATEGORY, buyers)
+    deltas.add_counts(TOP_SALES, quantities)
+    return deltas
+
+
+def _merge_into(target, deltas):
+    for key, sketch in deltas.items():
+        current = target.get(key)
+        if current is None:
+            target[key] = sketch
+        else:
+            current.update(sketch)
+
+
+class SketchBuffer:
+    """事务提交后的增量草图在进程内合并，由后台线程定期写入库中"""
+
+    def __init__(self):
+        self.app = None
+        self.enabled = True
+        self.flush_interval = 2.0
+        self._pending = {}
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stopping = False
+        self._stats = {'merged': 0, 'flushes': 0, 'written': 0, 'failed': 0,
+                       'flush_ms_total': 0.0, 'flush_ms_max': 0.0}
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get('SKETCH_BUFFER', self.enabled)
+        self.flush_interval = app.config.get('SKETCH_FLUSH_INTERVAL', self.flush_interval)
+        app.extensions['sketch_buffer'] = self
+        atexit.register(self.shutdown)
+
+    @property
+    def active(self):
+        return self.enabled and self.app is not None
+
+    def add(self, deltas):
+        with self._cond:
+            _merge_into(self._pending, deltas)
+            self._stats['merged'] += len(deltas)
+        self._ensure_thread()
+
+    def _ensure_thread(self):
+        # gunicorn fork 之后线程不会被继承，按进程号懒启动
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._cond:
+            if self._pid != os.getpid() or self._thread is None or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._stopping = False
+                self._thread = threading.Thread(target=self._run, name='sketch-flush', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait(self.flush_interval)
+                stopping = self._stopping
+            self.flush()
+            if stopping:
+                return
+
+    def flush(self):
+        """把当前累积的增量写入库中；失败时放回缓冲区，下次再写"""
+        with self._flush_lock:
+            with self._cond:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return
+            started = time.perf_counter()
+            try:
+                with self.app.app_context(), db.engine.begin() as conn:
+                    _write(conn, pending)
+            except Exception:
+                logger.exception('草图增量写入失败，%d 个草图留待下次写入', len(pending))
+                with self._cond:
+                    # 失败期间新到的增量合并进旧的那份
+                    _merge_into(pending, self._pending)
+                    self._pending = pending
+                    self._stats['failed'] += 1
+                return
+            elapsed = (time.perf_counter() - started) * 1000
+            with self._cond:
+                self._stats['flushes'] += 1
+                self._stats['written'] += len(pending)
+                self._stats['flush_ms_total'] += elapsed
+                self._stats['flush_ms_max'] = max(self._stats['flush_ms_max'], elapsed)
+
+    def shutdown(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout=30)
+        if self.app is not None:
+            self.flush()
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats['pending'] = len(self._pending)
+        stats['enabled'] = self.active
+        stats['flush_ms_avg'] = round(stats['flush_ms_total'] / stats['flushes'], 2) if stats['flushes'] else 0.0
+        stats['flush_ms_max'] = round(stats['flush_ms_max'], 2)
+        del stats['flush_ms_total']
+        return stats
+
+
+sketch_buffer = SketchBuffer()
+
+
+def _stage(conn, deltas):
+    """增量挂在连接上，提交后交给 sketch_buffer；未启用缓冲（或测试中直接调用）时在当前事务内写入"""
+    if not deltas:
+        return
+    if not sketch_buffer.active:
+        _write(conn, deltas)
+        return
+    _merge_into(conn.info.setdefault('sketch_deltas', {}), deltas)
+
+
+_committing = threading.local() # 本线程正在提交的事务的增量
+
+
+@event.listens_for(Engine, 'commit')
+def _hold_on_commit(conn):
+    # commit 事件在数据库提交之前触发：增量先移到本线程，提交成功后再交给 sketch_buffer
+    deltas = conn.info.pop('sketch_deltas', None)
+    if deltas:
+        held = getattr(_committing, 'deltas', None)
+        if held is None:
+            _committing.deltas = deltas
+        else:
+            _merge_into(held, deltas)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _hand_over(session=None):
+    deltas, _committing.deltas = getattr(_committing, 'deltas', None), None
+    if deltas:
+        sketch_buffer.add(deltas)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _drop_committing(session=None):
+    _committing.deltas = None
+
+
+@contextmanager
+def transaction(engine):
+    """代替 engine.begin()：直接用连接写浏览、销售记录时，提交成功后才把草图增量交给 sketch_buffer"""
+    try:
+        with engine.begin() as conn:
+            yield conn
+    except BaseException:
+        _drop_committing()
+        raise
+    _hand_over()
+
+
+@event.listens_for(Engine, 'rollback')
+def _discard_on_rollback(conn):
+    # 连接断开后已失效，读不到 info（随连接一起丢弃）
+    if not conn.invalidated:
+        conn.info.pop('sketch_deltas', None)
+
+
+def _browse_rows(logs):
+    rows = []
+    for log in logs:
+        get = _getter(log)
+        rows.append((_as_day(get('browse_time')), get('user_id'), get('product_id'), get('platform')))
+    return rows
+
+
+def record_browse(conn, logs):
+    """把一批浏览记录（dict 或 BrowseLog 对象，需带 user_id）计入草图（提交后异步写入）"""
+    _stage(conn, _browse_deltas(_browse_rows(logs)))
+
+
+def record_sales(conn, sales):
+    """把一批销售记录（dict 或 Sale 对象，需带 user_id）计入草图（提交后异步写入）"""
+    rows = []
+    for s in sales:
+        get = _getter(s)
+        rows.append((_as_day(get('sale_date')), get('user_id'), get('product_id'), get('quantity')))
+    if not rows:
+        return
+    categories = dict(conn.execute(select(Product.id, Product.category)
+                                   .where(Product.id.in_({r[2] for r in rows}))).all())
+    _stage(conn, _sales_deltas(rows, categories))
+
+
+def drop_products(conn, product_ids):
+    """删除这些商品的独立访客草图（Count-Min 的候选在查询时按商品表过滤）"""
+    keys = [str(pid) for pid in product_ids]
+    for i in range(0, len(keys), 5000):
+        conn.execute(delete(Sketch).where(Sketch.kind == VIEWERS_PRODUCT,
+                                          Sketch.key.in_(keys[i:i + 5000])))
+
+
+def clear_sketches(conn):
+    conn.execute(_table.delete())
+
+
+def _months(conn, column):
+    lo, hi = conn.execute(select(func.min(column), func.max(column))).one()
+    if lo is None:
+        return []
+    month, last = month_start(_as_day(lo)), month_start(_as_day(hi))
+    months = []
+    while month <= last:
+        months.append(month)
+        month = add_months(month, 1)
+    return months
+
+
+def _month_bounds(month):
+    return datetime.combine(month, datetime.min.time()), \
+        datetime.combine(add_months(month, 1), datetime.min.time())
+
+
+def rebuild_sketches(conn):
+    """清空并从明细表（以及浏览记录的归档段）重新计算全部草图，逐月处理控制内存"""
+    from .partitions import frozen_segment_rows
+    from .rollups import _day_expr
+    clear_sketches(conn)
+    browse_day = _day_expr(conn, BrowseLog.browse_time)
+    for month in _months(conn, BrowseLog.browse_time):
+        lo, hi = _month_bounds(month)
+        logs = conn.execute(
+            select(browse_day, BrowseLog.user_id, BrowseLog.product_id, BrowseLog.platform)
+            .where(BrowseLog.browse_time >= lo, BrowseLog.browse_time < hi)).all()
+        # SQLite 上 date() 返回字符串，同一天的字符串只解析一次
+        days = {}
+        _write(conn, _browse_deltas(
+            (days.get(d) or days.setdefault(d, _as_day(d)), u, p, pf) for d, u, p, pf in logs),
+            merge=False)
+    categories = dict(conn.execute(select(Product.id, Product.category)).all())
+    for month in _months(conn, Sale.sale_date):
+        sales = conn.execute(
+            select(Sale.sale_date, Sale.user_id, Sale.product_id, Sale.quantity)
+            .where(Sale.sale_date >= month, Sale.sale_date < add_months(month, 1))).all()
+        _write(conn, _sales_deltas(sales, categories), merge=False)
+    # 归档段的月份里明细表可能还有零散的行，与已有草图合并（重建在本事务内直接写入）
+    for rows in frozen_segment_rows(conn):
+        _write(conn, _browse_deltas(_browse_rows(rows)))
+
+
+# ---------- 查询 ----------
+
+def _split_range(start, end):
+    """把 [start, end] 拆成整月与首尾零散的日，返回 SQL 条件"""
+    first = start if start.day == 1 else add_months(month_start(start), 1)
+    last = month_start(end + timedelta(days=1)) # 它之前的月份都整月落在区间内
+    if first >= last:
+        return [and_(_table.c.grain == DAY, _table.c.period.between(start, end))]
+    return [
+        and_(_table.c.grain == MONTH, _table.c.period >= first, _table.c.period < last),
+        and_(_table.c.grain == DAY, _table.c.period >= start, _table.c.period < first),
+        and_(_table.c.grain == DAY, _table.c.period >= last, _table.c.period <= end),
+    ]
+
+
+def _fetch(kind, start, end, keys=None):
+    """区间 [start, end]（None 表示不限）内各 key 的草图列表 {key: [草图]}"""
+    if start is None or end is None:
+        lo, hi = db.session.execute(
+            select(func.min(_table.c.period), func.max(_table.c.period))
+            .where(_table.c.kind == kind, _table.c.grain == DAY)).one()
+        if lo is None:
+            return {}
+        start, end = start or lo, end or hi
+    if start > end:
+        return {}
+    stmt = select(_table.c.key, _table.c.data) \
+        .where(_table.c.kind == kind, or_(*_split_range(start, end)))
+    if keys is not None:
+        stmt = stmt.where(_table.c.key.in_(list(keys)))
+    found = defaultdict(list)
+    for key, data in db.session.execute(stmt):
+        sketch = decode(data)
+        if sketch is not None:
+            found[key].append(sketch)
+    return found
+
+
+def unique_counts(kind, start=None, end=None, keys=None):
+    """区间内每个 key 的独立用户数估计 {key: n}，相对标准误差 HLL_ERROR"""
+    return {key: HyperLogLog.union(sketches).count()
+            for key, sketches in _fetch(kind, start, end, keys).items()}
+
+
+def unique_total(kind, start=None, end=None, keys=None):
+    """区间内所有 key 合并后的独立用户数估计"""
+    return unique_breakdown(kind, start, end, keys)[1]
+
+
+def unique_breakdown(kind, start=None, end=None, keys=None):
+    """一次读取同时返回 ({key: n}, 合计)"""
+    merged = {key: HyperLogLog.union(sketches)
+              for key, sketches in _fetch(kind, start, end, keys).items()}
+    total = HyperLogLog.union(list(merged.values())).count()
+    return {key: sketch.count() for key, sketch in merged.items()}, total
+
+
+def daily_unique(kind, key, start=None, end=None):
+    """单个 key 逐日的独立用户数估计 [(day, n)]"""
+    stmt = select(_table.c.period, _table.c.data) \
+        .where(_table.c.kind == kind, _table.c.key == key, _table.c.grain == DAY)
+    if start is not None:
+        stmt = stmt.where(_table.c.period >= start)
+    if end is not None:
+        stmt = stmt.where(_table.c.period <= end)
+    return [(day, decode(data).count())
+            for day, data in db.session.execute(stmt.order_by(_table.c.period))]
+
+
+def heavy_hitters(kind, start=None, end=None, n=10):
+    """
+    区间内估计值最高的 n 个商品，返回 ([(product_id, estimate)], 误差上限)。
+    估计值不低于真实值，以 1 - CMS_DELTA 的概率至多多出误差上限。
+    """
+    merged = CountMin.union([s for group in _fetch(kind, start, end).values() for s in group])
+    existing = set(db.session.execute(
+        select(Product.id).where(Product.id.in_(merged.candidates))).scalars()) \
+        if merged.candidates else set()
+    merged.candidates &= existing
+    return merged.top(n), math.ceil(CMS_EPSILON * merged.total)
+
+
+sketches_cli = AppGroup('sketches', help='独立访客/买家与热门商品草图')
+
+
+@sketches_cli.command('rebuild')
+def rebuild_command():
+    """从明细表重新计算全部草图"""
+    started = time.perf_counter()
+    with db.engine.begin() as conn:
+        rebuild_sketches(conn)
+    with db.engine.connect() as conn:
+        rows, size = conn.execute(select(func.count(), func.sum(func.length(_table.c.data)))).one()
+    click.echo(f'草图重建完成：{rows} 个，共 {(size or 0) / 1024:.0f} KB，'
+               f'用时 {time.perf_counter() - started:.1f} 秒')
+
+
+def _exact_distinct(stmt):
+    return db.session.execute(stmt).scalar() or 0
+
+
+def _within(estimate, exact, sigmas):
+    """误差在 sigmas 倍标准误差之内（小基数时至少允许差 2）"""
+    return abs(estimate - exact) <= max(2, sigmas * HLL_ERROR * exact)
+
+
+@sketches_cli.command('check')
+@click.option('--samples', default=50, show_default=True, help='随机抽查的 (商品, 区间) 个数')
+@click.option('--sigmas', default=4.0, show_default=True, help='允许的误差（标准误差的倍数）')
+@click.option('--seed', type=int, default=0, show_default=True, help='抽样随机种子')
+def check_command(samples, sigmas, seed):
+    """与明细表上精确的 COUNT(DISTINCT) 对比估计误差，超出范围时以非零状态退出"""
+    from .partitions import frozen_months
+    # 本进程里还没写库的增量先写完
+    sketch_buffer.flush()
+    frozen = frozen_months(db.session.connection())
+    # 已归档的月份不在明细表里，只检查保留期内的数据
+    since = add_months(frozen[-1], 1) if frozen else None
+    log_day = func.date(BrowseLog.browse_time) if db.engine.dialect.name == 'sqlite' \
+        else BrowseLog.browse_time.cast(db.Date)
+    bounds = db.session.execute(select(func.min(log_day), func.max(log_day))).one()
+    if bounds[0] is None:
+        raise click.ClickException('浏览记录为空')
+    first, last = (_as_day(v) for v in bounds)
+    first = max(first, since) if since else first
+
+    def log_window(lo, hi):
+        return [BrowseLog.browse_time >= datetime.combine(lo, datetime.min.time()),
+                BrowseLog.browse_time < datetime.combine(hi + timedelta(days=1), datetime.min.time())]
+
+    results = [] # (说明, 估计值, 精确值, 估计耗时 µs 或 None)
+
+    def timed(fn, *args):
+        started = time.perf_counter()
+        value = fn(*args)
+        return value, (time.perf_counter() - started) * 1e6
+
+    def compare(label, estimate, exact_stmt, elapsed):
+        results.append((label, estimate, _exact_distinct(exact_stmt), elapsed))
+
+    # 渠道维度一次读取得到各渠道与合计，耗时记在合计上
+    (platforms, total), elapsed = timed(unique_breakdown, VIEWERS_PLATFORM, first, last)
+    compare(f'全站独立访客 {first}~{last}', total,
+            select(func.count(BrowseLog.user_id.distinct())).where(*log_window(first, last)), elapsed)
+    for platform, estimate in sorted(platforms.items()):
+        compare(f'渠道 {platform or "(空)"} 独立访客', estimate,
+                select(func.count(BrowseLog.user_id.distinct())).where(
+                    func.coalesce(BrowseLog.platform, '') == platform, *log_window(first, last)), None)
+    # 销售记录不归档，独立买家按全部数据对比
+    buyers, elapsed = timed(unique_counts, BUYERS_CATEGORY)
+    for category, estimate in sorted(buyers.items()):
+        compare(f'品类 {category or "未分类"} 独立买家', estimate,
+                select(func.count(Sale.user_id.distinct()))
+                .join(Product, Product.id == Sale.product_id)
+                .where(func.coalesce(Product.category, '') == category), elapsed)
+        elapsed = None
+
+    rng = random.Random(seed)
+    product_ids = db.session.execute(select(Product.id)).scalars().all()
+    span = (last - first).days
+    for _ in range(samples if product_ids else 0):
+        key = str(rng.choice(product_ids))
+        lo = first + timedelta(days=rng.randint(0, span))
+        hi = min(last, lo + timedelta(days=rng.choice([0, 6, 30, 90, 365])))
+        counts, elapsed = timed(unique_counts, VIEWERS_PRODUCT, lo, hi, [key])
+        compare(f'商品 {key} {lo}~{hi}', counts.get(key, 0),
+                select(func.count(BrowseLog.user_id.distinct())).where(
+                    BrowseLog.product_id == int(key), *log_window(lo, hi)), elapsed)
+
+    failed = 0
+    errors = []
+    for label, estimate, exact, elapsed in results:
+        ok = _within(estimate, exact, sigmas)
+        failed += not ok
+        if exact:
+            errors.append(abs(estimate - exact) / exact)
+        if not ok or len(results) <= 20 or not label.startswith('商品'):
+            timing = '' if elapsed is None else f'，估计耗时 {elapsed:.0f} µs'
+            click.echo(f'{"OK  " if ok else "FAIL"} {label}: 估计 {estimate}，精确 {exact}{timing}')
+    timings = sorted(r[3] for r in results if r[3] is not None)
+    click.echo(f'共 {len(results)} 项，相对误差均值 {sum(errors) / max(len(errors), 1):.2%}、'
+               f'最大 {max(errors, default=0):.2%}（标准误差 {HLL_ERROR:.2%}），'
+               f'估计耗时中位数 {timings[len(timings) // 2]:.0f} µs')
+
+    # 热门商品：与浏览日汇总表上的精确计数对比，估计值只会偏大，且不超过误差上限
+    from .models import BrowseDaily
+    top, bound = heavy_hitters(TOP_VIEWS, first, last, n=10)
+    exact = dict(db.session.execute(
+        select(BrowseDaily.product_id, func.sum(BrowseDaily.views))
+        .where(BrowseDaily.day.between(first, last), BrowseDaily.product_id.in_([p for p, _ in top]))
+        .group_by(BrowseDaily.product_id)).all())
+    for product_id, estimate in top:
+        ok = exact.get(product_id, 0) <= estimate <= exact.get(product_id, 0) + bound
+        failed += not ok
+        click.echo(f'{"OK  " if ok else "FAIL"} 热门商品 {product_id}: 估计浏览 {estimate}，'
+                   f'精确 {exact.get(product_id, 0)}，误差上限 {bound}')
+    if failed:
+        click.echo(f'{failed} 项超出误差范围')
+        sys.exit(1)
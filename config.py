@@ -1,5 +1,7 @@
 import os
 
+basedir = os.path.abspath(os.path.dirname(__file__))
+
 class Config:
     # 获取数据库URL
     database_url = os.environ.get('DATABASE_URL')
@@ -11,8 +13,100 @@ class Config:
         SQLALCHEMY_DATABASE_URI = database_url
     else:
         # 本地开发使用 SQLite
-        basedir = os.path.abspath(os.path.dirname(__file__))
         SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(basedir, 'instance', 'cpims.db')
     
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # 数据库引擎（app/engine.py）：连接池按 gunicorn 每个 worker 的线程数估算，与 gunicorn.conf.py 读同一个变量
+    WEB_THREADS = int(os.environ.get('WEB_THREADS', 4))
+    DB_POOL_SIZE = int(os.environ['DB_POOL_SIZE']) if os.environ.get('DB_POOL_SIZE') else None # 默认线程数 + 2
+    DB_MAX_OVERFLOW = int(os.environ['DB_MAX_OVERFLOW']) if os.environ.get('DB_MAX_OVERFLOW') else None # 默认等于线程数
+    DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10)) # 等待空闲连接的秒数
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800)) # PostgreSQL 连接的最长复用秒数
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', '1') == '1'
+    DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 30000)) # PostgreSQL Web 进程的语句超时，0 表示不限
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)) # 字节
+    SQLITE_CACHE_SIZE_KB = int(os.environ.get('SQLITE_CACHE_SIZE_KB', 32768)) # 每个连接的页缓存
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 15000)) # 写锁被占用时的等待时间
     SECRET_KEY = os.environ.get('SECRET_KEY', 'dev_secret_key_change_in_production')
+
+    # 看板结果缓存：memory（进程内 LRU）或 sqlite（本机多 worker 共享）
+    DASHBOARD_CACHE_BACKEND = os.environ.get('DASHBOARD_CACHE_BACKEND', 'memory')
+    DASHBOARD_CACHE_PATH = os.environ.get('DASHBOARD_CACHE_PATH',
+                                          os.path.join(basedir, 'instance', 'dashboard_cache.db'))
+    DASHBOARD_CACHE_TTL = int(os.environ.get('DASHBOARD_CACHE_TTL', 60)) # 秒
+    DASHBOARD_CACHE_SIZE = int(os.environ.get('DASHBOARD_CACHE_SIZE', 128))
+
+    # 商品目录缓存：每个 worker 按商品编号缓存名称 / 品类 / 单价 / 库存等，按数据库中的目录版本失效
+    CATALOG_CACHE = os.environ.get('CATALOG_CACHE', '1') == '1'
+    CATALOG_SYNC_INTERVAL = float(os.environ.get('CATALOG_SYNC_INTERVAL', 1.0)) # 读取目录版本号的最短间隔（秒）
+    CATALOG_GAP_SECONDS = float(os.environ.get('CATALOG_GAP_SECONDS', 600)) # 目录版本号空缺补查的时长（秒），超过视为已回滚
+
+    # HTTP 缓存：看板 / 商品 / 销售 / 浏览记录页面按数据版本戳生成 ETag，未变化时返回 304
+    HTTP_ETAGS = os.environ.get('HTTP_ETAGS', '1') == '1'
+    HTTP_STAMP_TTL = float(os.environ.get('HTTP_STAMP_TTL', 1.0)) # 每个 worker 复用数据版本戳的秒数
+    # 响应压缩（安装 brotli 时优先 br，否则 gzip）与静态文件缓存
+    COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024)) # 小于该字节数的响应不压缩
+    COMPRESS_GZIP_LEVEL = int(os.environ.get('COMPRESS_GZIP_LEVEL', 6))
+    COMPRESS_BROTLI_QUALITY = int(os.environ.get('COMPRESS_BROTLI_QUALITY', 5))
+    STATIC_MAX_AGE = int(os.environ.get('STATIC_MAX_AGE', 31536000)) # 带版本参数的静态文件缓存秒数
+
+    # 结果集不超过该行数时用页码分页，否则改用游标分页
+    PAGE_MODE_MAX_ROWS = int(os.environ.get('PAGE_MODE_MAX_ROWS', 10000))
+
+    # SQLite → PostgreSQL 迁移（upload_to_railway.py）
+    MIGRATE_SOURCE_URL = os.environ.get('MIGRATE_SOURCE_URL',
+                                        'sqlite:///' + os.path.join(basedir, 'instance', 'cpims.db'))
+    MIGRATE_TARGET_URL = os.environ.get('MIGRATE_TARGET_URL', database_url)
+    if MIGRATE_TARGET_URL and MIGRATE_TARGET_URL.startswith('postgres://'):
+        MIGRATE_TARGET_URL = MIGRATE_TARGET_URL.replace('postgres://', 'postgresql://', 1)
+
+    # 浏览事件批量写入：攒够条数或到时间就刷写，缓冲区上限用于背压
+    INGEST_BATCH_SIZE = int(os.environ.get('INGEST_BATCH_SIZE', 500))
+    INGEST_FLUSH_INTERVAL = float(os.environ.get('INGEST_FLUSH_INTERVAL', 1.0)) # 秒
+    INGEST_MAX_PENDING = int(os.environ.get('INGEST_MAX_PENDING', 50000))
+    INGEST_MAX_BATCH = int(os.environ.get('INGEST_MAX_BATCH', 10000))
+    INGEST_COPY_THRESHOLD = int(os.environ.get('INGEST_COPY_THRESHOLD', 1000)) # PostgreSQL 上超过该条数改用 COPY
+
+    # 独立访客 / 热门商品草图：提交后的增量在进程内合并，按间隔写库（不在下单事务里加行锁）
+    SKETCH_BUFFER = os.environ.get('SKETCH_BUFFER', '1') == '1'
+    SKETCH_FLUSH_INTERVAL = float(os.environ.get('SKETCH_FLUSH_INTERVAL', 2.0)) # 秒
+
+    # 浏览记录分区与归档：保留最近 N 个月在明细表，更早的月份由 `flask partitions archive` 压缩归档
+    BROWSE_RETENTION_MONTHS = int(os.environ.get('BROWSE_RETENTION_MONTHS', 12))
+    BROWSE_PARTITIONS_AHEAD = int(os.environ.get('BROWSE_PARTITIONS_AHEAD', 2)) # PostgreSQL 提前建好的月分区数
+    BROWSE_ARCHIVE_SEGMENT_ROWS = int(os.environ.get('BROWSE_ARCHIVE_SEGMENT_ROWS', 200000)) # 每个归档段的行数上限
+
+    # 请求级 SQL 统计：单条 SQL 超过该耗时写入慢查询日志
+    SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 200))
+
+    # 只读副本（可选）：逗号分隔的连接串，看板、销售、浏览记录、商品列表的查询轮询分发到副本
+    READ_REPLICA_URLS = [url.strip().replace('postgres://', 'postgresql://', 1)
+                         for url in os.environ.get('READ_REPLICA_URLS', '').split(',') if url.strip()]
+    REPLICA_READ_YOUR_WRITES = float(os.environ.get('REPLICA_READ_YOUR_WRITES', 5)) # 写入后该客户端的读取继续走主库的秒数
+    REPLICA_HEALTH_INTERVAL = float(os.environ.get('REPLICA_HEALTH_INTERVAL', 10)) # 副本健康检查间隔（秒）
+    REPLICA_RETRY_AFTER = float(os.environ.get('REPLICA_RETRY_AFTER', 30)) # 副本不可用后暂停使用的秒数
+    REPLICA_MAX_LAG = float(os.environ.get('REPLICA_MAX_LAG', 30)) # 复制延迟超过该秒数视为不可用
+
+    # 看板聚合：sql（读汇总表）或 numpy（每个 worker 维护销售/浏览记录的列式快照，需安装 numpy）
+    DASHBOARD_ANALYTICS = os.environ.get('DASHBOARD_ANALYTICS', 'sql')
+    ANALYTICS_REFRESH_SECONDS = float(os.environ.get('ANALYTICS_REFRESH_SECONDS', 5)) # 增量追加新行的间隔
+    ANALYTICS_FULL_RELOAD_SECONDS = float(os.environ.get('ANALYTICS_FULL_RELOAD_SECONDS', 300)) # 全量重载的间隔
+
+    # 浏览 → 购买转化报表：按窗口缓存在 conversion_reports 表
+    CONVERSION_DEFAULT_DAYS = int(os.environ.get('CONVERSION_DEFAULT_DAYS', 30)) # 未指定日期时的窗口天数
+    CONVERSION_CACHE_TTL = int(os.environ.get('CONVERSION_CACHE_TTL', 300)) # 窗口包含计算当天时的缓存秒数
+    CONVERSION_CLOSED_TTL = int(os.environ.get('CONVERSION_CLOSED_TTL', 86400)) # 已结束窗口的缓存秒数
+
+    # 后台任务：local（Web 进程自己的进程池执行）或 worker（只排队，由 flask jobs worker 执行）
+    JOB_RUNNER = os.environ.get('JOB_RUNNER', 'local')
+    JOB_PROCESSES = int(os.environ.get('JOB_PROCESSES', 2)) # 同时执行的任务数
+    JOB_STALE_SECONDS = float(os.environ.get('JOB_STALE_SECONDS', 300)) # 超过该秒数没有心跳的任务视为中断，重新排队
+    JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 3)) # 中断后重新排队，执行满该次数后记为失败
+    JOB_REAP_INTERVAL = float(os.environ.get('JOB_REAP_INTERVAL', 30)) # 整理中断 / 无人执行的任务的最短间隔（秒）
+    JOB_EXPORT_DIR = os.environ.get('JOB_EXPORT_DIR', os.path.join(basedir, 'instance', 'exports')) # 导出任务的文件目录
+    JOB_LOCK_FILE = os.environ.get('JOB_LOCK_FILE', os.path.join(basedir, 'instance', 'jobs.lock')) # local 模式下持有该文件锁的 Web 进程执行任务
+    # 是否允许通过 /api/jobs 提交会清空或改写数据的任务（seed / archive / migrate）
+    JOBS_ALLOW_DESTRUCTIVE = os.environ.get('JOBS_ALLOW_DESTRUCTIVE', '0') == '1'
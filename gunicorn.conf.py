@@ -0,0 +1,7 @@
+# gunicorn 配置：worker 进程数与每个 worker 的线程数
+# 数据库连接池大小按 WEB_THREADS 估算（见 config.py），两边读同一组环境变量
+import os
+
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+threads = int(os.environ.get('WEB_THREADS', 4))
+timeout = int(os.environ.get('WEB_TIMEOUT', 60))
@@ -0,0 +1,77 @@
+"""
+测试共用的夹具
+
+每次测试会话在临时目录里建一个 SQLite 库，按固定随机种子生成一套数据（含汇总表与草图）。
+DATABASE_URL 必须在导入 app / config 之前设置，所以放在模块顶部。
+"""
+import os
+import sys
+import tempfile
+from datetime import date
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+TMP_DIR = tempfile.mkdtemp(prefix='cpims-test-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(TMP_DIR, 'cpims.db')
+os.environ['JOB_LOCK_FILE'] = os.path.join(TMP_DIR, 'jobs.lock')
+
+SEED = 20240601
+END_DATE = date(2025, 6, 30)
+
+
+@pytest.fixture(scope='session')
+def flask_app():
+    from app import create_app, db
+    from app.schema import upgrade
+    from app.seed import generate
+
+    flask_app = create_app(batch=True)
+    flask_app.config['TESTING'] = True
+    with flask_app.app_context():
+        upgrade(db.engine)
+        generate(users=400, products=60, browse_logs=30000, sales=6000, seed=SEED,
+                 end_date=END_DATE, echo=lambda *args, **kwargs: None)
+    yield flask_app
+    with flask_app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def app_context(flask_app):
+    from app import db
+    with flask_app.app_context():
+        yield
+        db.session.remove()
+
+
+@pytest.fixture
+def scratch_product(flask_app):
+    """测试专用的商品（单独的品类）和用户，返回 (商品编号, 用户编号)；结束后连同明细、汇总行和草图一并删除"""
+    from sqlalchemy import delete
+
+    from app import db
+    from app.models import Product, Sketch, User
+    from app.products import submit_delete
+    from app.sketches import BUYERS_CATEGORY, sketch_buffer
+    with flask_app.app_context():
+        product = Product(name='测试商品', category='测试品类', price=10, stock=10)
+        user = User(username='测试用户')
+        db.session.add_all([product, user])
+        db.session.commit()
+        ids = product.id, user.id
+        db.session.remove()
+    yield ids
+    with flask_app.app_context():
+        submit_delete([ids[0]])
+        db.session.delete(db.session.get(User, ids[1]))
+        db.session.commit()
+        db.session.remove()
+        # 草图只增不减：先写完缓冲的增量，再删掉测试品类的买家草图
+        if sketch_buffer.active:
+            sketch_buffer.flush()
+        with db.engine.begin() as conn:
+            conn.execute(delete(Sketch).where(Sketch.kind == BUYERS_CATEGORY, Sketch.key == '测试品类'))
@@ -0,0 +1,80 @@
+"""
+看板列式快照：增量刷新与并发读取同时进行时，读到的各列行数一致、聚合不出错；
+渠道数超过 127 个时编码不溢出
+"""
+import threading
+from datetime import date
+
+import pytest
+from sqlalchemy import delete, insert, select
+
+from app import db
+from app.analytics import _State, analytics
+from app.models import Product, Sale, User
+
+PERIOD = (date(2025, 1, 1), None)
+
+
+@pytest.fixture
+def snapshot(flask_app):
+    enabled, interval = analytics.enabled, analytics.refresh_interval
+    analytics.enabled, analytics.refresh_interval = True, 0
+    with flask_app.app_context():
+        analytics.mark_stale()
+        analytics.current()
+    yield
+    analytics.enabled, analytics.refresh_interval = enabled, interval
+    analytics.mark_stale()
+
+
+def test_refresh_does_not_disturb_readers(flask_app, snapshot):
+    errors, done = [], threading.Event()
+
+    def read():
+        with flask_app.app_context():
+            while not done.is_set():
+                try:
+                    view = analytics.current()
+                    assert len({len(column) for column in view.sales.values()}) == 1
+                    analytics.sales_metrics(PERIOD, PERIOD)
+                    analytics.browse_metrics(None, PERIOD)
+                except Exception as exc:
+                    errors.append(exc)
+                finally:
+                    db.session.remove()
+
+    with flask_app.app_context():
+        product_id, user_id = (db.session.scalar(select(model.id).limit(1)) for model in (Product, User))
+        before = analytics.current()
+        rows = len(before.sales['product'])
+        readers = [threading.Thread(target=read) for _ in range(3)]
+        for reader in readers:
+            reader.start()
+        added = []
+        try:
+            for _ in range(100):
+                with db.engine.begin() as conn:
+                    added.append(conn.execute(insert(Sale).values(
+                        product_id=product_id, user_id=user_id, sale_date=date(2025, 6, 30),
+                        unit_price=1, quantity=1, total_amount=1)).inserted_primary_key[0])
+                analytics.current()
+            done.set()
+            for reader in readers:
+                reader.join()
+            assert errors == []
+            # 先拿到的视图不受之后的追加影响；读者都停下后最后一次刷新追加到全部新行
+            assert {len(column) for column in before.sales.values()} == {rows}
+            assert len(analytics.current().sales['product']) == rows + len(added)
+        finally:
+            done.set()
+            for reader in readers:
+                reader.join()
+            with db.engine.begin() as conn:
+                conn.execute(delete(Sale).where(Sale.id.in_(added)))
+            db.session.remove()
+
+
+def test_platform_codes_do_not_overflow(flask_app, snapshot):
+    state = _State(analytics.np)
+    codes = analytics._platform_codes(state, [f'渠道{i}' for i in range(300)])
+    assert list(codes) == list(range(300))
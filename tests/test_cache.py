@@ -0,0 +1,88 @@
+"""
+看板结果缓存：条目过期后重新计算、LRU 淘汰最久未用的 key；会话提交与下单之后失效受影响的 key
+（回滚不失效）；SQLite 后端在多个 worker 之间共享同一份缓存
+"""
+from datetime import date
+
+import pytest
+
+from app import db
+from app.cache import (BROWSE_KEY, CATALOG_KEY, SALES_KEY, LRUCache, ResultCache, SqliteCache,
+                       dashboard_cache)
+from app.models import Sale
+from app.orders import submit_orders
+
+KEYS = (SALES_KEY, BROWSE_KEY, CATALOG_KEY)
+
+
+def cached_keys():
+    return {key for key in KEYS if dashboard_cache.backend.get(key) is not None}
+
+
+@pytest.fixture
+def primed(flask_app):
+    # 填入占位值，结束后清掉，不影响其它测试渲染看板
+    for key in KEYS:
+        dashboard_cache.get_or_compute(key, lambda: {'key': key})
+    assert cached_keys() == set(KEYS)
+    yield
+    dashboard_cache.invalidate(*KEYS)
+
+
+def test_ttl_and_lru():
+    cache = ResultCache(LRUCache(maxsize=2), ttl=60)
+    calls = []
+
+    def compute(value):
+        return lambda: calls.append(value) or value
+
+    assert cache.get_or_compute('a', compute(1)) == 1
+    assert cache.get_or_compute('a', compute(2)) == 1
+    cache.ttl = -1
+    cache.get_or_compute('b', compute(3))
+    assert cache.get_or_compute('b', compute(4)) == 4
+    cache.ttl = 60
+    cache.get_or_compute('c', compute(5))
+    # 容量为 2：最久未用的 a 被淘汰
+    assert cache.backend.get('a') is None
+    assert calls == [1, 3, 4, 5]
+    stats = cache.stats()
+    assert (stats['hits'], stats['stale'], stats['misses']) == (1, 1, 3)
+
+
+def test_session_commit_invalidates_affected_keys(flask_app, scratch_product, primed):
+    product_id, user_id = scratch_product
+    with flask_app.app_context():
+        db.session.add(Sale(product_id=product_id, user_id=user_id, sale_date=date(2025, 6, 30),
+                            unit_price=10, quantity=1, total_amount=10))
+        db.session.flush()
+        db.session.rollback()
+        assert cached_keys() == set(KEYS)
+
+        db.session.add(Sale(product_id=product_id, user_id=user_id, sale_date=date(2025, 6, 30),
+                            unit_price=10, quantity=1, total_amount=10))
+        db.session.commit()
+        # 新增销售只影响销售部分，其它 key 保留
+        assert cached_keys() == {BROWSE_KEY, CATALOG_KEY}
+        db.session.remove()
+
+
+def test_orders_invalidate_sales(flask_app, scratch_product, primed):
+    product_id, user_id = scratch_product
+    with flask_app.app_context():
+        submit_orders([{'user_id': user_id, 'lines': [{'product_id': product_id, 'quantity': 20}]}])
+        # 全部缺货：没有写入，缓存不动
+        assert cached_keys() == set(KEYS)
+        submit_orders([{'user_id': user_id, 'lines': [{'product_id': product_id, 'quantity': 1}]}])
+        assert cached_keys() == {BROWSE_KEY}
+        db.session.remove()
+
+
+def test_sqlite_backend_is_shared(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    # 两个实例相当于两个 worker 进程
+    first, second = ResultCache(SqliteCache(path)), ResultCache(SqliteCache(path))
+    assert first.get_or_compute(SALES_KEY, lambda: {'total': 1}) == {'total': 1}
+    assert second.get_or_compute(SALES_KEY, lambda: {'total': 2}) == {'total': 1}
+    second.invalidate(SALES_KEY)
+    assert first.get_or_compute(SALES_KEY, lambda: {'total': 3}) == {'total': 3}
@@ -0,0 +1,91 @@
+"""
+商品目录缓存：另一个进程修改商品后，本进程同步版本号时只失效变化的商品；版本号的空缺（尚未提交的事务）
+之后补查；本进程目录里的商品比库里旧时保存商品，库里与汇总表的品类都以表单上的值为准
+"""
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import func, insert, select, update
+
+from app import db
+from app.catalog import ALL_PRODUCTS, bump_version, product_catalog
+from app.models import CatalogChange, Product, SalesDaily
+from app.orders import submit_orders
+
+
+@pytest.fixture
+def catalog(flask_app):
+    # 本进程不按时间间隔同步，只在测试显式同步（或本进程提交修改）时同步
+    interval = product_catalog.sync_interval
+    product_catalog.sync_interval = 3600
+    with flask_app.app_context():
+        product_catalog.sync(force=True)
+        yield product_catalog
+        db.session.remove()
+    product_catalog.sync_interval = interval
+    product_catalog.expire()
+
+
+def change_elsewhere(product_id, **values):
+    """模拟另一个进程修改商品：同一事务内记下目录版本，本进程不因这次提交提前同步"""
+    with db.engine.begin() as conn:
+        conn.execute(update(Product).where(Product.id == product_id).values(**values))
+        if 'category' in values:
+            conn.execute(update(SalesDaily).where(SalesDaily.product_id == product_id)
+                         .values(category=values['category']))
+        version = bump_version(conn, [product_id])
+        conn.info.pop('catalog_bumped')
+    return version
+
+
+def test_other_worker_changes(scratch_product, catalog):
+    product_id, _ = scratch_product
+    other = db.session.scalar(select(Product.id).where(Product.id != product_id).limit(1))
+    before = catalog.lookup([product_id, other])
+    change_elsewhere(product_id, name='改名后', price=Decimal('12.5'))
+    # 同步之前仍是旧值；同步后只有改过的商品失效并重新读取
+    assert catalog.get(product_id).name == '测试商品'
+    evictions = catalog.stats()['evictions']
+    catalog.sync(force=True)
+    assert catalog.stats()['evictions'] == evictions + 1
+    current = catalog.lookup([product_id, other])
+    assert (current[product_id].name, current[product_id].price) == ('改名后', Decimal('12.5'))
+    assert current[other].name == before[other].name
+
+
+def test_version_gap_is_filled_later(scratch_product, catalog):
+    product_id, _ = scratch_product
+    catalog.get(product_id)
+    # PostgreSQL 上版本号取自序列，可能乱序提交：先出现较大的版本，较小的版本记为空缺
+    latest = db.session.scalar(select(func.max(CatalogChange.version)))
+    db.session.remove()
+    with db.engine.begin() as conn:
+        conn.execute(insert(CatalogChange).values(version=latest + 2, product_id=ALL_PRODUCTS - 1))
+    catalog.sync(force=True)
+    assert catalog.stats()['gaps'] == 1 and catalog.get(product_id).stock == 10
+    # 迟到的版本提交后补查到，其中的商品失效
+    with db.engine.begin() as conn:
+        conn.execute(update(Product).where(Product.id == product_id).values(stock=1))
+        conn.execute(insert(CatalogChange).values(version=latest + 1, product_id=product_id))
+    catalog.sync(force=True)
+    assert catalog.stats()['gaps'] == 0 and catalog.stats()['version'] == latest + 2
+    assert catalog.get(product_id).stock == 1
+
+
+def test_save_with_stale_catalog(flask_app, scratch_product, catalog):
+    product_id, user_id = scratch_product
+    submit_orders([{'user_id': user_id, 'lines': [{'product_id': product_id, 'quantity': 2}]}])
+    catalog.get(product_id)
+    change_elsewhere(product_id, category='别处改的品类', stock=100)
+    assert catalog.get(product_id).category == '测试品类'
+    client = flask_app.test_client()
+    form = {'id': product_id, 'name': '测试商品', 'price': '10', 'stock': '7', 'category': '测试品类'}
+    # 表单上的品类与本进程目录里的旧值相同，与库里不同：保存后库里和汇总表都以表单为准
+    client.post('/products/save', data=form)
+    db.session.remove()
+    product = db.session.get(Product, product_id)
+    assert (product.category, product.stock) == ('测试品类', 7)
+    assert set(db.session.scalars(select(SalesDaily.category)
+                                  .where(SalesDaily.product_id == product_id))) == {'测试品类'}
+    # 本进程的提交让目录立即同步
+    assert catalog.get(product_id).stock == 7
@@ -0,0 +1,60 @@
+"""
+转化报表接口不在请求里计算：GET 只读缓存，没有缓存也不提交任务；POST 提交计算任务（同一窗口只提交一个），
+任务完成后返回缓存；缓存过期时 GET 返回旧报表，POST 再提交一次计算
+"""
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import delete, func, select, update
+
+from app import db
+from app.jobs import job_runner, run_job
+from app.models import ConversionReport, Job
+
+WINDOW = {'start_date': '2025-05-01', 'end_date': '2025-05-31'}
+
+
+@pytest.fixture
+def queue_only(flask_app):
+    # 只排队，由测试在当前进程里执行任务
+    mode, job_runner.mode = job_runner.mode, 'worker'
+    yield
+    job_runner.mode = mode
+    with flask_app.app_context():
+        with db.engine.begin() as conn:
+            conn.execute(delete(ConversionReport))
+            conn.execute(delete(Job).where(Job.kind == 'conversion_report'))
+
+
+def test_only_post_submits_jobs(flask_app, queue_only):
+    client = flask_app.test_client()
+    with flask_app.app_context():
+        # GET 不提交任务
+        assert client.get('/api/conversion', query_string=WINDOW).status_code == 404
+        assert client.get('/conversion', query_string=WINDOW).status_code == 200
+        assert db.session.scalar(select(func.count()).where(Job.kind == 'conversion_report')) == 0
+
+        first = client.post('/api/conversion', query_string=WINDOW)
+        assert first.status_code == 202
+        job_id = first.get_json()['job_id']
+        assert client.post('/api/conversion', query_string=WINDOW).get_json()['job_id'] == job_id
+        assert client.post('/conversion', query_string=WINDOW).status_code == 302
+        # 排队中的任务 GET 也能看到
+        assert client.get('/api/conversion', query_string=WINDOW).get_json()['job_id'] == job_id
+        assert client.get('/conversion', query_string=WINDOW).status_code == 202
+
+        assert run_job(job_id)
+        report = client.get('/api/conversion', query_string=WINDOW).get_json()
+        assert report['stale'] is False and 'job_id' not in report
+        assert report['totals']['viewers'] > 0
+
+        # 缓存过期：GET 返回旧报表但不提交，POST 提交新的计算任务
+        with db.engine.begin() as conn:
+            conn.execute(update(ConversionReport).values(computed_at=datetime.now() - timedelta(days=30)))
+        stale = client.get('/api/conversion', query_string=WINDOW)
+        assert stale.status_code == 200
+        body = stale.get_json()
+        assert body['stale'] is True and body['totals'] == report['totals'] and 'job_id' not in body
+        refreshed = client.post('/api/conversion', query_string=WINDOW).get_json()
+        assert refreshed['stale'] is True and refreshed['job_id'] != job_id
+        db.session.remove()
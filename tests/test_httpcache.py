@@ -0,0 +1,54 @@
+"""
+HTTP 条件请求：删除不改变最大编号的行后 ETag 也会变化；其它进程改了商品目录时，
+版本戳从数据库读出变化，本进程的商品目录缓存同步到同一版本
+"""
+from datetime import date
+
+from sqlalchemy import select
+
+from app import db
+from app.catalog import bump_version, product_catalog
+from app.httpcache import http_cache
+from app.models import CatalogChange, Sale
+
+
+def test_delete_changes_etag(flask_app, scratch_product):
+    product_id, user_id = scratch_product
+    client = flask_app.test_client()
+    with flask_app.app_context():
+        sales = [Sale(product_id=product_id, user_id=user_id, sale_date=date(2025, 6, 30),
+                      unit_price=10, quantity=1, total_amount=10) for _ in range(2)]
+        db.session.add_all(sales)
+        db.session.commit()
+        first_id = sales[0].id
+        db.session.remove()
+
+        etag = client.get('/sales').headers['ETag'].strip('W/"')
+        assert client.get('/sales', headers={'If-None-Match': etag}).status_code == 304
+
+        # 删掉较早的一条，销售表的最大编号不变
+        db.session.delete(db.session.get(Sale, first_id))
+        db.session.commit()
+        db.session.remove()
+        response = client.get('/sales', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'].strip('W/"') != etag
+
+
+def test_catalog_change_from_other_worker(flask_app):
+    client = flask_app.test_client()
+    with flask_app.app_context():
+        etag = client.get('/products').headers['ETag'].strip('W/"')
+        with db.engine.begin() as conn:
+            version = bump_version(conn, [db.session.scalar(select(CatalogChange.product_id).limit(1))])
+            # 当作另一个进程的提交：本进程的目录缓存不会因此提前同步
+            conn.info.pop('catalog_bumped')
+        db.session.remove()
+        http_cache.expire()
+
+        response = client.get('/products', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert product_catalog.version.split('.')[1] == str(version)
+        # 同一份数据再算一次得到同一个 ETag
+        http_cache.expire()
+        assert client.get('/products', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
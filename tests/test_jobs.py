@@ -0,0 +1,78 @@
+"""
+后台任务：执行进程中断（没有心跳）的任务重新排队、执行满次数后记为失败；
+local 模式下只有拿到任务锁的进程执行任务；子进程清空看板缓存后，各 worker 读数据版本戳时随之清空
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, insert, update
+
+from app import db
+from app.cache import SALES_KEY, dashboard_cache
+from app.httpcache import http_cache
+from app.jobs import FAILED, QUEUED, RUNNING, JobRunner, job_runner, run_job
+from app.models import Job
+
+
+def add_job(attempts, **values):
+    with db.engine.begin() as conn:
+        return conn.execute(insert(Job).values(
+            kind='rebuild_rollups', params='{}', status=RUNNING, progress=0.5, cancel_requested=False,
+            attempts=attempts, pid=1, created_at=datetime.now(), started_at=datetime.now(),
+            heartbeat_at=datetime.now() - timedelta(hours=1), **values).returning(Job.id)).scalar()
+
+
+def test_stale_jobs_are_requeued_then_failed(app_context):
+    requeue = add_job(attempts=1)
+    give_up = add_job(attempts=job_runner.max_attempts)
+    alive = add_job(attempts=1)
+    with db.engine.begin() as conn:
+        conn.execute(update(Job).where(Job.id == alive).values(heartbeat_at=datetime.now()))
+    try:
+        assert job_runner.reap_stale() == (1, 1)
+        jobs = {job.id: job for job in db.session.query(Job).filter(Job.id.in_([requeue, give_up, alive]))}
+        assert (jobs[requeue].status, jobs[requeue].pid, jobs[requeue].started_at) == (QUEUED, None, None)
+        assert jobs[give_up].status == FAILED
+        assert jobs[alive].status == RUNNING
+        # 重新排队的任务照常被认领执行，执行次数累加
+        assert run_job(requeue)
+        job = db.session.get(Job, requeue, populate_existing=True)
+        assert (job.status, job.attempts) == ('succeeded', 2)
+    finally:
+        with db.engine.begin() as conn:
+            conn.execute(delete(Job).where(Job.id.in_([requeue, give_up, alive])))
+
+
+def test_clear_everywhere_reaches_other_workers(flask_app):
+    client = flask_app.test_client()
+    with flask_app.app_context():
+        http_cache.expire()
+        etag = client.get('/dashboard').headers['ETag']
+        assert dashboard_cache.backend.get(SALES_KEY) is not None
+        cleared = dashboard_cache.stats()['generations']
+        # 模拟另一个进程：库里的代数加一，本进程的缓存原样保留
+        backend, dashboard_cache.backend = dashboard_cache.backend, type(dashboard_cache.backend)()
+        try:
+            with db.engine.begin() as conn:
+                dashboard_cache.clear_everywhere(conn)
+        finally:
+            dashboard_cache.backend = backend
+        http_cache.expire()
+        response = client.get('/dashboard', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert dashboard_cache.stats()['generations'] == cleared + 1
+
+
+def test_one_runner_per_lock(tmp_path, monkeypatch):
+    # 两个 JobRunner 分别打开锁文件，相当于同一台机器上的两个 worker
+    monkeypatch.setattr(JobRunner, '_poll', lambda self: None)
+    first, second = JobRunner(), JobRunner()
+    first.lock_path = second.lock_path = str(tmp_path / 'jobs.lock')
+    try:
+        assert first.is_runner() and first.is_runner()
+        assert not second.is_runner()
+        # 持有者退出后由下一个进程接手
+        first.shutdown()
+        assert second.is_runner()
+    finally:
+        first.shutdown()
+        second.shutdown()
@@ -0,0 +1,84 @@
+"""
+下单：各订单行分别返回成功、缺货、商品不存在、用户不存在；并发下单不超卖；
+SQLite 上扣库存与写销售记录是两条语句，写销售记录失败时库存一并回滚
+"""
+import threading
+
+import pytest
+from sqlalchemy import Column, MetaData, Table, func, select
+
+from app import db, orders
+from app.models import Product, Sale
+from app.orders import (STATUS_INVALID_USER, STATUS_NOT_FOUND, STATUS_OK, STATUS_OUT_OF_STOCK,
+                        submit_orders)
+
+
+def stock_and_sales(product_id):
+    return (db.session.scalar(select(Product.stock).where(Product.id == product_id)),
+            db.session.scalar(select(func.count()).where(Sale.product_id == product_id)))
+
+
+def test_line_statuses(flask_app, scratch_product):
+    product_id, user_id = scratch_product
+    with flask_app.app_context():
+        missing_product = db.session.scalar(select(func.max(Product.id))) + 1000
+        results = submit_orders([
+            {'user_id': user_id, 'payment_method': '支付宝',
+             'lines': [{'product_id': product_id, 'quantity': 3},
+                       {'product_id': product_id, 'quantity': 8},
+                       {'product_id': missing_product, 'quantity': 1}]},
+            {'user_id': -1, 'lines': [{'product_id': product_id, 'quantity': 1}]},
+        ])
+        assert [line['status'] for line in results[0]] == [STATUS_OK, STATUS_OUT_OF_STOCK, STATUS_NOT_FOUND]
+        assert [line['status'] for line in results[1]] == [STATUS_INVALID_USER]
+        assert results[0][0]['total_amount'] == 30.0
+        sale = db.session.get(Sale, results[0][0]['sale_id'])
+        assert (sale.quantity, sale.unit_price, sale.payment_method) == (3, 10, '支付宝')
+        assert stock_and_sales(product_id) == (7, 1)
+        db.session.remove()
+
+
+def test_concurrent_orders_do_not_oversell(flask_app, scratch_product):
+    product_id, user_id = scratch_product
+    sold, errors, lock = [], [], threading.Lock()
+
+    def buy():
+        with flask_app.app_context():
+            try:
+                results = submit_orders([{'user_id': user_id,
+                                          'lines': [{'product_id': product_id, 'quantity': 1}]}] * 3)
+            except Exception as exc:
+                errors.append(exc)
+                return
+            finally:
+                db.session.remove()
+            with lock:
+                sold.extend(line for order in results for line in order if line['status'] == STATUS_OK)
+
+    threads = [threading.Thread(target=buy) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    # 24 行争抢 10 件库存：恰好卖出 10 件，库存不为负
+    assert len(sold) == 10
+    with flask_app.app_context():
+        assert stock_and_sales(product_id) == (0, 10)
+        db.session.remove()
+
+
+def test_failed_sale_insert_restores_stock(flask_app, scratch_product, monkeypatch):
+    product_id, user_id = scratch_product
+    with flask_app.app_context():
+        if db.engine.dialect.name != 'sqlite':
+            pytest.skip('PostgreSQL 上扣库存与写销售记录是同一条语句')
+        # 扣库存成功之后写销售记录失败（表不存在）
+        missing = Table('sales_missing', MetaData(),
+                        *(Column(c.name, c.type, primary_key=c.primary_key) for c in Sale.__table__.columns))
+        monkeypatch.setattr(orders, '_sales', missing)
+        with pytest.raises(Exception, match='sales_missing'):
+            submit_orders([{'user_id': user_id, 'lines': [{'product_id': product_id, 'quantity': 4}]}])
+        monkeypatch.undo()
+        assert stock_and_sales(product_id) == (10, 0)
+        db.session.remove()
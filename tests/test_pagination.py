@@ -0,0 +1,76 @@
+"""
+游标分页：向后翻完所有页与一次性排序的结果一致（排序列大量重复时按 id 区分），再向前翻回得到同样的页；
+翻页期间插入更新的行不影响后面的页；结果集恰好是整页数时最后一页没有“下一页”；无效游标回到第一页
+"""
+from datetime import date, datetime
+
+import pytest
+
+from app import db
+from app.models import BrowseLog, Sale
+from app.pagination import KeysetPagination, decode_cursor, encode_cursor
+
+PER_PAGE = 37
+
+
+def ordered_ids(query):
+    return [s.id for s in query.order_by(Sale.sale_date.desc(), Sale.id.desc())]
+
+
+def page(query, cursor=None, per_page=PER_PAGE):
+    return KeysetPagination(query, Sale.sale_date, Sale.id, per_page, cursor=cursor)
+
+
+def walk(query, per_page=PER_PAGE):
+    pages = [page(query, per_page=per_page)]
+    while pages[-1].has_next:
+        pages.append(page(query, pages[-1].next_cursor, per_page))
+    return pages
+
+
+def test_forward_and_back(app_context):
+    query = Sale.query.filter(Sale.sale_date >= date(2025, 6, 1))
+    pages = walk(query)
+    assert [s.id for p in pages for s in p.items] == ordered_ids(query)
+    assert len(pages) > 3 and not pages[0].has_prev and pages[0].prev_cursor is None
+    assert pages[-1].next_cursor is None
+
+    back = [pages[-1]]
+    while back[-1].has_prev:
+        back.append(page(query, back[-1].prev_cursor))
+    assert [[s.id for s in p.items] for p in reversed(back)] == [[s.id for s in p.items] for p in pages]
+
+
+def test_exact_multiple_of_page_size(app_context):
+    ids = ordered_ids(Sale.query)[:PER_PAGE * 2]
+    pages = walk(Sale.query.filter(Sale.id.in_(ids)))
+    assert [len(p.items) for p in pages] == [PER_PAGE, PER_PAGE]
+    assert not pages[-1].has_next
+    assert page(Sale.query.filter(Sale.id.in_(ids)), per_page=PER_PAGE * 2).next_cursor is None
+
+
+def test_cursor_is_stable_under_inserts(app_context, scratch_product):
+    product_id, user_id = scratch_product
+    first = page(Sale.query)
+    second = [s.id for s in page(Sale.query, first.next_cursor).items]
+    # 插入排在最前面的新行：页码分页会整体后移一行，游标分页的下一页不变
+    db.session.add(Sale(product_id=product_id, user_id=user_id, sale_date=date(2099, 1, 1),
+                        unit_price=10, quantity=1, total_amount=10))
+    db.session.commit()
+    assert [s.id for s in page(Sale.query, first.next_cursor).items] == second
+    assert page(Sale.query).items[0].product_id == product_id
+
+
+@pytest.mark.parametrize('cursor', ['not-a-cursor', encode_cursor('sideways', '2025-01-01', 1),
+                                    encode_cursor('next', '2025-01-01', 'x')])
+def test_invalid_cursor_starts_over(app_context, cursor):
+    assert [s.id for s in page(Sale.query, cursor).items] == ordered_ids(Sale.query)[:PER_PAGE]
+
+
+def test_cursor_round_trip():
+    moment = datetime(2025, 6, 30, 23, 59, 58, 123456)
+    assert decode_cursor(encode_cursor('prev', moment, 42), BrowseLog.browse_time) == ('prev', (moment, 42))
+    assert decode_cursor(encode_cursor('next', date(2025, 6, 30), 7), Sale.sale_date) == \
+        ('next', (date(2025, 6, 30), 7))
+    with pytest.raises(ValueError):
+        decode_cursor('@@@', Sale.sale_date)
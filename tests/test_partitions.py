@@ -0,0 +1,119 @@
+"""
+冷数据归档：窗口覆盖已归档月份时，浏览记录页、导出与转化报表直接读归档段，
+结果与归档前一致，且读请求不写库；翻页与按用户计数只解码少数几段；
+删除用户后汇总表与重建结果一致；解冻后数据完整回到明细表
+"""
+import re
+from datetime import date
+from html import unescape
+
+from sqlalchemy import delete, func, select
+
+from app import db
+from app.conversion import compute_report
+from app.models import BrowseArchive, BrowseDaily, BrowseLog, User
+from app.partitions import archive_before, frozen_months, frozen_segment_rows, thaw_between
+from app.rollups import rebuild_rollups, subtract_users
+from app.querycount import count_queries
+
+CUTOFF = date(2024, 10, 1)
+# 最后一天在明细表里，翻到第二、三页时进入已归档的九月
+WINDOW = {'start_date': '2024-08-15', 'end_date': '2024-10-01'}
+
+
+def page_ids(client, params, pages=3):
+    """按游标连续翻几页，返回每页的记录 id"""
+    ids, params = [], dict(params, cursor='first')
+    for _ in range(pages):
+        html = client.get('/browse_logs', query_string=params).get_data(as_text=True)
+        ids.append(re.findall(r'#(\d+)</td>', html))
+        cursor = re.search(r'cursor=([^&"]+)[^"]*">下一页', html)
+        if not cursor:
+            break
+        params['cursor'] = unescape(cursor.group(1))
+    return ids
+
+
+def total_badge(client, params):
+    html = client.get('/browse_logs', query_string=params).get_data(as_text=True)
+    return re.search(r'badge-default">([^<]+) 条', html).group(1)
+
+
+def snapshot(client):
+    with db.engine.connect() as conn:
+        report = compute_report(conn, date(2024, 9, 1), date(2024, 10, 31))
+    return {
+        'pages': page_ids(client, WINDOW),
+        'user_pages': page_ids(client, dict(WINDOW, username='王')),
+        'user_total': total_badge(client, dict(WINDOW, username='王', exact=1)),
+        'export': sorted(client.get('/browse_logs/export', query_string=WINDOW)
+                         .get_data(as_text=True).splitlines()[1:]),
+        'report': report,
+    }
+
+
+def test_archived_months_are_read_without_thawing(flask_app):
+    client = flask_app.test_client()
+    with flask_app.app_context():
+        before = snapshot(client)
+    assert len(before['pages']) == 3 and before['user_pages'][0] and before['export']
+
+    with flask_app.app_context():
+        done = archive_before(db.engine, CUTOFF, segment_rows=500)
+        try:
+            assert [month for month, _ in done] == [date(2024, 7, 1), date(2024, 8, 1), date(2024, 9, 1)]
+            with count_queries(db.engine) as statements:
+                after = snapshot(client)
+            assert after == before
+            # 翻页确实跨到了只在归档段里的记录
+            shown = [int(i) for page in after['pages'] for i in page]
+            hot = set(db.session.execute(select(BrowseLog.id).where(BrowseLog.id.in_(shown))).scalars())
+            assert hot and len(hot) < len(shown)
+            # 读请求只查询，不解冻也不写库
+            assert all(s.lstrip().upper().startswith(('SELECT', 'WITH', 'PRAGMA')) for s in statements)
+            with db.engine.connect() as conn:
+                assert frozen_months(conn) == [month for month, _ in done]
+            check_segment_reads(client, after)
+            check_deleted_user_rollups()
+        finally:
+            thawed = thaw_between(db.engine, date(2000, 1, 1), CUTOFF)
+            assert sum(rows for _, rows in thawed) == sum(rows for _, rows in done)
+            with db.engine.connect() as conn:
+                assert frozen_months(conn) == []
+            db.session.remove()
+
+
+def segment_reads(statements):
+    return sum('browse_archive.payload' in s for s in statements)
+
+
+def check_segment_reads(client, snapshot):
+    """翻到归档月份的深处时每页只解码游标附近的段；按用户精确计数只解码跨窗口边界的段"""
+    with db.engine.connect() as conn:
+        segments = conn.execute(select(func.count(BrowseArchive.id))).scalar()
+    params = dict(WINDOW, cursor='first')
+    for _ in range(8):
+        with count_queries(db.engine) as statements:
+            html = client.get('/browse_logs', query_string=params).get_data(as_text=True)
+        assert segment_reads(statements) <= 2 < segments
+        params['cursor'] = unescape(re.search(r'cursor=([^&"]+)[^"]*">下一页', html).group(1))
+    with count_queries(db.engine) as statements:
+        assert total_badge(client, dict(WINDOW, username='王', exact=1)) == snapshot['user_total']
+    assert segment_reads(statements) <= 4
+
+
+def check_deleted_user_rollups():
+    """删除用户时连同其归档记录从汇总表扣减，结果与重建汇总表（跳过已删除用户的归档记录）一致"""
+    with db.engine.connect() as conn:
+        user_id = next(r['user_id'] for rows in frozen_segment_rows(conn) for r in rows)
+        try:
+            views = select(BrowseDaily.day, BrowseDaily.product_id, BrowseDaily.platform, BrowseDaily.views)\
+                .where(BrowseDaily.views != 0).order_by(BrowseDaily.day, BrowseDaily.product_id, BrowseDaily.platform)
+            subtract_users(conn, [user_id])
+            conn.execute(delete(User).where(User.id == user_id))
+            subtracted = conn.execute(views).all()
+            assert all(r['user_id'] != user_id for rows in frozen_segment_rows(conn) for r in rows)
+            rebuild_rollups(conn)
+            assert conn.execute(views).all() == subtracted
+        finally:
+            conn.rollback()
@@ -0,0 +1,98 @@
+"""
+商品批量导入：逐字段校验规则；合法的行新增或按 id 更新（登记日期留空时保留原值，汇总表品类同步），
+不合法的行按行号进入错误报告；某块写入失败时逐行重试，只有出错的行被拒；表头不对时整个请求被拒
+"""
+import pytest
+from sqlalchemy import exc, select
+
+from app import db, product_import
+from app.models import Product, SalesDaily
+from app.orders import submit_orders
+from app.product_import import parse_product
+from app.products import submit_delete
+
+HEADER = 'id,name,reg_date,category,model,unit,price,stock\n'
+
+
+@pytest.mark.parametrize('values, error', [
+    ({'name': ' '}, '名称不能为空'),
+    ({'name': '甲', 'price': 'abc'}, '格式错误'),
+    ({'name': '甲', 'stock': '1.5'}, '格式错误'),
+    ({'name': '甲', 'price': 'nan'}, '超出范围'),
+    ({'name': '甲', 'price': '100000000'}, '超出范围'),
+    ({'name': '甲', 'reg_date': '2025/01/01'}, 'YYYY-MM-DD'),
+    ({'name': '甲', 'category': '长' * 51}, 'category 超过 50'),
+])
+def test_invalid_values(values, error):
+    with pytest.raises(ValueError, match=error):
+        parse_product(values)
+
+
+def test_valid_values():
+    assert parse_product({'name': ' 甲 ', 'price': '12.345', 'stock': '', 'unit': ' '}) == {
+        'name': '甲', 'price': 12.35, 'stock': 0, 'reg_date': None,
+        'category': None, 'model': None, 'unit': None}
+
+
+@pytest.fixture
+def imported(flask_app):
+    """导入测试新增的商品（名称以“导入测试”开头），结束后删除"""
+    yield
+    with flask_app.app_context():
+        submit_delete(db.session.scalars(select(Product.id).where(Product.name.like('导入测试%'))).all())
+        db.session.remove()
+
+
+def post(client, body, **params):
+    return client.post('/api/products/import', data=body.encode('utf-8'), query_string=params,
+                       content_type='text/csv')
+
+
+def test_import_report(flask_app, scratch_product, imported):
+    product_id, user_id = scratch_product
+    client = flask_app.test_client()
+    with flask_app.app_context():
+        submit_orders([{'user_id': user_id, 'lines': [{'product_id': product_id, 'quantity': 1}]}])
+        reg_date = db.session.get(Product, product_id).reg_date
+        db.session.remove()
+        body = HEADER + (',导入测试甲,2025-01-02,测试品类,M1,个,9.9,5\n'
+                         ',导入测试乙,,,,,abc,1\n'
+                         '\n'
+                         f'{product_id},测试商品,,测试品类二,,,12,3\n'
+                         'x,导入测试丙,,,,,1,1\n')
+        report = post(client, body).get_json()
+        assert (report['rows'], report['inserted'], report['updated'], report['error_count']) == (4, 1, 1, 2)
+        assert [e['line'] for e in report['errors']] == [3, 6]
+
+        new = db.session.execute(select(Product).where(Product.name.like('导入测试%'))).scalars().all()
+        assert [(p.name, p.category, p.stock, str(p.reg_date)) for p in new] == \
+            [('导入测试甲', '测试品类', 5, '2025-01-02')]
+        updated = db.session.get(Product, product_id)
+        assert (updated.category, updated.stock, updated.reg_date) == ('测试品类二', 3, reg_date)
+        assert set(db.session.scalars(select(SalesDaily.category)
+                                      .where(SalesDaily.product_id == product_id))) == {'测试品类二'}
+        db.session.remove()
+
+
+def test_failed_chunk_is_retried_row_by_row(flask_app, imported, monkeypatch):
+    write_rows = product_import._write_rows
+
+    def failing(conn, rows, upsert):
+        if any(row['name'] == '导入测试坏行' for row in rows):
+            raise exc.DBAPIError('INSERT', None, Exception('模拟写入失败'))
+        write_rows(conn, rows, upsert)
+
+    monkeypatch.setattr(product_import, '_write_rows', failing)
+    client = flask_app.test_client()
+    with flask_app.app_context():
+        body = HEADER + ''.join(f',{name},,,,,1,1\n' for name in ('导入测试一', '导入测试坏行', '导入测试二'))
+        report = post(client, body, chunk_size=10).get_json()
+        assert (report['inserted'], report['error_count']) == (2, 1)
+        assert report['errors'][0]['line'] == 3 and '模拟写入失败' in report['errors'][0]['error']
+        db.session.remove()
+
+
+@pytest.mark.parametrize('header, error', [('name,colour\n', '未知的列: colour'), ('id,price\n', '缺少 name 列')])
+def test_bad_header_is_rejected(flask_app, header, error):
+    response = post(flask_app.test_client(), header + '1,2\n')
+    assert response.status_code == 400 and error in response.get_json()['error']
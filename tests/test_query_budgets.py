@@ -0,0 +1,25 @@
+"""列表路由的 SQL 条数不超过 QUERY_BUDGETS（即 flask queries check），防止 N+1 查询回归"""
+import pytest
+
+from app.catalog import product_catalog
+from app.httpcache import http_cache
+from app.querycount import QUERY_BUDGETS, check_query_budgets
+from app.sketches import sketch_buffer
+
+
+@pytest.fixture
+def settled(flask_app):
+    # 预热请求与计数请求之间版本戳、目录版本号不到期，后台也没有待写的草图增量（它的提交会让版本戳重算），
+    # 计到的只是页面本身的查询
+    ttl, interval = http_cache.stamp_ttl, product_catalog.sync_interval
+    http_cache.stamp_ttl = product_catalog.sync_interval = 3600
+    sketch_buffer.flush()
+    yield
+    http_cache.stamp_ttl, product_catalog.sync_interval = ttl, interval
+    http_cache.expire()
+    product_catalog.expire()
+
+
+@pytest.mark.parametrize('url', list(QUERY_BUDGETS))
+def test_route_within_query_budget(flask_app, settled, url):
+    assert check_query_budgets(flask_app, {url: QUERY_BUDGETS[url]}) == []
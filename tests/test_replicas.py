@@ -0,0 +1,113 @@
+"""
+只读副本路由：用测试库的一份 SQLite 拷贝当副本，检查只读路由走副本、写入（保存商品、下单）后读己之写走主库、
+副本不可用或查询中途断开时回落到主库，而查询本身出错时不切换
+"""
+import sqlite3
+
+import pytest
+from sqlalchemy import select
+
+from app import db
+from app.models import Product
+from app.products import submit_delete
+from app.querycount import count_queries
+from app.replicas import PIN_COOKIE, replica_router
+
+
+@pytest.fixture
+def replica(flask_app, tmp_path):
+    path = tmp_path / 'replica.db'
+    with flask_app.app_context():
+        primary = sqlite3.connect(db.engine.url.database)
+    copy = sqlite3.connect(path)
+    primary.backup(copy)
+    primary.close()
+    copy.close()
+    replica_router.set_replicas([f'sqlite:///{path}'])
+    yield path
+    replica_router.set_replicas([])
+
+
+def test_read_routes_use_replica(flask_app, replica):
+    client = flask_app.test_client()
+    # 先请求一次：结构版本检查、商品目录同步等进程级的一次性查询照常走主库
+    client.get('/sales')
+    with flask_app.app_context():
+        engine = replica_router.replicas[0].engine
+        with count_queries(engine) as on_replica, count_queries(db.engine) as on_primary:
+            assert client.get('/sales').status_code == 200
+    assert on_replica
+    assert not on_primary
+
+
+def assert_reads_primary(flask_app, client):
+    with flask_app.app_context():
+        engine = replica_router.replicas[0].engine
+        with count_queries(engine) as on_replica:
+            assert client.get('/sales').status_code == 200
+    assert not on_replica
+
+
+def test_client_reads_primary_after_write(flask_app, replica):
+    client = flask_app.test_client()
+    name = '副本测试商品'
+    try:
+        response = client.post('/products/save', data={'name': name, 'price': '9.9', 'stock': '3'})
+        assert response.status_code == 302
+        assert PIN_COOKIE in response.headers.get('Set-Cookie', '')
+        assert_reads_primary(flask_app, client)
+    finally:
+        with flask_app.app_context():
+            submit_delete(db.session.execute(select(Product.id).where(Product.name == name)).scalars().all())
+            db.session.remove()
+
+
+def test_client_reads_primary_after_order(flask_app, replica, scratch_product):
+    product_id, user_id = scratch_product
+    client = flask_app.test_client()
+    response = client.post('/api/orders', json={'user_id': user_id,
+                                                'lines': [{'product_id': product_id, 'quantity': 1}]})
+    assert response.get_json()['orders'][0]['lines'][0]['status'] == 'ok'
+    assert PIN_COOKIE in response.headers.get('Set-Cookie', '')
+    assert_reads_primary(flask_app, client)
+
+
+def test_unreachable_replica_falls_back_to_primary(flask_app, tmp_path):
+    replica_router.set_replicas([f'sqlite:///{tmp_path}/missing/replica.db'])
+    try:
+        client = flask_app.test_client()
+        assert client.get('/sales').status_code == 200
+        assert replica_router.pick() is None
+    finally:
+        replica_router.set_replicas([])
+
+
+def drop_sales_daily(path):
+    copy = sqlite3.connect(path)
+    copy.execute('DROP TABLE sales_daily')
+    copy.close()
+
+
+def test_replica_disconnect_retries_on_primary(flask_app, replica, monkeypatch):
+    # 副本健康检查能连上，但查询到一半连接断开（这里让方言把缺表的错误判成断开来模拟）
+    drop_sales_daily(replica)
+    dialect = replica_router.replicas[0].engine.dialect
+    monkeypatch.setattr(dialect, 'is_disconnect', lambda *args: True)
+    client = flask_app.test_client()
+    with flask_app.app_context():
+        with count_queries(db.engine) as on_primary:
+            response = client.get('/sales')
+    assert response.status_code == 200
+    assert on_primary
+    assert replica_router.pick() is None
+
+
+def test_query_error_keeps_replica(flask_app, replica):
+    # 语句本身出错（如语句超时）不是副本故障：照常报错，不停用副本，也不在主库上再执行一遍
+    drop_sales_daily(replica)
+    client = flask_app.test_client()
+    with flask_app.app_context():
+        with count_queries(db.engine) as on_primary:
+            assert client.get('/sales').status_code == 500
+    assert not [s for s in on_primary if 'sales_daily' in s]
+    assert replica_router.pick() is not None
@@ -0,0 +1,158 @@
+"""
+草图误差范围：HyperLogLog 的估计与明细表上精确的 COUNT(DISTINCT) 相差不超过 SIGMAS 倍标准误差，
+Count-Min 的估计不低于真实值、且不超过 ε·总量的误差上限
+"""
+import random
+from datetime import date, datetime, timedelta
+
+import pytest
+from sqlalchemy import func, select
+
+from app import db
+from app.orders import submit_orders
+from app.models import BrowseDaily, BrowseLog, Product, Sale, SalesDaily, User
+from app.sketches import (BUYERS_CATEGORY, CMS_DELTA, CMS_EPSILON, HLL_ERROR, TOP_SALES, TOP_VIEWS,
+                          VIEWERS_PLATFORM, VIEWERS_PRODUCT, CountMin, HyperLogLog, heavy_hitters,
+                          sketch_buffer, unique_breakdown, unique_counts)
+
+SIGMAS = 4
+
+
+def assert_within(estimate, exact):
+    # 小基数时至少允许差 2（与 flask sketches check 的口径一致）
+    assert abs(estimate - exact) <= max(2, SIGMAS * HLL_ERROR * exact), (estimate, exact)
+
+
+def browse_window(lo, hi):
+    return [BrowseLog.browse_time >= datetime.combine(lo, datetime.min.time()),
+            BrowseLog.browse_time < datetime.combine(hi + timedelta(days=1), datetime.min.time())]
+
+
+def browse_days():
+    lo, hi = db.session.execute(select(func.min(BrowseLog.browse_time), func.max(BrowseLog.browse_time))).one()
+    return lo.date(), hi.date()
+
+
+def test_hyperloglog_error_and_merge():
+    for n in (10, 1000, 50000):
+        whole = HyperLogLog()
+        whole.add_all(range(1, n + 1))
+        assert_within(whole.count(), n)
+        halves = [HyperLogLog(), HyperLogLog()]
+        halves[0].add_all(range(1, n // 2 + 1))
+        halves[1].add_all(range(n // 2 + 1, n + 1))
+        assert HyperLogLog.union(halves).count() == whole.count()
+        assert HyperLogLog.from_bytes(whole.to_bytes()).count() == whole.count()
+
+
+def test_count_min_never_underestimates():
+    rng = random.Random(7)
+    counts = {item: rng.randint(1, 50) for item in range(1, 3000)}
+    sketch = CountMin()
+    sketch.add_all(counts)
+    bound = CMS_EPSILON * sketch.total
+    over = 0
+    for item, count in counts.items():
+        assert sketch.estimate(item) >= count
+        over += sketch.estimate(item) > count + bound
+    # 每个商品超出误差上限的概率不超过 δ
+    assert over <= CMS_DELTA * len(counts)
+    restored = CountMin.from_bytes(sketch.to_bytes())
+    assert restored.counters == sketch.counters
+
+
+def test_platform_viewers(app_context):
+    first, last = browse_days()
+    platforms, total = unique_breakdown(VIEWERS_PLATFORM, first, last)
+    assert_within(total, db.session.execute(
+        select(func.count(BrowseLog.user_id.distinct())).where(*browse_window(first, last))).scalar())
+    assert platforms
+    for platform, estimate in platforms.items():
+        assert_within(estimate, db.session.execute(
+            select(func.count(BrowseLog.user_id.distinct()))
+            .where(func.coalesce(BrowseLog.platform, '') == platform, *browse_window(first, last))).scalar())
+
+
+def test_category_buyers(app_context):
+    buyers = unique_counts(BUYERS_CATEGORY)
+    exact = dict(db.session.execute(
+        select(func.coalesce(Product.category, ''), func.count(Sale.user_id.distinct()))
+        .join(Product, Product.id == Sale.product_id)
+        .group_by(func.coalesce(Product.category, ''))).all())
+    assert set(buyers) == set(exact)
+    for category, estimate in buyers.items():
+        assert_within(estimate, exact[category])
+
+
+def test_product_viewers_in_random_windows(app_context):
+    rng = random.Random(11)
+    first, last = browse_days()
+    product_ids = db.session.execute(select(Product.id)).scalars().all()
+    for _ in range(40):
+        product_id = rng.choice(product_ids)
+        lo = first + timedelta(days=rng.randint(0, (last - first).days))
+        hi = min(last, lo + timedelta(days=rng.choice([0, 6, 30, 90, 365])))
+        estimate = unique_counts(VIEWERS_PRODUCT, lo, hi, [str(product_id)]).get(str(product_id), 0)
+        assert_within(estimate, db.session.execute(
+            select(func.count(BrowseLog.user_id.distinct()))
+            .where(BrowseLog.product_id == product_id, *browse_window(lo, hi))).scalar())
+
+
+def test_heavy_hitters(app_context):
+    first, last = browse_days()
+    for kind, table, measure in ((TOP_VIEWS, BrowseDaily, BrowseDaily.views),
+                                 (TOP_SALES, SalesDaily, SalesDaily.quantity)):
+        top, bound = heavy_hitters(kind, first, last, n=10)
+        exact = dict(db.session.execute(
+            select(table.product_id, func.sum(measure))
+            .where(table.day.between(first, last)).group_by(table.product_id)).all())
+        assert top
+        for product_id, estimate in top:
+            assert exact.get(product_id, 0) <= estimate <= exact.get(product_id, 0) + bound
+        # 数据按 Zipf 分布生成，真实的第一名一定在估计的前十里
+        assert max(exact, key=exact.get) in {product_id for product_id, _ in top}
+
+
+def test_buffered_deltas_are_merged_after_flush(app_context):
+    _, last = browse_days()
+    day = last + timedelta(days=1)
+    product_id = db.session.execute(select(Product.id).order_by(Product.id)).scalars().first()
+    user_ids = db.session.execute(select(User.id).order_by(User.id).limit(120)).scalars().all()
+    sketch_buffer.flush()
+    db.session.add_all(BrowseLog(user_id=user_id, product_id=product_id, platform='APP',
+                                 browse_time=datetime.combine(day, datetime.min.time()) + timedelta(minutes=i))
+                       for i, user_id in enumerate(user_ids + user_ids[:30]))
+    db.session.commit()
+    # 提交后增量只在进程内缓冲，还没写库
+    assert unique_counts(VIEWERS_PRODUCT, day, day, [str(product_id)]) == {}
+    sketch_buffer.flush()
+    assert_within(unique_counts(VIEWERS_PRODUCT, day, day, [str(product_id)])[str(product_id)], len(user_ids))
+    top, _ = heavy_hitters(TOP_VIEWS, day, day, n=1)
+    assert top == [(product_id, len(user_ids) + 30)]
+
+
+def test_failed_commit_drops_deltas(flask_app, scratch_product, monkeypatch):
+    product_id, user_id = scratch_product
+    order = [{'user_id': user_id, 'lines': [{'product_id': product_id, 'quantity': 1}]}]
+    with flask_app.app_context():
+        merged = sketch_buffer.stats()['merged']
+
+        def fail(dbapi_connection):
+            raise RuntimeError('提交失败')
+
+        monkeypatch.setattr(db.engine.dialect, 'do_commit', fail)
+        with pytest.raises(RuntimeError):
+            submit_orders(order)
+        db.session.add(Sale(product_id=product_id, user_id=user_id, sale_date=date(2025, 6, 30),
+                            unit_price=10, quantity=1, total_amount=10))
+        with pytest.raises(RuntimeError):
+            db.session.commit()
+        db.session.rollback()
+        monkeypatch.undo()
+        # 提交失败的两个事务都没有把增量交给缓冲区
+        assert sketch_buffer.stats()['merged'] == merged
+        assert db.session.scalar(select(func.count()).where(Sale.product_id == product_id)) == 0
+
+        assert submit_orders(order)[0][0]['status'] == 'ok'
+        assert sketch_buffer.stats()['merged'] > merged
+        db.session.remove()
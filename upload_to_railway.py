@@ -1,200 +1,191 @@
 """
-直接上传数据到 Railway PostgreSQL
-使用 psycopg2 直接连接，不依赖 Flask
+把本地 SQLite 数据迁移到 PostgreSQL（Railway 或本地库）
+
+- 按 id 分块流式读取 SQLite，用 COPY FROM STDIN 写入，内存占用与表大小无关；
+- 父表（users/products）与子表（browse_logs/sales）分两批，同一批内的表并行迁移；
+- 每个分块单独提交，目标表里已有的最大 id 即断点，中断后重新运行会接着迁移；
+- 数据全部导入后再建索引、重建汇总表并重置序列，并报告每张表的行/秒。
+
+连接信息来自配置：MIGRATE_SOURCE_URL（默认本地 instance/cpims.db）、
+MIGRATE_TARGET_URL（默认 DATABASE_URL）。
+
+用法：python upload_to_railway.py [--fresh] [--chunk-size 50000] [--workers 2]
+      或作为后台任务：flask --app run jobs submit migrate --param fresh=true
 """
+import argparse
+import io
 import sqlite3
-import psycopg2
+import time
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.schema import CreateTable
+
+from config import Config
+from app import db
+from app.models import User, Product, BrowseLog, Sale, BrowseArchive, catalog_version_seq
+from app.indexes import ensure_indexes
+from app.rollups import rebuild_rollups
+from app.partitions import ensure_partitions
+from app.schema import record_version
+from app.catalog import bump_version
+from app.cache import dashboard_cache
+
+# 外键安全的迁移顺序：同一批内的表互不依赖，可以并行
+PHASES = [
+    [User.__table__, Product.__table__, BrowseArchive.__table__],
+    [BrowseLog.__table__, Sale.__table__],
+]
+
+
+def _copy_value(value):
+    # COPY 文本格式：NULL 写作 \N，转义反斜杠、制表符和换行
+    if value is None:
+        return '\\N'
+    if isinstance(value, bytes):
+        # bytea 十六进制格式，反斜杠本身也要转义
+        return '\\\\x' + value.hex()
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t') \
+        .replace('\n', '\\n').replace('\r', '\\r')
+
+
+def _sqlite_path(url):
+    return url.split('sqlite:///', 1)[1] if url.startswith('sqlite:///') else url
+
+
+def _source_time_range(sqlite_path):
+    src = sqlite3.connect(sqlite_path)
+    try:
+        lo, hi = src.execute('SELECT MIN(browse_time), MAX(browse_time) FROM browse_logs').fetchone()
+    finally:
+        src.close()
+    return tuple(datetime.fromisoformat(v).date() if v else None for v in (lo, hi))
+
+
+def create_schema(pg_engine, fresh, time_range=(None, None)):
+    """建表并按源库的时间跨度建好浏览记录月分区（不建索引，索引在导入完成后再建）"""
+    with pg_engine.begin() as conn:
+        existing = set(inspect(conn).get_table_names())
+        if fresh:
+            for table in reversed(db.metadata.sorted_tables):
+                conn.execute(text(f'DROP TABLE IF EXISTS {table.name} CASCADE'))
+            existing = set()
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing:
+                conn.execute(CreateTable(table))
+        catalog_version_seq.create(conn, checkfirst=True)
+        ensure_partitions(conn, *time_range, ahead=Config.BROWSE_PARTITIONS_AHEAD)
 
-# Railway PostgreSQL 连接信息
-PG_HOST = "yamabiko.proxy.rlwy.net"
-PG_PORT = 31771
-PG_USER = "postgres"
-PG_PASSWORD = "uuYxhqwGZugqVqYrLlOdxmrPHpayIXPQ"
-PG_DATABASE = "railway"
 
-# 本地 SQLite 路径
-SQLITE_PATH = "instance/cpims.db"
+def copy_table(sqlite_path, pg_engine, table, chunk_size, echo=print):
+    """从断点开始分块迁移一张表，返回 (迁移行数, 用时秒)"""
+    columns = [c.name for c in table.columns]
+    col_list = ', '.join(columns)
+    started = time.perf_counter()
+
+    with pg_engine.connect() as conn:
+        last_id = conn.execute(text(f'SELECT COALESCE(MAX(id), 0) FROM {table.name}')).scalar()
+    if last_id:
+        echo(f'   {table.name}: 从 id > {last_id} 处继续')
+
+    src = sqlite3.connect(sqlite_path)
+    raw = pg_engine.raw_connection()
+    copied = 0
+    try:
+        while True:
+            rows = src.execute(
+                f'SELECT {col_list} FROM {table.name} WHERE id > ? ORDER BY id LIMIT ?',
+                (last_id, chunk_size)).fetchall()
+            if not rows:
+                break
+            buf = io.StringIO()
+            for row in rows:
+                buf.write('\t'.join(_copy_value(v) for v in row))
+                buf.write('\n')
+            buf.seek(0)
+            with raw.cursor() as cur:
+                cur.copy_expert(f'COPY {table.name} ({col_list}) FROM STDIN', buf)
+            raw.commit()
+            copied += len(rows)
+            last_id = rows[-1][0]
+            elapsed = time.perf_counter() - started
+            echo(f'   {table.name}: +{copied}（{copied / elapsed:,.0f} 行/秒）')
+    finally:
+        raw.close()
+        src.close()
+    return copied, time.perf_counter() - started
+
+
+def finish(pg_engine, echo=print):
+    echo('🔧 建立索引...')
+    ensure_indexes(pg_engine)
+    with pg_engine.begin() as conn:
+        echo('📊 重建汇总表...')
+        rebuild_rollups(conn)
+        echo('🔄 重置序列...')
+        for phase in PHASES:
+            for table in phase:
+                conn.execute(text(
+                    f"SELECT setval('{table.name}_id_seq', "
+                    f"(SELECT COALESCE(MAX(id), 1) FROM {table.name}), true)"))
+        record_version(conn)
+        # 目标库上已在运行的 worker 整体失效商品目录缓存与看板缓存
+        bump_version(conn)
+        dashboard_cache.clear_everywhere(conn)
+
+
+def migrate(fresh=False, chunk_size=50000, workers=2, echo=print, progress=None):
+    """执行一次迁移，返回迁移行数；progress(已完成表数, 总表数) 在每张表完成后调用"""
+    if not Config.MIGRATE_TARGET_URL or not Config.MIGRATE_TARGET_URL.startswith('postgresql'):
+        raise RuntimeError('请设置 MIGRATE_TARGET_URL 或 DATABASE_URL 为 PostgreSQL 连接串')
+
+    sqlite_path = _sqlite_path(Config.MIGRATE_SOURCE_URL)
+    pg_engine = create_engine(Config.MIGRATE_TARGET_URL, pool_size=workers)
+    echo(f"📂 源库: {sqlite_path}")
+    echo(f"🐘 目标库: {pg_engine.url.render_as_string(hide_password=True)}")
+
+    create_schema(pg_engine, fresh, _source_time_range(sqlite_path))
+
+    started = time.perf_counter()
+    total = done = 0
+    table_count = sum(len(phase) for phase in PHASES)
+    with ThreadPoolExecutor(workers) as pool:
+        for phase in PHASES:
+            futures = {table.name: pool.submit(copy_table, sqlite_path, pg_engine, table, chunk_size, echo)
+                       for table in phase}
+            for name, future in futures.items():
+                copied, elapsed = future.result()
+                total += copied
+                done += 1
+                rate = copied / elapsed if elapsed else 0
+                echo(f"✅ {name}: {copied} 行，{elapsed:.1f} 秒，{rate:,.0f} 行/秒")
+                if progress is not None:
+                    progress(done, table_count)
+
+    finish(pg_engine, echo)
+    elapsed = time.perf_counter() - started
+    echo(f"🎉 迁移完成：{total} 行，{elapsed:.1f} 秒，{total / elapsed if elapsed else 0:,.0f} 行/秒")
+    return total
+
 
 def main():
+    parser = argparse.ArgumentParser(description='SQLite → PostgreSQL 数据迁移')
+    parser.add_argument('--fresh', action='store_true', help='删除目标库中的表后重新迁移')
+    parser.add_argument('--chunk-size', type=int, default=50000, help='每批迁移行数')
+    parser.add_argument('--workers', type=int, default=2, help='同一批内并行迁移的表数')
+    args = parser.parse_args()
+
     print("=" * 60)
-    print("🚀 直接上传数据到 Railway PostgreSQL")
+    print("🚀 迁移数据到 PostgreSQL")
     print("=" * 60)
-    print()
-    
-    # 1. 连接 SQLite
-    print("📂 连接本地 SQLite...")
-    sqlite_conn = sqlite3.connect(SQLITE_PATH)
-    sqlite_conn.row_factory = sqlite3.Row
-    sqlite_cur = sqlite_conn.cursor()
-    print("✅ SQLite 连接成功")
-    print()
-    
-    # 2. 连接 PostgreSQL
-    print("🐘 连接 Railway PostgreSQL...")
     try:
-        pg_conn = psycopg2.connect(
-            host=PG_HOST,
-            port=PG_PORT,
-            user=PG_USER,
-            password=PG_PASSWORD,
-            database=PG_DATABASE
-        )
-        pg_conn.autocommit = False
-        pg_cur = pg_conn.cursor()
-        print("✅ PostgreSQL 连接成功")
-    except Exception as e:
-        print(f"❌ PostgreSQL 连接失败: {e}")
+        migrate(args.fresh, args.chunk_size, args.workers)
+    except RuntimeError as e:
+        print(f'❌ {e}')
         return
-    print()
-    
-    # 3. 创建表 (使用复数表名匹配 Flask-SQLAlchemy)
-    print("📋 创建数据表...")
-    
-    create_tables_sql = """
-    DROP TABLE IF EXISTS sales CASCADE;
-    DROP TABLE IF EXISTS browse_logs CASCADE;
-    DROP TABLE IF EXISTS products CASCADE;
-    DROP TABLE IF EXISTS users CASCADE;
-    
-    CREATE TABLE users (
-        id SERIAL PRIMARY KEY,
-        username VARCHAR(100) NOT NULL,
-        address VARCHAR(500),
-        phone VARCHAR(50)
-    );
-    
-    CREATE TABLE products (
-        id SERIAL PRIMARY KEY,
-        name VARCHAR(200) NOT NULL,
-        reg_date DATE,
-        category VARCHAR(100),
-        model VARCHAR(100),
-        unit VARCHAR(50),
-        price DECIMAL(10,2) NOT NULL,
-        stock INTEGER NOT NULL DEFAULT 0
-    );
-    
-    CREATE TABLE browse_logs (
-        id SERIAL PRIMARY KEY,
-        user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-        product_id INTEGER REFERENCES products(id) ON DELETE CASCADE,
-        browse_time TIMESTAMP,
-        platform VARCHAR(50)
-    );
-    
-    CREATE TABLE sales (
-        id SERIAL PRIMARY KEY,
-        product_id INTEGER REFERENCES products(id) ON DELETE CASCADE,
-        user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-        sale_date DATE,
-        unit_price DECIMAL(10,2),
-        quantity INTEGER,
-        total_amount DECIMAL(12,2),
-        payment_method VARCHAR(50)
-    );
-    """
-    
-    pg_cur.execute(create_tables_sql)
-    pg_conn.commit()
-    print("✅ 表创建成功")
-    print()
-    
-    # 4. 迁移用户数据
-    print("👥 上传用户数据...")
-    sqlite_cur.execute("SELECT id, username, address, phone FROM users")
-    users = sqlite_cur.fetchall()
-    
-    for user in users:
-        pg_cur.execute(
-            'INSERT INTO users (id, username, address, phone) VALUES (%s, %s, %s, %s)',
-            (user['id'], user['username'], user['address'], user['phone'])
-        )
-    pg_conn.commit()
-    print(f"✅ 上传了 {len(users)} 个用户")
-    
-    # 5. 迁移商品数据
-    print("📦 上传商品数据...")
-    sqlite_cur.execute("SELECT id, name, reg_date, category, model, unit, price, stock FROM products")
-    products = sqlite_cur.fetchall()
-    
-    for p in products:
-        pg_cur.execute(
-            'INSERT INTO products (id, name, reg_date, category, model, unit, price, stock) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)',
-            (p['id'], p['name'], p['reg_date'], p['category'], p['model'], p['unit'], p['price'], p['stock'])
-        )
-    pg_conn.commit()
-    print(f"✅ 上传了 {len(products)} 个商品")
-    
-    # 6. 迁移浏览记录
-    print("👀 上传浏览记录...")
-    sqlite_cur.execute("SELECT id, user_id, product_id, browse_time, platform FROM browse_logs")
-    logs = sqlite_cur.fetchall()
-    
-    batch_size = 100
-    for i in range(0, len(logs), batch_size):
-        batch = logs[i:i+batch_size]
-        for log in batch:
-            pg_cur.execute(
-                'INSERT INTO browse_logs (id, user_id, product_id, browse_time, platform) VALUES (%s, %s, %s, %s, %s)',
-                (log['id'], log['user_id'], log['product_id'], log['browse_time'], log['platform'])
-            )
-        pg_conn.commit()
-        print(f"   进度: {min(i+batch_size, len(logs))}/{len(logs)}")
-    print(f"✅ 上传了 {len(logs)} 条浏览记录")
-    
-    # 7. 迁移销售记录
-    print("💰 上传销售记录...")
-    sqlite_cur.execute("SELECT id, product_id, user_id, sale_date, unit_price, quantity, total_amount, payment_method FROM sales")
-    sales = sqlite_cur.fetchall()
-    
-    for i in range(0, len(sales), batch_size):
-        batch = sales[i:i+batch_size]
-        for s in batch:
-            pg_cur.execute(
-                'INSERT INTO sales (id, product_id, user_id, sale_date, unit_price, quantity, total_amount, payment_method) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)',
-                (s['id'], s['product_id'], s['user_id'], s['sale_date'], s['unit_price'], s['quantity'], s['total_amount'], s['payment_method'])
-            )
-        pg_conn.commit()
-        print(f"   进度: {min(i+batch_size, len(sales))}/{len(sales)}")
-    print(f"✅ 上传了 {len(sales)} 条销售记录")
-    print()
-    
-    # 8. 重置序列
-    print("🔄 重置序列...")
-    pg_cur.execute(f"SELECT setval('users_id_seq', {max(u['id'] for u in users)}, true)")
-    pg_cur.execute(f"SELECT setval('products_id_seq', {max(p['id'] for p in products)}, true)")
-    pg_cur.execute(f"SELECT setval('browse_logs_id_seq', {max(l['id'] for l in logs)}, true)")
-    pg_cur.execute(f"SELECT setval('sales_id_seq', {max(s['id'] for s in sales)}, true)")
-    pg_conn.commit()
-    print("✅ 序列重置完成")
-    print()
-    
-    # 9. 验证数据
-    print("🔍 验证数据...")
-    pg_cur.execute('SELECT COUNT(*) FROM users')
-    user_count = pg_cur.fetchone()[0]
-    pg_cur.execute('SELECT COUNT(*) FROM products')
-    product_count = pg_cur.fetchone()[0]
-    pg_cur.execute('SELECT COUNT(*) FROM browse_logs')
-    log_count = pg_cur.fetchone()[0]
-    pg_cur.execute('SELECT COUNT(*) FROM sales')
-    sale_count = pg_cur.fetchone()[0]
-    
-    print(f"   用户: {user_count}")
-    print(f"   商品: {product_count}")
-    print(f"   浏览记录: {log_count}")
-    print(f"   销售记录: {sale_count}")
-    print()
-    
-    # 关闭连接
-    sqlite_conn.close()
-    pg_conn.close()
-    
-    print("=" * 60)
-    print("🎉 数据上传完成！")
     print("=" * 60)
-    print()
-    print("现在去 Railway 控制台刷新 Database 页面查看数据")
+
 
 if __name__ == '__main__':
     main()